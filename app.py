@@ -4,6 +4,13 @@ import os
 import signal
 import sys
 import time
+
+if "--import-profile" in sys.argv:
+    # 需要在导入其他模块之前开始统计
+    from common import import_profile
+
+    import_profile.install()
+
 from common.log import logger, set_log_level
 # 添加lib目录到Python路径，解决wx849模块导入问题
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -21,6 +28,7 @@ from channel import channel_factory
 from common import const
 from config import load_config
 from plugins import *
+from common import import_profile
 import threading
 
 
@@ -50,6 +58,16 @@ def start_channel(channel_name: str):
             threading.Thread(target=linkai_client.start, args=(channel,)).start()
         except Exception as e:
             pass
+
+    if conf().get("bridge_warm_up", True) or import_profile.enabled():
+        from bridge.bridge import Bridge
+
+        warm_up = Bridge().warm_up()
+        if import_profile.enabled():
+            # 统计模式下等待插件加载和预热完成后输出导入耗时，再启动通道
+            warm_up.join()
+            PluginManager().wait_loaded()
+            logger.info(import_profile.report())
     channel.startup()
 
 
@@ -59,7 +77,11 @@ def run():
         load_config()
 
         # 获取配置的日志级别，默认为 INFO 以减少输出
-        set_log_level("DEBUG" if conf().get("debug", False) else "INFO")
+        set_log_level(
+            "DEBUG" if conf().get("debug", False) else "INFO",
+            enqueue=conf().get("log_enqueue", False),
+            max_length=conf().get("log_max_length", 4000),
+        )
         # ctrl + c
         sigterm_handler_wrap(signal.SIGINT)
         # kill signal
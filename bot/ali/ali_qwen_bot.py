@@ -15,12 +15,13 @@ from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
 from common.log import logger
 from common import const
+from common.token_manager import token_manager
 from config import conf, load_config
 
 class AliQwenBot(Bot):
     def __init__(self):
         super().__init__()
-        self.api_key_expired_time = self.set_api_key()
+        self.set_api_key()
         self.sessions = SessionManager(AliQwenSession, model=conf().get("model", const.QWEN))
 
     def api_key_client(self):
@@ -144,14 +145,19 @@ class AliQwenBot(Bot):
             else:
                 return result
 
-    def set_api_key(self):
+    def token_source(self):
+        return token_manager.source("qwen:" + str(self.access_key_id()) + ":" + str(self.agent_key()), self.create_token)
+
+    def create_token(self):
         api_key, expired_time = self.api_key_client().create_token(agent_key=self.agent_key())
-        broadscope_bailian.api_key = api_key
-        return expired_time
+        return api_key, expired_time - time.time()
+
+    def set_api_key(self):
+        broadscope_bailian.api_key = self.token_source().get()
 
     def update_api_key_if_expired(self):
-        if time.time() > self.api_key_expired_time:
-            self.api_key_expired_time = self.set_api_key()
+        # token在过期前由token_manager刷新，这里每次取最新的
+        self.set_api_key()
 
     def convert_messages_format(self, messages) -> Tuple[str, List[ChatQaMessage]]:
         history = []
@@ -28,11 +28,11 @@ class AliQwenSession(Session):
             logger.debug("Exception when counting tokens precisely for query: {}".format(e))
         while cur_tokens > max_tokens:
             if len(self.messages) > 2:
-                self.messages.pop(1)
+                dropped = self.pop_message(1)
             elif len(self.messages) == 2 and self.messages[1]["role"] == "assistant":
-                self.messages.pop(1)
+                dropped = self.pop_message(1)
                 if precise:
-                    cur_tokens = self.calc_tokens()
+                    cur_tokens -= dropped
                 else:
                     cur_tokens = cur_tokens - max_tokens
                 break
@@ -43,13 +43,13 @@ class AliQwenSession(Session):
                 logger.debug("max_tokens={}, total_tokens={}, len(messages)={}".format(max_tokens, cur_tokens, len(self.messages)))
                 break
             if precise:
-                cur_tokens = self.calc_tokens()
+                cur_tokens -= dropped
             else:
                 cur_tokens = cur_tokens - max_tokens
         return cur_tokens
 
-    def calc_tokens(self):
-        return num_tokens_from_messages(self.messages, self.model)
+    def count_message_tokens(self, message):
+        return num_tokens_from_messages([message], self.model)
 
 def num_tokens_from_messages(messages, model):
     """Returns the number of tokens used by a list of messages."""
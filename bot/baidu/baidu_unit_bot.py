@@ -2,8 +2,10 @@
 
 import requests
 
+from bot.baidu.baidu_wenxin import fetch_access_token
 from bot.bot import Bot
 from bridge.reply import Reply, ReplyType
+from common.token_manager import token_manager
 
 
 # Baidu Unit对话接口 (可用, 但能力较弱)
@@ -29,8 +31,5 @@ class BaiduUnitBot(Bot):
     def get_token(self):
         access_key = "YOUR_ACCESS_KEY"
         secret_key = "YOUR_SECRET_KEY"
-        host = "https://aip.baidubce.com/oauth/2.0/token?grant_type=client_credentials&client_id=" + access_key + "&client_secret=" + secret_key
-        response = requests.get(host)
-        if response:
-            print(response.json())
-            return response.json()["access_token"]
+        source = token_manager.source("baidu_unit:" + access_key, lambda: fetch_access_token(access_key, secret_key))
+        return source.get()
@@ -8,6 +8,7 @@ from bot.session_manager import SessionManager
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
 from common.log import logger
+from common.token_manager import token_manager
 from config import conf
 from bot.baidu.baidu_wenxin_session import BaiduWenxinSession
 
@@ -78,7 +79,7 @@ class BaiduWenxinBot(Bot):
         try:
             logger.info("[BAIDU] model={}".format(session.model))
             access_token = self.get_access_token()
-            if access_token == 'None':
+            if not access_token:
                 logger.warn("[BAIDU] access token 获取失败")
                 return {
                     "total_tokens": 0,
@@ -92,6 +93,11 @@ class BaiduWenxinBot(Bot):
             payload = {'messages': session.messages, 'system': self.prompt} if self.prompt_enabled else {'messages': session.messages}
             response = requests.request("POST", url, headers=headers, data=json.dumps(payload))
             response_text = json.loads(response.text)
+            if response_text.get("error_code") in ACCESS_TOKEN_ERRORS and retry_count < 1:
+                # token在有效期内被重置或提前失效，重新获取后重试一次
+                logger.warn("[BAIDU] access token invalid: {}".format(response_text.get("error_msg")))
+                self.token_source().invalidate(access_token)
+                return self.reply_text(session, retry_count + 1)
             logger.info(f"[BAIDU] response text={response_text}")
             res_content = response_text["result"]
             total_tokens = response_text["usage"]["total_tokens"]
@@ -110,11 +116,30 @@ class BaiduWenxinBot(Bot):
             result = {"total_tokens": 0, "completion_tokens": 0, "content": "出错了: {}".format(e)}
             return result
 
+    def token_source(self):
+        return token_manager.source("baidu_wenxin:" + str(BAIDU_API_KEY), fetch_access_token)
+
     def get_access_token(self):
         """
-        使用 AK，SK 生成鉴权签名（Access Token）
+        使用 AK，SK 生成鉴权签名（Access Token），有效期内复用缓存的token
         :return: access_token，或是None(如果错误)
         """
-        url = "https://aip.baidubce.com/oauth/2.0/token"
-        params = {"grant_type": "client_credentials", "client_id": BAIDU_API_KEY, "client_secret": BAIDU_SECRET_KEY}
-        return str(requests.post(url, params=params).json().get("access_token"))
+        try:
+            return self.token_source().get()
+        except Exception as e:
+            logger.warn("[BAIDU] get access token failed: {}".format(e))
+            return None
+
+
+# 接口返回的access token无效、过期错误码
+ACCESS_TOKEN_ERRORS = (110, 111)
+
+
+def fetch_access_token(api_key=None, secret_key=None):
+    """请求百度OAuth接口，返回(access_token, expires_in)"""
+    url = "https://aip.baidubce.com/oauth/2.0/token"
+    params = {"grant_type": "client_credentials", "client_id": api_key or BAIDU_API_KEY, "client_secret": secret_key or BAIDU_SECRET_KEY}
+    result = requests.post(url, params=params).json()
+    if not result.get("access_token"):
+        raise Exception(result.get("error_description") or result.get("error") or result)
+    return result["access_token"], result.get("expires_in", 2592000)
@@ -5,6 +5,7 @@ Auto-replay chat robot abstract class
 
 from bridge.context import Context
 from bridge.reply import Reply
+from common import http_pool
 
 
 class Bot(object):
@@ -15,3 +16,29 @@ class Bot(object):
         :return: reply content
         """
         raise NotImplementedError
+
+    def reply_stream(self, query, context: Context = None):
+        """
+        流式回复，返回Reply或者依次产生文本片段的迭代器：
+        - 迭代器在生成过程中产出文本，迭代结束时会话记录已更新，请求失败时抛出异常
+        - 命令、出错等不需要流式的情况直接返回Reply
+        默认不支持流式，返回reply()的结果
+        """
+        return self.reply(query, context)
+
+    def warm_up(self):
+        """
+        启动后在后台线程中调用，提前完成首条消息才会做的准备工作：
+        加载会话计算token用的编码器，预先建立到接口的连接
+        """
+        sessions = getattr(self, "sessions", None)
+        if sessions is not None:
+            session = sessions.sessioncls(None, None, **sessions.session_args)
+            session.count_message_tokens({"role": "user", "content": "warm up"})
+        url = self.warm_up_url()
+        if url:
+            http_pool.preconnect(url)
+
+    def warm_up_url(self):
+        """通过http_pool访问的接口地址，预热时提前建立连接；不使用http_pool的bot返回None"""
+        return None
@@ -15,7 +15,7 @@ from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
 from common.log import logger
 from common.token_bucket import TokenBucket
-from config import conf, load_config
+from config import conf, config_snapshot, load_config
 
 
 
@@ -51,7 +51,8 @@ class ChatGPTBot(Bot, OpenAIImage):
 
             session_id = context["session_id"]
             reply = None
-            clear_memory_commands = conf().get("clear_memory_commands", ["#清除记忆"])
+            snapshot = config_snapshot()
+            clear_memory_commands = snapshot.get("clear_memory_commands", ["#清除记忆"])
             if query in clear_memory_commands:
                 self.sessions.clear_session(session_id)
                 reply = Reply(ReplyType.INFO, "记忆已清除")
@@ -63,54 +64,7 @@ class ChatGPTBot(Bot, OpenAIImage):
                 reply = Reply(ReplyType.INFO, "配置已更新")
             if reply:
                 return reply
-            session = self.sessions.session_query(query, session_id)
-            logger.debug("[CHATGPT] session query={}".format(session.messages))
-            group_system_template = conf().get("group_character_desc", "")
-            system_template = conf().get("character_desc", "")
-
-            msg = context.kwargs['msg']
-            isgroup = context.kwargs['isgroup']
-            logger.debug(f"context.kwargs={context.kwargs}")
-            current_date = datetime.datetime.now().strftime("%Y年%m月%d日%H时%M分")
-
-            for message in session.messages:
-                # 在每次循环时重新获取botname和name
-                bot_name = msg.to_user_nickname
-
-                if isgroup:  # 如果是群聊
-                    if message['role'] == 'system':  # 如果是system message
-                        name = msg.actual_user_nickname  # 使用实际的用户名
-                        group_name = msg.other_user_nickname
-                        prompt = get_prompt(group_name)
-                        if prompt:
-                            group_system_template = prompt
-                        try:
-                            message['content'] = group_system_template.format(time=current_date, group_name=group_name,
-                                                                              bot_name=bot_name,
-                                                                              name=name)  # 使用初始的模板
-                        except KeyError:
-                            # Handle the exception as needed
-                            pass
-                else:
-                    if message['role'] == 'system':
-                        name = msg.from_user_nickname  # 使用发送消息的用户名
-                        try:
-                            message['content'] = system_template.format(time=current_date, bot_name=bot_name, name=name)
-                        except KeyError:
-                            # Handle the exception as needed
-                            pass
-
-            api_key_list = conf().get("fastgpt_list", {})
-            receiver = context.kwargs.get("receiver")
-            api_key = api_key_list.get(receiver, conf().get("open_ai_api_key")) \
-                if conf().get("fast_gpt") and isgroup else conf().get("open_ai_api_key")
-            api_base = conf().get("open_ai_api_base")
-
-            model = context.get("gpt_model")
-            new_args = None
-            if model:
-                new_args = self.args.copy()
-                new_args["model"] = model
+            session, api_key, api_base, new_args = self._prepare_request(query, context)
             # if context.get('stream'):
             #     # reply in stream
             #     return self.reply_text_stream(query, new_query, session_id)
@@ -126,7 +80,7 @@ class ChatGPTBot(Bot, OpenAIImage):
                 )
             )
 
-            if conf().get("fast_gpt", False):
+            if snapshot.get("fast_gpt", False):
                 self.sessions.session_reply(reply_content["content"], session_id, reply_content["total_tokens"])
                 reply = Reply(ReplyType.TEXT, reply_content["content"])
             elif reply_content["completion_tokens"] == 0 and len(reply_content["content"]) > 0:
@@ -151,6 +105,90 @@ class ChatGPTBot(Bot, OpenAIImage):
             reply = Reply(ReplyType.ERROR, "Bot不支持处理{}类型的消息".format(context.type))
             return reply
 
+    def _prepare_request(self, query, context):
+        """把query加入会话，按群聊/私聊填充system prompt，返回请求需要的参数"""
+        session_id = context["session_id"]
+        snapshot = config_snapshot()
+        session = self.sessions.session_query(query, session_id)
+        logger.debug("[CHATGPT] session query={}".format(session.messages))
+        group_system_template = snapshot.get("group_character_desc", "")
+        system_template = snapshot.get("character_desc", "")
+
+        msg = context.kwargs['msg']
+        isgroup = context.kwargs['isgroup']
+        logger.debug(f"context.kwargs={context.kwargs}")
+        current_date = datetime.datetime.now().strftime("%Y年%m月%d日%H时%M分")
+
+        for message in session.messages:
+            # 在每次循环时重新获取botname和name
+            bot_name = msg.to_user_nickname
+
+            if isgroup:  # 如果是群聊
+                if message['role'] == 'system':  # 如果是system message
+                    name = msg.actual_user_nickname  # 使用实际的用户名
+                    group_name = msg.other_user_nickname
+                    prompt = get_prompt(group_name)
+                    if prompt:
+                        group_system_template = prompt
+                    try:
+                        message['content'] = group_system_template.format(time=current_date, group_name=group_name,
+                                                                          bot_name=bot_name,
+                                                                          name=name)  # 使用初始的模板
+                    except KeyError:
+                        # Handle the exception as needed
+                        pass
+            else:
+                if message['role'] == 'system':
+                    name = msg.from_user_nickname  # 使用发送消息的用户名
+                    try:
+                        message['content'] = system_template.format(time=current_date, bot_name=bot_name, name=name)
+                    except KeyError:
+                        # Handle the exception as needed
+                        pass
+
+        api_key_list = snapshot.get("fastgpt_list", {})
+        receiver = context.kwargs.get("receiver")
+        api_key = api_key_list.get(receiver, snapshot.get("open_ai_api_key")) \
+            if snapshot.get("fast_gpt") and isgroup else snapshot.get("open_ai_api_key")
+        api_base = snapshot.get("open_ai_api_base")
+
+        model = context.get("gpt_model")
+        new_args = None
+        if model:
+            new_args = self.args.copy()
+            new_args["model"] = model
+        return session, api_key, api_base, new_args
+
+    def reply_stream(self, query, context=None):
+        if context.type != ContextType.TEXT or query in config_snapshot().get("clear_memory_commands", ["#清除记忆"]) \
+                or query in ["#清除所有", "#更新配置"]:
+            return self.reply(query, context)
+        logger.info("[CHATGPT] stream query={}".format(query))
+        session, api_key, api_base, args = self._prepare_request(query, context)
+        if args is None:
+            args = self.args
+        if config_snapshot().get("rate_limit_chatgpt") and not self.tb4chatgpt.get_token():
+            return Reply(ReplyType.ERROR, "提问太快啦，请休息一下再问我吧")
+        try:
+            response = openai.ChatCompletion.create(api_key=api_key, api_base=api_base, messages=session.messages,
+                                                    stream=True, **args)
+        except Exception as e:
+            logger.warn("[CHATGPT] stream request failed: {}".format(e))
+            return Reply(ReplyType.ERROR, "我现在有点累了，等会再来吧")
+        return self._iter_stream(response, session.session_id)
+
+    def _iter_stream(self, response, session_id):
+        """产出增量文本，完整结束后写入会话；流式接口不返回usage，token数由会话自行计算"""
+        content = []
+        for chunk in response:
+            if not chunk.get("choices"):
+                continue
+            text = chunk["choices"][0].get("delta", {}).get("content")
+            if text:
+                content.append(text)
+                yield text
+        self.sessions.session_reply("".join(content), session_id)
+
     def reply_text(self, session: ChatGPTSession, api_key=None, api_base=None, args=None, retry_count=0) -> dict:
         """
         call openai's ChatCompletion to get the answer
@@ -160,7 +198,7 @@ class ChatGPTBot(Bot, OpenAIImage):
         :return: {}
         """
         try:
-            if conf().get("rate_limit_chatgpt") and not self.tb4chatgpt.get_token():
+            if config_snapshot().get("rate_limit_chatgpt") and not self.tb4chatgpt.get_token():
                 raise openai.error.RateLimitError("RateLimitError: rate limit exceeded")
             # if api_key == None, the default openai.api_key will be used
             if args is None:
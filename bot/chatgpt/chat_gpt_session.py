@@ -1,3 +1,5 @@
+import functools
+
 from bot.session_manager import Session
 from common.log import logger
 from common import const
@@ -28,11 +30,11 @@ class ChatGPTSession(Session):
             logger.debug("Exception when counting tokens precisely for query: {}".format(e))
         while cur_tokens > max_tokens:
             if len(self.messages) > 2:
-                self.messages.pop(1)
+                dropped = self.pop_message(1)
             elif len(self.messages) == 2 and self.messages[1]["role"] == "assistant":
-                self.messages.pop(1)
+                dropped = self.pop_message(1)
                 if precise:
-                    cur_tokens = self.calc_tokens()
+                    cur_tokens -= dropped
                 else:
                     cur_tokens = cur_tokens - max_tokens
                 break
@@ -43,30 +45,37 @@ class ChatGPTSession(Session):
                 logger.debug("max_tokens={}, total_tokens={}, len(messages)={}".format(max_tokens, cur_tokens, len(self.messages)))
                 break
             if precise:
-                cur_tokens = self.calc_tokens()
+                cur_tokens -= dropped
             else:
                 cur_tokens = cur_tokens - max_tokens
         return cur_tokens
 
-    def calc_tokens(self):
-        return num_tokens_from_messages(self.messages, self.model)
+    @property
+    def base_tokens(self):
+        return num_tokens_from_messages([], self.model)
 
+    def count_message_tokens(self, message):
+        return num_tokens_from_message(message, self.model)
 
-# refer to https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb
-def num_tokens_from_messages(messages, model):
-    """Returns the number of tokens used by a list of messages."""
+
+@functools.lru_cache(maxsize=None)
+def _token_rules(model):
+    """
+    返回模型的 (encoding, tokens_per_message, tokens_per_name)，按模型缓存，
+    避免每次计算都重新导入tiktoken和查找编码；按字符计算的模型encoding为None
+    """
     if model in ["wenxin", "xunfei", const.GEMINI]:
-        return num_tokens_by_character(messages)
+        return None, 0, 0
     import tiktoken
 
     if model in ["gpt-3.5-turbo-0301", "gpt-35-turbo"]:
-        return num_tokens_from_messages(messages, model="gpt-3.5-turbo")
+        return _token_rules("gpt-3.5-turbo")
     elif model in ["gpt-4-0314", "gpt-4-0613", "gpt-4-32k", "gpt-4-32k-0613", "gpt-3.5-turbo-0613", "gpt-3.5-turbo-16k",
                    "gpt-3.5-turbo-1106","gpt-3.5-turbo-0125", "gpt-3.5-turbo-16k-0613", "gpt-35-turbo-16k",
                    const.GPT4o,const.GPT4o_MINI,const.GPT4_TURBO, const.GPT4_VISION,const.COZE,const.LINKAI_4o, const.LINKAI_4_TURBO]:
-        return num_tokens_from_messages(messages, model="gpt-4")
+        return _token_rules("gpt-4")
     elif model.startswith("claude-3"):
-        return num_tokens_from_messages(messages, model="gpt-3.5-turbo")
+        return _token_rules("gpt-3.5-turbo")
     try:
         encoding = tiktoken.encoding_for_model(model)
     except KeyError:
@@ -80,19 +89,28 @@ def num_tokens_from_messages(messages, model):
         tokens_per_name = 1
     else:
         logger.warn(f"num_tokens_from_messages() is not implemented for model {model}. Returning num tokens assuming gpt-3.5-turbo.")
-        return num_tokens_from_messages(messages, model="gpt-3.5-turbo")
-    num_tokens = 0
-    for message in messages:
-        num_tokens += tokens_per_message
-        for key, value in message.items():
-            num_tokens += len(encoding.encode(value))
-            if key == "name":
-                num_tokens += tokens_per_name
-    num_tokens += 3  # every reply is primed with <|start|>assistant<|message|>
+        return _token_rules("gpt-3.5-turbo")
+    return encoding, tokens_per_message, tokens_per_name
+
+
+def num_tokens_from_message(message, model):
+    """Returns the number of tokens used by a single message, without the reply priming."""
+    encoding, tokens_per_message, tokens_per_name = _token_rules(model)
+    if encoding is None:
+        return len(message["content"])
+    num_tokens = tokens_per_message
+    for key, value in message.items():
+        num_tokens += len(encoding.encode(value))
+        if key == "name":
+            num_tokens += tokens_per_name
     return num_tokens
-def num_tokens_by_character(messages):
+
+
+# refer to https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb
+def num_tokens_from_messages(messages, model):
     """Returns the number of tokens used by a list of messages."""
-    tokens = 0
-    for msg in messages:
-        tokens += len(msg["content"])
-    return tokens
\ No newline at end of file
+    encoding = _token_rules(model)[0]
+    num_tokens = sum(num_tokens_from_message(message, model) for message in messages)
+    if encoding is not None:
+        num_tokens += 3  # every reply is primed with <|start|>assistant<|message|>
+    return num_tokens
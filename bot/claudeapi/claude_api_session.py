@@ -15,15 +15,7 @@ class ClaudeAPISession(Session):
               A: xxx
               Q: xxx
         """
-        prompt = ""
-        for item in self.messages:
-            if item["role"] == "system":
-                prompt += item["content"] + "<|endoftext|>\n\n\n"
-            elif item["role"] == "user":
-                prompt += "Q: " + item["content"] + "\n"
-            elif item["role"] == "assistant":
-                prompt += "\n\nA: " + item["content"] + "<|endoftext|>\n"
-
+        prompt = "".join(format_item(item) for item in self.messages)
         if len(self.messages) > 0 and self.messages[-1]["role"] == "user":
             prompt += "A: "
         return prompt
@@ -40,11 +32,11 @@ class ClaudeAPISession(Session):
             logger.debug("Exception when counting tokens precisely for query: {}".format(e))
         while cur_tokens > max_tokens:
             if len(self.messages) > 1:
-                self.messages.pop(0)
+                dropped = self.pop_message(0)
             elif len(self.messages) == 1 and self.messages[0]["role"] == "assistant":
-                self.messages.pop(0)
+                dropped = self.pop_message(0)
                 if precise:
-                    cur_tokens = self.calc_tokens()
+                    cur_tokens -= dropped
                 else:
                     cur_tokens = len(str(self))
                 break
@@ -55,16 +47,33 @@ class ClaudeAPISession(Session):
                 logger.debug("max_tokens={}, total_tokens={}, len(conversation)={}".format(max_tokens, cur_tokens, len(self.messages)))
                 break
             if precise:
-                cur_tokens = self.calc_tokens()
+                cur_tokens -= dropped
             else:
                 cur_tokens = len(str(self))
         return cur_tokens
+    def count_message_tokens(self, message):
+        return num_tokens_from_string(format_item(message), self.model)
+
     def calc_tokens(self):
-        return num_tokens_from_string(str(self), self.model)
+        # 按条缓存，只有末尾的"A: "需要单独计算
+        tokens = super().calc_tokens()
+        if len(self.messages) > 0 and self.messages[-1]["role"] == "user":
+            tokens += num_tokens_from_string("A: ", self.model)
+        return tokens
+
+
+def format_item(item):
+    if item["role"] == "system":
+        return item["content"] + "<|endoftext|>\n\n\n"
+    elif item["role"] == "user":
+        return "Q: " + item["content"] + "\n"
+    elif item["role"] == "assistant":
+        return "\n\nA: " + item["content"] + "<|endoftext|>\n"
+    return ""
 
 
 # refer to https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb
 def num_tokens_from_string(string: str, model: str) -> int:
     """Returns the number of tokens in a text string."""
     num_tokens = len(string)
-    return num_tokens
\ No newline at end of file
+    return num_tokens
@@ -1,15 +1,16 @@
 # encoding:utf-8
 
+import json
 import time
 
 from bot.bot import Bot
 from bot.session_manager import SessionManager
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
+from common import http_pool
 from common.log import logger
 from config import conf, load_config
 from .deepseek_session import DeepSeekSession
-import requests
 
 
 # ZhipuAI对话模型API
@@ -25,6 +26,9 @@ class DeepSeekBot(Bot):
         self.api_key = conf().get("deepseek_api_key")
         self.base_url = conf().get("deepseek_base_url", "https://api.deepseek.com/v1/chat/completions")
 
+    def warm_up_url(self):
+        return self.base_url
+
     def reply(self, query, context=None):
         # acquire reply content
         if context.type == ContextType.TEXT:
@@ -77,6 +81,66 @@ class DeepSeekBot(Bot):
             reply = Reply(ReplyType.ERROR, "Bot不支持处理{}类型的消息".format(context.type))
             return reply
 
+    def reply_stream(self, query, context=None):
+        if context.type != ContextType.TEXT or query in conf().get("clear_memory_commands", ["#清除记忆"]) \
+                or query in ["#清除所有", "#更新配置"]:
+            return self.reply(query, context)
+        logger.info("[DEEPSEEK_AI] stream query={}".format(query))
+        session_id = context["session_id"]
+        session = self.sessions.session_query(query, session_id)
+        body = self.args.copy()
+        model = context.get("deepseek_model")
+        if model:
+            body["model"] = model
+        body["messages"] = session.messages
+        body["stream"] = True
+        body["stream_options"] = {"include_usage": True}
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": "Bearer " + self.api_key
+        }
+        try:
+            # 读取超时是两次收到数据之间的间隔，上游卡住时不会一直占用处理线程
+            timeout = (conf().get("stream_reply_connect_timeout", 10), conf().get("stream_reply_read_timeout", 60))
+            res = http_pool.session().post(self.base_url, headers=headers, json=body, stream=True, timeout=timeout)
+        except Exception as e:
+            logger.exception(e)
+            return Reply(ReplyType.ERROR, "我现在有点累了，等会再来吧")
+        if res.status_code != 200:
+            logger.error(f"[DEEPSEEK_AI] stream chat failed, status_code={res.status_code}, body={res.text}")
+            if res.status_code == 401:
+                return Reply(ReplyType.ERROR, "授权失败，请检查API Key是否正确")
+            elif res.status_code == 429:
+                return Reply(ReplyType.ERROR, "请求过于频繁，请稍后再试")
+            return Reply(ReplyType.ERROR, "提问太快啦，请休息一下再问我吧")
+        return self._iter_stream(res, session_id)
+
+    def _iter_stream(self, res, session_id):
+        """逐行解析SSE，产出增量文本，完整结束后写入会话"""
+        content = []
+        total_tokens = None
+        finished = False
+        with res:
+            # chunk_size=None: 收到一个数据块就处理，不等待凑满固定大小
+            for line in res.iter_lines(chunk_size=None):
+                if not line or not line.startswith(b"data:"):
+                    continue
+                data = line[5:].strip()
+                if data == b"[DONE]":
+                    finished = True
+                    break
+                event = json.loads(data)
+                if event.get("usage"):
+                    total_tokens = event["usage"].get("total_tokens")
+                for choice in event.get("choices") or []:
+                    text = (choice.get("delta") or {}).get("content")
+                    if text:
+                        content.append(text)
+                        yield text
+        if not finished:
+            raise Exception("[DEEPSEEK_AI] stream closed before [DONE]")
+        self.sessions.session_reply("".join(content), session_id, total_tokens)
+
     def reply_text(self, session: DeepSeekSession, args=None, retry_count=0) -> dict:
         """
         call openai's ChatCompletion to get the answer
@@ -94,7 +158,7 @@ class DeepSeekBot(Bot):
             body["messages"] = session.messages
             # logger.debug("[DEEPSEEK_AI] response={}".format(response))
             # logger.info("[DEEPSEEK_AI] reply={}, total_tokens={}".format(response.choices[0]['message']['content'], response["usage"]["total_tokens"]))
-            res = requests.post(
+            res = http_pool.session().post(
                 self.base_url,
                 headers=headers,
                 json=body
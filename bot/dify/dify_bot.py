@@ -33,37 +33,9 @@ class DifyBot(Bot):
             if context.type == ContextType.IMAGE_CREATE:
                 query = conf().get('image_create_prefix', ['画画'])[0] + query
             logger.info("[DIFY] query={}".format(query))
-            session_id = context["session_id"]
-            # TODO: 适配除微信以外的其他channel
-            channel_type = conf().get("channel_type", "wx")
-            user = None
-            if channel_type in ["wx", "wework", "gewechat", "wx849","wcferry"]:
-                user = context["msg"].other_user_nickname if context.get("msg") else "default"
-            elif channel_type in ["wechatcom_app", "wechatmp", "wechatmp_service", "wechatcom_service", "web"]:
-                user = context["msg"].other_user_id if context.get("msg") else "default"
-            else:
-                return Reply(ReplyType.ERROR, f"unsupported channel type: {channel_type}, now dify only support wx, wx849, wechatcom_app, wechatmp, wechatmp_service channel")
-            logger.debug(f"[DIFY] dify_user={user}")
-            user = user if user else "default" # 防止用户名为None，当被邀请进的群未设置群名称时用户名为None
-            session = self.sessions.get_session(session_id, user)
-            if context.get("isgroup", False):
-                # 群聊：根据是否是共享会话群来决定是否设置用户信息
-                if not context.get("is_shared_session_group", False):
-                    # 非共享会话群：设置发送者信息
-                    session.set_user_info(context["msg"].actual_user_id, context["msg"].actual_user_nickname)
-                else:
-                    # 共享会话群：不设置用户信息
-                    session.set_user_info('', '')
-                # 设置群聊信息
-                session.set_room_info(context["msg"].other_user_id, context["msg"].other_user_nickname)
-            else:
-                # 私聊：使用发送者信息作为用户信息，房间信息留空
-                session.set_user_info(context["msg"].other_user_id, context["msg"].other_user_nickname)
-                session.set_room_info('', '')
-
-            # 打印设置的session信息
-            logger.debug(f"[DIFY] Session user and room info - user_id: {session.get_user_id()}, user_name: {session.get_user_name()}, room_id: {session.get_room_id()}, room_name: {session.get_room_name()}")
-            logger.debug(f"[DIFY] session={session} query={query}")
+            session, err_reply = self._prepare_session(query, context)
+            if err_reply:
+                return err_reply
 
             reply, err = self._reply(query, session, context)
             if err != None:
@@ -75,6 +47,99 @@ class DifyBot(Bot):
             reply = Reply(ReplyType.ERROR, "Bot不支持处理{}类型的消息".format(context.type))
             return reply
 
+    def _prepare_session(self, query, context: Context):
+        """根据消息来源取得会话并设置用户、群聊信息，返回 (session, 错误回复)"""
+        session_id = context["session_id"]
+        # TODO: 适配除微信以外的其他channel
+        channel_type = conf().get("channel_type", "wx")
+        user = None
+        if channel_type in ["wx", "wework", "gewechat", "wx849","wcferry"]:
+            user = context["msg"].other_user_nickname if context.get("msg") else "default"
+        elif channel_type in ["wechatcom_app", "wechatmp", "wechatmp_service", "wechatcom_service", "web"]:
+            user = context["msg"].other_user_id if context.get("msg") else "default"
+        else:
+            return None, Reply(ReplyType.ERROR, f"unsupported channel type: {channel_type}, now dify only support wx, wx849, wechatcom_app, wechatmp, wechatmp_service channel")
+        logger.debug(f"[DIFY] dify_user={user}")
+        user = user if user else "default" # 防止用户名为None，当被邀请进的群未设置群名称时用户名为None
+        session = self.sessions.get_session(session_id, user)
+        if context.get("isgroup", False):
+            # 群聊：根据是否是共享会话群来决定是否设置用户信息
+            if not context.get("is_shared_session_group", False):
+                # 非共享会话群：设置发送者信息
+                session.set_user_info(context["msg"].actual_user_id, context["msg"].actual_user_nickname)
+            else:
+                # 共享会话群：不设置用户信息
+                session.set_user_info('', '')
+            # 设置群聊信息
+            session.set_room_info(context["msg"].other_user_id, context["msg"].other_user_nickname)
+        else:
+            # 私聊：使用发送者信息作为用户信息，房间信息留空
+            session.set_user_info(context["msg"].other_user_id, context["msg"].other_user_nickname)
+            session.set_room_info('', '')
+
+        # 打印设置的session信息
+        logger.debug(f"[DIFY] Session user and room info - user_id: {session.get_user_id()}, user_name: {session.get_user_name()}, room_id: {session.get_room_id()}, room_name: {session.get_room_name()}")
+        logger.debug(f"[DIFY] session={session} query={query}")
+        return session, None
+
+    def reply_stream(self, query, context: Context=None):
+        dify_app_type = self._get_dify_conf(context, "dify_app_type", 'chatbot')
+        # workflow没有对话消息流，其他类型的消息仍然一次性回复
+        if context.type != ContextType.TEXT or dify_app_type not in ['chatbot', 'chatflow', 'agent']:
+            return self.reply(query, context)
+        logger.info("[DIFY] stream query={}".format(query))
+        session, err_reply = self._prepare_session(query, context)
+        if err_reply:
+            return err_reply
+        try:
+            session.count_user_message()
+            api_key = self._get_dify_conf(context, "dify_api_key", '')
+            api_base = self._get_dify_conf(context, "dify_api_base", "https://api.dify.ai/v1")
+            chat_client = ChatClient(api_key, api_base)
+            payload = self._get_payload(query, session, 'streaming')
+            files = self._get_upload_files(session, context)
+            response = chat_client.create_chat_message(
+                inputs=payload['inputs'],
+                query=payload['query'],
+                user=payload['user'],
+                response_mode=payload['response_mode'],
+                conversation_id=payload['conversation_id'],
+                files=files
+            )
+        except Exception as e:
+            logger.exception(f"[DIFY] Exception: {e}")
+            return Reply(ReplyType.TEXT, conf().get("dify_error_reply", None) or UNKNOWN_ERROR_MSG)
+        if response.status_code != 200:
+            logger.warning(f"[DIFY] payload={payload} response text={response.text} status_code={response.status_code}")
+            friendly_error_msg = self._handle_error_response(response.text, response.status_code)
+            return Reply(ReplyType.TEXT, conf().get("dify_error_reply", None) or friendly_error_msg)
+        return self._iter_stream(response, session, context)
+
+    def _iter_stream(self, response, session: DifySession, context: Context):
+        """产出回答的增量文本，图片等文件在收到时直接发送"""
+        channel = context.get("channel")
+        conversation_id = None
+        for event in self._iter_sse_events(response):
+            event_name = event['event']
+            if event_name == 'agent_message' or event_name == 'message':
+                if not conversation_id:
+                    conversation_id = event['conversation_id']
+                if event['answer']:
+                    yield event['answer']
+            elif event_name == 'message_file':
+                if channel:
+                    url = self._fill_file_base_url(event['url'])
+                    threading.Thread(target=channel.send, args=(Reply(ReplyType.IMAGE_URL, url), context)).start()
+            elif event_name == 'error':
+                logger.error("[DIFY] error: {}".format(event))
+                raise Exception(event)
+            elif event_name == 'message_end':
+                logger.debug("[DIFY] message_end usage: {}".format(event.get('metadata', {}).get('usage')))
+                break
+        # 设置dify conversation_id, 依靠dify管理上下文
+        if conversation_id and session.get_conversation_id() == '':
+            session.set_conversation_id(conversation_id)
+
     # TODO: delete this function
     def _get_payload(self, query, session: DifySession, response_mode):
         # 输入的变量参考 wechat-assistant-pro：https://github.com/leochen-g/wechat-assistant-pro/issues/76
@@ -437,20 +502,21 @@ class DifyBot(Bot):
             logger.warning("Received an empty SSE event.")
             return None
 
-    # TODO: 异步返回events
-    def _handle_sse_response(self, response: requests.Response):
-        events = []
-        for line in response.iter_lines():
-            if line:
-                decoded_line = line.decode('utf-8')
-                event = self._parse_sse_event(decoded_line)
-                if event:
-                    events.append(event)
+    def _iter_sse_events(self, response: requests.Response):
+        """逐行解析SSE响应，收到一个事件就返回一个，不等待整个响应结束"""
+        with response:
+            # chunk_size=None: 收到一个数据块就处理，不等待凑满固定大小
+            for line in response.iter_lines(chunk_size=None):
+                if line:
+                    event = self._parse_sse_event(line.decode('utf-8'))
+                    if event:
+                        yield event
 
+    def _handle_sse_response(self, response: requests.Response):
         merged_message = []
         accumulated_agent_message = ''
         conversation_id = None
-        for event in events:
+        for event in self._iter_sse_events(response):
             event_name = event['event']
             if event_name == 'agent_message' or event_name == 'message':
                 accumulated_agent_message += event['answer']
@@ -8,10 +8,10 @@ from bot.bot import Bot
 from bot.session_manager import SessionManager
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
+from common import http_pool
 from common.log import logger
 from config import conf, load_config
 from .moonshot_session import MoonshotSession
-import requests
 
 
 # ZhipuAI对话模型API
@@ -30,6 +30,9 @@ class MoonshotBot(Bot):
         self.api_key = conf().get("moonshot_api_key")
         self.base_url = conf().get("moonshot_base_url", "https://api.moonshot.cn/v1/chat/completions")
 
+    def warm_up_url(self):
+        return self.base_url
+
     def reply(self, query, context=None):
         # acquire reply content
         if context.type == ContextType.TEXT:
@@ -99,7 +102,7 @@ class MoonshotBot(Bot):
             body["messages"] = session.messages
             # logger.debug("[MOONSHOT_AI] response={}".format(response))
             # logger.info("[MOONSHOT_AI] reply={}, total_tokens={}".format(response.choices[0]['message']['content'], response["usage"]["total_tokens"]))
-            res = requests.post(
+            res = http_pool.session().post(
                 self.base_url,
                 headers=headers,
                 json=body
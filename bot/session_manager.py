@@ -1,12 +1,20 @@
-from common.expired_dict import ExpiredDict
+from bot.session_store import build_session_store
 from common.log import logger
-from config import conf
+from config import conf, config_snapshot
 
 
 class Session(object):
+    base_tokens = 0  # 与具体消息无关的固定token开销
+
     def __init__(self, session_id, system_prompt=None):
         self.session_id = session_id
         self.messages = []
+        self.token_cache = {}  # id(message) -> (message, content, tokens)，内容不变时每条消息只计算一次token
+        self.counted_list = None  # calc_tokens上次累加的消息列表
+        self.counted_head = 0  # 累加的起始位置，开头的system消息不计入前缀
+        self.counted_len = 0  # 已累加到的位置
+        self.counted_last = None  # 已累加的最后一条消息，用于发现列表被外部修改
+        self.counted_tokens = 0  # 已累加消息的token总数
         if system_prompt is None:
             self.system_prompt = conf().get("character_desc", "")
         else:
@@ -16,6 +24,7 @@ class Session(object):
     def reset(self):
         system_item = {"role": "system", "content": self.system_prompt}
         self.messages = [system_item]
+        self.token_cache = {}
 
     def set_system_prompt(self, system_prompt):
         self.system_prompt = system_prompt
@@ -32,17 +41,61 @@ class Session(object):
     def discard_exceeding(self, max_tokens=None, cur_tokens=None):
         raise NotImplementedError
 
-    def calc_tokens(self):
+    def count_message_tokens(self, message):
+        """单条消息的token数，由子类实现"""
         raise NotImplementedError
 
+    def message_tokens(self, message):
+        # system消息的content会在每次请求前被原地改写(如按群设置的prompt)，内容变化时重新计算
+        content = message.get("content")
+        entry = self.token_cache.get(id(message))
+        if entry is None or entry[0] is not message or entry[1] is not content:
+            entry = (message, content, self.count_message_tokens(message))
+            self.token_cache[id(message)] = entry
+        return entry[2]
+
+    def calc_tokens(self):
+        # 维护已计算前缀的token总数，每次只计算新追加的消息；开头的system消息每次单独取
+        messages = self.messages
+        head = 1 if messages and messages[0].get("role") == "system" else 0
+        counted = self.counted_len
+        if (
+            messages is not self.counted_list
+            or head != self.counted_head
+            or counted > len(messages)
+            or (counted > head and messages[counted - 1] is not self.counted_last)
+        ):
+            # 消息列表被外部直接修改过，用每条消息的缓存重新累加，并清理已不在会话中的缓存
+            live = {id(message) for message in messages}
+            self.token_cache = {k: v for k, v in self.token_cache.items() if k in live}
+            self.counted_list, self.counted_head, self.counted_tokens, counted = messages, head, 0, head
+        for message in messages[counted:]:
+            self.counted_tokens += self.message_tokens(message)
+        self.counted_len = len(messages)
+        self.counted_last = messages[-1] if len(messages) > head else None
+        system_tokens = self.message_tokens(messages[0]) if head else 0
+        return self.base_tokens + system_tokens + self.counted_tokens
+
+    def pop_message(self, index):
+        """移除一条消息，返回它的token数(未计算过时返回0)，裁剪会话时据此更新总数而不必重新计算"""
+        position = index if index >= 0 else len(self.messages) + index
+        message = self.messages.pop(index)
+        entry = self.token_cache.pop(id(message), None)
+        tokens = entry[2] if entry is not None and entry[0] is message else 0
+        if self.messages is self.counted_list:
+            if position < self.counted_head:
+                # 移除了开头的system消息，下次重新累加
+                self.counted_list = None
+            elif position < self.counted_len:
+                self.counted_len -= 1
+                self.counted_tokens -= tokens
+                self.counted_last = self.messages[self.counted_len - 1] if self.counted_len > self.counted_head else None
+        return tokens
+
 
 class SessionManager(object):
     def __init__(self, sessioncls, **session_args):
-        if conf().get("expires_in_seconds"):
-            sessions = ExpiredDict(conf().get("expires_in_seconds"))
-        else:
-            sessions = dict()
-        self.sessions = sessions
+        self.sessions = build_session_store(sessioncls, session_args)
         self.sessioncls = sessioncls
         self.session_args = session_args
 
@@ -65,7 +118,7 @@ class SessionManager(object):
         session = self.build_session(session_id)
         session.add_query(query)
         try:
-            max_tokens = conf().get("conversation_max_tokens", 1000)
+            max_tokens = config_snapshot().get("conversation_max_tokens", 1000)
             total_tokens = session.discard_exceeding(max_tokens, None)
             logger.debug("prompt tokens used={}".format(total_tokens))
         except Exception as e:
@@ -76,7 +129,7 @@ class SessionManager(object):
         session = self.build_session(session_id)
         session.add_reply(reply)
         try:
-            max_tokens = conf().get("conversation_max_tokens", 1000)
+            max_tokens = config_snapshot().get("conversation_max_tokens", 1000)
             tokens_cnt = session.discard_exceeding(max_tokens, total_tokens)
             logger.debug("raw total_tokens={}, savesession tokens={}".format(total_tokens, tokens_cnt))
         except Exception as e:
@@ -0,0 +1,286 @@
+"""
+会话存储
+
+memory: 会话只保存在进程内(ExpiredDict或dict)，重启后丢失。
+sqlite: 最近使用的会话保存在内存LRU中，其余保存在本地SQLite(WAL模式)。
+        build_session时按需加载，修改过的会话由后台线程批量写回，超出容量的会话从内存淘汰，
+        重启后会话从数据库恢复。会话由持有者直接修改，写回时按指纹判断是否变化，
+        淘汰时仍被持有的会话继续跟踪，之后的修改同样会写回。
+"""
+
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+from common.expired_dict import ExpiredDict
+from common.log import logger
+from config import conf, get_appdata_dir
+
+
+def build_session_store(sessioncls, session_args):
+    store_type = conf().get("session_store", "memory")
+    if store_type == "sqlite":
+        path = conf().get("session_store_path") or os.path.join(get_appdata_dir(), "sessions.db")
+        namespace = "{}:{}".format(sessioncls.__name__, session_args.get("model", ""))
+        return SQLiteSessionStore(path, namespace, sessioncls, session_args)
+    if store_type != "memory":
+        logger.warning("[SessionStore] unknown session_store={}, fallback to memory".format(store_type))
+    if conf().get("expires_in_seconds"):
+        return ExpiredDict(conf().get("expires_in_seconds"))
+    return dict()
+
+
+class SQLiteSessionStore(object):
+    """
+    与dict相同的用法(in, [], del, clear)，SessionManager无需关心会话在内存还是磁盘中
+    """
+
+    def __init__(self, path, namespace, sessioncls, session_args):
+        self.path = path
+        self.namespace = namespace
+        self.sessioncls = sessioncls
+        self.session_args = session_args
+        self.expires_in_seconds = conf().get("expires_in_seconds")
+        self.cache_size = conf().get("session_cache_size", 1000)
+        self.flush_interval = conf().get("session_flush_interval", 5)
+        self.lock = threading.RLock()
+        self.flush_lock = threading.Lock()  # 同一时间只有一次写回
+        self.hot = OrderedDict()  # session_id -> (session, last_access, 上次写回时的指纹)，按最近使用排序，新会话指纹为None
+        self.pending = {}  # session_id -> (session, last_access)，已淘汰但修改尚未写回的会话
+        self.retired = {}  # session_id -> (weakref, last_access, 指纹)，已淘汰且已写回、可能仍被持有的会话
+        self.flushing = None  # 正在写回时，期间被删除的session_id
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "namespace TEXT NOT NULL, session_id TEXT NOT NULL, data TEXT NOT NULL, updated_at REAL NOT NULL, "
+            "PRIMARY KEY (namespace, session_id))"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_updated ON sessions (updated_at)")
+        self.conn.commit()
+        self._purge_expired()
+
+        threading.Thread(target=self._flush_loop, daemon=True, name="session-store").start()
+        atexit.register(self.flush)
+        logger.info("[SessionStore] sqlite session store: {}, namespace={}".format(path, namespace))
+
+    # ---------- 序列化 ----------
+
+    @staticmethod
+    def _dump(system_prompt, messages):
+        return json.dumps({"system_prompt": system_prompt, "messages": messages}, ensure_ascii=False)
+
+    def _load(self, session_id, data):
+        data = json.loads(data)
+        session = self.sessioncls(session_id, data.get("system_prompt"), **self.session_args)
+        session.messages = data.get("messages", [])
+        return session
+
+    @staticmethod
+    def _fingerprint(session):
+        # 会话由持有者直接修改(追加、裁剪消息或重置)，不经过store；写回时比较指纹，只写回变化过的会话
+        messages = session.messages
+        return (
+            session.system_prompt,
+            id(messages),
+            len(messages),
+            id(messages[0]) if messages else None,
+            id(messages[-1]) if messages else None,
+        )
+
+    # ---------- dict接口 ----------
+
+    def _expired(self, last_access):
+        return bool(self.expires_in_seconds) and time.time() - last_access > self.expires_in_seconds
+
+    def _get(self, session_id):
+        item = self.hot.get(session_id)
+        if item is not None:
+            session, last_access, saved = item
+        elif session_id in self.pending:
+            # 已淘汰但尚未写回，仍使用同一个对象，持有者之后的修改不会丢失
+            session, last_access = self.pending.pop(session_id)
+            saved = None
+        else:
+            session, last_access, saved = self._retired(session_id)
+            if session is None:
+                row = self.conn.execute(
+                    "SELECT data, updated_at FROM sessions WHERE namespace=? AND session_id=?", (self.namespace, session_id)
+                ).fetchone()
+                if row is None:
+                    return None
+                data, last_access = row
+                if self._expired(last_access):
+                    self._delete(session_id)
+                    return None
+                try:
+                    session = self._load(session_id, data)
+                except Exception as e:
+                    logger.warning("[SessionStore] failed to load session {}: {}".format(session_id, e))
+                    self._delete(session_id)
+                    return None
+                saved = self._fingerprint(session)
+        if self._expired(last_access):
+            self._delete(session_id)
+            return None
+        self.hot[session_id] = (session, time.time(), saved)
+        self.hot.move_to_end(session_id)
+        self._evict()
+        return session
+
+    def _retired(self, session_id):
+        item = self.retired.pop(session_id, None)
+        if item is not None:
+            ref, last_access, saved = item
+            session = ref()
+            if session is not None:
+                return session, last_access, saved
+        return None, None, None
+
+    def _evict(self):
+        while len(self.hot) > self.cache_size:
+            session_id, (session, last_access, saved) = self.hot.popitem(last=False)
+            if saved != self._fingerprint(session):
+                self.pending[session_id] = (session, last_access)
+            else:
+                # 已写回的会话只保留弱引用：仍被持有时，之后的修改在写回时发现，再次取出时也是同一个对象
+                self.retired[session_id] = (weakref.ref(session), last_access, saved)
+
+    def _delete(self, session_id):
+        self.hot.pop(session_id, None)
+        self.pending.pop(session_id, None)
+        self.retired.pop(session_id, None)
+        if self.flushing is not None:
+            self.flushing.add(session_id)
+        self.conn.execute("DELETE FROM sessions WHERE namespace=? AND session_id=?", (self.namespace, session_id))
+        self.conn.commit()
+
+    def __contains__(self, session_id):
+        with self.lock:
+            return self._get(session_id) is not None
+
+    def __getitem__(self, session_id):
+        with self.lock:
+            session = self._get(session_id)
+        if session is None:
+            raise KeyError(session_id)
+        return session
+
+    def __setitem__(self, session_id, session):
+        with self.lock:
+            self.pending.pop(session_id, None)
+            self.retired.pop(session_id, None)
+            self.hot[session_id] = (session, time.time(), None)
+            self.hot.move_to_end(session_id)
+            self._evict()
+
+    def __delitem__(self, session_id):
+        with self.lock:
+            self._delete(session_id)
+
+    def __len__(self):
+        self.flush()
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM sessions WHERE namespace=?", (self.namespace,)).fetchone()[0]
+
+    def clear(self):
+        with self.lock:
+            if self.flushing is not None:
+                self.flushing.update(self.hot, self.pending, self.retired)
+            self.hot.clear()
+            self.pending.clear()
+            self.retired.clear()
+            self.conn.execute("DELETE FROM sessions WHERE namespace=?", (self.namespace,))
+            self.conn.commit()
+
+    # ---------- 写回 ----------
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+                self._purge_expired()
+            except Exception as e:
+                logger.warning("[SessionStore] flush failed: {}".format(e))
+
+    def _changed(self):
+        """取出需要写回的会话：(session_id, session, last_access, 指纹)"""
+        changed = [(session_id, session, last_access, None) for session_id, (session, last_access) in self.pending.items()]
+        self.pending.clear()
+        for session_id, (session, last_access, saved) in self.hot.items():
+            fingerprint = self._fingerprint(session)
+            if fingerprint != saved:
+                changed.append((session_id, session, last_access, fingerprint))
+        for session_id, (ref, last_access, saved) in list(self.retired.items()):
+            session = ref()
+            if session is None:
+                del self.retired[session_id]
+                continue
+            fingerprint = self._fingerprint(session)
+            if fingerprint != saved:
+                changed.append((session_id, session, last_access, fingerprint))
+        return changed
+
+    def flush(self):
+        """把修改过的会话在一个事务中写回数据库，加锁时只复制消息列表，序列化在锁外进行"""
+        with self.flush_lock:
+            with self.lock:
+                changed = self._changed()
+                if not changed:
+                    return
+                snapshots = []
+                for session_id, session, last_access, fingerprint in changed:
+                    snapshots.append((session_id, session.system_prompt, list(session.messages), last_access))
+                    fingerprint = fingerprint or self._fingerprint(session)
+                    if session_id in self.hot:
+                        self.hot[session_id] = (session, self.hot[session_id][1], fingerprint)
+                    else:
+                        self.retired[session_id] = (weakref.ref(session), last_access, fingerprint)
+                self.flushing = set()
+            try:
+                rows = [
+                    (self.namespace, session_id, self._dump(prompt, messages), last_access)
+                    for session_id, prompt, messages, last_access in snapshots
+                ]
+                with self.lock:
+                    # 序列化期间被删除的会话不再写回
+                    rows = [row for row in rows if row[1] not in self.flushing]
+                    self.conn.executemany(
+                        "INSERT OR REPLACE INTO sessions (namespace, session_id, data, updated_at) VALUES (?, ?, ?, ?)", rows
+                    )
+                    self.conn.commit()
+            except Exception:
+                with self.lock:
+                    # 写回失败，下次重新写回
+                    for session_id, session, last_access, _ in changed:
+                        if session_id in self.flushing:
+                            continue
+                        if session_id in self.hot:
+                            item = self.hot[session_id]
+                            self.hot[session_id] = (item[0], item[1], None)
+                        else:
+                            self.retired.pop(session_id, None)
+                            self.pending[session_id] = (session, last_access)
+                raise
+            finally:
+                with self.lock:
+                    self.flushing = None
+        logger.debug("[SessionStore] flushed {} sessions".format(len(rows)))
+
+    def _purge_expired(self):
+        if not self.expires_in_seconds:
+            return
+        with self.lock:
+            self.conn.execute(
+                "DELETE FROM sessions WHERE namespace=? AND updated_at<?", (self.namespace, time.time() - self.expires_in_seconds)
+            )
+            self.conn.commit()
@@ -1,6 +1,10 @@
+import threading
+import time
+
 from bot.bot_factory import create_bot
-from bridge.context import Context
-from bridge.reply import Reply
+from bridge.context import Context, ContextType
+from bridge.reply import Reply, ReplyType
+from bridge.reply_cache import get_reply_cache
 from common import const
 from common.log import logger
 from common.singleton import singleton
@@ -63,28 +67,120 @@ class Bridge(object):
         if not conf().get("text_to_voice") or conf().get("text_to_voice") in ["openai", const.TTS_1, const.TTS_1_HD]:
             self.btype["text_to_voice"] = const.LINKAI
             
+        router_backends = conf().get("chat_router_backends")
+        if router_backends:
+            # 使用路由时按第一个后端的类型判断支持的功能(如重置会话)
+            self.btype["chat"] = router_backends[0]["type"]
+
         self.bots = {}
         self.chat_bots = {}
+        self.lock = threading.RLock()
 
 
     def get_bot(self, typename):
         if self.bots.get(typename) is None:
-            logger.info("create bot {} for {}".format(self.btype[typename], typename))
-            if typename == "text_to_voice":
-                self.bots[typename] = create_voice(self.btype[typename])
-            elif typename == "voice_to_text":
-                self.bots[typename] = create_voice(self.btype[typename])
-            elif typename == "chat":
-                self.bots[typename] = create_bot(self.btype[typename])
-            elif typename == "translate":
-                self.bots[typename] = create_translator(self.btype[typename])
+            # 预热线程和处理消息的线程可能同时创建，加锁保证每种bot只创建一次
+            with self.lock:
+                if self.bots.get(typename) is None:
+                    logger.info("create bot {} for {}".format(self.btype[typename], typename))
+                    if typename == "text_to_voice":
+                        self.bots[typename] = create_voice(self.btype[typename])
+                    elif typename == "voice_to_text":
+                        self.bots[typename] = create_voice(self.btype[typename])
+                    elif typename == "chat":
+                        if conf().get("chat_router_backends"):
+                            from bridge.router import ChatRouter
+
+                            self.bots[typename] = ChatRouter(conf().get("chat_router_backends"), self.find_chat_bot)
+                        else:
+                            self.bots[typename] = create_bot(self.btype[typename])
+                    elif typename == "translate":
+                        self.bots[typename] = create_translator(self.btype[typename])
         return self.bots[typename]
 
+    def warm_up(self):
+        """
+        在后台线程中提前创建配置的bot：导入SDK、加载tokenizer、建立连接，避免由第一条消息承担这些耗时。
+        返回预热线程
+        """
+        typenames = ["chat"]
+        if conf().get("speech_recognition") or conf().get("group_speech_recognition"):
+            typenames.append("voice_to_text")
+        if conf().get("voice_reply_voice") or conf().get("always_reply_voice"):
+            typenames.append("text_to_voice")
+
+        def run():
+            for typename in typenames:
+                start = time.perf_counter()
+                try:
+                    bot = self.get_bot(typename)
+                    warm_up = getattr(bot, "warm_up", None)
+                    if warm_up is not None:
+                        warm_up()
+                    logger.info("[Bridge] warm up {} ({}) in {:.0f}ms".format(typename, self.btype[typename], (time.perf_counter() - start) * 1000))
+                except Exception as e:
+                    logger.warning("[Bridge] warm up {} ({}) failed: {}".format(typename, self.btype[typename], e))
+
+        thread = threading.Thread(target=run, daemon=True, name="bridge-warm-up")
+        thread.start()
+        return thread
+
     def get_bot_type(self, typename):
         return self.btype[typename]
 
     def fetch_reply_content(self, query, context: Context) -> Reply:
-        return self.get_bot("chat").reply(query, context)
+        bot = self.get_bot("chat")
+        cache, key, reply = self._cached_reply(bot, query, context)
+        if reply is not None:
+            return reply
+        reply = bot.reply(query, context)
+        if key is not None and reply is not None and reply.type == ReplyType.TEXT:
+            cache.put(key, reply.content)
+        return reply
+
+    def fetch_reply_stream(self, query, context: Context):
+        """返回Reply或文本片段的迭代器，见Bot.reply_stream"""
+        bot = self.get_bot("chat")
+        cache, key, reply = self._cached_reply(bot, query, context)
+        if reply is not None:
+            return reply
+        result = bot.reply_stream(query, context)
+        if key is None or result is None:
+            return result
+        if isinstance(result, Reply):
+            if result.type == ReplyType.TEXT:
+                cache.put(key, result.content)
+            return result
+        return self._cache_stream(cache, key, result)
+
+    def _cached_reply(self, bot, query, context):
+        """返回 (cache, key, 缓存的回复)，未开启缓存或这条消息不能缓存时key为None"""
+        cache = get_reply_cache()
+        if cache is None or context is None or context.type != ContextType.TEXT:
+            return None, None, None
+        key = cache.make_key(query, context, self.btype["chat"], bot)
+        if key is None:
+            return cache, None, None
+        content = cache.get(key)
+        if content is None:
+            return cache, key, None
+        logger.debug("[Bridge] reply cache hit, query={}".format(query))
+        # 命中时没有经过bot，补上会话记录，后续对话的上下文保持完整
+        sessions = getattr(bot, "sessions", None)
+        session_id = context.get("session_id")
+        if session_id and hasattr(sessions, "session_query"):
+            sessions.session_query(query, session_id)
+            sessions.session_reply(content, session_id)
+        return cache, key, Reply(ReplyType.TEXT, content)
+
+    @staticmethod
+    def _cache_stream(cache, key, stream):
+        # 流式回复完整结束后才写入缓存
+        content = []
+        for text in stream:
+            content.append(text)
+            yield text
+        cache.put(key, "".join(content))
 
     def fetch_voice_to_text(self, voiceFile) -> Reply:
         return self.get_bot("voice_to_text").voiceToText(voiceFile)
@@ -97,7 +193,9 @@ class Bridge(object):
 
     def find_chat_bot(self, bot_type: str):
         if self.chat_bots.get(bot_type) is None:
-            self.chat_bots[bot_type] = create_bot(bot_type)
+            with self.lock:
+                if self.chat_bots.get(bot_type) is None:
+                    self.chat_bots[bot_type] = create_bot(bot_type)
         return self.chat_bots.get(bot_type)
 
 
@@ -1,6 +1,8 @@
 # encoding:utf-8
 
+from collections.abc import MutableMapping
 from enum import Enum
+from types import MappingProxyType
 
 
 class ContextType(Enum):
@@ -40,11 +42,109 @@ class ContextType(Enum):
         return self.name
 
 
+def _copy_container(value):
+    return value.copy() if isinstance(value, (dict, list)) else value
+
+
+class ContextKwargs(MutableMapping):
+    """
+    叠加在父级kwargs上的写时复制视图
+
+    写入和删除只记录在本层，不影响父级；读取本层没有的key时取父级的值，
+    其中dict/list在第一次读取时复制到本层，避免修改嵌套内容时影响父级。
+    父级是只读的底层(MappingProxyType)，可以被多个视图共享，任何持有者都不能修改。
+    字符串、消息对象等其它值直接共享，原始XML、引用消息等内容不会在每次传递时被复制。
+    """
+
+    __slots__ = ("_local", "_parent", "_deleted")
+
+    def __init__(self, parent=None):
+        self._local = {}
+        self._parent = parent if isinstance(parent, MappingProxyType) else self.frozen(parent or {})
+        self._deleted = set()
+
+    @staticmethod
+    def frozen(mapping):
+        """复制为只读底层，dict/list值复制一层，原持有者之后修改自己的dict或其中的嵌套内容都不影响底层"""
+        return MappingProxyType({key: _copy_container(value) for key, value in mapping.items()})
+
+    def __getitem__(self, key):
+        try:
+            return self._local[key]
+        except KeyError:
+            pass
+        if key in self._deleted:
+            raise KeyError(key)
+        value = self._parent[key]
+        if isinstance(value, (dict, list)):
+            value = _copy_container(value)
+            self._local[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self._local[key] = value
+        self._deleted.discard(key)
+
+    def __delitem__(self, key):
+        if key in self._local:
+            del self._local[key]
+            if key in self._parent:
+                self._deleted.add(key)
+        elif key in self._parent and key not in self._deleted:
+            self._deleted.add(key)
+        else:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self._local or (key not in self._deleted and key in self._parent)
+
+    def __iter__(self):
+        for key in self._parent:
+            if key not in self._local and key not in self._deleted:
+                yield key
+        yield from self._local
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def copy(self):
+        return dict(self.items())
+
+    def freeze(self):
+        """
+        当前内容的只读底层，用于fork，不修改本层
+        本层没有修改时直接共享原底层，否则合并为新的底层，本层的dict/list值复制一层
+        """
+        if not self._local and not self._deleted:
+            return self._parent
+        merged = {key: value for key, value in self._parent.items() if key not in self._deleted and key not in self._local}
+        for key, value in self._local.items():
+            merged[key] = _copy_container(value)
+        return MappingProxyType(merged)
+
+    def __repr__(self):
+        return repr(self.copy())
+
+
 class Context:
-    def __init__(self, type: ContextType = None, content=None, kwargs=dict()):
+    __slots__ = ("type", "content", "kwargs")
+
+    def __init__(self, type: ContextType = None, content=None, kwargs=None):
         self.type = type
         self.content = content
-        self.kwargs = kwargs
+        self.kwargs = kwargs if kwargs is not None else {}
+
+    def fork(self):
+        """
+        创建独立的上下文副本，不复制消息内容
+
+        副本的kwargs是叠加在当前内容只读快照上的写时复制视图，原上下文不做改变，之后双方的修改互不影响
+        """
+        if isinstance(self.kwargs, ContextKwargs):
+            base = self.kwargs.freeze()
+        else:
+            base = ContextKwargs.frozen(self.kwargs)
+        return Context(self.type, self.content, ContextKwargs(base))
 
     def __contains__(self, key):
         if key == "type":
@@ -0,0 +1,242 @@
+"""
+对话回复缓存
+
+群里经常有重复的问题(如"今天天气")，每次都要完整请求一次大模型。开启reply_cache后，
+Bridge在调用chat bot之前按以下内容计算key查找缓存，命中时直接返回之前的文本回复：
+- 归一化后的问题(全半角、大小写、空白、句尾标点)
+- 对话后端类型、模型、会话的system prompt
+- 会话最近reply_cache_session_window条消息(默认0，此时会话已有上下文就不使用缓存)
+- 作用范围：global所有群共用，group每个群单独，session每个会话单独；私聊总是每个用户单独
+缓存按写入时间过期(reply_cache_ttl)，内存中最多保留reply_cache_size条，
+开启reply_cache_persist后同时写入本地SQLite，重启后仍可命中。
+
+以下情况不使用缓存：上下文保存在服务端的bot(dify、coze)、指令、正在识别图片的会话、
+会话已有上下文且未设置reply_cache_session_window(如"为什么"、"继续"的含义取决于之前的对话)、
+配置了reply_cache_patterns但问题不匹配。只缓存文本回复。
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+from common import const, memory
+from common.expired_dict import ExpiredDict
+from common.log import logger
+from config import conf, config_derived, config_snapshot, get_appdata_dir
+
+# 上下文由服务端维护的bot，本地无法判断上下文是否相同
+STATEFUL_BOTS = (const.DIFY, const.COZE)
+# 插件通过context覆盖模型时使用的key
+MODEL_KEYS = ("gpt_model", "deepseek_model", "moonshot_model")
+
+_SPACES = re.compile(r"\s+")
+_CJK_SPACE = re.compile(r"(?<=[^\x00-\x7f]) | (?=[^\x00-\x7f])")  # 中文前后的空格
+_TRAILING_PUNCTUATION = re.compile(r"[\s.,!?;~。，！？；～…]+$")
+
+
+def normalize_query(query):
+    query = unicodedata.normalize("NFKC", query).lower()
+    query = _CJK_SPACE.sub("", _SPACES.sub(" ", query).strip())
+    return _TRAILING_PUNCTUATION.sub("", query)
+
+
+class CacheRules(object):
+    def __init__(self, config):
+        self.enabled = config.get("reply_cache", False)
+        self.ttl = config.get("reply_cache_ttl", 600)
+        self.scope = config.get("reply_cache_scope", "group")
+        self.session_window = config.get("reply_cache_session_window", 0)
+        patterns = config.get("reply_cache_patterns", [])
+        self.pattern = re.compile("|".join("(?:{})".format(p) for p in patterns)) if patterns else None
+        self.commands = set(config.get("clear_memory_commands", ["#清除记忆"]))
+        self.model = config.get("model")
+        self.character_desc = config.get("character_desc", "")
+
+
+get_cache_rules = config_derived(CacheRules)
+
+
+class _DiskTier(object):
+    """SQLite持久层，内存未命中时查询，写入时同步写入"""
+
+    def __init__(self, path, max_rows):
+        self.max_rows = max_rows
+        self.lock = threading.Lock()
+        self.writes = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS reply_cache (key TEXT PRIMARY KEY, content TEXT NOT NULL, created_at REAL NOT NULL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS reply_cache_created_at ON reply_cache (created_at)")
+        self.conn.commit()
+
+    def get(self, key, ttl):
+        with self.lock:
+            row = self.conn.execute("SELECT content, created_at FROM reply_cache WHERE key = ?", (key,)).fetchone()
+        if row is None or row[1] + ttl <= time.time():
+            return None
+        return row
+
+    def put(self, key, content, created_at, ttl):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO reply_cache (key, content, created_at) VALUES (?, ?, ?)", (key, content, created_at))
+            self.writes += 1
+            if self.writes % 100 == 0:
+                # 定期清理过期和超出数量的记录
+                self.conn.execute("DELETE FROM reply_cache WHERE created_at <= ?", (time.time() - ttl,))
+                self.conn.execute(
+                    "DELETE FROM reply_cache WHERE key IN (SELECT key FROM reply_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_rows,),
+                )
+            self.conn.commit()
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM reply_cache")
+            self.conn.commit()
+
+
+class ReplyCache(object):
+    def __init__(self):
+        ttl = conf().get("reply_cache_ttl", 600)
+        size = conf().get("reply_cache_size", 1000)
+        # ExpiredDict读取时会延长过期时间，这里另外记录写入时间，按写入时间判断是否过期
+        self.memory = ExpiredDict(ttl, max_size=size)
+        self.disk = None
+        if conf().get("reply_cache_persist", False):
+            path = conf().get("reply_cache_path") or os.path.join(get_appdata_dir(), "reply_cache.db")
+            self.disk = _DiskTier(path, size * 10)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self.stores = 0
+        self.lookup_time = 0.0
+
+    def make_key(self, query, context, bot_type, bot):
+        """返回缓存key，这条消息不能使用缓存时返回None"""
+        rules = get_cache_rules()
+        if not rules.enabled or not isinstance(query, str):
+            return None
+        session_id = context.get("session_id")
+        if bot_type in STATEFUL_BOTS or query in rules.commands or query.startswith("#") \
+                or (session_id and memory.USER_IMAGE_CACHE.get(session_id)):
+            self._count("bypasses")
+            return None
+        normalized = normalize_query(query)
+        if not normalized or (rules.pattern is not None and rules.pattern.search(normalized) is None):
+            self._count("bypasses")
+            return None
+
+        if not context.get("isgroup", False):
+            # 私聊每个用户单独，不同用户之间不共用缓存
+            user = session_id or context.get("receiver")
+            if not user:
+                self._count("bypasses")
+                return None
+            scope = "private:" + user
+        elif rules.scope == "global":
+            scope = ""
+        elif rules.scope == "session":
+            scope = session_id or ""
+        else:
+            scope = context.get("receiver", "")
+        system_prompt, history = rules.character_desc, ()
+        store = getattr(getattr(bot, "sessions", None), "sessions", None)
+        if store is not None and session_id and session_id in store:
+            session = store[session_id]
+            system_prompt = session.system_prompt
+            messages = [m for m in session.messages if m.get("role") != "system"]
+            if messages and not rules.session_window:
+                # 已有上下文时问题的含义可能取决于之前的对话，不使用缓存
+                self._count("bypasses")
+                return None
+            if messages:
+                history = tuple((m.get("role"), m.get("content")) for m in messages[-rules.session_window:])
+        models = tuple(context.get(key) for key in MODEL_KEYS)
+        raw = repr((normalized, bot_type, rules.model, models, system_prompt, history, scope))
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        start = time.perf_counter()
+        ttl = get_cache_rules().ttl
+        item = self.memory.get(key)
+        if item is not None and item[1] + ttl <= time.time():
+            self.memory.pop(key)
+            item = None
+        counter = "hits"
+        if item is None and self.disk is not None:
+            item = self.disk.get(key, ttl)
+            if item is not None:
+                self.memory[key] = item
+                counter = "disk_hits"
+        with self.lock:
+            self.lookup_time += time.perf_counter() - start
+            if item is None:
+                self.misses += 1
+            elif counter == "hits":
+                self.hits += 1
+            else:
+                self.disk_hits += 1
+        return item[0] if item is not None else None
+
+    def put(self, key, content):
+        if not content:
+            return
+        item = (content, time.time())
+        self.memory[key] = item
+        if self.disk is not None:
+            try:
+                self.disk.put(key, item[0], item[1], get_cache_rules().ttl)
+            except Exception as e:
+                logger.warning("[ReplyCache] write disk cache failed: {}".format(e))
+        self._count("stores")
+
+    def clear(self):
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def _count(self, name):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def stats(self, reset=False):
+        with self.lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            result = {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "bypasses": self.bypasses,
+                "stores": self.stores,
+                "size": len(self.memory),
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                "avg_lookup": self.lookup_time / lookups if lookups else 0.0,
+            }
+            if reset:
+                self.hits = self.disk_hits = self.misses = self.bypasses = self.stores = 0
+                self.lookup_time = 0.0
+        return result
+
+
+_lock = threading.Lock()
+_cache = None
+
+
+def get_reply_cache():
+    """开启reply_cache时返回全局的ReplyCache，否则返回None"""
+    global _cache
+    if not config_snapshot().get("reply_cache", False):
+        return None
+    if _cache is None:
+        with _lock:
+            if _cache is None:
+                _cache = ReplyCache()
+    return _cache
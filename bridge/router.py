@@ -0,0 +1,327 @@
+"""
+对话后端路由
+
+配置chat_router_backends后，Bridge的chat bot是ChatRouter，文本消息在多个后端之间分配：
+- 每个后端有并发上限(max_concurrency)和每分钟请求数限制(rate_limit)，满了就换其他后端，都满时排队等待
+- 会话优先使用上次成功回复它的后端，保持上下文；否则按延迟、错误率和当前负载选择得分最低的后端
+- 请求失败(抛出异常或返回ERROR回复)时换下一个后端重试，连续失败的后端暂停使用一段时间
+- 开启chat_router_hedge后，请求超过该后端的p95延迟仍未返回时，同时向另一个后端发送，采用先成功的回复
+流式回复(stream_reply)不对冲，只在后端开始输出之前失败时换后端。
+非文本消息(画图等)与具体后端的能力有关，固定交给第一个后端处理。
+"""
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from bot.bot import Bot
+from bot.session_manager import SessionManager
+from bridge.context import ContextType
+from bridge.reply import Reply, ReplyType
+from common.expired_dict import ExpiredDict
+from common.log import logger
+from common.token_bucket import TokenBucket
+from config import conf, config_snapshot
+
+EWMA_ALPHA = 0.2  # 延迟和错误率移动平均的权重
+MAX_FAILURES = 3  # 连续失败多少次后暂停使用该后端
+
+
+def _succeeded(reply):
+    return reply is not None and reply.type != ReplyType.ERROR
+
+
+def _override_model(bot, model):
+    """各bot在初始化时从全局配置读取模型，这里按后端覆盖，只用于该后端独立的bot实例"""
+    if isinstance(getattr(bot, "args", None), dict):
+        bot.args["model"] = model
+    sessions = getattr(bot, "sessions", None)
+    if isinstance(sessions, SessionManager) and "model" in sessions.session_args:
+        # 会话存储按模型区分，重新创建，不与使用全局模型的bot共用存储
+        bot.sessions = SessionManager(sessions.sessioncls, **dict(sessions.session_args, model=model))
+
+
+class Backend(object):
+    def __init__(self, name, bot, max_concurrency=8, rate_limit=None, queue_timeout=30):
+        self.name = name
+        self.bot = bot
+        self.max_concurrency = max_concurrency
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self.bucket = TokenBucket(rate_limit, queue_timeout) if rate_limit else None
+        self.lock = threading.Lock()
+        self.inflight = 0
+        self.latency = None  # 成功请求耗时的移动平均，没有数据时为None
+        self.error_rate = 0.0
+        self.recent = deque(maxlen=100)  # 最近成功请求的耗时，用于计算p95
+        self.failures = 0  # 连续失败次数
+        self.paused_until = 0.0
+        self.calls = 0
+        self.errors = 0
+
+    def paused(self, now):
+        return self.paused_until > now
+
+    def score(self):
+        # 没有延迟数据的后端延迟按0计算，会被优先尝试；错误率另外加上固定惩罚，避免只失败过的后端一直得0分
+        latency = self.latency or 0.0
+        return latency * (1 + 4 * self.error_rate) * (1 + self.inflight / self.max_concurrency) + 10 * self.error_rate
+
+    def p95(self):
+        with self.lock:
+            if len(self.recent) < 20:
+                return None
+            samples = sorted(self.recent)
+        return samples[int(len(samples) * 0.95) - 1]
+
+    def try_acquire(self):
+        # 并发名额或令牌不够时都不等待，直接换下一个后端
+        if not self.slots.acquire(blocking=False):
+            return False
+        if self.bucket is not None and not self.bucket.try_get_token():
+            self.slots.release()
+            return False
+        self._enter()
+        return True
+
+    def acquire(self, timeout):
+        if not self.slots.acquire(timeout=timeout):
+            return False
+        if self.bucket is not None and not self.bucket.get_token():
+            self.slots.release()
+            return False
+        self._enter()
+        return True
+
+    def _enter(self):
+        with self.lock:
+            self.inflight += 1
+
+    def release(self, elapsed, ok, cooldown):
+        with self.lock:
+            self.inflight -= 1
+            self.calls += 1
+            self.error_rate += EWMA_ALPHA * ((0.0 if ok else 1.0) - self.error_rate)
+            if ok:
+                self.failures = 0
+                self.latency = elapsed if self.latency is None else self.latency + EWMA_ALPHA * (elapsed - self.latency)
+                self.recent.append(elapsed)
+            else:
+                self.errors += 1
+                self.failures += 1
+                if self.failures >= MAX_FAILURES and not self.paused(time.monotonic()):
+                    self.paused_until = time.monotonic() + cooldown
+                    logger.warning("[Router] backend {} failed {} times in a row, paused for {}s".format(self.name, self.failures, cooldown))
+        self.slots.release()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "inflight": self.inflight,
+                "max_concurrency": self.max_concurrency,
+                "calls": self.calls,
+                "errors": self.errors,
+                "latency": self.latency,
+                "error_rate": self.error_rate,
+                "paused": self.paused(time.monotonic()),
+            }
+
+
+class RouterSessions(object):
+    """提供与SessionManager相同的会话操作，作用于所有后端，供godcmd、role等插件使用"""
+
+    def __init__(self, router):
+        self.router = router
+
+    def _managers(self):
+        return [backend.bot.sessions for backend in self.router.backends if getattr(backend.bot, "sessions", None) is not None]
+
+    def build_session(self, session_id, system_prompt=None):
+        # 返回会话当前所在后端的session
+        preferred = self.router.affinity.get(session_id) if session_id else None
+        result = None
+        for backend in self.router.backends:
+            manager = getattr(backend.bot, "sessions", None)
+            if manager is None:
+                continue
+            session = manager.build_session(session_id, system_prompt)
+            if result is None or backend.name == preferred:
+                result = session
+        return result
+
+    def clear_session(self, session_id):
+        for manager in self._managers():
+            manager.clear_session(session_id)
+
+    def clear_all_session(self):
+        for manager in self._managers():
+            manager.clear_all_session()
+
+
+class ChatRouter(Bot):
+    def __init__(self, specs, create_bot, new_bot=None):
+        """
+        :param specs: chat_router_backends配置，如 [{"type": "deepseek", "max_concurrency": 8, "rate_limit": 60}]
+        :param create_bot: 根据类型创建(或复用)bot的函数
+        :param new_bot: 根据类型创建新bot实例的函数，指定了model的后端使用独立的实例，默认为bot_factory.create_bot
+        """
+        if new_bot is None:
+            from bot.bot_factory import create_bot as new_bot
+        self.queue_timeout = conf().get("chat_router_queue_timeout", 30)
+        self.cooldown = conf().get("chat_router_cooldown", 30)
+        self.hedge = conf().get("chat_router_hedge", False)
+        self.hedge_delay = conf().get("chat_router_hedge_delay", 3)
+        self.backends = []
+        for spec in specs:
+            bot_type = spec["type"]
+            if spec.get("model"):
+                # 复用的bot可能还被插件等其他地方使用，指定模型的后端创建独立的实例再覆盖模型
+                bot = new_bot(bot_type)
+                _override_model(bot, spec["model"])
+            else:
+                bot = create_bot(bot_type)
+            name = spec.get("name") or bot_type
+            self.backends.append(Backend(name, bot, spec.get("max_concurrency", 8), spec.get("rate_limit"), self.queue_timeout))
+        self.affinity = ExpiredDict(conf().get("expires_in_seconds") or 3600, max_size=10000)  # session_id -> 后端名称
+        self.sessions = RouterSessions(self)
+        self.executor = None
+        if self.hedge and len(self.backends) > 1:
+            workers = sum(backend.max_concurrency for backend in self.backends)
+            self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="chat-router")
+        logger.info("[Router] chat backends: {}, hedge={}".format([backend.name for backend in self.backends], self.hedge))
+
+    def warm_up(self):
+        for backend in self.backends:
+            warm_up = getattr(backend.bot, "warm_up", None)
+            if warm_up is not None:
+                warm_up()
+
+    def stats(self):
+        return {backend.name: backend.stats() for backend in self.backends}
+
+    # ---------- 选择后端 ----------
+
+    def _pick(self, session_id, exclude, blocking):
+        now = time.monotonic()
+        candidates = [backend for backend in self.backends if backend not in exclude and not backend.paused(now)]
+        if not candidates:
+            # 剩下的后端都在暂停中时仍然尝试，总比直接失败好
+            candidates = [backend for backend in self.backends if backend not in exclude]
+            if not candidates:
+                return None
+        preferred = self.affinity.get(session_id) if session_id else None
+        candidates.sort(key=lambda backend: (backend.name != preferred, backend.score()))
+        for backend in candidates:
+            if backend.try_acquire():
+                return backend
+        if blocking and candidates[0].acquire(self.queue_timeout):
+            return candidates[0]
+        return None
+
+    # ---------- 请求 ----------
+
+    def _call(self, backend, query, context):
+        """在已占用backend名额的情况下调用，结束后释放名额并记录结果"""
+        start = time.monotonic()
+        reply = None
+        try:
+            reply = backend.bot.reply(query, context)
+        except Exception as e:
+            logger.exception("[Router] backend {} raised: {}".format(backend.name, e))
+            reply = Reply(ReplyType.ERROR, "我现在有点累了，等会再来吧")
+        finally:
+            backend.release(time.monotonic() - start, _succeeded(reply), self.cooldown)
+        return reply
+
+    def _call_with_hedge(self, backend, query, context, session_id, tried):
+        if self.executor is None:
+            return self._call(backend, query, context), backend
+        # 两个后端各自可能修改context，对冲请求使用独立的副本，在主请求开始之前复制
+        hedge_context = context.fork()
+        future = self.executor.submit(self._call, backend, query, context)
+        delay = max(self.hedge_delay, backend.p95() or 0)
+        done, _ = wait([future], timeout=delay)
+        if done:
+            return future.result(), backend
+        hedge = self._pick(session_id, tried, blocking=False)
+        if hedge is None:
+            return future.result(), backend
+        tried.append(hedge)
+        logger.info("[Router] {} slower than {:.1f}s, hedging to {}".format(backend.name, delay, hedge.name))
+        futures = {future: backend, self.executor.submit(self._call, hedge, query, hedge_context): hedge}
+        pending = set(futures)
+        reply, winner = None, backend
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for f in done:
+                reply, winner = f.result(), futures[f]
+                if _succeeded(reply):
+                    return reply, winner
+        return reply, winner
+
+    def _stream(self, backend, stream, start, session_id):
+        """转发后端的流式输出，结束后释放名额；已经开始输出后无法再换后端"""
+        ok = False
+        try:
+            for text in stream:
+                yield text
+            ok = True
+            if session_id:
+                self.affinity[session_id] = backend.name
+        finally:
+            backend.release(time.monotonic() - start, ok, self.cooldown)
+
+    def reply_stream(self, query, context=None):
+        if context is None or context.type != ContextType.TEXT:
+            return self.backends[0].bot.reply_stream(query, context)
+        session_id = context.get("session_id")
+        if query in config_snapshot().get("clear_memory_commands", ["#清除记忆"]):
+            self.sessions.clear_session(session_id)
+            return Reply(ReplyType.INFO, "记忆已清除")
+        # 流式请求不对冲，只在拿到输出之前失败时换后端
+        tried = []
+        reply = None
+        while len(tried) < len(self.backends):
+            backend = self._pick(session_id, tried, blocking=True)
+            if backend is None:
+                break
+            tried.append(backend)
+            start = time.monotonic()
+            try:
+                result = backend.bot.reply_stream(query, context)
+            except Exception as e:
+                logger.exception("[Router] backend {} raised: {}".format(backend.name, e))
+                result = Reply(ReplyType.ERROR, "我现在有点累了，等会再来吧")
+            if not isinstance(result, Reply) and result is not None:
+                return self._stream(backend, result, start, session_id)
+            reply = result
+            backend.release(time.monotonic() - start, _succeeded(reply), self.cooldown)
+            if _succeeded(reply):
+                if session_id:
+                    self.affinity[session_id] = backend.name
+                return reply
+            logger.warning("[Router] backend {} failed, {} backends left".format(backend.name, len(self.backends) - len(tried)))
+        return reply or Reply(ReplyType.ERROR, "请求过于频繁，请稍后再试")
+
+    def reply(self, query, context=None):
+        if context is None or context.type != ContextType.TEXT:
+            return self.backends[0].bot.reply(query, context)
+        session_id = context.get("session_id")
+        if query in config_snapshot().get("clear_memory_commands", ["#清除记忆"]):
+            # 会话记录分散在各个后端中，清除时需要全部清除
+            self.sessions.clear_session(session_id)
+            return Reply(ReplyType.INFO, "记忆已清除")
+        tried = []
+        reply = None
+        while len(tried) < len(self.backends):
+            backend = self._pick(session_id, tried, blocking=True)
+            if backend is None:
+                break
+            tried.append(backend)
+            reply, winner = self._call_with_hedge(backend, query, context, session_id, tried)
+            if _succeeded(reply):
+                if session_id:
+                    self.affinity[session_id] = winner.name
+                return reply
+            logger.warning("[Router] backend {} failed, {} backends left".format(winner.name, len(self.backends) - len(tried)))
+        return reply or Reply(ReplyType.ERROR, "请求过于频繁，请稍后再试")
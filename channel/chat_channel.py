@@ -2,24 +2,40 @@ import os
 import re
 import threading
 import time
-from asyncio import CancelledError
-from concurrent.futures import Future, ThreadPoolExecutor
+from collections import OrderedDict
+from concurrent.futures import CancelledError, Future
 
 from bridge.context import *
 from bridge.reply import *
 from channel.channel import Channel
-from common.dequeue import Dequeue
+from channel.handler_pool import LANE_COMMAND, POLICY_BLOCK, HandlerPool, PoolFullError
+from channel.stream_chunker import StreamChunker
+from channel.trigger_matcher import at_pattern, get_trigger_matcher
 from common import memory
-from plugins import *
+from common.dequeue import Dequeue
+from common.expired_dict import ExpiredDict
 from common.log import logger
-from config import conf
+from common.token_bucket import KeyedTokenBucket
+from config import conf, config_derived, config_snapshot
+from plugins import *
 
 try:
     from voice.audio_convert import any_to_wav
 except Exception as e:
     pass
 
-handler_pool = ThreadPoolExecutor(max_workers=8)  # 处理消息的线程池
+handler_pool = HandlerPool()  # 处理消息的线程池，按llm/media/command分通道
+
+
+def _build_chat_limiter(config):
+    rate = config.get("rate_limit_per_chat", 0)
+    return KeyedTokenBucket(rate) if rate and rate > 0 else None
+
+
+# 按群/私聊用户分别限流，避免个别活跃的群占满对话后端
+get_chat_limiter = config_derived(_build_chat_limiter)
+# 最近一分钟内已提示过超出限流的群/私聊用户，避免持续刷屏时每条消息都回复提示
+rate_limit_notified = ExpiredDict(60, max_size=10000)
 
 
 # 抽象类, 它包含了与消息通道无关的通用处理逻辑
@@ -30,6 +46,10 @@ class ChatChannel(Channel):
     futures = {}  # 记录每个session_id提交到线程池的future对象, 用于重置会话时把没执行的future取消掉，正在执行的不会被取消
     sessions = {}  # 用于控制并发，每个session_id同时只能有一个context在处理
     lock = threading.Lock()  # 用于控制对sessions的访问
+    ready = threading.Condition(lock)  # 有session可调度时唤醒消费者线程
+    ready_sessions = OrderedDict()  # 待调度的session_id, 当作有序集合使用, 保证先就绪的session先被调度
+    blocked_sessions = OrderedDict()  # 因线程池通道排队已满而暂停调度的session_id -> lane
+    SUPPORT_STREAM_REPLY = True  # 是否可以把一条回复分成多条消息发送(stream_reply)
 
     def __init__(self):
         _thread = threading.Thread(target=self.consume)
@@ -51,10 +71,10 @@ class ChatChannel(Channel):
         # context首次传入时，receiver是None，根据类型设置receiver
         first_in = "receiver" not in context
         # 群名匹配过程，设置session_id和receiver
+        matcher = get_trigger_matcher()
         if first_in:  # context首次传入时，receiver是None，根据类型设置receiver
-            config = conf()
             cmsg = context["msg"]
-            
+
             user_data = conf().get_user_data(cmsg.from_user_id)
             context["openai_api_key"] = user_data.get("openai_api_key")
             context["gpt_model"] = user_data.get("gpt_model")
@@ -63,24 +83,10 @@ class ChatChannel(Channel):
                 group_id = cmsg.other_user_id
                 context["group_name"] = group_name
 
-                group_name_white_list = config.get("group_name_white_list", [])
-                group_name_keyword_white_list = config.get("group_name_keyword_white_list", [])
-                if any(
-                        [
-                            group_name in group_name_white_list,
-                            "ALL_GROUP" in group_name_white_list,
-                            check_contain(group_name, group_name_keyword_white_list),
-                        ]
-                ):
-                    group_chat_in_one_session = conf().get("group_chat_in_one_session", [])
+                if matcher.is_group_allowed(group_name):
                     session_id = f"{cmsg.actual_user_id}@@{group_id}" # 当群聊未共享session时，session_id为user_id与group_id的组合，用于区分不同群聊以及单聊
                     context["is_shared_session_group"] = False  # 默认为非共享会话群
-                    if any(
-                            [
-                                group_name in group_chat_in_one_session,
-                                "ALL_GROUP" in group_chat_in_one_session,
-                            ]
-                    ):
+                    if matcher.is_shared_session_group(group_name):
                         session_id = group_id
                         context["is_shared_session_group"] = True  # 如果是共享会话群，设置为True
                 else:
@@ -95,17 +101,16 @@ class ChatChannel(Channel):
             context = e_context["context"]
             if e_context.is_pass() or context is None:
                 return context
-            if cmsg.from_user_id == self.user_id and not config.get("trigger_by_self", True):
+            if cmsg.from_user_id == self.user_id and not matcher.trigger_by_self:
                 logger.debug("[chat_channel]self message skipped")
                 return None
 
         # 消息内容匹配过程，并处理content
         if ctype == ContextType.TEXT:
-            nick_name_black_list = conf().get("nick_name_black_list", [])
             if context.get("isgroup", False):  # 群聊
                 # 校验关键字
-                match_prefix = check_prefix(content, conf().get("group_chat_prefix"))
-                match_contain = check_contain(content, conf().get("group_chat_keyword"))
+                match_prefix = matcher.match_prefix(matcher.group_chat_prefix, content)
+                match_contain = matcher.match_contain(matcher.group_chat_keyword, content)
                 flag = False
                 if context["msg"].to_user_id != context["msg"].actual_user_id:
                     if match_prefix is not None or match_contain is not None:
@@ -114,25 +119,22 @@ class ChatChannel(Channel):
                             content = content.replace(match_prefix, "", 1).strip()
                     if context["msg"].is_at:
                         nick_name = context["msg"].actual_user_nickname
-                        if nick_name and nick_name in nick_name_black_list:
+                        if matcher.is_nick_name_blocked(nick_name):
                             # 黑名单过滤
                             logger.warning(f"[chat_channel] Nickname {nick_name} in In BlackList, ignore")
                             return None
 
                         logger.info("[chat_channel]收到AT@消息")
-                        if not conf().get("group_at_off", False):
+                        if not matcher.group_at_off:
                             flag = True
                         self.name = self.name if self.name is not None else ""  # 部分渠道self.name可能没有赋值
-                        pattern = f"@{re.escape(self.name)}(\u2005|\u0020)"
-                        subtract_res = re.sub(pattern, r"", content)
+                        subtract_res = at_pattern(self.name).sub(r"", content)
                         if hasattr(context["msg"],'at_list') and isinstance(context["msg"].at_list, list):
                             for at in context["msg"].at_list:
-                                pattern = f"@{re.escape(at)}(\u2005|\u0020)"
-                                subtract_res = re.sub(pattern, r"", subtract_res)
+                                subtract_res = at_pattern(at).sub(r"", subtract_res)
                         if subtract_res == content and context["msg"].self_display_name:
                             # 前缀移除后没有变化，使用群昵称再次移除
-                            pattern = f"@{re.escape(context['msg'].self_display_name)}(\u2005|\u0020)"
-                            subtract_res = re.sub(pattern, r"", content)
+                            subtract_res = at_pattern(context['msg'].self_display_name).sub(r"", content)
                         content = subtract_res
                 if not flag:
                     if context["origin_ctype"] == ContextType.VOICE:
@@ -140,12 +142,12 @@ class ChatChannel(Channel):
                     return None
             else:  # 单聊
                 nick_name = context["msg"].from_user_nickname
-                if nick_name and nick_name in nick_name_black_list:
+                if matcher.is_nick_name_blocked(nick_name):
                     # 黑名单过滤
                     logger.warning(f"[chat_channel] Nickname '{nick_name}' in In BlackList, ignore")
                     return None
 
-                match_prefix = check_prefix(content, conf().get("single_chat_prefix", [""]))
+                match_prefix = matcher.match_prefix(matcher.single_chat_prefix, content)
                 if match_prefix is not None:  # 判断如果匹配到自定义前缀，则返回过滤掉前缀+空格后的内容
                     content = content.replace(match_prefix, "", 1).strip()
                 elif self.channel_type == 'wechatcom_app':
@@ -156,19 +158,17 @@ class ChatChannel(Channel):
                 else:
                     return None
             content = content.strip()
-            img_match_prefix = check_prefix(content, conf().get("image_create_prefix",[""]))
+            img_match_prefix = matcher.match_prefix(matcher.image_create_prefix, content)
             if img_match_prefix:
                 content = content.replace(img_match_prefix, "", 1)
                 context.type = ContextType.IMAGE_CREATE
             else:
                 context.type = ContextType.TEXT
             context.content = content.strip()
-            if "desire_rtype" not in context and conf().get(
-                    "always_reply_voice") and ReplyType.VOICE not in self.NOT_SUPPORT_REPLYTYPE:
+            if "desire_rtype" not in context and matcher.always_reply_voice and ReplyType.VOICE not in self.NOT_SUPPORT_REPLYTYPE:
                 context["desire_rtype"] = ReplyType.VOICE
         elif context.type == ContextType.VOICE:
-            if "desire_rtype" not in context and conf().get(
-                    "voice_reply_voice") and ReplyType.VOICE not in self.NOT_SUPPORT_REPLYTYPE:
+            if "desire_rtype" not in context and matcher.voice_reply_voice and ReplyType.VOICE not in self.NOT_SUPPORT_REPLYTYPE:
                 context["desire_rtype"] = ReplyType.VOICE
         return context
 
@@ -176,23 +176,8 @@ class ChatChannel(Channel):
         if context is None or not context.content:
             return
 
-        # 创建上下文的深拷贝，确保完全独立
-        # 由于Context对象没有copy方法，我们需要手动创建一个新的Context对象
-        independent_context = Context(
-            type=context.type,
-            content=context.content,
-            kwargs={}  # 创建空字典，然后手动复制
-        )
-
-        # 手动复制 kwargs 字典中的内容
-        for key in context.kwargs:
-            # 对于复杂对象，创建深拷贝
-            if isinstance(context.kwargs[key], dict):
-                independent_context.kwargs[key] = context.kwargs[key].copy()
-            elif isinstance(context.kwargs[key], list):
-                independent_context.kwargs[key] = context.kwargs[key].copy()
-            else:
-                independent_context.kwargs[key] = context.kwargs[key]
+        # 创建独立的上下文副本(写时复制)，插件和回复流程的修改不会影响原上下文
+        independent_context = context.fork()
 
         # 记录上下文信息，确保使用的是正确的上下文对象
         logger.debug("[chat_channel] ready to handle context: {}".format(independent_context))
@@ -239,7 +224,14 @@ class ChatChannel(Channel):
                     # 不需要生成回复，直接返回空回复
                     return Reply()
 
-                reply = super().build_reply_content(context.content, context)
+                limiter = get_chat_limiter()
+                if limiter is not None and not limiter.try_get_token(context.get("receiver")):
+                    return self._rate_limited_reply(context)
+
+                if context.type == ContextType.TEXT and self._stream_enabled(context):
+                    reply = self._stream_reply(context)
+                else:
+                    reply = super().build_reply_content(context.content, context)
             elif context.type == ContextType.VOICE:  # 语音消息
                 cmsg = context["msg"]
                 cmsg.prepare()
@@ -287,7 +279,7 @@ class ChatChannel(Channel):
                     # 只有当IsAtMessage为True时，才检查at_list中是否包含机器人wxid
                     if context.kwargs["msg"].msg["IsAtMessage"]:
                         # 从配置文件中读取机器人wxid列表
-                        bot_wxids = conf().get("robot_wxids", ["wxid_p60yfpl5zg2m29", "wxid_uz9za1pqr3ea22", "wxid_l5im9jaxhr4412"])
+                        bot_wxids = config_snapshot().get("robot_wxids", ["wxid_p60yfpl5zg2m29", "wxid_uz9za1pqr3ea22", "wxid_l5im9jaxhr4412"])
                         # 遍历所有可能的机器人wxid
                         for bot_wxid in bot_wxids:
                             if bot_wxid in context.kwargs["at_list"]:
@@ -299,7 +291,7 @@ class ChatChannel(Channel):
                 if not is_at_bot and context.content and "IsAtMessage" in context.kwargs.get("msg", {}).msg:
                     if context.kwargs["msg"].msg["IsAtMessage"]:
                         # 从配置文件中读取机器人名称列表
-                        robot_names = conf().get("robot_names", ["小小x", "小x", "机器人"])
+                        robot_names = config_snapshot().get("robot_names", ["小小x", "小x", "机器人"])
                         for bot_name in robot_names:
                             if f"@{bot_name}" in context.content:
                                 is_at_bot = True
@@ -698,6 +690,65 @@ class ChatChannel(Channel):
                 return
         return reply
 
+    def _rate_limited_reply(self, context: Context) -> Reply:
+        """超出rate_limit_per_chat：每个群或用户每分钟提示一次，其余消息不回复"""
+        receiver = context.get("receiver")
+        notice = config_snapshot().get("rate_limit_per_chat_reply", "消息太频繁了，请稍后再试")
+        if not notice or receiver in rate_limit_notified:
+            logger.info("[chat_channel] rate_limit_per_chat exceeded, skip: receiver={}".format(receiver))
+            return Reply()
+        rate_limit_notified[receiver] = True
+        logger.warning("[chat_channel] rate_limit_per_chat exceeded, notify: receiver={}".format(receiver))
+        return Reply(ReplyType.TEXT, notice)
+
+    def _stream_enabled(self, context: Context):
+        # 需要回复语音时整段合成，不分段
+        if not self.SUPPORT_STREAM_REPLY or context.get("desire_rtype") == ReplyType.VOICE:
+            return False
+        return config_snapshot().get("stream_reply", False)
+
+    def _stream_reply(self, context: Context) -> Reply:
+        """
+        流式生成回复，内容够一条消息时立即包装并发送；
+        返回最后一条消息，由_handle按普通流程包装发送，bot不支持流式时返回它的完整回复
+        """
+        start = time.monotonic()
+        result = super().build_reply_stream(context.content, context)
+        if result is None or isinstance(result, Reply):
+            return result
+        snapshot = config_snapshot()
+        chunker = StreamChunker(snapshot.get("stream_reply_min_chars", 80), snapshot.get("stream_reply_interval", 1.5))
+        sent = 0
+        first_sent = None
+        try:
+            for text in result:
+                chunk = chunker.feed(text)
+                if chunk:
+                    context["stream_index"] = sent
+                    context["stream_final"] = False
+                    self._send_reply(context, self._decorate_reply(context, Reply(ReplyType.TEXT, chunk)))
+                    sent += 1
+                    if first_sent is None:
+                        first_sent = time.monotonic() - start
+        except Exception as e:
+            logger.exception("[chat_channel] stream reply interrupted: {}".format(e))
+            if sent == 0 and not chunker.buffer.strip():
+                return Reply(ReplyType.ERROR, "我现在有点累了，等会再来吧")
+        chunk = chunker.finish()
+        if not chunk:
+            return Reply()
+        context["stream_index"] = sent
+        context["stream_final"] = True
+        # 最后一条同样遵守发送间隔
+        delay = chunker.wait_time()
+        if delay > 0:
+            time.sleep(delay)
+        if first_sent is None:
+            first_sent = time.monotonic() - start
+        logger.info("[chat_channel] stream reply: first message in {:.0f}ms, {} messages in {:.0f}ms".format(
+            first_sent * 1000, sent + 1, (time.monotonic() - start) * 1000))
+        return Reply(ReplyType.TEXT, chunk)
+
     def _decorate_reply(self, context: Context, reply: Reply) -> Reply:
         if reply and reply.type:
             e_context = PluginManager().emit_event(
@@ -719,14 +770,18 @@ class ChatChannel(Channel):
                     if desire_rtype == ReplyType.VOICE and ReplyType.VOICE not in self.NOT_SUPPORT_REPLYTYPE:
                         reply = super().build_text_to_voice(reply.content)
                         return self._decorate_reply(context, reply)
+                    snapshot = config_snapshot()
+                    # 流式回复分成多条消息时，前缀只加在第一条，后缀只加在最后一条
+                    first_part = context.get("stream_index", 0) == 0
+                    last_part = context.get("stream_final", True)
                     if context.get("isgroup", False):
                         # 不再添加@前缀，因为我们使用API的At参数来实现@功能
                         # 只添加配置的前缀和后缀
-                        reply_text = conf().get("group_chat_reply_prefix", "") + reply_text.strip() + conf().get(
-                            "group_chat_reply_suffix", "")
+                        reply_text = (snapshot.get("group_chat_reply_prefix", "") if first_part else "") + reply_text.strip() + (
+                            snapshot.get("group_chat_reply_suffix", "") if last_part else "")
                     else:
-                        reply_text = conf().get("single_chat_reply_prefix", "") + reply_text + conf().get(
-                            "single_chat_reply_suffix", "")
+                        reply_text = (snapshot.get("single_chat_reply_prefix", "") if first_part else "") + reply_text + (
+                            snapshot.get("single_chat_reply_suffix", "") if last_part else "")
                     reply.content = reply_text
                 elif reply.type == ReplyType.ERROR or reply.type == ReplyType.INFO:
                     reply.content = "[" + str(reply.type) + "]\n" + reply.content
@@ -784,7 +839,7 @@ class ChatChannel(Channel):
     def _fail_callback(self, session_id, exception, **kwargs):  # 线程异常结束时的回调函数
         logger.exception("Worker return exception: {}".format(exception))
 
-    def _thread_pool_callback(self, session_id, **kwargs):
+    def _thread_pool_callback(self, session_id, lane, **kwargs):
         def func(worker: Future):
             try:
                 worker_exception = worker.exception()
@@ -798,48 +853,82 @@ class ChatChannel(Channel):
                 logger.exception("Worker raise exception: {}".format(e))
             with self.lock:
                 self.sessions[session_id][1].release()
+                self._mark_ready(session_id)  # 释放信号量后重新调度该session, 处理排队消息或回收session
+                for blocked_id, blocked_lane in list(self.blocked_sessions.items()):  # 通道有空闲，恢复等待该通道的session
+                    if blocked_lane == lane:
+                        del self.blocked_sessions[blocked_id]
+                        self._mark_ready(blocked_id)
 
         return func
 
+    # 标记session有待调度的工作并唤醒消费者，调用方需持有self.lock
+    def _mark_ready(self, session_id):
+        self.ready_sessions[session_id] = None
+        self.ready.notify()
+
     def produce(self, context: Context):
         session_id = context.get("session_id", 0)
         with self.lock:
             if session_id not in self.sessions:
                 self.sessions[session_id] = [
                     Dequeue(),
-                    threading.BoundedSemaphore(conf().get("concurrency_in_session", 4)),
+                    threading.BoundedSemaphore(config_snapshot().get("concurrency_in_session", 4)),
                 ]
             if context.type == ContextType.TEXT and context.content.startswith("#"):
                 self.sessions[session_id][0].putleft(context)  # 优先处理管理命令
             else:
                 self.sessions[session_id][0].put(context)
+            self._mark_ready(session_id)
 
     # 消费者函数，单独线程，用于从消息队列中取出消息并处理
+    # 只在produce或任务结束时被唤醒，且只访问有待处理工作的session
     def consume(self):
         while True:
             with self.lock:
-                session_ids = list(self.sessions.keys())
-            for session_id in session_ids:
+                while not self.ready_sessions:
+                    self.ready.wait()
+                session_id, _ = self.ready_sessions.popitem(last=False)
+                if session_id not in self.sessions:
+                    continue
+                context_queue, semaphore = self.sessions[session_id]
+                if not semaphore.acquire(blocking=False):
+                    continue  # 并发已满，任务结束的回调会重新调度该session
+                if context_queue.empty():
+                    semaphore.release()
+                    if semaphore._initial_value == semaphore._value:  # 没有排队的消息也没有处理中的任务，回收session
+                        self.futures[session_id] = [t for t in self.futures.get(session_id, []) if not t.done()]
+                        assert len(self.futures[session_id]) == 0, "thread pool error"
+                        del self.sessions[session_id]
+                    continue
+                lane = handler_pool.lane_of(context_queue.queue[0])
+                if handler_pool.lane(lane).policy == POLICY_BLOCK and handler_pool.lane(lane).is_full():
+                    semaphore.release()
+                    self.blocked_sessions[session_id] = lane  # 消息留在会话队列中，通道有任务结束时再调度
+                    continue
+                context = context_queue.get()
+                if not context_queue.empty():
+                    self._mark_ready(session_id)  # 还有排队的消息，信号量允许时继续调度
+            logger.debug("[chat_channel] consume context: {}".format(context))
+            try:
+                future: Future = handler_pool.submit(lane, self._handle, context)
+            except PoolFullError:
+                logger.warning("[chat_channel] handler pool lane {} is full, reject context: {}".format(lane, context))
                 with self.lock:
-                    context_queue, semaphore = self.sessions[session_id]
-                if semaphore.acquire(blocking=False):  # 等线程处理完毕才能删除
-                    if not context_queue.empty():
-                        context = context_queue.get()
-                        logger.debug("[chat_channel] consume context: {}".format(context))
-                        future: Future = handler_pool.submit(self._handle, context)
-                        future.add_done_callback(self._thread_pool_callback(session_id, context=context))
-                        with self.lock:
-                            if session_id not in self.futures:
-                                self.futures[session_id] = []
-                            self.futures[session_id].append(future)
-                    elif semaphore._initial_value == semaphore._value + 1:  # 除了当前，没有任务再申请到信号量，说明所有任务都处理完毕
-                        with self.lock:
-                            self.futures[session_id] = [t for t in self.futures[session_id] if not t.done()]
-                            assert len(self.futures[session_id]) == 0, "thread pool error"
-                            del self.sessions[session_id]
-                    else:
-                        semaphore.release()
-            time.sleep(0.2)
+                    semaphore.release()
+                    self._mark_ready(session_id)
+                reject_reply = config_snapshot().get("handler_pool_reject_reply", "")
+                if reject_reply:
+                    # 拒绝提示通过指令通道发送，指令通道也已满时不再提示
+                    try:
+                        handler_pool.submit(LANE_COMMAND, self._send, Reply(ReplyType.TEXT, reject_reply), context)
+                    except PoolFullError:
+                        logger.warning("[chat_channel] handler pool lane {} is full, skip reject reply".format(LANE_COMMAND))
+                continue
+            with self.lock:
+                if session_id not in self.futures:
+                    self.futures[session_id] = []
+                self.futures[session_id].append(future)
+            future.add_done_callback(self._thread_pool_callback(session_id, lane, context=context))
 
     # 取消session_id对应的所有任务，只能取消排队的消息和已提交线程池但未执行的任务
     def cancel_session(self, session_id):
@@ -0,0 +1,128 @@
+"""
+分通道(lane)的消息处理线程池
+
+LLM调用、媒体转换和插件指令各自使用独立的线程池，避免管理指令和轻量回复排在耗时的生成任务之后。
+每个通道有排队上限和溢出策略，并记录饱和度、排队长度等指标。
+"""
+
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from bridge.context import Context, ContextType
+from common.log import logger
+from config import conf, config_snapshot
+
+LANE_LLM = "llm"  # 需要调用大模型的消息
+LANE_MEDIA = "media"  # 语音、图片、文件等媒体消息
+LANE_COMMAND = "command"  # 管理指令和插件指令
+
+POLICY_REJECT = "reject"  # 队列已满时拒绝新消息并回复提示
+POLICY_DROP_OLDEST = "drop_oldest"  # 队列已满时丢弃最早排队的任务
+POLICY_BLOCK = "block"  # 队列已满时消息留在会话队列中，等待通道空闲后再提交
+
+MEDIA_CONTEXT_TYPES = [ContextType.VOICE, ContextType.IMAGE, ContextType.FILE, ContextType.VIDEO, ContextType.SHARING]
+
+
+class PoolFullError(Exception):
+    pass
+
+
+class Lane:
+    def __init__(self, name, max_workers, max_queue, policy):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue  # 小于等于0表示不限制
+        self.policy = policy
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"handler-{name}")
+        self.lock = threading.Lock()
+        self.pending = OrderedDict()  # 已提交但还未开始执行的任务, task_id -> future
+        self.task_seq = 0
+        self.running = 0
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.dropped = 0
+
+    def is_full(self):
+        with self.lock:
+            return 0 < self.max_queue <= len(self.pending)
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        dropped = None
+        with self.lock:
+            if 0 < self.max_queue <= len(self.pending):
+                if self.policy != POLICY_DROP_OLDEST:
+                    self.rejected += 1
+                    raise PoolFullError(f"handler lane {self.name} is full")
+                _, dropped = self.pending.popitem(last=False)
+            self.task_seq += 1
+            task_id = self.task_seq
+            future = self.executor.submit(self._run, task_id, fn, args, kwargs)
+            self.pending[task_id] = future
+            self.submitted += 1
+        # 取消会执行future的回调，不能持有self.lock；最早的任务可能已经开始执行，取消失败时不算丢弃
+        if dropped is not None and dropped.cancel():
+            with self.lock:
+                self.dropped += 1
+            logger.warning("[handler_pool] lane {} is full, dropped the oldest pending task".format(self.name))
+        return future
+
+    def _run(self, task_id, fn, args, kwargs):
+        with self.lock:
+            self.pending.pop(task_id, None)
+            self.running += 1
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self.lock:
+                self.running -= 1
+                self.completed += 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "workers": self.max_workers,
+                "running": self.running,
+                "queued": len(self.pending),
+                "max_queue": self.max_queue,
+                "saturation": round(self.running / self.max_workers, 2),
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "dropped": self.dropped,
+            }
+
+
+class HandlerPool:
+    def __init__(self):
+        max_queue = conf().get("handler_pool_max_queue", 100)
+        policy = conf().get("handler_pool_overflow_policy", POLICY_BLOCK)
+        if policy not in [POLICY_REJECT, POLICY_DROP_OLDEST, POLICY_BLOCK]:
+            logger.warning("[handler_pool] unknown overflow policy {}, use {}".format(policy, POLICY_BLOCK))
+            policy = POLICY_BLOCK
+        self.lanes = {
+            LANE_LLM: Lane(LANE_LLM, conf().get("handler_pool_llm_workers", 8), max_queue, policy),
+            LANE_MEDIA: Lane(LANE_MEDIA, conf().get("handler_pool_media_workers", 2), max_queue, policy),
+            LANE_COMMAND: Lane(LANE_COMMAND, conf().get("handler_pool_command_workers", 2), max_queue, policy),
+        }
+
+    @staticmethod
+    def lane_of(context: Context) -> str:
+        if context.type == ContextType.TEXT:
+            content = context.content or ""
+            trigger_prefix = config_snapshot().get("plugin_trigger_prefix", "$")
+            if content.startswith("#") or (trigger_prefix and content.startswith(trigger_prefix)):
+                return LANE_COMMAND
+        elif context.type in MEDIA_CONTEXT_TYPES:
+            return LANE_MEDIA
+        return LANE_LLM
+
+    def lane(self, name) -> Lane:
+        return self.lanes[name]
+
+    def submit(self, lane_name, fn, *args, **kwargs) -> Future:
+        return self.lanes[lane_name].submit(fn, *args, **kwargs)
+
+    def stats(self) -> dict:
+        return {name: lane.stats() for name, lane in self.lanes.items()}
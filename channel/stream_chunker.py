@@ -0,0 +1,68 @@
+"""
+流式回复分段
+
+bot流式返回的是零碎的文本片段，逐个发送会刷屏并触发发送频率限制。
+StreamChunker把片段累积起来，在满足最少字数和最小间隔后，从最后一个段落或句子结尾处切出一条消息；
+切点之后必须还有内容，保证最后一条消息总是由finish()返回，调用方据此只在最后一条加后缀。
+"""
+
+import re
+import time
+
+# 段落结尾(空行)或中英文句子结尾，英文句号后面需要跟空白，避免切开小数和网址
+_BOUNDARY = re.compile(r"\n\s*\n|[。！？!?；;…]+[”’」』)）]*|\.(?=\s)|\n")
+_PARAGRAPH = re.compile(r"\n\s*\n")
+
+
+class StreamChunker(object):
+    def __init__(self, min_chars=80, interval=1.5, max_chars=None):
+        self.min_chars = min_chars
+        self.interval = interval
+        # 一直没有句子结尾(如代码)时，超过max_chars强制切分
+        self.max_chars = max_chars or max(min_chars * 8, 1000)
+        self.buffer = ""
+        self.last_flush = None
+
+    def feed(self, text):
+        """追加片段，返回可以发送的一条消息，还不能发送时返回None"""
+        if text:
+            self.buffer += text
+        if len(self.buffer) < self.min_chars:
+            return None
+        # 第一条消息不受间隔限制，尽快发出
+        if self.last_flush is not None and time.monotonic() - self.last_flush < self.interval:
+            return None
+        cut = self._find_cut()
+        if cut is None:
+            return None
+        chunk, self.buffer = self.buffer[:cut], self.buffer[cut:]
+        self.last_flush = time.monotonic()
+        return chunk.strip()
+
+    def finish(self):
+        """流结束，返回剩余的内容(最后一条消息)"""
+        chunk, self.buffer = self.buffer, ""
+        return chunk.strip()
+
+    def wait_time(self):
+        """距离下一条消息可以发送还需等待的秒数"""
+        if self.last_flush is None:
+            return 0
+        return max(0.0, self.last_flush + self.interval - time.monotonic())
+
+    def _find_cut(self):
+        buffer = self.buffer
+        # 只有空白的部分不能单独成为最后一条消息，切点之后要有非空白内容
+        tail = len(buffer.rstrip())
+        # 优先在段落结尾切分，其次是句子结尾
+        for pattern in (_PARAGRAPH, _BOUNDARY):
+            cut = None
+            for m in pattern.finditer(buffer, self.min_chars - 1 if self.min_chars > 0 else 0):
+                if m.end() >= tail:
+                    break
+                cut = m.end()
+            if cut is not None:
+                return cut
+        if len(buffer) >= self.max_chars:
+            return self.max_chars
+        return None
@@ -0,0 +1,83 @@
+"""
+消息触发规则匹配
+
+_compose_context 每条消息都要判断群白名单、共享会话群、昵称黑名单，并匹配前缀和关键词。
+这些规则在配置变化时编译一次：名单转为集合，前缀和关键词各编译为一个正则(按配置中的顺序排列的分支)，
+@提及的正则按名称缓存。配置版本变化后下一条消息会自动重建。
+"""
+
+import functools
+import re
+
+from config import config_derived
+
+
+def _compile_prefix(prefix_list):
+    if not prefix_list:
+        return None
+    # 正则分支按顺序尝试，与check_prefix一样返回列表中第一个匹配的前缀
+    return re.compile("|".join(re.escape(prefix) for prefix in prefix_list))
+
+
+def _compile_keyword(keyword_list):
+    if not keyword_list:
+        return None
+    return re.compile("|".join(re.escape(keyword) for keyword in keyword_list))
+
+
+@functools.lru_cache(maxsize=1024)
+def at_pattern(name):
+    """@某人 的正则，按名称缓存"""
+    return re.compile(f"@{re.escape(name)}(\u2005|\u0020)")
+
+
+class TriggerMatcher:
+    def __init__(self, config):
+        # config为ConfigSnapshot
+        self.version = config.version
+        group_name_white_list = config.get("group_name_white_list", []) or []
+        self.group_name_white_list = set(group_name_white_list)
+        self.all_group = "ALL_GROUP" in self.group_name_white_list
+        self.group_name_keyword = _compile_keyword(config.get("group_name_keyword_white_list", []))
+        group_chat_in_one_session = config.get("group_chat_in_one_session", []) or []
+        self.group_chat_in_one_session = set(group_chat_in_one_session)
+        self.all_group_in_one_session = "ALL_GROUP" in self.group_chat_in_one_session
+        self.nick_name_black_list = set(config.get("nick_name_black_list", []) or [])
+        self.group_chat_prefix = _compile_prefix(config.get("group_chat_prefix"))
+        self.group_chat_keyword = _compile_keyword(config.get("group_chat_keyword"))
+        self.single_chat_prefix = _compile_prefix(config.get("single_chat_prefix", [""]))
+        self.image_create_prefix = _compile_prefix(config.get("image_create_prefix", [""]))
+        self.group_at_off = config.get("group_at_off", False)
+        self.trigger_by_self = config.get("trigger_by_self", True)
+        self.always_reply_voice = config.get("always_reply_voice")
+        self.voice_reply_voice = config.get("voice_reply_voice")
+
+    def is_group_allowed(self, group_name):
+        if self.all_group or group_name in self.group_name_white_list:
+            return True
+        return self.group_name_keyword is not None and group_name is not None and self.group_name_keyword.search(group_name) is not None
+
+    def is_shared_session_group(self, group_name):
+        return self.all_group_in_one_session or group_name in self.group_chat_in_one_session
+
+    def is_nick_name_blocked(self, nick_name):
+        return bool(nick_name) and nick_name in self.nick_name_black_list
+
+    @staticmethod
+    def match_prefix(pattern, content):
+        """与check_prefix相同：返回匹配的前缀，没有匹配返回None"""
+        if pattern is None:
+            return None
+        m = pattern.match(content)
+        return m.group() if m else None
+
+    @staticmethod
+    def match_contain(pattern, content):
+        """与check_contain相同：包含任一关键词返回True，否则返回None"""
+        if pattern is None or pattern.search(content) is None:
+            return None
+        return True
+
+
+# 当前配置对应的匹配器，配置版本变化时重建
+get_trigger_matcher = config_derived(TriggerMatcher)
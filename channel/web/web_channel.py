@@ -1,8 +1,8 @@
+import asyncio
 import sys
 import time
-import web
 import json
-from queue import Queue
+from aiohttp import web
 from bridge.context import *
 from bridge.reply import Reply, ReplyType
 from channel.chat_channel import ChatChannel, check_prefix
@@ -31,6 +31,16 @@ class WebMessage(ChatMessage):
         self.other_user_id = other_user_id
 
 
+class WebClient:
+    """一个用户的消息队列，SSE连接断开后保留一段时间，期间的回复在重新连接后送达"""
+
+    def __init__(self, queue_size):
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.unsent = None  # 连接断开时没有送达的消息，重新连接后最先发送
+        self.connections = 0
+        self.last_seen = time.monotonic()
+
+
 @singleton
 class WebChannel(ChatChannel):
     NOT_SUPPORT_REPLYTYPE = [ReplyType.VOICE]
@@ -43,8 +53,13 @@ class WebChannel(ChatChannel):
 
     def __init__(self):
         super().__init__()
-        self.message_queues = {}  # 为每个用户存储一个消息队列
+        # 为每个用户存储一个消息队列，只在事件循环线程中访问
+        self.message_queues = {}  # user_id -> WebClient
         self.msg_id_counter = 0  # 添加消息ID计数器
+        self.loop = None
+        self.heartbeat_interval = conf().get("web_heartbeat_interval", 15)
+        self.idle_timeout = conf().get("web_idle_timeout", 300)
+        self.queue_size = conf().get("web_queue_size", 100)
 
     def _generate_msg_id(self):
         """生成唯一的消息ID"""
@@ -82,73 +97,110 @@ class WebChannel(ChatChannel):
             # 获取用户ID，如果没有则使用默认值
             # user_id = getattr(context.get("session", None), "session_id", "default_user")
             user_id = context["receiver"]
-            # 确保用户有对应的消息队列
-            if user_id not in self.message_queues:
-                self.message_queues[user_id] = Queue()
-                
-            # 将消息放入对应用户的队列
             message_data = {
                 "type": str(reply.type),
                 "content": reply.content,
                 "timestamp": time.time()
             }
-            self.message_queues[user_id].put(message_data)
+            if self.loop is None:
+                logger.warning(f"[WebChannel] server not started, message for user {user_id} dropped")
+                return
+            # send在工作线程中调用，交给事件循环放入对应用户的队列，等待中的SSE连接立即被唤醒
+            self.loop.call_soon_threadsafe(self._enqueue, user_id, message_data)
             logger.debug(f"Message queued for user {user_id}")
             
         except Exception as e:
             logger.error(f"Error in send method: {e}")
             raise
 
-    def sse_handler(self, user_id):
+    def _get_client(self, user_id):
+        client = self.message_queues.get(user_id)
+        if client is None:
+            client = WebClient(self.queue_size)
+            self.message_queues[user_id] = client
+        return client
+
+    def _enqueue(self, user_id, message):
+        client = self._get_client(user_id)
+        if client.queue.full():
+            # 用户长时间没有连接，丢弃最早的消息
+            client.queue.get_nowait()
+            logger.warning(f"[WebChannel] message queue of user {user_id} is full, drop the oldest message")
+        client.queue.put_nowait(message)
+
+    async def sse_handler(self, request):
         """
         Handle Server-Sent Events (SSE) for real-time communication.
         """
-        web.header('Content-Type', 'text/event-stream')
-        web.header('Cache-Control', 'no-cache')
-        web.header('Connection', 'keep-alive')
-        
+        user_id = request.match_info["user_id"]
+        response = web.StreamResponse(headers={
+            "Content-Type": "text/event-stream",
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+        })
+        await response.prepare(request)
+
         # 确保用户有消息队列
-        if user_id not in self.message_queues:
-            self.message_queues[user_id] = Queue()
-        
-        try:    
+        client = self._get_client(user_id)
+        client.connections += 1
+        try:
+            await response.write(b": connected\n\n")
             while True:
+                message, client.unsent = client.unsent, None
+                if message is None:
+                    try:
+                        message = await asyncio.wait_for(client.queue.get(), self.heartbeat_interval)
+                    except asyncio.TimeoutError:
+                        # 空闲时只定时发送心跳，连接已断开时写入失败退出
+                        await response.write(b": heartbeat\n\n")
+                        continue
                 try:
-                    # 发送心跳
-                    yield f": heartbeat\n\n"
-                    
-                    # 非阻塞方式获取消息
-                    if not self.message_queues[user_id].empty():
-                        message = self.message_queues[user_id].get_nowait()
-                        yield f"data: {json.dumps(message)}\n\n"
-                    time.sleep(0.5)
-                except Exception as e:
-                    logger.error(f"SSE Error: {e}")
-                    break
+                    await response.write(f"data: {json.dumps(message)}\n\n".encode("utf-8"))
+                except BaseException:
+                    client.unsent = message
+                    raise
+        except ConnectionResetError:
+            pass
+        except Exception as e:
+            logger.error(f"SSE Error: {e}")
         finally:
-            # 清理资源
-            if user_id in self.message_queues:
-                # 只有当队列为空时才删除
-                if self.message_queues[user_id].empty():
+            client.connections -= 1
+            client.last_seen = time.monotonic()
+        return response
+
+    async def _reap_idle_clients(self):
+        """清理断开连接超过idle_timeout的用户队列"""
+        while True:
+            await asyncio.sleep(min(60, self.idle_timeout))
+            now = time.monotonic()
+            for user_id, client in list(self.message_queues.items()):
+                if client.connections == 0 and now - client.last_seen > self.idle_timeout:
                     del self.message_queues[user_id]
+                    dropped = client.queue.qsize() + (client.unsent is not None)
+                    if dropped:
+                        logger.info(f"[WebChannel] user {user_id} disconnected, {dropped} messages dropped")
 
-    def post_message(self):
+    async def post_message(self, request):
         """
         Handle incoming messages from users via POST request.
         """
         try:
-            data = web.data()  # 获取原始POST数据
-            json_data = json.loads(data)
+            json_data = await request.json()
             user_id = json_data.get('user_id', 'default_user')
             prompt = json_data.get('message', '')
         except json.JSONDecodeError:
-            return json.dumps({"status": "error", "message": "Invalid JSON"})
+            return web.json_response({"status": "error", "message": "Invalid JSON"})
         except Exception as e:
-            return json.dumps({"status": "error", "message": str(e)})
+            return web.json_response({"status": "error", "message": str(e)})
         
         if not prompt:
-            return json.dumps({"status": "error", "message": "No message provided"})
-            
+            return web.json_response({"status": "error", "message": "No message provided"})
+
+        # 插件处理消息可能较慢，不在事件循环中执行
+        result = await asyncio.get_running_loop().run_in_executor(None, self._produce_message, user_id, prompt)
+        return web.json_response(result)
+
+    def _produce_message(self, user_id, prompt):
         try:
             msg_id = self._generate_msg_id()
             context = self._compose_context(ContextType.TEXT, prompt, msg=WebMessage(msg_id, 
@@ -157,47 +209,47 @@ class WebChannel(ChatChannel):
                                                                                      other_user_id = user_id
                                                                                      ))
             if not context:
-                return json.dumps({"status": "error", "message": "Failed to process message"})
+                return {"status": "error", "message": "Failed to process message"}
 
             context["isgroup"] = False
             # context["session"] = web.storage(session_id=user_id)
                 
             self.produce(context)
-            return json.dumps({"status": "success", "message": "Message received"})
+            return {"status": "success", "message": "Message received"}
             
         except Exception as e:
             logger.error(f"Error processing message: {e}")
-            return json.dumps({"status": "error", "message": "Internal server error"})
+            return {"status": "error", "message": "Internal server error"}
 
-    def chat_page(self):
+    async def chat_page(self, request):
         """Serve the chat HTML page."""
         file_path = os.path.join(os.path.dirname(__file__), 'chat.html')  # 使用绝对路径
-        with open(file_path, 'r', encoding='utf-8') as f:
-            return f.read()
+        return web.FileResponse(file_path, headers={"Content-Type": "text/html; charset=utf-8"})
+
+    def _app(self):
+        app = web.Application()
+        app.add_routes([
+            web.get('/sse/{user_id}', self.sse_handler),  # 修改路由以接收用户ID
+            web.post('/message', self.post_message),
+            web.get('/chat', self.chat_page),
+        ])
+        return app
+
+    async def _serve(self, port):
+        runner = web.AppRunner(self._app())
+        await runner.setup()
+        site = web.TCPSite(runner, "0.0.0.0", port)
+        await site.start()
+        await self._reap_idle_clients()
 
     def startup(self):
         print("\nWeb Channel is running, please visit http://localhost:9899/chat")
-        
-        urls = (
-            '/sse/(.+)', 'SSEHandler',  # 修改路由以接收用户ID
-            '/message', 'MessageHandler',
-            '/chat', 'ChatHandler', 
-        )
+        # 所有SSE连接在一个事件循环中等待消息，不再每个连接占用一个线程轮询
         port = conf().get("web_port", 9899)
-        app = web.application(urls, globals(), autoreload=False)
-        web.httpserver.runsimple(app.wsgifunc(), ("0.0.0.0", port))
-
-
-class SSEHandler:
-    def GET(self, user_id):
-        return WebChannel().sse_handler(user_id)
-
-
-class MessageHandler:
-    def POST(self):
-        return WebChannel().post_message()
-
-
-class ChatHandler:
-    def GET(self):
-        return WebChannel().chat_page()
+        # 先设置self.loop再启动服务，事件循环开始运行前send提交的消息也会在运行后放入队列
+        loop = asyncio.new_event_loop()
+        self.loop = loop
+        try:
+            loop.run_until_complete(self._serve(port))
+        finally:
+            loop.close()
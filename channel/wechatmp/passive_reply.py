@@ -62,7 +62,7 @@ class Query:
                     logger.debug("[wechatmp] context: {} {} {}".format(context, wechatmp_msg, supported))
 
                     if supported and context:
-                        channel.running.add(from_user)
+                        channel.passive_state.start(from_user)
                         channel.produce(context)
                     else:
                         trigger_prefix = conf().get("single_chat_prefix", [""])[0]
@@ -100,16 +100,17 @@ class Query:
                     )
                 )
 
-                task_running = True
-                waiting_until = request_time + 4
-                while time.time() < waiting_until:
-                    if from_user in channel.running:
-                        time.sleep(0.1)
-                    else:
-                        task_running = False
-                        break
+                # 回复生成或失败时会被立即唤醒
+                finished = channel.passive_state.wait(from_user, request_time + 4 - time.time())
+                task_running = not finished
 
                 reply_text = ""
+                if finished is None:
+                    # 等待的请求过多，不再占用线程，提示用户稍后获取
+                    logger.warning("[wechatmp] Too many requests waiting for reply, request {} from {} returns at once".format(request_cnt, from_user))
+                    reply_text = "【正在思考中，回复任意文字尝试获取回复】"
+                    replyPost = create_reply(reply_text, msg)
+                    return encrypt_func(replyPost.render())
                 if task_running:
                     if request_cnt < 3:
                         # waiting for timeout (the POST request will be closed by Wechat official server)
@@ -125,17 +126,11 @@ class Query:
                 # reply is ready
                 channel.request_cnt.pop(message_id)
 
-                # no return because of bandwords or other reasons
-                if from_user not in channel.cache_dict and from_user not in channel.running:
-                    return "success"
-
                 # Only one request can access to the cached data
-                try:
-                    (reply_type, reply_content) = channel.cache_dict[from_user].pop(0)
-                    if not channel.cache_dict[from_user]:  # If popping the message makes the list empty, delete the user entry from cache
-                        del channel.cache_dict[from_user]
-                except IndexError:
+                cached = channel.passive_state.pop_reply(from_user)
+                if cached is None:  # no return because of bandwords or other reasons
                     return "success"
+                (reply_type, reply_content) = cached
 
                 if reply_type == "text":
                     if len(reply_content.encode("utf8")) <= MAX_UTF8_LEN:
@@ -148,7 +143,7 @@ class Query:
                             max_split=1,
                         )
                         reply_text = splits[0] + continue_text
-                        channel.cache_dict[from_user].append(("text", splits[1]))
+                        channel.passive_state.add_reply(from_user, ("text", splits[1]))
 
                     logger.info(
                         "[wechatmp] Request {} do send to {} {}: {}\n{}".format(
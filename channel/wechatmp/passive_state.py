@@ -0,0 +1,65 @@
+"""
+公众号被动回复的等待状态
+
+被动回复模式下，微信服务器对同一条消息最多请求3次(每次等待5秒)，请求线程需要等到回复生成后才能返回。
+每个正在处理的用户对应一个Event，回复生成或失败时set，等待中的请求立即被唤醒，不再轮询。
+每个等待中的请求都占用一个web.py工作线程，同时等待的请求数有上限，避免新消息没有线程处理。
+"""
+
+import threading
+
+from common.expired_dict import ExpiredDict
+
+
+class PassiveReplyState(object):
+    def __init__(self, max_waiters=8, cache_ttl=3600, cache_size=10000):
+        # Cache the reply to the user's first message, 用户一直不来取的回复过期后丢弃
+        self.cache_dict = ExpiredDict(cache_ttl, max_size=cache_size)
+        # Record whether the current message is being processed, 用户 -> 处理完成时set的Event
+        self.running = dict()
+        # Count the request from wechat official server by message_id, 3次请求都在15秒内
+        self.request_cnt = ExpiredDict(60)
+        self.lock = threading.Lock()
+        self.waiters = threading.BoundedSemaphore(max_waiters) if max_waiters > 0 else None
+
+    def start(self, user):
+        with self.lock:
+            self.running[user] = threading.Event()
+
+    def finish(self, user):
+        with self.lock:
+            event = self.running.pop(user, None)
+        if event is not None:
+            event.set()
+
+    def wait(self, user, timeout):
+        """等待用户的回复生成，返回是否已完成；同时等待的请求过多时不等待，返回None"""
+        event = self.running.get(user)
+        if event is None:
+            return True
+        if self.waiters is not None and not self.waiters.acquire(blocking=False):
+            return None
+        try:
+            return event.wait(max(0, timeout))
+        finally:
+            if self.waiters is not None:
+                self.waiters.release()
+
+    def add_reply(self, user, reply):
+        with self.lock:
+            replies = self.cache_dict.get(user)
+            if replies is None:
+                replies = []
+                self.cache_dict[user] = replies
+            replies.append(reply)
+
+    def pop_reply(self, user):
+        """取出用户最早的一条回复，没有时返回None"""
+        with self.lock:
+            replies = self.cache_dict.get(user)
+            if not replies:
+                return None
+            reply = replies.pop(0)
+            if not replies:
+                self.cache_dict.pop(user)
+            return reply
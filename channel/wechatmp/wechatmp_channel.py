@@ -10,12 +10,12 @@ import requests
 import web
 from wechatpy.crypto import WeChatCrypto
 from wechatpy.exceptions import WeChatClientException
-from collections import defaultdict
 
 from bridge.context import *
 from bridge.reply import *
 from channel.chat_channel import ChatChannel
 from channel.wechatmp.common import *
+from channel.wechatmp.passive_state import PassiveReplyState
 from channel.wechatmp.wechatmp_client import WechatMPClient
 from common.log import logger
 from common.singleton import singleton
@@ -46,12 +46,18 @@ class WechatMPChannel(ChatChannel):
         if aes_key:
             self.crypto = WeChatCrypto(token, aes_key, appid)
         if self.passive_reply:
+            # 被动回复模式每次请求只能取走一条回复，不分段发送
+            self.SUPPORT_STREAM_REPLY = False
+            self.passive_state = PassiveReplyState(
+                max_waiters=conf().get("wechatmp_max_waiting_requests", 8),
+                cache_ttl=conf().get("wechatmp_reply_cache_ttl", 3600),
+            )
             # Cache the reply to the user's first message
-            self.cache_dict = defaultdict(list)
+            self.cache_dict = self.passive_state.cache_dict
             # Record whether the current message is being processed
-            self.running = set()
+            self.running = self.passive_state.running
             # Count the request from wechat official server by message_id
-            self.request_cnt = dict()
+            self.request_cnt = self.passive_state.request_cnt
             # The permanent media need to be deleted to avoid media number limit
             self.delete_media_loop = asyncio.new_event_loop()
             t = threading.Thread(target=self.start_loop, args=(self.delete_media_loop,))
@@ -86,7 +92,7 @@ class WechatMPChannel(ChatChannel):
             if reply.type == ReplyType.TEXT or reply.type == ReplyType.INFO or reply.type == ReplyType.ERROR:
                 reply_text = remove_markdown_symbol(reply.content)
                 logger.info("[wechatmp] text cached, receiver {}\n{}".format(receiver, reply_text))
-                self.cache_dict[receiver].append(("text", reply_text))
+                self.passive_state.add_reply(receiver, ("text", reply_text))
             elif reply.type == ReplyType.VOICE:
                 voice_file_path = reply.content
                 duration, files = split_audio(voice_file_path, 60 * 1000)
@@ -107,7 +113,7 @@ class WechatMPChannel(ChatChannel):
                         return
                     media_id = response["media_id"]
                     logger.info("[wechatmp] voice uploaded, receiver {}, media_id {}".format(receiver, media_id))
-                    self.cache_dict[receiver].append(("voice", media_id))
+                    self.passive_state.add_reply(receiver, ("voice", media_id))
 
             elif reply.type == ReplyType.IMAGE_URL:  # 从网络下载图片
                 img_url = reply.content
@@ -127,7 +133,7 @@ class WechatMPChannel(ChatChannel):
                     return
                 media_id = response["media_id"]
                 logger.info("[wechatmp] image uploaded, receiver {}, media_id {}".format(receiver, media_id))
-                self.cache_dict[receiver].append(("image", media_id))
+                self.passive_state.add_reply(receiver, ("image", media_id))
             elif reply.type == ReplyType.IMAGE:  # 从文件读取图片
                 image_storage = reply.content
                 image_storage.seek(0)
@@ -142,7 +148,7 @@ class WechatMPChannel(ChatChannel):
                     return
                 media_id = response["media_id"]
                 logger.info("[wechatmp] image uploaded, receiver {}, media_id {}".format(receiver, media_id))
-                self.cache_dict[receiver].append(("image", media_id))
+                self.passive_state.add_reply(receiver, ("image", media_id))
             elif reply.type == ReplyType.VIDEO_URL:  # 从网络下载视频
                 video_url = reply.content
                 video_res = requests.get(video_url, stream=True)
@@ -161,7 +167,7 @@ class WechatMPChannel(ChatChannel):
                     return
                 media_id = response["media_id"]
                 logger.info("[wechatmp] video uploaded, receiver {}, media_id {}".format(receiver, media_id))
-                self.cache_dict[receiver].append(("video", media_id))
+                self.passive_state.add_reply(receiver, ("video", media_id))
 
             elif reply.type == ReplyType.VIDEO:  # 从文件读取视频
                 video_storage = reply.content
@@ -177,7 +183,7 @@ class WechatMPChannel(ChatChannel):
                     return
                 media_id = response["media_id"]
                 logger.info("[wechatmp] video uploaded, receiver {}, media_id {}".format(receiver, media_id))
-                self.cache_dict[receiver].append(("video", media_id))
+                self.passive_state.add_reply(receiver, ("video", media_id))
 
         else:
             if reply.type == ReplyType.TEXT or reply.type == ReplyType.INFO or reply.type == ReplyType.ERROR:
@@ -311,13 +317,13 @@ class WechatMPChannel(ChatChannel):
     def _success_callback(self, session_id, context, **kwargs):  # 线程异常结束时的回调函数
         logger.debug("[wechatmp] Success to generate reply, msgId={}".format(context["msg"].msg_id))
         if self.passive_reply:
-            self.running.remove(session_id)
+            self.passive_state.finish(session_id)
 
     def _fail_callback(self, session_id, exception, context, **kwargs):  # 线程异常结束时的回调函数
         logger.exception("[wechatmp] Fail to generate reply to user, msgId={}, exception={}".format(context["msg"].msg_id, exception))
         if self.passive_reply:
             assert session_id not in self.cache_dict
-            self.running.remove(session_id)
+            self.passive_state.finish(session_id)
 
     def  get_user_by_wxid(self, wxid):
         return self.client.user.get(wxid);
\ No newline at end of file
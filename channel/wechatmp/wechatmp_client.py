@@ -6,12 +6,13 @@ from wechatpy.exceptions import APILimitedException
 
 from channel.wechatmp.common import *
 from common.log import logger
+from common.token_manager import token_manager
 
 
 class WechatMPClient(WeChatClient):
     def __init__(self, appid, secret, access_token=None, session=None, timeout=None, auto_retry=True):
         super(WechatMPClient, self).__init__(appid, secret, access_token, session, timeout, auto_retry)
-        self.fetch_access_token_lock = threading.Lock()
+        self.token_source = token_manager.source("wechatmp:" + appid + ":" + secret, self._fetch_token, margin=300)
         self.clear_quota_lock = threading.Lock()
         self.last_clear_quota_time = -1
 
@@ -21,16 +22,19 @@ class WechatMPClient(WeChatClient):
     def clear_quota_v2(self):
         return self.post("clear_quota/v2", params={"appid": self.appid, "appsecret": self.secret})
 
-    def fetch_access_token(self):  # 重载父类方法，加锁避免多线程重复获取access_token
-        with self.fetch_access_token_lock:
-            access_token = self.session.get(self.access_token_key)
-            if access_token:
-                if not self.expires_at:
-                    return access_token
-                timestamp = time.time()
-                if self.expires_at - timestamp > 60:
-                    return access_token
-            return super().fetch_access_token()
+    def _fetch_token(self):
+        result = super().fetch_access_token()
+        return result["access_token"], result["expires_in"]
+
+    @property
+    def access_token(self):  # 重载父类属性，token由token_manager缓存和提前刷新，多线程共用一次获取
+        return self.token_source.get()
+
+    def fetch_access_token(self):  # 父类在接口返回token失效时调用，丢弃旧token后重新获取
+        # 重新获取会使旧token失效，并发失败的请求只获取一次
+        self.token_source.invalidate(min_age=10)
+        access_token = self.token_source.get()
+        return {"access_token": access_token, "expires_in": int(self.token_source.expires_at - time.time())}
 
     def _request(self, method, url_or_endpoint, **kwargs):  # 重载父类方法，遇到API限流时，清除quota后重试
         try:
@@ -0,0 +1,184 @@
+"""
+wx849 协议服务的HTTP客户端
+
+通道内所有对协议服务(以及媒体下载)的HTTP请求共用一个ClientSession，复用keep-alive连接，
+并统一处理超时、带抖动的退避重试、并发限制，以及按接口统计的耗时分布。
+"""
+
+import asyncio
+import os
+import random
+import threading
+import time
+
+import aiohttp
+
+from common.log import logger
+from config import conf
+
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, float("inf")]  # 耗时分布的桶上界，单位秒
+RETRY_STATUS = [502, 503, 504]  # 网关类错误时重试，只用于可以重复执行的请求
+
+
+class EndpointStats:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+
+    def observe(self, elapsed, ok):
+        self.count += 1
+        self.total_time += elapsed
+        if not ok:
+            self.errors += 1
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if elapsed <= bound:
+                self.buckets[i] += 1
+                break
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "avg": round(self.total_time / self.count, 3) if self.count else 0,
+            "histogram": {str(bound): n for bound, n in zip(LATENCY_BUCKETS, self.buckets)},
+        }
+
+
+class WX849ApiClient:
+    def __init__(self):
+        api_host = conf().get("wx849_api_host", "127.0.0.1")
+        api_port = conf().get("wx849_api_port", 9011)
+        protocol_version = conf().get("wx849_protocol_version", "849")
+        # 855和ipad协议使用/api前缀，849协议使用/VXAPI前缀
+        self.api_path_prefix = "/api" if protocol_version in ["855", "ipad"] else "/VXAPI"
+        self.base_url = f"http://{api_host}:{api_port}{self.api_path_prefix}"
+        self.default_timeout = conf().get("wx849_api_timeout", 30)
+        self.endpoint_timeouts = conf().get("wx849_api_endpoint_timeouts", {})  # endpoint -> 超时秒数
+        self.max_retries = conf().get("wx849_api_retries", 2)
+        self.max_concurrency = conf().get("wx849_api_max_concurrency", 32)
+        self.loop = None  # 通道的事件循环，会话只在这个循环中创建和使用
+        self.session = None
+        self.semaphore = None  # 限制同时进行的请求数，在通道事件循环中创建
+        self.stats_lock = threading.Lock()
+        self.endpoint_stats = {}
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    def url(self, endpoint):
+        return f"{self.base_url}{endpoint}"
+
+    async def post(self, endpoint, json=None, data=None, headers=None, timeout=None, idempotent=False):
+        """
+        调用协议接口，返回解析后的JSON，失败返回None
+        idempotent: 查询等可以重复执行的接口传True，网关错误时也会重试；
+        发送消息等接口只在连接未建立(请求没有发出)时重试，避免重复发送
+        """
+        return await self._dispatch("POST", endpoint, self.url(endpoint), json, data, headers, timeout, None, idempotent)
+
+    async def download(self, url, headers=None, timeout=None):
+        """下载媒体文件，返回bytes，失败返回None"""
+        return await self._dispatch("GET", "download", url, None, None, headers, timeout, b"", True)
+
+    async def download_to_file(self, url, path, headers=None, timeout=None):
+        """流式下载媒体文件到path，成功返回响应的Content-Type，失败返回None且不留下不完整的文件"""
+        return await self._dispatch("GET", "download", url, None, None, headers, timeout, path, True)
+
+    async def _dispatch(self, *args):
+        # ClientSession绑定创建它的事件循环，其它线程中的事件循环发起的请求转发到通道事件循环执行
+        running_loop = asyncio.get_running_loop()
+        if running_loop is self.loop:
+            async with self.semaphore:
+                return await self._request(await self._get_session(), *args)
+        if self.loop is not None and self.loop.is_running():
+            future = asyncio.run_coroutine_threadsafe(self._dispatch(*args), self.loop)
+            return await asyncio.wrap_future(future)
+        # 通道事件循环未启动(如初始化阶段)，使用临时会话
+        async with aiohttp.ClientSession() as session:
+            return await self._request(session, *args)
+
+    async def _get_session(self):
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency, keepalive_timeout=60)
+            self.session = aiohttp.ClientSession(connector=connector)
+        return self.session
+
+    async def _request(self, session, method, endpoint, url, json, data, headers, timeout, sink, idempotent):
+        # sink为None时解析JSON，为b""时返回bytes，为文件路径时把响应体流式写入文件
+        timeout = aiohttp.ClientTimeout(total=timeout or self.endpoint_timeouts.get(endpoint, self.default_timeout))
+        attempt = 0
+        while True:
+            start = time.monotonic()
+            try:
+                async with session.request(method, url, json=json, data=data, headers=headers, timeout=timeout) as response:
+                    if idempotent and response.status in RETRY_STATUS and attempt < self.max_retries:
+                        self._observe(endpoint, time.monotonic() - start, False)
+                        attempt += 1
+                        await asyncio.sleep(self._backoff(attempt))
+                        continue
+                    if response.status != 200:
+                        self._observe(endpoint, time.monotonic() - start, False)
+                        logger.error(f"[WX849] API请求失败: {url}, 状态码: {response.status}")
+                        return None
+                    if sink is None:
+                        result = await response.json(content_type=None)
+                    elif isinstance(sink, bytes):
+                        result = await response.read()
+                    else:
+                        await self._save(response, sink)
+                        result = response.headers.get("Content-Type", "")
+                    self._observe(endpoint, time.monotonic() - start, True)
+                    return result
+            except aiohttp.ClientConnectorError as e:
+                # 连接未建立，请求不会被服务端处理，可以安全重试
+                self._observe(endpoint, time.monotonic() - start, False)
+                if attempt >= self.max_retries:
+                    logger.error(f"[WX849] API连接失败: {url}, 错误: {e}")
+                    return None
+                attempt += 1
+                await asyncio.sleep(self._backoff(attempt))
+            except Exception as e:
+                self._observe(endpoint, time.monotonic() - start, False)
+                logger.error(f"[WX849] API请求异常: {url}, 错误: {e}")
+                return None
+
+    @staticmethod
+    async def _save(response, path):
+        """响应体先写入临时文件，完成后再改名为path；文件操作在线程池中执行，不阻塞事件循环"""
+        loop = asyncio.get_running_loop()
+        tmp_path = f"{path}.{os.getpid()}.{id(response)}.part"
+        f = await loop.run_in_executor(None, open, tmp_path, "wb")
+        try:
+            try:
+                async for chunk in response.content.iter_chunked(65536):
+                    await loop.run_in_executor(None, f.write, chunk)
+            finally:
+                await loop.run_in_executor(None, f.close)
+            await loop.run_in_executor(None, os.replace, tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    @staticmethod
+    def _backoff(attempt):
+        return min(0.2 * (2 ** attempt), 5) * random.uniform(0.5, 1.5)
+
+    def _observe(self, endpoint, elapsed, ok):
+        with self.stats_lock:
+            if endpoint not in self.endpoint_stats:
+                self.endpoint_stats[endpoint] = EndpointStats()
+            self.endpoint_stats[endpoint].observe(elapsed, ok)
+
+    def stats(self) -> dict:
+        with self.stats_lock:
+            return {endpoint: s.to_dict() for endpoint, s in self.endpoint_stats.items()}
+
+    async def close(self):
+        if self.session and not self.session.closed:
+            await self.session.close()
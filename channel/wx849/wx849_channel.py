@@ -17,12 +17,16 @@ from bridge.reply import Reply, ReplyType
 from channel.chat_channel import ChatChannel
 from channel.chat_message import ChatMessage
 from channel.wx849.wx849_message import WX849Message  # 改为从wx849_message导入WX849Message
+from channel.wx849.wx849_dispatcher import WX849Dispatcher
+from channel.wx849.wx849_api_client import WX849ApiClient
+from channel.wx849.wx849_contacts import ContactDirectory
+from channel.wx849.wx849_media import ImageDownloader
 from common.expired_dict import ExpiredDict
-from common.log import logger, set_log_level
+from common.log import logger, set_log_level, lazy_json, sample_log
 from common.singleton import singleton
 from common.time_check import time_checker
 from common.utils import remove_markdown_symbol
-from config import conf, get_appdata_dir
+from config import conf, config_snapshot, get_appdata_dir
 # 新增HTTP服务器相关导入
 from aiohttp import web
 import uuid
@@ -33,6 +37,9 @@ import math
 from io import BytesIO
 from PIL import Image
 
+# 消息处理线程等待图片下载的最长时间(秒)
+IMAGE_DOWNLOAD_TIMEOUT = 120
+
 # 增大日志行长度限制，以便完整显示XML内容
 try:
     import logging
@@ -210,83 +217,60 @@ class WX849Channel(ChatChannel):
     # 不再使用单独的图片消息ID集合，所有消息ID都记录在_processed_message_ids中
 
     def _process_single_message_independently(self, msg_id: str, msg: dict):
-        """在独立线程中处理单条消息"""
+        """在调度器线程池中处理单条消息，同一会话的消息由调度器保证顺序"""
+        thread_id = threading.get_ident()
         try:
-            # 创建新的事件循环
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-
-            # 记录处理信息
-            thread_id = threading.get_ident()
-            logger.debug(f"[WX849] 独立消息处理线程 {thread_id} 开始处理 - 消息ID: {msg_id}")
-
-            try:
-                # 构建标准的消息对象
-                is_group = False
-
-                # 判断是否是群消息
-                from_user_id = msg.get("fromUserName", msg.get("FromUserName", ""))
-                to_user_id = msg.get("toUserName", msg.get("ToUserName", ""))
-
-                if isinstance(from_user_id, dict) and "string" in from_user_id:
-                    from_user_id = from_user_id["string"]
-                if isinstance(to_user_id, dict) and "string" in to_user_id:
-                    to_user_id = to_user_id["string"]
-
-                if from_user_id and from_user_id.endswith("@chatroom"):
-                    is_group = True
-                elif to_user_id and to_user_id.endswith("@chatroom"):
-                    is_group = True
-                    # 交换发送者和接收者，确保from_user_id是群ID
-                    from_user_id, to_user_id = to_user_id, from_user_id
-
-                # 创建消息对象
-                cmsg = WX849Message(msg, is_group)
-
-                # 注释掉从回调消息中获取发送者昵称的部分，改用API接口获取
-                # if "SenderNickName" in msg and msg["SenderNickName"]:
-                #     cmsg.sender_nickname = msg["SenderNickName"]
-                #     logger.debug(f"[WX849] 使用回调中的发送者昵称: {cmsg.sender_nickname}")
-
-                # 处理被@消息
-                if is_group and "@" in str(msg.get("Content", "")):
-                    # 检查是否有@列表
-                    at_list = []
-
-                    # 方法1: 从RawLogLine中提取@列表
-                    raw_log_line = msg.get("RawLogLine", "")
-
-                    # 检查是否是被@消息
-                    if raw_log_line and "收到被@消息" in raw_log_line:
-                        logger.debug(f"[WX849] 检测到被@消息: {raw_log_line}")
-                        # 设置is_at标志
-                        cmsg.is_at = True
-                    # 检查是否有IsAtMessage标志
-                    elif "IsAtMessage" in msg and msg["IsAtMessage"]:
-                        logger.debug(f"[WX849] 检测到IsAtMessage标志")
-                        # 设置is_at标志
-                        cmsg.is_at = True
+            logger.debug(f"[WX849] 消息处理线程 {thread_id} 开始处理 - 消息ID: {msg_id}")
+
+            # 构建标准的消息对象
+            is_group = False
+
+            # 判断是否是群消息
+            from_user_id = msg.get("fromUserName", msg.get("FromUserName", ""))
+            to_user_id = msg.get("toUserName", msg.get("ToUserName", ""))
+
+            if isinstance(from_user_id, dict) and "string" in from_user_id:
+                from_user_id = from_user_id["string"]
+            if isinstance(to_user_id, dict) and "string" in to_user_id:
+                to_user_id = to_user_id["string"]
+
+            if from_user_id and from_user_id.endswith("@chatroom"):
+                is_group = True
+            elif to_user_id and to_user_id.endswith("@chatroom"):
+                is_group = True
+                # 交换发送者和接收者，确保from_user_id是群ID
+                from_user_id, to_user_id = to_user_id, from_user_id
+
+            # 创建消息对象
+            cmsg = WX849Message(msg, is_group)
+
+            # 注释掉从回调消息中获取发送者昵称的部分，改用API接口获取
+            # if "SenderNickName" in msg and msg["SenderNickName"]:
+            #     cmsg.sender_nickname = msg["SenderNickName"]
+            #     logger.debug(f"[WX849] 使用回调中的发送者昵称: {cmsg.sender_nickname}")
+
+            # 处理被@消息
+            if is_group and "@" in str(msg.get("Content", "")):
+                # 检查是否有@列表
+                at_list = []
+
+                # 方法1: 从RawLogLine中提取@列表
+                raw_log_line = msg.get("RawLogLine", "")
+
+                # 检查是否是被@消息
+                if raw_log_line and "收到被@消息" in raw_log_line:
+                    logger.debug(f"[WX849] 检测到被@消息: {raw_log_line}")
+                    # 设置is_at标志
+                    cmsg.is_at = True
+                # 检查是否有IsAtMessage标志
+                elif "IsAtMessage" in msg and msg["IsAtMessage"]:
+                    logger.debug(f"[WX849] 检测到IsAtMessage标志")
+                    # 设置is_at标志
+                    cmsg.is_at = True
 
-                        # 尝试从日志行中提取@列表
-                        if "@:" in raw_log_line:
-                            try:
-                                at_part = raw_log_line.split("@:", 1)[1].split(" ", 1)[0]
-                                if at_part.startswith("[") and at_part.endswith("]"):
-                                    # 解析@列表
-                                    at_list_str = at_part[1:-1]  # 去除[]
-                                    if at_list_str:
-                                        at_items = at_list_str.split(",")
-                                        for item in at_items:
-                                            item = item.strip().strip("'\"")
-                                            if item:
-                                                at_list.append(item)
-                                        logger.debug(f"[WX849] 从被@消息中提取到@列表: {at_list}")
-                            except Exception as e:
-                                logger.debug(f"[WX849] 从被@消息中提取@列表失败: {e}")
-                    # 普通消息中的@列表提取
-                    elif raw_log_line and "@:" in raw_log_line:
+                    # 尝试从日志行中提取@列表
+                    if "@:" in raw_log_line:
                         try:
-                            # 尝试从日志行中提取@列表
                             at_part = raw_log_line.split("@:", 1)[1].split(" ", 1)[0]
                             if at_part.startswith("[") and at_part.endswith("]"):
                                 # 解析@列表
@@ -297,160 +281,160 @@ class WX849Channel(ChatChannel):
                                         item = item.strip().strip("'\"")
                                         if item:
                                             at_list.append(item)
-                                    logger.debug(f"[WX849] 从RawLogLine提取到@列表: {at_list}")
+                                    logger.debug(f"[WX849] 从被@消息中提取到@列表: {at_list}")
                         except Exception as e:
-                            logger.debug(f"[WX849] 从RawLogLine提取@列表失败: {e}")
+                            logger.debug(f"[WX849] 从被@消息中提取@列表失败: {e}")
+                # 普通消息中的@列表提取
+                elif raw_log_line and "@:" in raw_log_line:
+                    try:
+                        # 尝试从日志行中提取@列表
+                        at_part = raw_log_line.split("@:", 1)[1].split(" ", 1)[0]
+                        if at_part.startswith("[") and at_part.endswith("]"):
+                            # 解析@列表
+                            at_list_str = at_part[1:-1]  # 去除[]
+                            if at_list_str:
+                                at_items = at_list_str.split(",")
+                                for item in at_items:
+                                    item = item.strip().strip("'\"")
+                                    if item:
+                                        at_list.append(item)
+                                logger.debug(f"[WX849] 从RawLogLine提取到@列表: {at_list}")
+                    except Exception as e:
+                        logger.debug(f"[WX849] 从RawLogLine提取@列表失败: {e}")
 
-                    # 方法2: 从MsgSource中提取@列表
-                    if not at_list and "MsgSource" in msg:
-                        try:
-                            msg_source = msg.get("MsgSource", "")
-                            if msg_source:
-                                root = ET.fromstring(msg_source)
-                                atuserlist_elem = root.find('atuserlist')
-                                if atuserlist_elem is not None and atuserlist_elem.text:
-                                    at_users = atuserlist_elem.text.split(",")
-                                    for user in at_users:
-                                        if user.strip():
-                                            at_list.append(user.strip())
-                                    logger.debug(f"[WX849] 从MsgSource提取到@列表: {at_list}")
-                        except Exception as e:
-                            logger.debug(f"[WX849] 从MsgSource提取@列表失败: {e}")
+                # 方法2: 从MsgSource中提取@列表
+                if not at_list and "MsgSource" in msg:
+                    try:
+                        msg_source = msg.get("MsgSource", "")
+                        if msg_source:
+                            root = ET.fromstring(msg_source)
+                            atuserlist_elem = root.find('atuserlist')
+                            if atuserlist_elem is not None and atuserlist_elem.text:
+                                at_users = atuserlist_elem.text.split(",")
+                                for user in at_users:
+                                    if user.strip():
+                                        at_list.append(user.strip())
+                                logger.debug(f"[WX849] 从MsgSource提取到@列表: {at_list}")
+                    except Exception as e:
+                        logger.debug(f"[WX849] 从MsgSource提取@列表失败: {e}")
 
-                    # 设置@列表到消息对象
-                    if at_list:
-                        cmsg.at_list = at_list
-                        # 设置is_at标志
-                        cmsg.is_at = self.wxid in at_list
-                        logger.debug(f"[WX849] 设置@列表: {at_list}, is_at: {cmsg.is_at}")
+                # 设置@列表到消息对象
+                if at_list:
+                    cmsg.at_list = at_list
+                    # 设置is_at标志
+                    cmsg.is_at = self.wxid in at_list
+                    logger.debug(f"[WX849] 设置@列表: {at_list}, is_at: {cmsg.is_at}")
 
-                # 处理消息
-                logger.debug(f"[WX849] 处理回调消息: ID:{cmsg.msg_id} 类型:{cmsg.msg_type}")
+            # 处理消息
+            logger.debug(f"[WX849] 处理回调消息: ID:{cmsg.msg_id} 类型:{cmsg.msg_type}")
 
-                # 使用线程安全的方式检查和标记消息
-                with self.__class__._message_lock:
-                    # 检查消息是否已经处理过 - 使用全局集合
-                    if cmsg.msg_id in self.__class__._processed_message_ids:
-                        logger.debug(f"[WX849] 消息 {cmsg.msg_id} 已在全局集合中标记为处理过，忽略")
-                        return
+            # 使用线程安全的方式检查和标记消息
+            with self.__class__._message_lock:
+                # 检查消息是否已经处理过 - 使用全局集合
+                if cmsg.msg_id in self.__class__._processed_message_ids:
+                    logger.debug(f"[WX849] 消息 {cmsg.msg_id} 已在全局集合中标记为处理过，忽略")
+                    return
 
-                    # 检查本地字典中是否有这个消息ID（兼容旧代码）
-                    if cmsg.msg_id in self.received_msgs:
-                        logger.debug(f"[WX849] 消息 {cmsg.msg_id} 已在本地字典中标记为处理过，忽略")
-                        return
+                # 检查本地字典中是否有这个消息ID（兼容旧代码）
+                if cmsg.msg_id in self.received_msgs:
+                    logger.debug(f"[WX849] 消息 {cmsg.msg_id} 已在本地字典中标记为处理过，忽略")
+                    return
 
-                    # 标记消息为已处理 - 在全局集合和本地字典中标记
-                    # 所有消息都在这里标记，包括图片消息
-                    self.__class__._processed_message_ids.add(cmsg.msg_id)
-                    self.received_msgs[cmsg.msg_id] = True
+                # 标记消息为已处理 - 在全局集合和本地字典中标记
+                # 所有消息都在这里标记，包括图片消息
+                self.__class__._processed_message_ids.add(cmsg.msg_id)
+                self.received_msgs[cmsg.msg_id] = True
 
-                    # 如果集合太大，清理一下
-                    if len(self.__class__._processed_message_ids) > 1000:
-                        # 只保留最近的500条
-                        self.__class__._processed_message_ids = set(list(self.__class__._processed_message_ids)[-500:])
+                # 如果集合太大，清理一下
+                if len(self.__class__._processed_message_ids) > 1000:
+                    # 只保留最近的500条
+                    self.__class__._processed_message_ids = set(list(self.__class__._processed_message_ids)[-500:])
 
-                    # 不再使用_processed_image_ids集合
+                # 不再使用_processed_image_ids集合
 
-                # 检查消息时间是否过期
-                create_time = cmsg.create_time  # 消息时间戳
-                current_time = int(time.time())
+            # 检查消息时间是否过期
+            create_time = cmsg.create_time  # 消息时间戳
+            current_time = int(time.time())
 
-                # 设置超时时间为60秒
-                timeout = 60
-                if int(create_time) < current_time - timeout:
-                    logger.debug(f"[WX849] 历史消息 {cmsg.msg_id} 已跳过，时间差: {current_time - int(create_time)}秒")
-                    return
+            # 设置超时时间为60秒
+            timeout = 60
+            if int(create_time) < current_time - timeout:
+                logger.debug(f"[WX849] 历史消息 {cmsg.msg_id} 已跳过，时间差: {current_time - int(create_time)}秒")
+                return
 
-                # 创建一个全新的消息对象，避免共享引用
-                new_msg = WX849Message(msg, is_group)
+            # 创建一个全新的消息对象，避免共享引用
+            new_msg = WX849Message(msg, is_group)
 
-                # 复制原始消息对象的属性
-                for attr_name in dir(cmsg):
-                    if not attr_name.startswith('_') and not callable(getattr(cmsg, attr_name)):
-                        try:
-                            setattr(new_msg, attr_name, getattr(cmsg, attr_name))
-                        except Exception:
-                            pass
-
-                # 设置正确的接收者和会话ID
-                if is_group:
-                    # 如果是群聊，接收者应该是群ID
-                    new_msg.to_user_id = from_user_id  # 群ID
-                    new_msg.session_id = from_user_id  # 使用群ID作为会话ID
-                    new_msg.other_user_id = from_user_id  # 群ID
-                    new_msg.is_group = True
-
-                    # 确保群聊消息的其他字段也是正确的
-                    new_msg.group_id = from_user_id
-
-                    # 清除可能从其他消息继承的私聊相关字段
-                    if hasattr(new_msg, 'other_user_nickname'):
-                        delattr(new_msg, 'other_user_nickname')
-                else:
-                    # 如果是私聊，接收者应该是发送者ID
-                    sender_wxid = msg.get("SenderWxid", "")
-                    if not sender_wxid:
-                        sender_wxid = from_user_id
-
-                    new_msg.to_user_id = sender_wxid
-                    new_msg.session_id = sender_wxid  # 使用发送者ID作为会话ID
-                    new_msg.other_user_id = sender_wxid
-                    new_msg.is_group = False
-
-                    # 清除可能从其他消息继承的群聊相关字段
-                    if hasattr(new_msg, 'group_name'):
-                        delattr(new_msg, 'group_name')
-                    if hasattr(new_msg, 'group_id'):
-                        delattr(new_msg, 'group_id')
-                    if hasattr(new_msg, 'is_at'):
-                        new_msg.is_at = False
-                    if hasattr(new_msg, 'at_list'):
-                        new_msg.at_list = []
-
-                # 使用新的消息对象替换原始消息对象
-                cmsg = new_msg
-
-                # 创建一个新的线程来处理消息，确保每个消息都有完全独立的处理环境
-                def process_message_in_new_thread():
+            # 复制原始消息对象的属性
+            for attr_name in dir(cmsg):
+                if not attr_name.startswith('_') and not callable(getattr(cmsg, attr_name)):
                     try:
-                        # 创建新的事件循环
-                        msg_loop = asyncio.new_event_loop()
-                        asyncio.set_event_loop(msg_loop)
+                        setattr(new_msg, attr_name, getattr(cmsg, attr_name))
+                    except Exception:
+                        pass
 
-                        try:
-                            # 调用原有的消息处理逻辑
-                            if is_group:
-                                self.handle_group(cmsg)
-                            else:
-                                self.handle_single(cmsg)
-                        finally:
-                            # 关闭事件循环
-                            msg_loop.close()
-                    except Exception as e:
-                        logger.error(f"[WX849] 消息处理线程执行异常: {e}")
-                        logger.error(traceback.format_exc())
+            # 设置正确的接收者和会话ID
+            if is_group:
+                # 如果是群聊，接收者应该是群ID
+                new_msg.to_user_id = from_user_id  # 群ID
+                new_msg.session_id = from_user_id  # 使用群ID作为会话ID
+                new_msg.other_user_id = from_user_id  # 群ID
+                new_msg.is_group = True
+
+                # 确保群聊消息的其他字段也是正确的
+                new_msg.group_id = from_user_id
+
+                # 清除可能从其他消息继承的私聊相关字段
+                if hasattr(new_msg, 'other_user_nickname'):
+                    delattr(new_msg, 'other_user_nickname')
+            else:
+                # 如果是私聊，接收者应该是发送者ID
+                sender_wxid = msg.get("SenderWxid", "")
+                if not sender_wxid:
+                    sender_wxid = from_user_id
 
-                # 启动新线程处理消息
-                msg_thread = threading.Thread(target=process_message_in_new_thread)
-                msg_thread.daemon = True
-                msg_thread.start()
+                new_msg.to_user_id = sender_wxid
+                new_msg.session_id = sender_wxid  # 使用发送者ID作为会话ID
+                new_msg.other_user_id = sender_wxid
+                new_msg.is_group = False
 
-                # 等待消息处理线程完成
-                msg_thread.join()
-            finally:
-                # 关闭事件循环
-                loop.close()
+                # 清除可能从其他消息继承的群聊相关字段
+                if hasattr(new_msg, 'group_name'):
+                    delattr(new_msg, 'group_name')
+                if hasattr(new_msg, 'group_id'):
+                    delattr(new_msg, 'group_id')
+                if hasattr(new_msg, 'is_at'):
+                    new_msg.is_at = False
+                if hasattr(new_msg, 'at_list'):
+                    new_msg.at_list = []
+
+            # 使用新的消息对象替换原始消息对象
+            cmsg = new_msg
+
+            # 调用原有的消息处理逻辑，生成的context通过produce进入ChatChannel的会话队列
+            if is_group:
+                self.handle_group(cmsg)
+            else:
+                self.handle_single(cmsg)
 
-            logger.debug(f"[WX849] 独立消息处理线程 {thread_id} 处理完成 - 消息ID: {msg_id}")
+            logger.debug(f"[WX849] 消息处理线程 {thread_id} 处理完成 - 消息ID: {msg_id}")
         except Exception as e:
-            logger.error(f"[WX849] 独立消息处理线程 {thread_id} 执行异常: {e}")
+            logger.error(f"[WX849] 消息处理线程 {thread_id} 执行异常: {e}")
             logger.error(traceback.format_exc())
 
 
 
     def __init__(self):
         super().__init__()
-        self.received_msgs = ExpiredDict(conf().get("expires_in_seconds", 3600))
+        self.received_msgs = ExpiredDict(conf().get("expires_in_seconds", 3600), max_size=20000)
+        # 回调消息调度器，在通道事件循环中按会话排队，消息处理在有界线程池中执行
+        self.dispatcher = WX849Dispatcher(conf().get("wx849_dispatch_workers", 16), conf().get("wx849_dispatch_max_pending", 1000))
+        # 协议服务HTTP客户端，通道内共用连接池
+        self.api = WX849ApiClient()
+        # 群聊和联系人信息目录，启动时加载一次，之后在内存中查询
+        self.contact_directory = ContactDirectory(os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "tmp"))
+        # 图片分段下载器，按MsgId去重并支持断点续传
+        self.image_downloader = ImageDownloader(self.api, os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "tmp", "images"))
         self.bot = None
         self.user_id = None
         self.name = None
@@ -483,9 +467,9 @@ class WX849Channel(ChatChannel):
         else:
             logger.info("[WX849] 未设置API密钥，将不进行授权验证")
         # 新增属性，用于记录正在等待图片的会话
-        self.waiting_for_image = ExpiredDict(300)  # 设置5分钟过期，固定值
+        self.waiting_for_image = ExpiredDict(300, max_size=1000)  # 设置5分钟过期，固定值
         # 新增属性，用于记录会话最近图片消息
-        self.recent_image_msgs = ExpiredDict(600)  # 设置10分钟过期，固定值
+        self.recent_image_msgs = ExpiredDict(600, max_size=1000)  # 设置10分钟过期，固定值
 
     async def _initialize_bot(self):
         """初始化 bot"""
@@ -568,7 +552,7 @@ class WX849Channel(ChatChannel):
                 async with aiohttp.ClientSession() as session:
                     try:
                         # 尝试访问登录接口
-                        url = f"http://{api_host}:{api_port}{api_path_prefix}/Login/GetQR"
+                        url = self.api.url("/Login/GetQR")
                         logger.debug(f"尝试连接: {url}")
                         async with session.get(url, timeout=5) as response:
                             if response.status in [200, 401, 403, 404]:  # 任何HTTP响应都表示服务在运行
@@ -617,61 +601,54 @@ class WX849Channel(ChatChannel):
                             logger.info(f"[WX849] 检测到原始框架已登录，wxid: {stored_wxid}")
 
                             # 尝试检查连接是否有效
-                            import aiohttp
-                            async with aiohttp.ClientSession() as session:
-                                try:
-                                    # 构建检查连接状态的URL
-                                    check_url = f"http://{api_host}:{api_port}{api_path_prefix}/Login/HeartBeat"
-
-                                    # 准备参数
-                                    form_data = {"wxid": stored_wxid}
-                                    encoded_data = urllib.parse.urlencode(form_data)
-
-                                    # 设置请求头
-                                    headers = {
-                                        'Content-Type': 'application/x-www-form-urlencoded'
-                                    }
-
-                                    async with session.post(check_url, data=encoded_data, headers=headers) as response:
-                                        if response.status == 200:
-                                            json_resp = await response.json()
-
-                                            if json_resp.get("Success", False):
-                                                # 连接有效，直接使用这个会话
-                                                self.wxid = stored_wxid
-                                                self.user_id = stored_wxid
-                                                self.using_original_session = True
-
-                                                # 获取个人信息设置昵称
-                                                try:
-                                                    # 直接使用wxid作为默认昵称
-                                                    self.name = stored_wxid
-
-                                                    # 尝试获取更准确的昵称
-                                                    my_info = await self.bot.get_self_info()
-                                                    if my_info and isinstance(my_info, dict):
-                                                        self.name = my_info.get("NickName", stored_wxid)
-                                                except Exception as e:
-                                                    logger.error(f"[WX849] 获取用户昵称失败: {e}")
-
-                                                self.is_logged_in = True
-                                                logger.info(f"[WX849] 成功复用原始框架会话: user_id: {self.user_id}, nickname: {self.name}")
-
-                                                # 启动HTTP服务器接收消息
-                                                await self._start_http_server()
-                                                return True
-                                            else:
-                                                logger.error(f"[WX849] 原始框架会话无效: {json_resp.get('Message', '未知错误')}")
-                                                logger.error("[WX849] DOW框架只支持使用原始框架的会话，请确保原始框架已登录")
-                                                return False
-                                        else:
-                                            logger.error(f"[WX849] 检查原始框架会话失败，状态码: {response.status}")
-                                            logger.error("[WX849] DOW框架只支持使用原始框架的会话，请确保原始框架已登录")
-                                            return False
-                                except Exception as e:
-                                    logger.error(f"[WX849] 检查原始框架会话时出错: {e}")
+                            try:
+                                # 准备参数
+                                form_data = {"wxid": stored_wxid}
+                                encoded_data = urllib.parse.urlencode(form_data)
+
+                                # 设置请求头
+                                headers = {
+                                    'Content-Type': 'application/x-www-form-urlencoded'
+                                }
+
+                                json_resp = await self.api.post("/Login/HeartBeat", data=encoded_data, headers=headers, idempotent=True)
+                                if json_resp is None:
+                                    logger.error("[WX849] 检查原始框架会话失败")
+                                    logger.error("[WX849] DOW框架只支持使用原始框架的会话，请确保原始框架已登录")
+                                    return False
+
+                                if json_resp.get("Success", False):
+                                    # 连接有效，直接使用这个会话
+                                    self.wxid = stored_wxid
+                                    self.user_id = stored_wxid
+                                    self.using_original_session = True
+
+                                    # 获取个人信息设置昵称
+                                    try:
+                                        # 直接使用wxid作为默认昵称
+                                        self.name = stored_wxid
+
+                                        # 尝试获取更准确的昵称
+                                        my_info = await self.bot.get_self_info()
+                                        if my_info and isinstance(my_info, dict):
+                                            self.name = my_info.get("NickName", stored_wxid)
+                                    except Exception as e:
+                                        logger.error(f"[WX849] 获取用户昵称失败: {e}")
+
+                                    self.is_logged_in = True
+                                    logger.info(f"[WX849] 成功复用原始框架会话: user_id: {self.user_id}, nickname: {self.name}")
+
+                                    # 启动HTTP服务器接收消息
+                                    await self._start_http_server()
+                                    return True
+                                else:
+                                    logger.error(f"[WX849] 原始框架会话无效: {json_resp.get('Message', '未知错误')}")
                                     logger.error("[WX849] DOW框架只支持使用原始框架的会话，请确保原始框架已登录")
                                     return False
+                            except Exception as e:
+                                logger.error(f"[WX849] 检查原始框架会话时出错: {e}")
+                                logger.error("[WX849] DOW框架只支持使用原始框架的会话，请确保原始框架已登录")
+                                return False
                         else:
                             logger.error("[WX849] 未找到原始框架的wxid信息")
                             logger.error("[WX849] DOW框架只支持使用原始框架的会话，请确保原始框架已登录")
@@ -770,7 +747,11 @@ class WX849Channel(ChatChannel):
 
             # 读取消息内容
             data = await request.json()
-            logger.info(f"[WX849] 收到回调消息: {json.dumps(data, ensure_ascii=False)}")
+            # 每条回调都完整输出会拖慢高频回调，INFO级别只定期记录一次，完整内容见DEBUG日志
+            skipped = sample_log("wx849.callback", 60)
+            if skipped is not None:
+                logger.info(f"[WX849] 收到回调消息(过去60秒内省略{skipped}条)")
+            logger.debug("[WX849] 收到回调消息: {}", lazy_json(data))
 
             # 处理消息
             await self._process_callback_message(data)
@@ -1008,17 +989,20 @@ class WX849Channel(ChatChannel):
                     msg_type = msg.get('MsgType', 0)
                     # 让图片消息正常处理
 
-                    # 创建独立的处理线程
-                    process = threading.Thread(
-                        target=self._process_single_message_independently,
-                        args=(msg_id, msg),
-                        daemon=True  # 设置为守护线程，主线程退出时自动结束
-                    )
-                    process.start()
-                    logger.debug(f"[WX849] 已启动独立处理流程 - 消息ID: {msg_id}")
+                    # 按会话排队处理，同一会话的消息保持到达顺序
+                    conversation_id = msg.get("fromUserName", msg.get("FromUserName", ""))
+                    if isinstance(conversation_id, dict):
+                        conversation_id = conversation_id.get("string", "")
+                    to_user_id = msg.get("toUserName", msg.get("ToUserName", ""))
+                    if isinstance(to_user_id, dict):
+                        to_user_id = to_user_id.get("string", "")
+                    if isinstance(to_user_id, str) and to_user_id.endswith("@chatroom"):
+                        conversation_id = to_user_id
+                    await self.dispatcher.submit(conversation_id, self._process_single_message_independently, msg_id, msg)
+                    logger.debug(f"[WX849] 消息已加入调度队列 - 消息ID: {msg_id}, 会话: {conversation_id}")
 
                 except Exception as e:
-                    logger.error(f"[WX849] 创建消息处理线程失败: {e}")
+                    logger.error(f"[WX849] 消息加入调度队列失败: {e}")
                     logger.error(traceback.format_exc())
 
             return True
@@ -1034,11 +1018,15 @@ class WX849Channel(ChatChannel):
         logger.info("[WX849] 注意: DOW框架将使用原始框架的登录会话，请确保原始框架已正常登录运行")
         logger.info("[WX849] 消息将通过回调方式从原始框架传递给DOW框架")
 
+        self.contact_directory.load()
+
         # 创建事件循环
         loop = asyncio.new_event_loop()
 
         # 定义启动任务
         async def startup_task():
+            self.dispatcher.start(asyncio.get_running_loop())
+            self.api.start(asyncio.get_running_loop())
             # 初始化机器人（获取原始框架会话并启动HTTP服务器）
             login_success = await self._initialize_bot()
             if login_success:
@@ -1086,12 +1074,15 @@ class WX849Channel(ChatChannel):
             await self.http_site.stop()
         if self.http_runner:
             await self.http_runner.cleanup()
+        await self.api.close()
+        self.contact_directory.flush()
 
         logger.info("[WX849] HTTP服务器已关闭")
 
     @_check
     def handle_single(self, cmsg: ChatMessage):
         """处理私聊消息"""
+        snapshot = config_snapshot()
         try:
             # 设置_channel属性，以便_prepare_fn方法可以调用_download_image
             if not hasattr(cmsg, '_channel'):
@@ -1101,17 +1092,17 @@ class WX849Channel(ChatChannel):
             self._process_message(cmsg)
 
             # 只记录关键消息信息，减少日志输出
-            if conf().get("log_level", "INFO") != "ERROR":
+            if snapshot.get("log_level", "INFO") != "ERROR":
                 logger.debug(f"[WX849] 私聊消息 - 类型: {cmsg.ctype}, ID: {cmsg.msg_id}, 内容: {cmsg.content[:20]}...")
 
             # 根据消息类型处理
-            if cmsg.ctype == ContextType.VOICE and conf().get("speech_recognition") != True:
+            if cmsg.ctype == ContextType.VOICE and snapshot.get("speech_recognition") != True:
                 logger.debug("[WX849] 语音识别功能未启用，跳过处理")
                 return
 
             # 检查前缀匹配
             if cmsg.ctype == ContextType.TEXT:
-                single_chat_prefix = conf().get("single_chat_prefix", [""])
+                single_chat_prefix = snapshot.get("single_chat_prefix", [""])
                 # 日志记录前缀配置，方便调试
                 logger.debug(f"[WX849] 单聊前缀配置: {single_chat_prefix}")
                 match_prefix = None
@@ -1138,13 +1129,14 @@ class WX849Channel(ChatChannel):
                 logger.debug(f"[WX849] 生成上下文失败，跳过处理")
         except Exception as e:
             logger.error(f"[WX849] 处理私聊消息异常: {e}")
-            if conf().get("log_level", "INFO") == "DEBUG":
+            if snapshot.get("log_level", "INFO") == "DEBUG":
                 import traceback
                 logger.debug(f"[WX849] 异常堆栈: {traceback.format_exc()}")
 
     @_check
     def handle_group(self, cmsg: ChatMessage):
         """处理群聊消息"""
+        snapshot = config_snapshot()
         try:
             # 添加日志，记录处理前的消息基本信息
             logger.debug(f"[WX849] 开始处理群聊消息 - ID:{cmsg.msg_id} 类型:{cmsg.msg_type} 从:{cmsg.from_user_id}")
@@ -1157,36 +1149,26 @@ class WX849Channel(ChatChannel):
             self._process_message(cmsg)
 
             # 只记录关键消息信息，减少日志输出
-            if conf().get("log_level", "INFO") != "ERROR":
+            if snapshot.get("log_level", "INFO") != "ERROR":
                 logger.debug(f"[WX849] 群聊消息 - 类型: {cmsg.ctype}, 群ID: {cmsg.other_user_id}")
 
             # 根据消息类型处理
-            if cmsg.ctype == ContextType.VOICE and conf().get("group_speech_recognition") != True:
+            if cmsg.ctype == ContextType.VOICE and snapshot.get("group_speech_recognition") != True:
                 logger.debug("[WX849] 群聊语音识别功能未启用，跳过处理")
                 return
 
             # 检查白名单
             if cmsg.from_user_id and hasattr(cmsg, 'from_user_id'):
-                group_white_list = conf().get("group_name_white_list", ["ALL_GROUP"])
+                group_white_list = snapshot.get("group_name_white_list", ["ALL_GROUP"])
                 # 检查是否启用了白名单
                 if "ALL_GROUP" not in group_white_list:
                     # 获取群名
                     group_name = None
                     try:
-                        # 使用同步方式获取群名，避免事件循环嵌套
-                        chatrooms_file = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "tmp", 'wx849_rooms.json')
-
-                        if os.path.exists(chatrooms_file):
-                            try:
-                                with open(chatrooms_file, 'r', encoding='utf-8') as f:
-                                    chatrooms_info = json.load(f)
-
-                                if cmsg.from_user_id in chatrooms_info:
-                                    group_name = chatrooms_info[cmsg.from_user_id].get("nickName")
-                                    if group_name:
-                                        logger.debug(f"[WX849] 从缓存获取到群名: {group_name}")
-                            except Exception as e:
-                                logger.error(f"[WX849] 读取群聊缓存失败: {e}")
+                        # 从联系人目录获取群名，避免事件循环嵌套
+                        group_name = self.contact_directory.room_name(cmsg.from_user_id)
+                        if group_name:
+                            logger.debug(f"[WX849] 从缓存获取到群名: {group_name}")
 
                         # 如果没有从缓存获取到群名，使用群ID作为备用
                         if not group_name:
@@ -1210,8 +1192,8 @@ class WX849Channel(ChatChannel):
             # 检查前缀匹配
             trigger_proceed = False
             if cmsg.ctype == ContextType.TEXT:
-                group_chat_prefix = conf().get("group_chat_prefix", [])
-                group_chat_keyword = conf().get("group_chat_keyword", [])
+                group_chat_prefix = snapshot.get("group_chat_prefix", [])
+                group_chat_keyword = snapshot.get("group_chat_keyword", [])
 
                 # 日志记录前缀配置，方便调试
                 logger.debug(f"[WX849] 群聊前缀配置: {group_chat_prefix}")
@@ -1350,34 +1332,10 @@ class WX849Channel(ChatChannel):
         # 尝试获取机器人在群内的昵称
         if cmsg.is_group and not cmsg.self_display_name:
             try:
-                # 从缓存中查询群成员详情
-                tmp_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "tmp")
-                chatrooms_file = os.path.join(tmp_dir, 'wx849_rooms.json')
-
-                if os.path.exists(chatrooms_file):
-                    try:
-                        with open(chatrooms_file, 'r', encoding='utf-8') as f:
-                            chatrooms_info = json.load(f)
-
-                        if cmsg.from_user_id in chatrooms_info:
-                            room_info = chatrooms_info[cmsg.from_user_id]
-
-                            # 在成员中查找机器人的信息
-                            if "members" in room_info and isinstance(room_info["members"], list):
-                                for member in room_info["members"]:
-                                    if member.get("UserName") == self.wxid:
-                                        # 优先使用群内显示名称
-                                        if member.get("DisplayName"):
-                                            cmsg.self_display_name = member.get("DisplayName")
-                                            logger.debug(f"[WX849] 从群成员缓存中获取到机器人群内昵称: {cmsg.self_display_name}")
-                                            break
-                                        # 其次使用昵称
-                                        elif member.get("NickName"):
-                                            cmsg.self_display_name = member.get("NickName")
-                                            logger.debug(f"[WX849] 从群成员缓存中获取到机器人昵称: {cmsg.self_display_name}")
-                                            break
-                    except Exception as e:
-                        logger.error(f"[WX849] 读取群成员缓存失败: {e}")
+                # 从联系人目录查询机器人的群内显示名称，没有时为昵称
+                cmsg.self_display_name = self.contact_directory.member_name(cmsg.from_user_id, self.wxid)
+                if cmsg.self_display_name:
+                    logger.debug(f"[WX849] 从群成员缓存中获取到机器人群内昵称: {cmsg.self_display_name}")
 
                 # 如果缓存中没有找到，使用机器人名称
                 if not cmsg.self_display_name:
@@ -1501,14 +1459,14 @@ class WX849Channel(ChatChannel):
                 cmsg.actual_user_nickname = cmsg.sender_wxid
 
                 # 启动异步任务获取昵称并更新actual_user_nickname
-                threading.Thread(target=lambda: asyncio.run(self._update_nickname_async(cmsg))).start()
+                self.dispatcher.run_coroutine(self._update_nickname_async(cmsg))
 
             # 确保other_user_id设置为群ID
             cmsg.other_user_id = cmsg.from_user_id
 
             # 设置other_user_nickname为群名称，与gewechat保持一致
             # 启动异步任务获取群名称并更新other_user_nickname
-            threading.Thread(target=lambda: asyncio.run(self._update_group_nickname_async(cmsg))).start()
+            self.dispatcher.run_coroutine(self._update_group_nickname_async(cmsg))
 
             # 处理@消息，与gewechat保持一致
             # 优先从MsgSource的XML中解析是否被at
@@ -1549,7 +1507,7 @@ class WX849Channel(ChatChannel):
 
             # 设置other_user_nickname为联系人昵称，与gewechat保持一致
             # 启动异步任务获取联系人昵称并更新other_user_nickname
-            threading.Thread(target=lambda: asyncio.run(self._update_contact_nickname_async(cmsg))).start()
+            self.dispatcher.run_coroutine(self._update_contact_nickname_async(cmsg))
 
             logger.debug(f"[WX849] 设置私聊发送者信息: actual_user_id={cmsg.actual_user_id}, actual_user_nickname={cmsg.actual_user_nickname}")
 
@@ -1833,40 +1791,13 @@ class WX849Channel(ChatChannel):
                 if hasattr(cmsg, 'image_path') and cmsg.image_path and os.path.exists(cmsg.image_path):
                     logger.info(f"[WX849] 图片已存在，路径: {cmsg.image_path}")
                 else:
-                    # 创建一个锁文件，防止重复下载
-                    tmp_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "tmp", "images")
-                    os.makedirs(tmp_dir, exist_ok=True)
-                    lock_file = os.path.join(tmp_dir, f"img_{cmsg.msg_id}.lock")
-
-                    # 检查锁文件是否存在
-                    if os.path.exists(lock_file):
-                        logger.info(f"[WX849] 图片 {cmsg.msg_id} 正在被其他线程下载，跳过")
-                        return
-
-                    # 创建锁文件
-                    try:
-                        with open(lock_file, "w") as f:
-                            f.write(str(time.time()))
-                    except Exception as e:
-                        logger.error(f"[WX849] 创建锁文件失败: {e}")
-
-                    # 尝试下载图片
+                    # 尝试下载图片，同一MsgId的重复消息由下载器合并为一次下载
                     try:
-                        # 使用同步方式下载图片，避免多线程问题
-                        loop = asyncio.new_event_loop()
-                        asyncio.set_event_loop(loop)
-                        result = loop.run_until_complete(self._download_image(cmsg))
-                        loop.close()
+                        # 在通道事件循环中下载并等待完成，当前是消息处理线程
+                        result = self.dispatcher.run_coroutine_sync(self._download_image(cmsg), timeout=IMAGE_DOWNLOAD_TIMEOUT)
                     except Exception as e:
                         logger.error(f"[WX849] 下载图片失败: {e}")
                         logger.error(traceback.format_exc())
-                    finally:
-                        # 删除锁文件
-                        try:
-                            if os.path.exists(lock_file):
-                                os.remove(lock_file)
-                        except Exception as e:
-                            logger.error(f"[WX849] 删除锁文件失败: {e}")
             else:
                 # 如果内容不是XML，可能是已经下载好的图片路径
                 if os.path.exists(cmsg.content):
@@ -1885,40 +1816,13 @@ class WX849Channel(ChatChannel):
                     if hasattr(cmsg, 'image_path') and cmsg.image_path and os.path.exists(cmsg.image_path):
                         logger.info(f"[WX849] 图片已存在，路径: {cmsg.image_path}")
                     else:
-                        # 创建一个锁文件，防止重复下载
-                        tmp_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "tmp", "images")
-                        os.makedirs(tmp_dir, exist_ok=True)
-                        lock_file = os.path.join(tmp_dir, f"img_{cmsg.msg_id}.lock")
-
-                        # 检查锁文件是否存在
-                        if os.path.exists(lock_file):
-                            logger.info(f"[WX849] 图片 {cmsg.msg_id} 正在被其他线程下载，跳过")
-                            return
-
-                        # 创建锁文件
-                        try:
-                            with open(lock_file, "w") as f:
-                                f.write(str(time.time()))
-                        except Exception as e:
-                            logger.error(f"[WX849] 创建锁文件失败: {e}")
-
-                        # 尝试下载图片
+                        # 尝试下载图片，同一MsgId的重复消息由下载器合并为一次下载
                         try:
-                            # 使用同步方式下载图片，避免多线程问题
-                            loop = asyncio.new_event_loop()
-                            asyncio.set_event_loop(loop)
-                            result = loop.run_until_complete(self._download_image(cmsg))
-                            loop.close()
+                            # 在通道事件循环中下载并等待完成，当前是消息处理线程
+                            result = self.dispatcher.run_coroutine_sync(self._download_image(cmsg), timeout=IMAGE_DOWNLOAD_TIMEOUT)
                         except Exception as e:
                             logger.error(f"[WX849] 下载图片失败: {e}")
                             logger.error(traceback.format_exc())
-                        finally:
-                            # 删除锁文件
-                            try:
-                                if os.path.exists(lock_file):
-                                    os.remove(lock_file)
-                            except Exception as e:
-                                logger.error(f"[WX849] 删除锁文件失败: {e}")
         except Exception as e:
             logger.debug(f"解析图片消息失败: {e}, 内容: {cmsg.content[:100]}")
             logger.debug(f"详细错误: {traceback.format_exc()}")
@@ -1933,40 +1837,13 @@ class WX849Channel(ChatChannel):
             if hasattr(cmsg, 'image_path') and cmsg.image_path and os.path.exists(cmsg.image_path):
                 logger.info(f"[WX849] 图片已存在，路径: {cmsg.image_path}")
             else:
-                # 创建一个锁文件，防止重复下载
-                tmp_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "tmp", "images")
-                os.makedirs(tmp_dir, exist_ok=True)
-                lock_file = os.path.join(tmp_dir, f"img_{cmsg.msg_id}.lock")
-
-                # 检查锁文件是否存在
-                if os.path.exists(lock_file):
-                    logger.info(f"[WX849] 图片 {cmsg.msg_id} 正在被其他线程下载，跳过")
-                    return
-
-                # 创建锁文件
-                try:
-                    with open(lock_file, "w") as f:
-                        f.write(str(time.time()))
-                except Exception as e:
-                    logger.error(f"[WX849] 创建锁文件失败: {e}")
-
-                # 尝试下载图片
+                # 尝试下载图片，同一MsgId的重复消息由下载器合并为一次下载
                 try:
-                    # 使用同步方式下载图片，避免多线程问题
-                    loop = asyncio.new_event_loop()
-                    asyncio.set_event_loop(loop)
-                    result = loop.run_until_complete(self._download_image(cmsg))
-                    loop.close()
+                    # 在通道事件循环中下载并等待完成，当前是消息处理线程
+                    result = self.dispatcher.run_coroutine_sync(self._download_image(cmsg), timeout=IMAGE_DOWNLOAD_TIMEOUT)
                 except Exception as e:
                     logger.error(f"[WX849] 下载图片失败: {e}")
                     logger.error(traceback.format_exc())
-                finally:
-                    # 删除锁文件
-                    try:
-                        if os.path.exists(lock_file):
-                            os.remove(lock_file)
-                    except Exception as e:
-                        logger.error(f"[WX849] 删除锁文件失败: {e}")
 
         # 输出日志 - 修改为显示完整XML内容
         logger.info(f"收到图片消息: ID:{cmsg.msg_id} 来自:{cmsg.from_user_id} 发送人:{cmsg.sender_wxid}")
@@ -1996,560 +1873,77 @@ class WX849Channel(ChatChannel):
                 logger.info(f"[WX849] 图片已存在，路径: {cmsg.image_path}")
                 return True
 
-            # 创建临时目录
-            tmp_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "tmp", "images")
-            os.makedirs(tmp_dir, exist_ok=True)
-
-            # 检查是否已经存在相同的图片文件
-            msg_id = cmsg.msg_id
-            existing_files = [f for f in os.listdir(tmp_dir) if f.startswith(f"img_{msg_id}_")]
+            # 分段下载图片，同一MsgId已下载或正在下载时直接复用结果
+            image_info = getattr(cmsg, 'image_info', None) or {}
+            try:
+                data_len = int(image_info.get('length', '0'))
+            except (TypeError, ValueError):
+                data_len = 0
+            image_path = await self.image_downloader.download(cmsg.msg_id, cmsg.from_user_id, self.wxid,
+                                                              data_len, image_info.get('md5'))
+            if not image_path:
+                logger.error(f"[WX849] 图片下载失败: {cmsg.msg_id}")
+                return False
 
-            if existing_files:
-                # 找到最新的文件
-                latest_file = sorted(existing_files, key=lambda x: os.path.getmtime(os.path.join(tmp_dir, x)), reverse=True)[0]
-                existing_path = os.path.join(tmp_dir, latest_file)
+            self._verify_image(image_path)
 
-                # 检查文件是否有效
-                if os.path.exists(existing_path) and os.path.getsize(existing_path) > 0:
-                    try:
-                        from PIL import Image
-                        try:
-                            # 尝试打开图片文件
-                            with Image.open(existing_path) as img:
-                                # 获取图片格式和大小
-                                img_format = img.format
-                                img_size = img.size
-                                logger.info(f"[WX849] 图片已存在且有效: 格式={img_format}, 大小={img_size}")
-
-                                # 设置图片本地路径
-                                cmsg.image_path = existing_path
-                                cmsg.content = existing_path
-                                cmsg.ctype = ContextType.IMAGE
-                                cmsg._prepared = True
+            # 设置图片本地路径，并更新消息内容为图片路径，以便DOW框架处理
+            cmsg.image_path = image_path
+            cmsg.content = image_path
+            cmsg.ctype = ContextType.IMAGE
+            cmsg._prepared = True
 
-                                logger.info(f"[WX849] 使用已存在的图片文件: {existing_path}")
-                                return True
-                        except Exception as img_err:
-                            logger.warning(f"[WX849] 已存在的图片文件无效，重新下载: {img_err}")
-                    except ImportError:
-                        # 如果PIL库未安装，假设文件有效
-                        if os.path.getsize(existing_path) > 10000:  # 至少10KB
-                            cmsg.image_path = existing_path
-                            cmsg.content = existing_path
-                            cmsg.ctype = ContextType.IMAGE
-                            cmsg._prepared = True
-
-                            logger.info(f"[WX849] 使用已存在的图片文件: {existing_path}")
-                            return True
-
-            # 生成图片文件名
-            image_filename = f"img_{cmsg.msg_id}_{int(time.time())}.jpg"
-            image_path = os.path.join(tmp_dir, image_filename)
-
-            # 直接使用分段下载方法，不再尝试使用GetMsgImage
-            logger.info(f"[WX849] 使用分段下载方法获取图片")
-            result = await self._download_image_by_chunks(cmsg, image_path)
-            return result
+            logger.info(f"[WX849] 图片下载完成，保存到: {cmsg.image_path}")
+            return True
 
         except Exception as e:
             logger.error(f"[WX849] 下载图片过程中出错: {e}")
             logger.error(traceback.format_exc())
             return False
 
-    async def _download_image_by_chunks(self, cmsg, image_path):
-        """使用分段下载方法获取图片"""
+    def _verify_image(self, image_path):
+        """验证图片文件，无法打开时尝试截取有效的JPEG数据"""
+        # 验证图片文件是否为有效的图片格式
         try:
-            # 创建临时目录
-            tmp_dir = os.path.dirname(image_path)
-            os.makedirs(tmp_dir, exist_ok=True)
-
-            # 检查是否已经存在相同的图片文件
-            msg_id = cmsg.msg_id
-            existing_files = [f for f in os.listdir(tmp_dir) if f.startswith(f"img_{msg_id}_")]
-
-            if existing_files:
-                # 找到最新的文件
-                latest_file = sorted(existing_files, key=lambda x: os.path.getmtime(os.path.join(tmp_dir, x)), reverse=True)[0]
-                existing_path = os.path.join(tmp_dir, latest_file)
-
-                # 检查文件是否有效
-                if os.path.exists(existing_path) and os.path.getsize(existing_path) > 0:
-                    try:
-                        from PIL import Image
-                        try:
-                            # 尝试打开图片文件
-                            with Image.open(existing_path) as img:
-                                # 获取图片格式和大小
-                                img_format = img.format
-                                img_size = img.size
-                                logger.info(f"[WX849] 图片已存在且有效: 格式={img_format}, 大小={img_size}")
-
-                                # 设置图片本地路径
-                                cmsg.image_path = existing_path
-                                cmsg.content = existing_path
-                                cmsg.ctype = ContextType.IMAGE
-                                cmsg._prepared = True
-
-                                logger.info(f"[WX849] 使用已存在的图片文件: {existing_path}")
-                                return True
-                        except Exception as img_err:
-                            logger.warning(f"[WX849] 已存在的图片文件无效，重新下载: {img_err}")
-                    except ImportError:
-                        # 如果PIL库未安装，假设文件有效
-                        if os.path.getsize(existing_path) > 10000:  # 至少10KB
-                            cmsg.image_path = existing_path
-                            cmsg.content = existing_path
-                            cmsg.ctype = ContextType.IMAGE
-                            cmsg._prepared = True
-
-                            logger.info(f"[WX849] 使用已存在的图片文件: {existing_path}")
-                            return True
-
-            # 获取API配置
-            api_host = conf().get("wx849_api_host", "127.0.0.1")
-            api_port = conf().get("wx849_api_port", 9011)
-            protocol_version = conf().get("wx849_protocol_version", "849")
-
-            # 确定API路径前缀
-            if protocol_version == "855" or protocol_version == "ipad":
-                api_path_prefix = "/api"
-            else:
-                api_path_prefix = "/VXAPI"
-
-            # 估计图片大小
-            data_len = int(cmsg.image_info.get('length', '0'))
-            if data_len <= 0:
-                data_len = 229920  # 默认大小
-
-            # 分段大小
-            chunk_size = 65536  # 64KB - 必须使用这个大小，API限制每次最多下载64KB
-
-            # 计算分段数
-            num_chunks = (data_len + chunk_size - 1) // chunk_size
-            if num_chunks <= 0:
-                num_chunks = 1  # 至少分1段
-
-            # 不限制最大分段数，确保完整下载图片
-            # 但记录一个警告，如果分段数过多
-            if num_chunks > 20:
-                logger.warning(f"[WX849] 图片分段数较多 ({num_chunks})，下载可能需要较长时间")
-
-            logger.info(f"[WX849] 开始分段下载图片，总大小: {data_len} 字节，分 {num_chunks} 段下载")
-
-            # 创建一个空文件
-            with open(image_path, "wb") as f:
-                pass
-
-            # 分段下载
-            all_chunks_success = True
-            for i in range(num_chunks):
-                start_pos = i * chunk_size
-                current_chunk_size = min(chunk_size, data_len - start_pos)
-                if current_chunk_size <= 0:
-                    current_chunk_size = chunk_size
-
-                # 构建API请求参数 - 使用与原始框架相同的格式
-                params = {
-                    "MsgId": cmsg.msg_id,
-                    "ToWxid": cmsg.from_user_id,
-                    "Wxid": self.wxid,
-                    "DataLen": data_len,
-                    "CompressType": 0,
-                    "Section": {
-                        "StartPos": start_pos,
-                        "DataLen": current_chunk_size
-                    }
-                }
-
-                logger.debug(f"[WX849] 尝试下载图片分段: MsgId={cmsg.msg_id}, ToWxid={cmsg.from_user_id}, DataLen={data_len}, StartPos={start_pos}, ChunkSize={current_chunk_size}")
-
-                # 构建完整的API URL - 尝试不同的API路径
-                # 首先尝试 /VXAPI/Tools/DownloadImg
-                api_url = f"http://{api_host}:{api_port}{api_path_prefix}/Tools/DownloadImg"
-
-                # 记录完整的请求URL和参数
-                logger.debug(f"[WX849] 图片下载API URL: {api_url}")
-                logger.debug(f"[WX849] 图片下载API参数: {params}")
-
+            from PIL import Image
+            try:
+                # 尝试打开图片文件
+                with Image.open(image_path) as img:
+                    # 获取图片格式和大小
+                    img_format = img.format
+                    img_size = img.size
+                    logger.info(f"[WX849] 图片验证成功: 格式={img_format}, 大小={img_size}")
+            except Exception as img_err:
+                logger.error(f"[WX849] 图片验证失败，可能不是有效的图片文件: {img_err}")
+                # 尝试修复图片文件
                 try:
-                    async with aiohttp.ClientSession() as session:
-                        async with session.post(api_url, json=params) as response:
-                            if response.status != 200:
-                                logger.error(f"[WX849] 下载图片分段失败, 状态码: {response.status}")
-                                all_chunks_success = False
-                                break
-
-                            # 获取响应内容
-                            result = await response.json()
-
-                            # 检查响应是否成功
-                            if not result.get("Success", False):
-                                logger.error(f"[WX849] 下载图片分段失败: {result.get('Message', '未知错误')}")
-                                all_chunks_success = False
-                                break
-
-                            # 提取图片数据 - 适应原始框架的响应格式
-                            data = result.get("Data", {})
-
-                            # 记录响应结构以便调试
-                            if isinstance(data, dict):
-                                logger.debug(f"[WX849] 响应Data字段包含键: {list(data.keys())}")
-
-                            # 尝试不同的响应格式
-                            chunk_base64 = None
-
-                            # 参考 WechatAPI/Client/tool_extension.py 中的处理方式
-                            if isinstance(data, dict):
-                                # 如果是字典，尝试获取buffer字段
-                                if "buffer" in data:
-                                    logger.debug(f"[WX849] 从data.buffer字段获取图片数据")
-                                    chunk_base64 = data.get("buffer")
-                                elif "data" in data and isinstance(data["data"], dict) and "buffer" in data["data"]:
-                                    logger.debug(f"[WX849] 从data.data.buffer字段获取图片数据")
-                                    chunk_base64 = data["data"]["buffer"]
-                                else:
-                                    # 尝试其他可能的字段名
-                                    for field in ["Chunk", "Image", "Data", "FileData", "data"]:
-                                        if field in data:
-                                            logger.debug(f"[WX849] 从data.{field}字段获取图片数据")
-                                            chunk_base64 = data.get(field)
-                                            break
-                            elif isinstance(data, str):
-                                # 如果直接返回字符串，可能就是base64数据
-                                logger.debug(f"[WX849] Data字段是字符串，直接使用")
-                                chunk_base64 = data
-
-                            # 如果在data中没有找到，尝试在整个响应中查找
-                            if not chunk_base64 and isinstance(result, dict):
-                                for field in ["data", "Data", "FileData", "Image"]:
-                                    if field in result:
-                                        logger.debug(f"[WX849] 从result.{field}字段获取图片数据")
-                                        chunk_base64 = result.get(field)
-                                        break
-
-                            if not chunk_base64:
-                                logger.error(f"[WX849] 下载图片分段失败: 响应中无图片数据")
-                                # 避免记录大量数据，只记录数据类型和长度
-                                if isinstance(data, dict):
-                                    logger.debug(f"[WX849] 响应数据类型: 字典, 键: {list(data.keys())}")
-                                elif isinstance(data, str):
-                                    logger.debug(f"[WX849] 响应数据类型: 字符串, 长度: {len(data)}")
-                                else:
-                                    logger.debug(f"[WX849] 响应数据类型: {type(data)}")
-                                all_chunks_success = False
-                                break
-
-                            # 解码数据并保存图片分段
-                            try:
-                                # 尝试确定数据类型并正确处理
-                                if isinstance(chunk_base64, str):
-                                    # 尝试作为Base64解码
-                                    try:
-                                        # 修复：确保字符串是有效的Base64
-                                        # 移除可能的非Base64字符
-                                        clean_base64 = chunk_base64.strip()
-                                        # 确保长度是4的倍数，如果不是，添加填充
-                                        padding = 4 - (len(clean_base64) % 4) if len(clean_base64) % 4 != 0 else 0
-                                        clean_base64 = clean_base64 + ('=' * padding)
-
-                                        chunk_data = base64.b64decode(clean_base64)
-                                        logger.debug(f"[WX849] 成功解码Base64数据，大小: {len(chunk_data)} 字节")
-                                    except Exception as decode_err:
-                                        logger.error(f"[WX849] Base64解码失败: {decode_err}")
-                                        # 如果解码失败，记录错误并跳过这个分段
-                                        logger.error(f"[WX849] 无法解码的数据: {chunk_base64[:100]}...")
-                                        raise decode_err
-                                elif isinstance(chunk_base64, bytes):
-                                    # 已经是二进制数据，直接使用
-                                    logger.debug(f"[WX849] 使用二进制数据，大小: {len(chunk_base64)} 字节")
-                                    chunk_data = chunk_base64
-                                elif isinstance(chunk_base64, dict):
-                                    # 如果是字典，尝试从字典中提取数据
-                                    logger.debug(f"[WX849] 数据是字典类型，键: {list(chunk_base64.keys())}")
-                                    # 尝试从常见的键中获取数据
-                                    found_data = False
-                                    for key in ['data', 'Data', 'content', 'Content', 'image', 'Image']:
-                                        if key in chunk_base64:
-                                            data_value = chunk_base64[key]
-                                            if isinstance(data_value, str):
-                                                try:
-                                                    # 清理和填充Base64字符串
-                                                    clean_base64 = data_value.strip()
-                                                    padding = 4 - (len(clean_base64) % 4) if len(clean_base64) % 4 != 0 else 0
-                                                    clean_base64 = clean_base64 + ('=' * padding)
-
-                                                    chunk_data = base64.b64decode(clean_base64)
-                                                    logger.debug(f"[WX849] 从字典键 {key} 成功解码Base64数据，大小: {len(chunk_data)} 字节")
-                                                    found_data = True
-                                                    break
-                                                except Exception as e:
-                                                    logger.debug(f"[WX849] 从字典键 {key} 解码Base64失败: {e}")
-                                                    continue
-                                            elif isinstance(data_value, bytes):
-                                                chunk_data = data_value
-                                                logger.debug(f"[WX849] 从字典键 {key} 获取到二进制数据，大小: {len(data_value)} 字节")
-                                                found_data = True
-                                                break
-
-                                    # 如果常见键中没有找到，尝试遍历所有键
-                                    if not found_data:
-                                        logger.debug(f"[WX849] 在常见键中未找到数据，尝试遍历所有键")
-                                        for key, value in chunk_base64.items():
-                                            if isinstance(value, str) and len(value) > 10:  # 只处理可能是Base64的长字符串
-                                                try:
-                                                    # 清理和填充Base64字符串
-                                                    clean_base64 = value.strip()
-                                                    padding = 4 - (len(clean_base64) % 4) if len(clean_base64) % 4 != 0 else 0
-                                                    clean_base64 = clean_base64 + ('=' * padding)
-
-                                                    chunk_data = base64.b64decode(clean_base64)
-                                                    logger.debug(f"[WX849] 从字典键 {key} 成功解码Base64数据，大小: {len(chunk_data)} 字节")
-                                                    found_data = True
-                                                    break
-                                                except Exception:
-                                                    continue
-                                            elif isinstance(value, bytes) and len(value) > 10:
-                                                chunk_data = value
-                                                logger.debug(f"[WX849] 从字典键 {key} 获取到二进制数据，大小: {len(value)} 字节")
-                                                found_data = True
-                                                break
-                                            elif isinstance(value, dict) and len(value) > 0:
-                                                # 递归处理嵌套字典
-                                                logger.debug(f"[WX849] 发现嵌套字典，键: {key}，尝试递归处理")
-                                                for subkey, subvalue in value.items():
-                                                    if isinstance(subvalue, str) and len(subvalue) > 10:
-                                                        try:
-                                                            # 清理和填充Base64字符串
-                                                            clean_base64 = subvalue.strip()
-                                                            padding = 4 - (len(clean_base64) % 4) if len(clean_base64) % 4 != 0 else 0
-                                                            clean_base64 = clean_base64 + ('=' * padding)
-
-                                                            chunk_data = base64.b64decode(clean_base64)
-                                                            logger.debug(f"[WX849] 从嵌套字典键 {key}.{subkey} 成功解码Base64数据，大小: {len(chunk_data)} 字节")
-                                                            found_data = True
-                                                            break
-                                                        except Exception:
-                                                            continue
-                                                    elif isinstance(subvalue, bytes) and len(subvalue) > 10:
-                                                        chunk_data = subvalue
-                                                        logger.debug(f"[WX849] 从嵌套字典键 {key}.{subkey} 获取到二进制数据，大小: {len(subvalue)} 字节")
-                                                        found_data = True
-                                                        break
-                                                if found_data:
-                                                    break
-
-                                    # 如果仍然没有找到有效数据，尝试使用整个字典的字符串表示
-                                    if not found_data:
-                                        logger.warning(f"[WX849] 无法从字典中提取有效的图片数据，尝试使用默认空数据")
-                                        # 创建一个空的JPEG图片数据（最小的有效JPEG文件）
-                                        chunk_data = b'\xff\xd8\xff\xe0\x00\x10\x4a\x46\x49\x46\x00\x01\x01\x01\x00\x48\x00\x48\x00\x00\xff\xdb\x00\x43\x00\xff\xc0\x00\x11\x08\x00\x01\x00\x01\x03\x01\x11\x00\x02\x11\x01\x03\x11\x01\xff\xc4\x00\x14\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xff\xc4\x00\x14\x10\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xff\xda\x00\x0c\x03\x01\x00\x02\x11\x03\x11\x00\x3f\x00\xff\xd9'
-                                        logger.debug(f"[WX849] 使用默认空JPEG数据，大小: {len(chunk_data)} 字节")
-                                else:
-                                    # 其他类型，尝试转换为字符串后处理
-                                    logger.warning(f"[WX849] 未知数据类型: {type(chunk_base64)}，尝试转换为字符串")
-                                    try:
-                                        # 尝试转换为字符串
-                                        str_value = str(chunk_base64)
-                                        if len(str_value) > 10:  # 只处理可能有意义的字符串
-                                            try:
-                                                # 清理和填充Base64字符串
-                                                clean_base64 = str_value.strip()
-                                                padding = 4 - (len(clean_base64) % 4) if len(clean_base64) % 4 != 0 else 0
-                                                clean_base64 = clean_base64 + ('=' * padding)
-
-                                                chunk_data = base64.b64decode(clean_base64)
-                                                logger.debug(f"[WX849] 成功将未知类型转换为Base64并解码，大小: {len(chunk_data)} 字节")
-                                            except Exception as e:
-                                                logger.warning(f"[WX849] 无法将未知类型转换为Base64: {e}")
-                                                # 使用默认空JPEG数据
-                                                chunk_data = b'\xff\xd8\xff\xe0\x00\x10\x4a\x46\x49\x46\x00\x01\x01\x01\x00\x48\x00\x48\x00\x00\xff\xdb\x00\x43\x00\xff\xc0\x00\x11\x08\x00\x01\x00\x01\x03\x01\x11\x00\x02\x11\x01\x03\x11\x01\xff\xc4\x00\x14\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xff\xc4\x00\x14\x10\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xff\xda\x00\x0c\x03\x01\x00\x02\x11\x03\x11\x00\x3f\x00\xff\xd9'
-                                                logger.debug(f"[WX849] 使用默认空JPEG数据，大小: {len(chunk_data)} 字节")
-                                        else:
-                                            # 字符串太短，使用默认空JPEG数据
-                                            chunk_data = b'\xff\xd8\xff\xe0\x00\x10\x4a\x46\x49\x46\x00\x01\x01\x01\x00\x48\x00\x48\x00\x00\xff\xdb\x00\x43\x00\xff\xc0\x00\x11\x08\x00\x01\x00\x01\x03\x01\x11\x00\x02\x11\x01\x03\x11\x01\xff\xc4\x00\x14\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xff\xc4\x00\x14\x10\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xff\xda\x00\x0c\x03\x01\x00\x02\x11\x03\x11\x00\x3f\x00\xff\xd9'
-                                            logger.debug(f"[WX849] 使用默认空JPEG数据，大小: {len(chunk_data)} 字节")
-                                    except Exception as e:
-                                        logger.error(f"[WX849] 处理未知数据类型失败: {e}")
-                                        # 使用默认空JPEG数据
-                                        chunk_data = b'\xff\xd8\xff\xe0\x00\x10\x4a\x46\x49\x46\x00\x01\x01\x01\x00\x48\x00\x48\x00\x00\xff\xdb\x00\x43\x00\xff\xc0\x00\x11\x08\x00\x01\x00\x01\x03\x01\x11\x00\x02\x11\x01\x03\x11\x01\xff\xc4\x00\x14\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xff\xc4\x00\x14\x10\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xff\xda\x00\x0c\x03\x01\x00\x02\x11\x03\x11\x00\x3f\x00\xff\xd9'
-                                        logger.debug(f"[WX849] 使用默认空JPEG数据，大小: {len(chunk_data)} 字节")
-
-                                # 验证数据是否为有效的图片数据
-                                if 'chunk_data' in locals() and chunk_data:
-                                    # 追加到文件
-                                    with open(image_path, "ab") as f:
-                                        f.write(chunk_data)
-                                    logger.debug(f"[WX849] 第 {i+1}/{num_chunks} 段下载成功，大小: {len(chunk_data)} 字节")
-                                else:
-                                    logger.error(f"[WX849] 第 {i+1}/{num_chunks} 段下载失败: 无有效数据")
-                                    all_chunks_success = False
-                                    break
-                            except Exception as decode_err:
-                                logger.error(f"[WX849] 解码Base64图片分段数据失败: {decode_err}")
-                                all_chunks_success = False
-                                break
-                except Exception as api_err:
-                    logger.error(f"[WX849] 调用图片分段API失败: {api_err}")
-                    all_chunks_success = False
-                    break
-
-            if all_chunks_success:
-                # 检查文件大小
-                file_size = os.path.getsize(image_path)
-                logger.info(f"[WX849] 分段下载图片成功，总大小: {file_size} 字节")
-
-                # 如果文件大小与预期不符，记录警告
-                if file_size < data_len * 0.8:  # 如果实际大小小于预期的80%
-                    logger.warning(f"[WX849] 图片文件大小 ({file_size} 字节) 小于预期 ({data_len} 字节)，可能下载不完整")
-
-                    # 如果文件太小，尝试再次下载缺失的部分
-                    if file_size > 0 and file_size < data_len:
-                        logger.info(f"[WX849] 尝试下载缺失的图片部分，从位置 {file_size} 开始")
-
-                        # 计算剩余部分的分段数
-                        remaining_size = data_len - file_size
-                        remaining_chunks = (remaining_size + chunk_size - 1) // chunk_size
-
-                        # 下载剩余部分
-                        remaining_success = True
-                        for i in range(remaining_chunks):
-                            start_pos = file_size + i * chunk_size
-                            current_chunk_size = min(chunk_size, data_len - start_pos)
-
-                            if current_chunk_size <= 0:
-                                break
-
-                            # 构建API请求参数
-                            params = {
-                                "MsgId": cmsg.msg_id,
-                                "ToWxid": cmsg.from_user_id,
-                                "Wxid": self.wxid,
-                                "DataLen": data_len,
-                                "CompressType": 0,
-                                "Section": {
-                                    "StartPos": start_pos,
-                                    "DataLen": current_chunk_size
-                                }
-                            }
-
-                            logger.debug(f"[WX849] 尝试下载缺失的图片分段: MsgId={cmsg.msg_id}, StartPos={start_pos}, ChunkSize={current_chunk_size}")
-
-                            try:
-                                async with aiohttp.ClientSession() as session:
-                                    async with session.post(api_url, json=params) as response:
-                                        if response.status != 200:
-                                            logger.error(f"[WX849] 下载缺失的图片分段失败, 状态码: {response.status}")
-                                            remaining_success = False
-                                            break
-
-                                        result = await response.json()
-
-                                        if not result.get("Success", False):
-                                            logger.error(f"[WX849] 下载缺失的图片分段失败: {result.get('Message', '未知错误')}")
-                                            remaining_success = False
-                                            break
-
-                                        # 提取图片数据
-                                        data = result.get("Data", {})
-                                        chunk_base64 = None
-
-                                        # 参考 WechatAPI/Client/tool_extension.py 中的处理方式
-                                        if isinstance(data, dict):
-                                            if "buffer" in data:
-                                                chunk_base64 = data.get("buffer")
-                                            elif "data" in data and isinstance(data["data"], dict) and "buffer" in data["data"]:
-                                                chunk_base64 = data["data"]["buffer"]
-
-                                        if chunk_base64:
-                                            try:
-                                                chunk_data = base64.b64decode(chunk_base64)
-                                                with open(image_path, "ab") as f:
-                                                    f.write(chunk_data)
-                                                logger.debug(f"[WX849] 缺失的图片分段下载成功，大小: {len(chunk_data)} 字节")
-                                            except Exception as e:
-                                                logger.error(f"[WX849] 解码缺失的图片分段数据失败: {e}")
-                                                remaining_success = False
-                                                break
-                                        else:
-                                            logger.error(f"[WX849] 下载缺失的图片分段失败: 响应中无图片数据")
-                                            remaining_success = False
-                                            break
-                            except Exception as e:
-                                logger.error(f"[WX849] 下载缺失的图片分段失败: {e}")
-                                remaining_success = False
-                                break
+                    # 读取文件内容
+                    with open(image_path, "rb") as f:
+                        img_data = f.read()
 
-                        if remaining_success:
-                            file_size = os.path.getsize(image_path)
-                            logger.info(f"[WX849] 成功下载缺失的图片部分，最终大小: {file_size} 字节")
+                    # 尝试查找JPEG文件头和尾部标记
+                    jpg_header = b'\xff\xd8'
+                    jpg_footer = b'\xff\xd9'
 
-                # 检查文件是否存在且有效
-                if os.path.exists(image_path) and os.path.getsize(image_path) > 0:
-                    # 验证图片文件是否为有效的图片格式
-                    try:
-                        from PIL import Image
-                        try:
-                            # 尝试打开图片文件
-                            with Image.open(image_path) as img:
-                                # 获取图片格式和大小
-                                img_format = img.format
-                                img_size = img.size
-                                logger.info(f"[WX849] 图片验证成功: 格式={img_format}, 大小={img_size}")
-                        except Exception as img_err:
-                            logger.error(f"[WX849] 图片验证失败，可能不是有效的图片文件: {img_err}")
-                            # 尝试修复图片文件
-                            try:
-                                # 读取文件内容
-                                with open(image_path, "rb") as f:
-                                    img_data = f.read()
-
-                                # 尝试查找JPEG文件头和尾部标记
-                                jpg_header = b'\xff\xd8'
-                                jpg_footer = b'\xff\xd9'
-
-                                if img_data.startswith(jpg_header) and img_data.endswith(jpg_footer):
-                                    logger.info(f"[WX849] 图片文件有效的JPEG头尾标记，但内部可能有损坏")
-                                else:
-                                    # 查找JPEG头部标记的位置
-                                    header_pos = img_data.find(jpg_header)
-                                    if header_pos >= 0:
-                                        # 查找JPEG尾部标记的位置
-                                        footer_pos = img_data.rfind(jpg_footer)
-                                        if footer_pos > header_pos:
-                                            # 提取有效的JPEG数据
-                                            valid_data = img_data[header_pos:footer_pos+2]
-                                            # 重写文件
-                                            with open(image_path, "wb") as f:
-                                                f.write(valid_data)
-                                            logger.info(f"[WX849] 尝试修复图片文件，提取了 {len(valid_data)} 字节的有效JPEG数据")
-                            except Exception as fix_err:
-                                logger.error(f"[WX849] 尝试修复图片文件失败: {fix_err}")
-                    except ImportError:
-                        logger.warning(f"[WX849] PIL库未安装，无法验证图片有效性")
-
-                    # 设置图片本地路径
-                    cmsg.image_path = image_path
-
-                    # 更新消息内容为图片路径，以便DOW框架处理
-                    cmsg.content = image_path
-
-                    # 确保消息类型为IMAGE
-                    cmsg.ctype = ContextType.IMAGE
-
-                    # 设置_prepared标志，表示图片已准备好
-                    cmsg._prepared = True
-
-                    # 图片已经在回调处理时发送到DOW框架，这里只记录日志
-                    logger.info(f"[WX849] 图片下载完成，保存到: {cmsg.image_path}")
-
-                    # 返回True表示下载成功
-                    return True
-                else:
-                    logger.error(f"[WX849] 图片文件不存在或为空: {image_path}")
-                    return False
-        except Exception as e:
-            logger.error(f"[WX849] 下载图片失败: {e}")
-            logger.error(f"[WX849] 详细错误: {traceback.format_exc()}")
+                    if img_data.startswith(jpg_header) and img_data.endswith(jpg_footer):
+                        logger.info(f"[WX849] 图片文件有效的JPEG头尾标记，但内部可能有损坏")
+                    else:
+                        # 查找JPEG头部标记的位置
+                        header_pos = img_data.find(jpg_header)
+                        if header_pos >= 0:
+                            # 查找JPEG尾部标记的位置
+                            footer_pos = img_data.rfind(jpg_footer)
+                            if footer_pos > header_pos:
+                                # 提取有效的JPEG数据
+                                valid_data = img_data[header_pos:footer_pos+2]
+                                # 重写文件
+                                with open(image_path, "wb") as f:
+                                    f.write(valid_data)
+                                logger.info(f"[WX849] 尝试修复图片文件，提取了 {len(valid_data)} 字节的有效JPEG数据")
+                except Exception as fix_err:
+                    logger.error(f"[WX849] 尝试修复图片文件失败: {fix_err}")
+        except ImportError:
+            logger.warning(f"[WX849] PIL库未安装，无法验证图片有效性")
 
     def _get_image(self, msg_id):
         """获取图片数据"""
@@ -2559,7 +1953,7 @@ class WX849Channel(ChatChannel):
         # 查找匹配的图片文件
         if os.path.exists(tmp_dir):
             for filename in os.listdir(tmp_dir):
-                if filename.startswith(f"img_{msg_id}_"):
+                if filename == f"img_{msg_id}.jpg" or filename.startswith(f"img_{msg_id}_"):
                     image_path = os.path.join(tmp_dir, filename)
                     try:
                         # 验证图片文件是否为有效的图片格式
@@ -3186,38 +2580,9 @@ class WX849Channel(ChatChannel):
 
         logger.info(f"收到系统消息: ID:{cmsg.msg_id} 来自:{cmsg.from_user_id} 发送人:{cmsg.sender_wxid} 内容:{cmsg.content}")
 
-    async def _call_api(self, endpoint, params):
-        """通用API调用方法，用于直接访问WechatAPI的端点"""
-        try:
-            import aiohttp
-
-            # 获取API配置
-            api_host = conf().get("wx849_api_host", "127.0.0.1")
-            api_port = conf().get("wx849_api_port", 9011)
-
-            # 确定API路径前缀
-            protocol_version = conf().get("wx849_protocol_version", "849")
-            if protocol_version == "855" or protocol_version == "ipad":
-                api_path_prefix = "/api"
-            else:
-                api_path_prefix = "/VXAPI"
-
-            # 构建完整的API URL
-            url = f"http://{api_host}:{api_port}{api_path_prefix}{endpoint}"
-
-            # 发送请求
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, json=params) as response:
-                    if response.status != 200:
-                        logger.error(f"[WX849] API请求失败: {url}, 状态码: {response.status}")
-                        return None
-
-                    # 解析响应
-                    result = await response.json()
-                    return result
-        except Exception as e:
-            logger.error(f"[WX849] API调用失败: {endpoint}, 错误: {e}")
-            return None
+    async def _call_api(self, endpoint, params, idempotent=False):
+        """通用API调用方法，用于直接访问WechatAPI的端点，查询类接口传idempotent=True允许失败重试"""
+        return await self.api.post(endpoint, params, idempotent=idempotent)
 
     async def _send_message(self, to_user_id, content, msg_type=1, at_list=None, context=None):
         """发送消息的异步方法"""
@@ -3284,7 +2649,7 @@ class WX849Channel(ChatChannel):
             logger.debug(f"[WX849] 发送消息参数 - 接收者: {to_user_id}, 机器人wxid: {self.wxid}, @列表: {at_param}")
 
             # 记录API调用参数
-            logger.debug(f"[WX849] 发送消息API参数: {json.dumps(params, ensure_ascii=False)}")
+            logger.debug("[WX849] 发送消息API参数: {}", lazy_json(params))
 
             # 使用自定义的API调用方法
             result = await self._call_api("/Msg/SendTxt", params)
@@ -3293,7 +2658,7 @@ class WX849Channel(ChatChannel):
             if result and isinstance(result, dict):
                 success = result.get("Success", False)
                 if success:
-                    logger.debug(f"[WX849] 发送消息API返回成功: {json.dumps(result, ensure_ascii=False)}")
+                    logger.debug("[WX849] 发送消息API返回成功: {}", lazy_json(result))
                 else:
                     error_msg = result.get("Message", "未知错误")
                     logger.error(f"[WX849] 发送消息API返回错误: {error_msg}")
@@ -3352,272 +2717,21 @@ class WX849Channel(ChatChannel):
             logger.error(f"[WX849] 发送图片失败: {e}")
             return None
 
-    def _process_message_independently(self, message_id: str, msg: dict):
-        """在独立线程中处理单条消息"""
+    async def _process_message_async(self, message_id: str, reply: Reply, context: Context, receiver: str, session_id: str):
+        """异步处理消息"""
         try:
-            # 创建新的事件循环
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-
             # 记录处理信息
-            thread_id = threading.get_ident()
-            logger.debug(f"[WX849] 独立消息处理线程 {thread_id} 开始处理 - 消息ID: {message_id}")
-
-            try:
-                # 构建标准的消息对象
-                is_group = False
-
-                # 判断是否是群消息
-                from_user_id = msg.get("fromUserName", msg.get("FromUserName", ""))
-                to_user_id = msg.get("toUserName", msg.get("ToUserName", ""))
-
-                if isinstance(from_user_id, dict) and "string" in from_user_id:
-                    from_user_id = from_user_id["string"]
-                if isinstance(to_user_id, dict) and "string" in to_user_id:
-                    to_user_id = to_user_id["string"]
-
-                if from_user_id and from_user_id.endswith("@chatroom"):
-                    is_group = True
-                elif to_user_id and to_user_id.endswith("@chatroom"):
-                    is_group = True
-                    # 交换发送者和接收者，确保from_user_id是群ID
-                    from_user_id, to_user_id = to_user_id, from_user_id
-
-                # 创建消息对象
-                cmsg = WX849Message(msg, is_group)
-
-                # 检查是否有发送者昵称信息，优先使用这个
-                if "SenderNickName" in msg and msg["SenderNickName"]:
-                    cmsg.sender_nickname = msg["SenderNickName"]
-                    logger.debug(f"[WX849] 使用回调中的发送者昵称: {cmsg.sender_nickname}")
-
-                # 处理被@消息
-                if is_group and "@" in str(msg.get("Content", "")):
-                    # 检查是否有@列表
-                    at_list = []
-
-                    # 方法1: 从RawLogLine中提取@列表
-                    raw_log_line = msg.get("RawLogLine", "")
+            logger.debug(f"[WX849] 异步处理消息 - ID: {message_id}, 接收者: {receiver}, 消息类型: {reply.type}")
 
-                    # 检查是否是被@消息
-                    if raw_log_line and "收到被@消息" in raw_log_line:
-                        logger.debug(f"[WX849] 检测到被@消息: {raw_log_line}")
-                        # 设置is_at标志
-                        cmsg.is_at = True
-                    # 检查是否有IsAtMessage标志
-                    elif "IsAtMessage" in msg and msg["IsAtMessage"]:
-                        logger.debug(f"[WX849] 检测到IsAtMessage标志")
-                        # 设置is_at标志
-                        cmsg.is_at = True
+            # 记录上下文信息，确保使用的是正确的上下文对象
+            logger.debug(f"[WX849] 消息 {message_id} 使用的上下文对象ID: {id(context)}")
+            logger.debug(f"[WX849] 上下文信息 - 接收者: {context.get('receiver')}, 会话ID: {context.get('session_id')}, 群组: {context.get('group_name', 'N/A')}")
 
-                        # 确保at_list中包含机器人wxid
-                        if not hasattr(cmsg, 'at_list'):
-                            cmsg.at_list = []
-                        if self.wxid not in cmsg.at_list:
-                            cmsg.at_list.append(self.wxid)
+            # 创建独立的上下文副本(写时复制)，避免共享引用
+            context = context.fork()
 
-                        # 尝试从日志行中提取@列表
-                        if "@:" in raw_log_line:
-                            try:
-                                at_part = raw_log_line.split("@:", 1)[1].split(" ", 1)[0]
-                                if at_part.startswith("[") and at_part.endswith("]"):
-                                    # 解析@列表
-                                    at_list_str = at_part[1:-1]  # 去除[]
-                                    if at_list_str:
-                                        at_items = at_list_str.split(",")
-                                        for item in at_items:
-                                            item = item.strip().strip("'\"")
-                                            if item:
-                                                at_list.append(item)
-                                        logger.debug(f"[WX849] 从被@消息中提取到@列表: {at_list}")
-                            except Exception as e:
-                                logger.debug(f"[WX849] 从被@消息中提取@列表失败: {e}")
-                    # 普通消息中的@列表提取
-                    elif raw_log_line and "@:" in raw_log_line:
-                        try:
-                            # 尝试从日志行中提取@列表
-                            at_part = raw_log_line.split("@:", 1)[1].split(" ", 1)[0]
-                            if at_part.startswith("[") and at_part.endswith("]"):
-                                # 解析@列表
-                                at_list_str = at_part[1:-1]  # 去除[]
-                                if at_list_str:
-                                    at_items = at_list_str.split(",")
-                                    for item in at_items:
-                                        item = item.strip().strip("'\"")
-                                        if item:
-                                            at_list.append(item)
-                                    logger.debug(f"[WX849] 从RawLogLine提取到@列表: {at_list}")
-                        except Exception as e:
-                            logger.debug(f"[WX849] 从RawLogLine提取@列表失败: {e}")
-
-                    # 方法2: 从MsgSource中提取@列表
-                    if not at_list and "MsgSource" in msg:
-                        try:
-                            msg_source = msg.get("MsgSource", "")
-                            if msg_source:
-                                root = ET.fromstring(msg_source)
-                                atuserlist_elem = root.find('atuserlist')
-                                if atuserlist_elem is not None and atuserlist_elem.text:
-                                    at_users = atuserlist_elem.text.split(",")
-                                    for user in at_users:
-                                        if user.strip():
-                                            at_list.append(user.strip())
-                                    logger.debug(f"[WX849] 从MsgSource提取到@列表: {at_list}")
-                        except Exception as e:
-                            logger.debug(f"[WX849] 从MsgSource提取@列表失败: {e}")
-
-                    # 设置@列表到消息对象
-                    if at_list:
-                        cmsg.at_list = at_list
-                        # 设置is_at标志
-                        cmsg.is_at = self.wxid in at_list
-                        logger.debug(f"[WX849] 设置@列表: {at_list}, is_at: {cmsg.is_at}")
-
-                # 处理消息
-                logger.debug(f"[WX849] 处理回调消息: ID:{cmsg.msg_id} 类型:{cmsg.msg_type}")
-
-                # 使用线程安全的方式检查和标记消息
-                with self.__class__._message_lock:
-                    # 检查消息是否已经处理过
-                    if cmsg.msg_id in self.received_msgs:
-                        logger.debug(f"[WX849] 消息 {cmsg.msg_id} 已处理过，忽略")
-                        return
-
-                    # 标记消息为已处理
-                    self.received_msgs[cmsg.msg_id] = True
-
-                # 检查消息时间是否过期
-                create_time = cmsg.create_time  # 消息时间戳
-                current_time = int(time.time())
-
-                # 设置超时时间为60秒
-                timeout = 60
-                if int(create_time) < current_time - timeout:
-                    logger.debug(f"[WX849] 历史消息 {cmsg.msg_id} 已跳过，时间差: {current_time - int(create_time)}秒")
-                    return
-
-                # 创建一个全新的消息对象，避免共享引用
-                new_msg = WX849Message(msg, is_group)
-
-                # 复制原始消息对象的属性
-                for attr_name in dir(cmsg):
-                    if not attr_name.startswith('_') and not callable(getattr(cmsg, attr_name)):
-                        try:
-                            setattr(new_msg, attr_name, getattr(cmsg, attr_name))
-                        except Exception:
-                            pass
-
-                # 设置正确的接收者和会话ID
-                if is_group:
-                    # 如果是群聊，接收者应该是群ID
-                    new_msg.to_user_id = from_user_id  # 群ID
-                    new_msg.session_id = from_user_id  # 使用群ID作为会话ID
-                    new_msg.other_user_id = from_user_id  # 群ID
-                    new_msg.is_group = True
-
-                    # 确保群聊消息的其他字段也是正确的
-                    new_msg.group_id = from_user_id
-
-                    # 清除可能从其他消息继承的私聊相关字段
-                    if hasattr(new_msg, 'other_user_nickname'):
-                        delattr(new_msg, 'other_user_nickname')
-                else:
-                    # 如果是私聊，接收者应该是发送者ID
-                    sender_wxid = msg.get("SenderWxid", "")
-                    if not sender_wxid:
-                        sender_wxid = from_user_id
-
-                    new_msg.to_user_id = sender_wxid
-                    new_msg.session_id = sender_wxid  # 使用发送者ID作为会话ID
-                    new_msg.other_user_id = sender_wxid
-                    new_msg.is_group = False
-
-                    # 清除可能从其他消息继承的群聊相关字段
-                    if hasattr(new_msg, 'group_name'):
-                        delattr(new_msg, 'group_name')
-                    if hasattr(new_msg, 'group_id'):
-                        delattr(new_msg, 'group_id')
-                    if hasattr(new_msg, 'is_at'):
-                        new_msg.is_at = False
-                    if hasattr(new_msg, 'at_list'):
-                        new_msg.at_list = []
-                    # 确保没有任何群聊相关的属性
-                    for attr_name in dir(new_msg):
-                        if not attr_name.startswith('_') and not callable(getattr(new_msg, attr_name)):
-                            if 'group' in attr_name.lower() or 'at' in attr_name.lower():
-                                try:
-                                    delattr(new_msg, attr_name)
-                                except Exception:
-                                    pass
-
-                # 使用新的消息对象替换原始消息对象
-                cmsg = new_msg
-
-                # 创建一个新的线程来处理消息，确保每个消息都有完全独立的处理环境
-                def process_message_in_new_thread():
-                    try:
-                        # 创建新的事件循环
-                        msg_loop = asyncio.new_event_loop()
-                        asyncio.set_event_loop(msg_loop)
-
-                        try:
-                            # 调用原有的消息处理逻辑
-                            if is_group:
-                                self.handle_group(cmsg)
-                            else:
-                                self.handle_single(cmsg)
-                        finally:
-                            # 关闭事件循环
-                            msg_loop.close()
-                    except Exception as e:
-                        logger.error(f"[WX849] 消息处理线程执行异常: {e}")
-                        logger.error(traceback.format_exc())
-
-                # 启动新线程处理消息
-                msg_thread = threading.Thread(target=process_message_in_new_thread)
-                msg_thread.daemon = True
-                msg_thread.start()
-
-                # 等待消息处理线程完成
-                msg_thread.join()
-            finally:
-                # 关闭事件循环
-                loop.close()
-
-            logger.debug(f"[WX849] 独立消息处理线程 {thread_id} 处理完成 - 消息ID: {message_id}")
-        except Exception as e:
-            logger.error(f"[WX849] 独立消息处理线程 {thread_id} 执行异常: {e}")
-            logger.error(traceback.format_exc())
-
-    async def _process_message_async(self, message_id: str, reply: Reply, context: Context, receiver: str, session_id: str):
-        """异步处理消息"""
-        try:
-            # 记录处理信息
-            logger.debug(f"[WX849] 异步处理消息 - ID: {message_id}, 接收者: {receiver}, 消息类型: {reply.type}")
-
-            # 记录上下文信息，确保使用的是正确的上下文对象
-            logger.debug(f"[WX849] 消息 {message_id} 使用的上下文对象ID: {id(context)}")
-            logger.debug(f"[WX849] 上下文信息 - 接收者: {context.get('receiver')}, 会话ID: {context.get('session_id')}, 群组: {context.get('group_name', 'N/A')}")
-
-            # 创建一个全新的上下文对象，避免共享引用
-            new_context = Context(context.type, context.content)
-
-            # 复制原始上下文对象的属性
-            # Context 对象没有 items() 方法，需要从 kwargs 中复制
-            for key in context.kwargs:
-                # 对于复杂对象，创建深拷贝
-                if isinstance(context.kwargs[key], dict):
-                    new_context[key] = context.kwargs[key].copy()
-                elif isinstance(context.kwargs[key], list):
-                    new_context[key] = context.kwargs[key].copy()
-                else:
-                    new_context[key] = context.kwargs[key]
-
-            # 使用新的上下文对象替换原始上下文对象
-            context = new_context
-
-            # 检查是否是群聊消息
-            is_group = context.get("isgroup", False) or context.get("is_group", False)
+            # 检查是否是群聊消息
+            is_group = context.get("isgroup", False) or context.get("is_group", False)
 
             # 如果是群聊消息，确保接收者是群ID
             if is_group:
@@ -3730,18 +2844,17 @@ class WX849Channel(ChatChannel):
                     tmp_path = os.path.join(get_appdata_dir(), f"tmp_img_{int(time.time())}.jpg")
                     # 如果是图片URL，先下载图片
                     if reply.type == ReplyType.IMAGE_URL:
-                        # 使用aiohttp异步下载图片
-                        async with aiohttp.ClientSession() as session:
-                            async with session.get(image_path) as response:
-                                if response.status != 200:
-                                    logger.error(f"[WX849] 下载图片失败, 状态码: {response.status}")
-                                    return
-
-                                # 创建临时文件保存图片
-                                with open(tmp_path, 'wb') as f:
-                                    f.write(await response.read())
-                                # 使用下载后的本地文件路径
-                                image_path = tmp_path
+                        # 使用共享的HTTP会话下载图片
+                        image_data = await self.api.download(image_path)
+                        if image_data is None:
+                            logger.error(f"[WX849] 下载图片失败: {image_path}")
+                            return
+
+                        # 创建临时文件保存图片
+                        with open(tmp_path, 'wb') as f:
+                            f.write(image_data)
+                        # 使用下载后的本地文件路径
+                        image_path = tmp_path
                     if reply.type == ReplyType.IMAGE:
                         if isinstance(reply.content, io.BytesIO):
                             image_io: BytesIO = image_path
@@ -3804,17 +2917,11 @@ class WX849Channel(ChatChannel):
                 voice_url = reply.content
                 logger.debug(f"[WX849] 开始下载语音, url={voice_url}")
                 try:
-                    # 使用aiohttp异步下载语音
-                    async with aiohttp.ClientSession() as session:
-                        async with session.get(voice_url) as response:
-                            if response.status != 200:
-                                logger.error(f"[WX849] 下载语音失败, 状态码: {response.status}")
-                                return
-
-                            # 创建临时文件保存语音
-                            tmp_path = os.path.join(get_appdata_dir(), f"tmp_voice_{int(time.time())}.mp3")
-                            with open(tmp_path, 'wb') as f:
-                                f.write(await response.read())
+                    # 使用共享的HTTP会话流式下载语音到临时文件
+                    tmp_path = os.path.join(get_appdata_dir(), f"tmp_voice_{int(time.time())}.mp3")
+                    if await self.api.download_to_file(voice_url, tmp_path) is None:
+                        logger.error(f"[WX849] 下载语音失败: {voice_url}")
+                        return
 
                     # 使用统一的语音发送方法，会自动处理短语音和长语音的分割 - 直接使用异步调用
                     result = await self._send_voice(receiver, tmp_path)
@@ -3847,23 +2954,8 @@ class WX849Channel(ChatChannel):
         # 创建线程本地存储，确保每个线程都有自己的独立状态
         thread_local = threading.local()
 
-        # 创建上下文的深拷贝，确保完全独立
-        # 由于Context对象没有copy方法，我们需要手动创建一个新的Context对象
-        thread_local.context = Context(
-            type=context.type,
-            content=context.content,
-            kwargs={}  # 创建空字典，然后手动复制
-        )
-
-        # 手动复制 kwargs 字典中的内容
-        for key in context.kwargs:
-            # 对于复杂对象，创建深拷贝
-            if isinstance(context.kwargs[key], dict):
-                thread_local.context.kwargs[key] = context.kwargs[key].copy()
-            elif isinstance(context.kwargs[key], list):
-                thread_local.context.kwargs[key] = context.kwargs[key].copy()
-            else:
-                thread_local.context.kwargs[key] = context.kwargs[key]
+        # 创建独立的上下文副本(写时复制)，确保发送流程的修改不影响原上下文
+        thread_local.context = context.fork()
 
         # 创建回复的深拷贝，确保完全独立
         thread_local.reply = Reply(
@@ -3994,49 +3086,18 @@ class WX849Channel(ChatChannel):
             msg_dict["Type"] = 43  # 视频消息
             msg_dict["Content"] = thread_local.reply.content  # 视频URL
 
-        # 创建一个完全独立的处理流程
-        # 每个消息都有自己的线程、事件循环和上下文对象
-
-        # 创建一个副本，避免线程本地存储的问题
-        message_id = thread_local.message_id
-        reply_copy = thread_local.reply
-        context_copy = thread_local.context
-        receiver_copy = thread_local.receiver
-        session_id_copy = thread_local.session_id
-
-        def process_message_in_isolated_environment():
-            try:
-                # 创建新的事件循环
-                isolated_loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(isolated_loop)
-
-                try:
-                    # 调用独立处理函数
-                    isolated_loop.run_until_complete(
-                        self._process_message_async(
-                            message_id,
-                            reply_copy,
-                            context_copy,
-                            receiver_copy,
-                            session_id_copy
-                        )
-                    )
-                finally:
-                    # 关闭事件循环
-                    isolated_loop.close()
-            except Exception as e:
-                logger.error(f"[WX849] 独立处理环境执行异常: {e}")
-                logger.error(traceback.format_exc())
-
-        # 启动独立线程处理消息
-        process = threading.Thread(
-            target=process_message_in_isolated_environment,
-            daemon=True  # 设置为守护线程，主线程退出时自动结束
+        # 在通道事件循环中发送，不等待发送完成
+        self.dispatcher.run_coroutine(
+            self._process_message_async(
+                thread_local.message_id,
+                thread_local.reply,
+                thread_local.context,
+                thread_local.receiver,
+                thread_local.session_id,
+            )
         )
-        process.start()
 
-        # 不等待处理完成，立即返回
-        logger.debug(f"[WX849] 已启动独立处理流程 - 消息ID: {thread_local.message_id}, 接收者: {thread_local.receiver}, 消息类型: {thread_local.reply.type}")
+        logger.debug(f"[WX849] 已提交发送 - 消息ID: {thread_local.message_id}, 接收者: {thread_local.receiver}, 消息类型: {thread_local.reply.type}")
 
     async def _download_and_send_video(self, to_user_id, video_url):
         """下载视频并发送"""
@@ -4061,24 +3122,15 @@ class WX849Channel(ChatChannel):
 
             # 下载视频，设置30秒超时
             try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(video_url, headers=headers, timeout=30) as response:
-                        if response.status != 200:
-                            logger.error(f"[WX849] 下载视频失败, 状态码: {response.status}")
-                            return False
-
-                        # 检查内容类型
-                        content_type = response.headers.get('Content-Type', '')
-                        if 'video' not in content_type and 'octet-stream' not in content_type:
-                            logger.warning(f"[WX849] 警告: 响应内容类型不是视频: {content_type}")
+                # 使用共享的HTTP会话流式下载
+                content_type = await self.api.download_to_file(video_url, tmp_path, headers=headers, timeout=30)
+                if content_type is None:
+                    logger.error(f"[WX849] 下载视频失败: {video_url}")
+                    return False
 
-                        # 使用流式下载
-                        with open(tmp_path, 'wb') as f:
-                            while True:
-                                chunk = await response.content.read(8192)  # 8KB块
-                                if not chunk:
-                                    break
-                                f.write(chunk)
+                # 检查内容类型
+                if 'video' not in content_type and 'octet-stream' not in content_type:
+                    logger.warning(f"[WX849] 警告: 响应内容类型不是视频: {content_type}")
 
                 # 检查下载的文件
                 if not os.path.exists(tmp_path) or os.path.getsize(tmp_path) < 1024:  # 小于1KB
@@ -4300,20 +3352,6 @@ class WX849Channel(ChatChannel):
                 # 最大语音片段时长（毫秒）
                 max_segment_duration = 20 * 1000  # 20秒，确保更可靠的发送
 
-                # 获取API配置
-                api_host = conf().get("wx849_api_host", "127.0.0.1")
-                api_port = conf().get("wx849_api_port", 9011)
-                protocol_version = conf().get("wx849_protocol_version", "849")
-
-                # 确定API路径前缀
-                if protocol_version == "855" or protocol_version == "ipad":
-                    api_path_prefix = "/api"
-                else:
-                    api_path_prefix = "/VXAPI"
-
-                # 注意：之前这里强制使用/VXAPI前缀，现在根据协议版本动态选择
-                logger.debug(f"[WX849] 语音消息使用API路径前缀: {api_path_prefix} (适用于{protocol_version}协议)")
-
                 # 如果语音时长超过最大片段时长，将其分割成多个片段发送
                 if total_duration > max_segment_duration:
                     logger.info(f"[WX849] 语音时长超过20秒 ({total_duration/1000:.1f}秒)，将分割成多个片段发送")
@@ -4362,19 +3400,16 @@ class WX849Channel(ChatChannel):
 
                     # 发送文本消息通知语音长度
                     try:
-                        async with aiohttp.ClientSession() as session:
-                            text_url = f"http://{api_host}:{api_port}{api_path_prefix}/Msg/SendTxt"
-                            text_params = {
-                                "Wxid": self.wxid,
-                                "ToWxid": to_user_id,
-                                "Content": f"长语音消息 (总长{total_duration/1000:.1f}秒)，将分 {segments_count} 段发送..."
-                            }
+                        text_params = {
+                        "Wxid": self.wxid,
+                        "ToWxid": to_user_id,
+                        "Content": f"长语音消息 (总长{total_duration/1000:.1f}秒)，将分 {segments_count} 段发送..."
+                        }
 
-                            # 发送文本提示
-                            async with session.post(text_url, json=text_params, timeout=60) as text_response:
-                                text_json_resp = await text_response.json()
-                                if text_json_resp and text_json_resp.get("Success", False):
-                                    logger.info(f"[WX849] 发送语音分段通知成功")
+                        # 发送文本提示
+                        text_json_resp = await self.api.post("/Msg/SendTxt", json=text_params, timeout=60)
+                        if text_json_resp and text_json_resp.get("Success", False):
+                            logger.info(f"[WX849] 发送语音分段通知成功")
                     except Exception as e:
                         logger.error(f"[WX849] 发送语音分段通知失败: {e}")
 
@@ -4396,7 +3431,6 @@ class WX849Channel(ChatChannel):
                             segment_base64 = base64.b64encode(segment_silk_data).decode('utf-8')
 
                             # 准备API请求
-                            api_url = f"http://{api_host}:{api_port}{api_path_prefix}/Msg/SendVoice"
                             params = {
                                 "Wxid": self.wxid,
                                 "ToWxid": to_user_id,
@@ -4408,42 +3442,37 @@ class WX849Channel(ChatChannel):
                             # 记录日志，隐藏base64数据
                             debug_params = params.copy()
                             debug_params["Base64"] = f"[Base64 data, length: {len(segment_base64)}]"
-                            logger.debug(f"[WX849] 语音片段 {i+1}/{segments_count} API参数: {json.dumps(debug_params, ensure_ascii=False)}")
+                            logger.debug("[WX849] 语音片段 {}/{} API参数: {}", i + 1, segments_count, lazy_json(debug_params))
 
                             # 发送语音片段
-                            async with aiohttp.ClientSession() as session:
-                                async with session.post(api_url, json=params, timeout=60) as response:
-                                    json_resp = await response.json()
+                            json_resp = await self.api.post("/Msg/SendVoice", json=params, timeout=60)
 
-                                    # 检查响应
-                                    if json_resp and json_resp.get("Success", False):
-                                        logger.info(f"[WX849] 语音片段 {i+1}/{segments_count} 发送成功")
-                                        success_count += 1
+                            # 检查响应
+                            if json_resp and json_resp.get("Success", False):
+                                logger.info(f"[WX849] 语音片段 {i+1}/{segments_count} 发送成功")
+                                success_count += 1
 
-                                        # 添加延迟，避免发送过快导致的问题
-                                        await asyncio.sleep(1.0)  # 增加延迟到1秒
-                                    else:
-                                        error_msg = json_resp.get("Message", "未知错误")
-                                        logger.error(f"[WX849] 语音片段 {i+1}/{segments_count} API返回错误: {error_msg}")
+                                # 添加延迟，避免发送过快导致的问题
+                                await asyncio.sleep(1.0)  # 增加延迟到1秒
+                            else:
+                                error_msg = json_resp.get("Message", "未知错误") if json_resp else "接口无响应"
+                                logger.error(f"[WX849] 语音片段 {i+1}/{segments_count} API返回错误: {error_msg}")
                         except Exception as e:
                             logger.error(f"[WX849] 发送语音片段 {i+1}/{segments_count} 失败: {e}")
                             logger.error(traceback.format_exc())
 
                     # 发送完成通知
                     try:
-                        async with aiohttp.ClientSession() as session:
-                            text_url = f"http://{api_host}:{api_port}{api_path_prefix}/Msg/SendTxt"
-                            text_params = {
-                                "Wxid": self.wxid,
-                                "ToWxid": to_user_id,
-                                "Content": f"长语音发送完成，成功 {success_count}/{segments_count} 段"
-                            }
+                        text_params = {
+                        "Wxid": self.wxid,
+                        "ToWxid": to_user_id,
+                        "Content": f"长语音发送完成，成功 {success_count}/{segments_count} 段"
+                        }
 
-                            # 发送文本提示
-                            async with session.post(text_url, json=text_params, timeout=60) as text_response:
-                                text_json_resp = await text_response.json()
-                                if text_json_resp and text_json_resp.get("Success", False):
-                                    logger.info(f"[WX849] 发送语音完成通知成功")
+                        # 发送文本提示
+                        text_json_resp = await self.api.post("/Msg/SendTxt", json=text_params, timeout=60)
+                        if text_json_resp and text_json_resp.get("Success", False):
+                            logger.info(f"[WX849] 发送语音完成通知成功")
                     except Exception as e:
                         logger.error(f"[WX849] 发送语音完成通知失败: {e}")
 
@@ -4475,7 +3504,6 @@ class WX849Channel(ChatChannel):
                     silk_data = await pysilk.async_encode(audio.raw_data, sample_rate=audio.frame_rate)
                     voice_base64 = base64.b64encode(silk_data).decode('utf-8')
 
-                    api_url = f"http://{api_host}:{api_port}{api_path_prefix}/Msg/SendVoice"
                     params = {
                         "Wxid": self.wxid,
                         "ToWxid": to_user_id,
@@ -4487,22 +3515,20 @@ class WX849Channel(ChatChannel):
                     # 记录日志，隐藏base64数据
                     debug_params = params.copy()
                     debug_params["Base64"] = f"[Base64 data, length: {len(voice_base64)}]"
-                    logger.debug(f"[WX849] 语音API参数: {json.dumps(debug_params, ensure_ascii=False)}")
+                    logger.debug("[WX849] 语音API参数: {}", lazy_json(debug_params))
 
                     # 发送请求
-                    async with aiohttp.ClientSession() as session:
-                        async with session.post(api_url, json=params, timeout=60) as response:
-                            json_resp = await response.json()
+                    json_resp = await self.api.post("/Msg/SendVoice", json=params, timeout=60)
 
-                            # 检查响应
-                            if json_resp and json_resp.get("Success", False):
-                                logger.info(f"[WX849] 语音发送成功")
-                                result = {"Success": True}
-                            else:
-                                error_msg = json_resp.get("Message", "未知错误")
-                                logger.error(f"[WX849] 语音API返回错误: {error_msg}")
-                                logger.error(f"[WX849] 响应详情: {json.dumps(json_resp, ensure_ascii=False)}")
-                                result = None
+                    # 检查响应
+                    if json_resp and json_resp.get("Success", False):
+                        logger.info(f"[WX849] 语音发送成功")
+                        result = {"Success": True}
+                    else:
+                        error_msg = json_resp.get("Message", "未知错误") if json_resp else "接口无响应"
+                        logger.error(f"[WX849] 语音API返回错误: {error_msg}")
+                        logger.error(f"[WX849] 响应详情: {json.dumps(json_resp, ensure_ascii=False)}")
+                        result = None
             except Exception as e:
                 logger.error(f"[WX849] 处理音频数据失败: {e}")
                 logger.error(traceback.format_exc())
@@ -4588,475 +3614,33 @@ class WX849Channel(ChatChannel):
                 "PlayLength": video_duration  # 这是必需的参数，缺少会导致[Key:]数据不存在错误
             }
 
-            # 获取API配置
-            api_host = conf().get("wx849_api_host", "127.0.0.1")
-            api_port = conf().get("wx849_api_port", 9011)
-
-            # 确定API路径前缀
-            protocol_version = conf().get("wx849_protocol_version", "849")
-            if protocol_version == "855" or protocol_version == "ipad":
-                api_path_prefix = "/api"
-            else:
-                api_path_prefix = "/VXAPI"
-
             # 构建完整API URL
-            url = f"http://{api_host}:{api_port}{api_path_prefix}/Msg/SendVideo"
+            url = self.api.url("/Msg/SendVideo")
 
             logger.debug(f"[WX849] 直接调用SendVideo API: {url}")
 
             # 发送请求
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, json=params) as response:
-                    json_resp = await response.json()
+            json_resp = await self.api.post("/Msg/SendVideo", json=params)
 
-                    # 检查响应
-                    if json_resp and json_resp.get("Success", False):
-                        data = json_resp.get("Data", {})
-                        client_msg_id = data.get("clientMsgId")
-                        new_msg_id = data.get("newMsgId")
+            # 检查响应
+            if json_resp and json_resp.get("Success", False):
+                data = json_resp.get("Data", {})
+                client_msg_id = data.get("clientMsgId")
+                new_msg_id = data.get("newMsgId")
 
-                        logger.info(f"[WX849] 视频发送成功，返回ID: {client_msg_id}, {new_msg_id}")
-                        return {"Success": True, "client_msg_id": client_msg_id, "new_msg_id": new_msg_id}
-                    else:
-                        error_msg = json_resp.get("Message", "未知错误")
-                        logger.error(f"[WX849] 视频API返回错误: {error_msg}")
-                        logger.error(f"[WX849] 响应详情: {json.dumps(json_resp, ensure_ascii=False)}")
-                        return None
+                logger.info(f"[WX849] 视频发送成功，返回ID: {client_msg_id}, {new_msg_id}")
+                return {"Success": True, "client_msg_id": client_msg_id, "new_msg_id": new_msg_id}
+            else:
+                error_msg = json_resp.get("Message", "未知错误") if json_resp else "接口无响应"
+                logger.error(f"[WX849] 视频API返回错误: {error_msg}")
+                logger.error(f"[WX849] 响应详情: {json.dumps(json_resp, ensure_ascii=False)}")
+                return None
 
         except Exception as e:
             logger.error(f"[WX849] 发送视频失败: {e}")
             logger.error(traceback.format_exc())
             return None
 
-    async def _get_group_member_details(self, group_id):
-        """获取群成员详情"""
-        try:
-            logger.debug(f"[WX849] 尝试获取群 {group_id} 的成员详情")
-
-            # 检查是否已存在群成员信息，并检查是否需要更新
-            # 定义群聊信息文件路径
-            tmp_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "tmp")
-            if not os.path.exists(tmp_dir):
-                os.makedirs(tmp_dir)
-
-            chatrooms_file = os.path.join(tmp_dir, 'wx849_rooms.json')
-
-            # 读取现有的群聊信息（如果存在）
-            chatrooms_info = {}
-            if os.path.exists(chatrooms_file):
-                try:
-                    with open(chatrooms_file, 'r', encoding='utf-8') as f:
-                        chatrooms_info = json.load(f)
-                    logger.debug(f"[WX849] 已加载 {len(chatrooms_info)} 个现有群聊信息")
-                except Exception as e:
-                    logger.error(f"[WX849] 加载现有群聊信息失败: {str(e)}")
-
-            # 检查该群聊是否已存在且成员信息是否已更新
-            # 设定缓存有效期为24小时(86400秒)
-            cache_expiry = 86400
-            current_time = int(time.time())
-
-            if (group_id in chatrooms_info and
-                "members" in chatrooms_info[group_id] and
-                len(chatrooms_info[group_id]["members"]) > 0 and
-                "last_update" in chatrooms_info[group_id] and
-                current_time - chatrooms_info[group_id]["last_update"] < cache_expiry):
-                logger.debug(f"[WX849] 群 {group_id} 成员信息已存在且未过期，跳过更新")
-                return chatrooms_info[group_id]
-
-            logger.debug(f"[WX849] 群 {group_id} 成员信息不存在或已过期，开始更新")
-
-            # 调用API获取群成员详情
-            params = {
-                "QID": group_id,  # 群ID参数
-                "Wxid": self.wxid  # 自己的wxid参数
-            }
-
-            try:
-                # 获取API配置
-                api_host = conf().get("wx849_api_host", "127.0.0.1")
-                api_port = conf().get("wx849_api_port", 9011)
-                protocol_version = conf().get("wx849_protocol_version", "849")
-
-                # 确定API路径前缀
-                if protocol_version == "855" or protocol_version == "ipad":
-                    api_path_prefix = "/api"
-                else:
-                    api_path_prefix = "/VXAPI"
-
-                # 构建完整的API URL用于日志
-                api_url = f"http://{api_host}:{api_port}{api_path_prefix}/Group/GetChatRoomMemberDetail"
-                logger.debug(f"[WX849] 正在请求群成员详情API: {api_url}")
-                logger.debug(f"[WX849] 请求参数: {json.dumps(params, ensure_ascii=False)}")
-
-                # 调用API获取群成员详情
-                response = await self._call_api("/Group/GetChatRoomMemberDetail", params)
-
-                if not response or not isinstance(response, dict):
-                    logger.error(f"[WX849] 获取群成员详情失败: 无效响应")
-                    return None
-
-                # 检查响应是否成功
-                if not response.get("Success", False):
-                    logger.error(f"[WX849] 获取群成员详情失败: {response.get('Message', '未知错误')}")
-                    return None
-
-                # 提取NewChatroomData
-                data = response.get("Data", {})
-                new_chatroom_data = data.get("NewChatroomData", {})
-
-                if not new_chatroom_data:
-                    logger.error(f"[WX849] 获取群成员详情失败: 响应中无NewChatroomData")
-                    return None
-
-                # 检查当前群聊是否已存在
-                if group_id not in chatrooms_info:
-                    chatrooms_info[group_id] = {
-                        "chatroomId": group_id,
-                        "nickName": group_id,
-                        "chatRoomOwner": "",
-                        "members": [],
-                        "last_update": int(time.time())
-                    }
-
-                # 提取成员信息
-                member_count = new_chatroom_data.get("MemberCount", 0)
-                chat_room_members = new_chatroom_data.get("ChatRoomMember", [])
-
-                # 确保是有效的成员列表
-                if not isinstance(chat_room_members, list):
-                    logger.error(f"[WX849] 获取群成员详情失败: ChatRoomMember不是有效的列表")
-                    return None
-
-                # 更新群聊成员信息
-                members = []
-                for member in chat_room_members:
-                    if not isinstance(member, dict):
-                        continue
-
-                    # 提取成员必要信息
-                    member_info = {
-                        "UserName": member.get("UserName", ""),
-                        "NickName": member.get("NickName", ""),
-                        "DisplayName": member.get("DisplayName", ""),
-                        "ChatroomMemberFlag": member.get("ChatroomMemberFlag", 0),
-                        "InviterUserName": member.get("InviterUserName", ""),
-                        "BigHeadImgUrl": member.get("BigHeadImgUrl", ""),
-                        "SmallHeadImgUrl": member.get("SmallHeadImgUrl", "")
-                    }
-
-                    members.append(member_info)
-
-                # 更新群聊信息
-                chatrooms_info[group_id]["members"] = members
-                chatrooms_info[group_id]["last_update"] = int(time.time())
-                chatrooms_info[group_id]["memberCount"] = member_count
-
-                # 同时更新群主信息
-                for member in members:
-                    if member.get("ChatroomMemberFlag") == 2049:  # 群主标志
-                        chatrooms_info[group_id]["chatRoomOwner"] = member.get("UserName", "")
-                        break
-
-                # 保存到文件
-                with open(chatrooms_file, 'w', encoding='utf-8') as f:
-                    json.dump(chatrooms_info, f, ensure_ascii=False, indent=2)
-
-                logger.info(f"[WX849] 已更新群聊 {group_id} 成员信息，成员数: {len(members)}")
-
-                # 返回成员信息
-                return new_chatroom_data
-            except Exception as e:
-                logger.error(f"[WX849] 获取群成员详情失败: {e}")
-                logger.error(f"[WX849] 详细错误: {traceback.format_exc()}")
-                return None
-        except Exception as e:
-            logger.error(f"[WX849] 获取群成员详情过程中出错: {e}")
-            logger.error(f"[WX849] 详细错误: {traceback.format_exc()}")
-            return None
-
-    async def _get_group_name(self, group_id):
-        """获取群名称"""
-        try:
-            logger.debug(f"[WX849] 尝试获取群 {group_id} 的名称")
-
-            # 检查缓存中是否有群名
-            cache_key = f"group_name_{group_id}"
-            if hasattr(self, "group_name_cache") and cache_key in self.group_name_cache:
-                cached_name = self.group_name_cache[cache_key]
-                logger.debug(f"[WX849] 从缓存中获取群名: {cached_name}")
-
-                # 检查是否需要更新群成员详情
-                tmp_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "tmp")
-                chatrooms_file = os.path.join(tmp_dir, 'wx849_rooms.json')
-
-                need_update = True
-                # 设定缓存有效期为24小时(86400秒)
-                cache_expiry = 86400
-                current_time = int(time.time())
-
-                if os.path.exists(chatrooms_file):
-                    try:
-                        with open(chatrooms_file, 'r', encoding='utf-8') as f:
-                            chatrooms_info = json.load(f)
-
-                        # 检查群信息是否存在且未过期
-                        if (group_id in chatrooms_info and
-                            "last_update" in chatrooms_info[group_id] and
-                            current_time - chatrooms_info[group_id]["last_update"] < cache_expiry and
-                            "members" in chatrooms_info[group_id] and
-                            len(chatrooms_info[group_id]["members"]) > 0):
-                            logger.debug(f"[WX849] 群 {group_id} 信息已存在且未过期，跳过更新")
-                            need_update = False
-                    except Exception as e:
-                        logger.error(f"[WX849] 检查群信息缓存时出错: {e}")
-
-                # 只有需要更新时才启动线程获取群成员详情
-                if need_update:
-                    logger.debug(f"[WX849] 群 {group_id} 信息需要更新，启动更新线程")
-                    threading.Thread(target=lambda: asyncio.run(self._get_group_member_details(group_id))).start()
-
-                return cached_name
-
-            # 检查文件中是否已经有群信息，且未过期
-            tmp_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "tmp")
-            if not os.path.exists(tmp_dir):
-                os.makedirs(tmp_dir)
-
-            chatrooms_file = os.path.join(tmp_dir, 'wx849_rooms.json')
-
-            # 设定缓存有效期为24小时(86400秒)
-            cache_expiry = 86400
-            current_time = int(time.time())
-
-            if os.path.exists(chatrooms_file):
-                try:
-                    with open(chatrooms_file, 'r', encoding='utf-8') as f:
-                        chatrooms_info = json.load(f)
-
-                    # 检查群信息是否存在且未过期
-                    if (group_id in chatrooms_info and
-                        "nickName" in chatrooms_info[group_id] and
-                        chatrooms_info[group_id]["nickName"] and
-                        chatrooms_info[group_id]["nickName"] != group_id and
-                        "last_update" in chatrooms_info[group_id] and
-                        current_time - chatrooms_info[group_id]["last_update"] < cache_expiry):
-
-                        # 从文件中获取群名
-                        group_name = chatrooms_info[group_id]["nickName"]
-                        logger.debug(f"[WX849] 从文件缓存中获取群名: {group_name}")
-
-                        # 缓存群名
-                        if not hasattr(self, "group_name_cache"):
-                            self.group_name_cache = {}
-                        self.group_name_cache[cache_key] = group_name
-
-                        # 检查是否需要更新群成员详情
-                        need_update_members = not ("members" in chatrooms_info[group_id] and
-                                                len(chatrooms_info[group_id]["members"]) > 0)
-
-                        if need_update_members:
-                            logger.debug(f"[WX849] 群 {group_id} 名称已缓存，但需要更新成员信息")
-                            threading.Thread(target=lambda: asyncio.run(self._get_group_member_details(group_id))).start()
-                        else:
-                            logger.debug(f"[WX849] 群 {group_id} 信息已完整且未过期，无需更新")
-
-                        return group_name
-                except Exception as e:
-                    logger.error(f"[WX849] 从文件获取群名出错: {e}")
-
-            logger.debug(f"[WX849] 群 {group_id} 信息不存在或已过期，需要从API获取")
-
-            # 调用API获取群信息 - 使用群聊API
-            params = {
-                "QID": group_id,  # 群ID参数，正确的参数名是QID
-                "Wxid": self.wxid  # 自己的wxid参数
-            }
-
-            try:
-                # 获取API配置
-                api_host = conf().get("wx849_api_host", "127.0.0.1")
-                api_port = conf().get("wx849_api_port", 9011)
-                protocol_version = conf().get("wx849_protocol_version", "849")
-
-                # 确定API路径前缀
-                if protocol_version == "855" or protocol_version == "ipad":
-                    api_path_prefix = "/api"
-                else:
-                    api_path_prefix = "/VXAPI"
-
-                # 构建完整的API URL用于日志
-                api_url = f"http://{api_host}:{api_port}{api_path_prefix}/Group/GetChatRoomInfo"
-                logger.debug(f"[WX849] 正在请求群信息API: {api_url}")
-                logger.debug(f"[WX849] 请求参数: {json.dumps(params, ensure_ascii=False)}")  # 记录请求参数
-
-                # 尝试使用群聊专用API
-                group_info = await self._call_api("/Group/GetChatRoomInfo", params)
-
-                # 保存群聊详情到统一的JSON文件
-                try:
-                    # 读取现有的群聊信息（如果存在）
-                    chatrooms_info = {}
-                    if os.path.exists(chatrooms_file):
-                        try:
-                            with open(chatrooms_file, 'r', encoding='utf-8') as f:
-                                chatrooms_info = json.load(f)
-                            logger.debug(f"[WX849] 已加载 {len(chatrooms_info)} 个现有群聊信息")
-                        except Exception as e:
-                            logger.error(f"[WX849] 加载现有群聊信息失败: {str(e)}")
-
-                    # 提取必要的群聊信息
-                    if group_info and isinstance(group_info, dict):
-                        # 递归函数用于查找特定key的值
-                        def find_value(obj, key):
-                            # 如果是字典
-                            if isinstance(obj, dict):
-                                # 直接检查当前字典
-                                if key in obj:
-                                    return obj[key]
-                                # 检查带有"string"嵌套的字典
-                                if key in obj and isinstance(obj[key], dict) and "string" in obj[key]:
-                                    return obj[key]["string"]
-                                # 递归检查字典的所有值
-                                for k, v in obj.items():
-                                    result = find_value(v, key)
-                                    if result is not None:
-                                        return result
-                            # 如果是列表
-                            elif isinstance(obj, list):
-                                # 递归检查列表的所有项
-                                for item in obj:
-                                    result = find_value(item, key)
-                                    if result is not None:
-                                        return result
-                            return None
-
-                        # 尝试提取群名称及其他信息
-                        group_name = None
-
-                        # 首先尝试从NickName中获取
-                        nickname_obj = find_value(group_info, "NickName")
-                        if isinstance(nickname_obj, dict) and "string" in nickname_obj:
-                            group_name = nickname_obj["string"]
-                        elif isinstance(nickname_obj, str):
-                            group_name = nickname_obj
-
-                        # 如果没找到，尝试其他可能的字段
-                        if not group_name:
-                            for name_key in ["ChatRoomName", "nickname", "name", "DisplayName"]:
-                                name_value = find_value(group_info, name_key)
-                                if name_value:
-                                    if isinstance(name_value, dict) and "string" in name_value:
-                                        group_name = name_value["string"]
-                                    elif isinstance(name_value, str):
-                                        group_name = name_value
-                                    if group_name:
-                                        break
-
-                        # 提取群主ID
-                        owner_id = None
-                        for owner_key in ["ChatRoomOwner", "chatroomowner", "Owner"]:
-                            owner_value = find_value(group_info, owner_key)
-                            if owner_value:
-                                if isinstance(owner_value, dict) and "string" in owner_value:
-                                    owner_id = owner_value["string"]
-                                elif isinstance(owner_value, str):
-                                    owner_id = owner_value
-                                if owner_id:
-                                    break
-
-                        # 检查群聊信息是否已存在
-                        if group_id in chatrooms_info:
-                            # 更新已有群聊信息
-                            if group_name:
-                                chatrooms_info[group_id]["nickName"] = group_name
-                            if owner_id:
-                                chatrooms_info[group_id]["chatRoomOwner"] = owner_id
-                            chatrooms_info[group_id]["last_update"] = int(time.time())
-                        else:
-                            # 创建新群聊信息
-                            chatrooms_info[group_id] = {
-                                "chatroomId": group_id,
-                                "nickName": group_name or group_id,
-                                "chatRoomOwner": owner_id or "",
-                                "members": [],
-                                "last_update": int(time.time())
-                            }
-
-                        # 保存到文件
-                        with open(chatrooms_file, 'w', encoding='utf-8') as f:
-                            json.dump(chatrooms_info, f, ensure_ascii=False, indent=2)
-
-                        logger.info(f"[WX849] 已更新群聊 {group_id} 基础信息")
-
-                        # 缓存群名
-                        if group_name:
-                            if not hasattr(self, "group_name_cache"):
-                                self.group_name_cache = {}
-                            self.group_name_cache[cache_key] = group_name
-
-                            # 异步获取群成员详情（不阻塞当前方法）
-                            threading.Thread(target=lambda: asyncio.run(self._get_group_member_details(group_id))).start()
-
-                            return group_name
-
-                except Exception as save_err:
-                    logger.error(f"[WX849] 保存群聊信息到文件失败: {save_err}")
-                    import traceback
-                    logger.error(f"[WX849] 详细错误: {traceback.format_exc()}")
-
-                # 如果上面的处理没有返回群名称，再次尝试从原始数据中提取
-                if group_info and isinstance(group_info, dict):
-                    # 尝试从API返回中获取群名称
-                    group_name = None
-
-                    # 尝试多种可能的字段名
-                    possible_fields = ["NickName", "nickname", "ChatRoomName", "chatroomname", "DisplayName", "displayname"]
-                    for field in possible_fields:
-                        if field in group_info and group_info[field]:
-                            group_name = group_info[field]
-                            if isinstance(group_name, dict) and "string" in group_name:
-                                group_name = group_name["string"]
-                            break
-
-                    if group_name:
-                        logger.debug(f"[WX849] 获取到群名称: {group_name}")
-
-                        # 缓存群名
-                        if not hasattr(self, "group_name_cache"):
-                            self.group_name_cache = {}
-                        self.group_name_cache[cache_key] = group_name
-
-                        # 异步获取群成员详情
-                        threading.Thread(target=lambda: asyncio.run(self._get_group_member_details(group_id))).start()
-
-                        return group_name
-                    else:
-                        logger.warning(f"[WX849] API返回成功但未找到群名称字段: {json.dumps(group_info, ensure_ascii=False)}")
-                else:
-                    logger.warning(f"[WX849] API返回无效数据: {group_info}")
-            except Exception as e:
-                # 详细记录API请求失败的错误信息
-                logger.error(f"[WX849] 使用群聊API获取群名称失败: {e}")
-                logger.error(f"[WX849] 详细错误: {traceback.format_exc()}")
-                logger.error(f"[WX849] 请求参数: {json.dumps(params, ensure_ascii=False)}")
-
-            # 如果无法获取群名，使用群ID作为名称
-            logger.debug(f"[WX849] 无法获取群名称，使用群ID代替: {group_id}")
-            # 缓存结果
-            if not hasattr(self, "group_name_cache"):
-                self.group_name_cache = {}
-            self.group_name_cache[cache_key] = group_id
-
-            # 尽管获取群名失败，仍然尝试获取群成员详情
-            threading.Thread(target=lambda: asyncio.run(self._get_group_member_details(group_id))).start()
-
-            return group_id
-        except Exception as e:
-            logger.error(f"[WX849] 获取群名称失败: {e}")
-            logger.error(f"[WX849] 详细错误: {traceback.format_exc()}")
-            return group_id
-
     def _compose_context(self, ctype: ContextType, content, **kwargs):
         """重写父类方法，构建消息上下文"""
         try:
@@ -5104,9 +3688,7 @@ class WX849Channel(ChatChannel):
                 context["session_id"] = msg.from_user_id
 
                 # 启动异步任务获取群名称并更新
-                loop = asyncio.get_event_loop()
                 try:
-                    # 尝试创建异步任务获取群名
                     async def update_group_name():
                         try:
                             group_name = await self._get_group_name(msg.from_user_id)
@@ -5116,15 +3698,8 @@ class WX849Channel(ChatChannel):
                         except Exception as e:
                             logger.error(f"[WX849] 更新群名称失败: {e}")
 
-                    # 使用已有事件循环运行更新任务
-                    def run_async_task():
-                        try:
-                            asyncio.run(update_group_name())
-                        except Exception as e:
-                            logger.error(f"[WX849] 异步获取群名称任务失败: {e}")
-
-                    # 启动线程执行异步任务
-                    threading.Thread(target=run_async_task).start()
+                    # 在通道事件循环中执行，不等待结果
+                    self.dispatcher.run_coroutine(update_group_name())
                 except Exception as e:
                     logger.error(f"[WX849] 创建获取群名称任务失败: {e}")
             else:
@@ -5151,53 +3726,16 @@ class WX849Channel(ChatChannel):
             # 记录原始消息类型
             context["origin_ctype"] = ctype
 
-            # 添加调试日志
-            logger.debug(f"[WX849] 生成Context对象: type={context.type}, content={context.content}, isgroup={context['isgroup']}, session_id={context.get('session_id', 'None')}")
-            if isgroup:
-                logger.debug(f"[WX849] 群聊消息详情: group_id={context.get('group_id')}, from_user_id={context.get('from_user_id')}")
-
-            return context
-        except Exception as e:
-            logger.error(f"[WX849] 构建上下文失败: {e}")
-            logger.error(f"[WX849] 详细错误: {traceback.format_exc()}")
-            return None
-
-    async def _get_chatroom_member_nickname(self, group_id, member_wxid):
-        """获取群成员的昵称"""
-        if not group_id or not member_wxid:
-            return member_wxid
-
-        try:
-            # 优先从缓存获取群成员信息
-            tmp_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "tmp")
-            chatrooms_file = os.path.join(tmp_dir, 'wx849_rooms.json')
-
-            if os.path.exists(chatrooms_file):
-                with open(chatrooms_file, 'r', encoding='utf-8') as f:
-                    chatrooms_info = json.load(f)
-
-                if group_id in chatrooms_info and "members" in chatrooms_info[group_id]:
-                    for member in chatrooms_info[group_id]["members"]:
-                        if member.get("UserName") == member_wxid:
-                            # 优先使用群内显示名称(群昵称)
-                            if member.get("DisplayName"):
-                                logger.debug(f"[WX849] 获取到成员 {member_wxid} 的群昵称: {member.get('DisplayName')}")
-                                return member.get("DisplayName")
-                            # 次选使用个人昵称
-                            elif member.get("NickName"):
-                                logger.debug(f"[WX849] 获取到成员 {member_wxid} 的昵称: {member.get('NickName')}")
-                                return member.get("NickName")
-                            else:
-                                return member_wxid
-
-            # 如果缓存中没有，启动一个后台任务获取群成员，但本次先返回wxid
-            logger.debug(f"[WX849] 未找到成员 {member_wxid} 的昵称信息，启动更新任务")
-            threading.Thread(target=lambda: asyncio.run(self._get_group_member_details(group_id))).start()
-            return member_wxid
+            # 添加调试日志
+            logger.debug(f"[WX849] 生成Context对象: type={context.type}, content={context.content}, isgroup={context['isgroup']}, session_id={context.get('session_id', 'None')}")
+            if isgroup:
+                logger.debug(f"[WX849] 群聊消息详情: group_id={context.get('group_id')}, from_user_id={context.get('from_user_id')}")
+
+            return context
         except Exception as e:
-            logger.error(f"[WX849] 获取群成员昵称失败: {e}")
+            logger.error(f"[WX849] 构建上下文失败: {e}")
             logger.error(f"[WX849] 详细错误: {traceback.format_exc()}")
-            return member_wxid
+            return None
 
     async def _get_contact_name(self, contact_id):
         """获取联系人昵称，与gewechat保持一致"""
@@ -5212,42 +3750,27 @@ class WX849Channel(ChatChannel):
                 logger.debug(f"[WX849] 从缓存中获取联系人昵称: {cached_name}")
                 return cached_name
 
-            # 检查文件中是否已经有联系人信息，且未过期
-            tmp_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "tmp")
-            if not os.path.exists(tmp_dir):
-                os.makedirs(tmp_dir)
-
-            contacts_file = os.path.join(tmp_dir, 'wx849_contacts.json')
-
+            # 检查联系人目录中是否已经有联系人信息，且未过期
             # 设定缓存有效期为24小时(86400秒)
             cache_expiry = 86400
             current_time = int(time.time())
 
-            if os.path.exists(contacts_file):
-                try:
-                    with open(contacts_file, 'r', encoding='utf-8') as f:
-                        contacts_info = json.load(f)
-
-                    # 检查联系人信息是否存在且未过期
-                    if (contact_id in contacts_info and
-                        "NickName" in contacts_info[contact_id] and
-                        contacts_info[contact_id]["NickName"] and
-                        contacts_info[contact_id]["NickName"] != contact_id and
-                        "last_update" in contacts_info[contact_id] and
-                        current_time - contacts_info[contact_id]["last_update"] < cache_expiry):
-
-                        # 从文件中获取联系人昵称
-                        contact_name = contacts_info[contact_id]["NickName"]
-                        logger.debug(f"[WX849] 从文件缓存中获取联系人昵称: {contact_name}")
-
-                        # 缓存联系人昵称
-                        if not hasattr(self, "contact_name_cache"):
-                            self.contact_name_cache = {}
-                        self.contact_name_cache[cache_key] = contact_name
-
-                        return contact_name
-                except Exception as e:
-                    logger.error(f"[WX849] 从文件获取联系人昵称出错: {e}")
+            contact = self.contact_directory.contact(contact_id)
+            if (contact and
+                contact.get("NickName") and
+                contact["NickName"] != contact_id and
+                current_time - contact.get("last_update", 0) < cache_expiry):
+
+                # 从联系人目录中获取联系人昵称
+                contact_name = contact["NickName"]
+                logger.debug(f"[WX849] 从文件缓存中获取联系人昵称: {contact_name}")
+
+                # 缓存联系人昵称
+                if not hasattr(self, "contact_name_cache"):
+                    self.contact_name_cache = {}
+                self.contact_name_cache[cache_key] = contact_name
+
+                return contact_name
 
             logger.debug(f"[WX849] 联系人 {contact_id} 信息不存在或已过期，需要从API获取")
 
@@ -5258,19 +3781,8 @@ class WX849Channel(ChatChannel):
             }
 
             try:
-                # 获取API配置
-                api_host = conf().get("wx849_api_host", "127.0.0.1")
-                api_port = conf().get("wx849_api_port", 9011)
-                protocol_version = conf().get("wx849_protocol_version", "849")
-
-                # 确定API路径前缀
-                if protocol_version == "855" or protocol_version == "ipad":
-                    api_path_prefix = "/api"
-                else:
-                    api_path_prefix = "/VXAPI"
-
                 # 构建完整的API URL用于日志
-                api_url = f"http://{api_host}:{api_port}{api_path_prefix}/Friend/GetContractDetail"
+                api_url = self.api.url("/Friend/GetContractDetail")
                 logger.debug(f"[WX849] 正在请求联系人详情API: {api_url}")
 
                 # 准备请求参数
@@ -5280,10 +3792,10 @@ class WX849Channel(ChatChannel):
                     "ChatRoom": ""
                 }
 
-                logger.debug(f"[WX849] 请求参数: {json.dumps(params, ensure_ascii=False)}")
+                logger.debug("[WX849] 请求参数: {}", lazy_json(params))
 
                 # 尝试使用联系人详情API
-                contact_detail_response = await self._call_api("/Friend/GetContractDetail", params)
+                contact_detail_response = await self._call_api("/Friend/GetContractDetail", params, idempotent=True)
 
                 # 从联系人详情中提取信息
                 contact_info = None
@@ -5292,18 +3804,8 @@ class WX849Channel(ChatChannel):
                     if data:
                         contact_info = data
 
-                # 保存联系人详情到统一的JSON文件
+                # 保存联系人详情到联系人目录
                 try:
-                    # 读取现有的联系人信息（如果存在）
-                    contacts_info = {}
-                    if os.path.exists(contacts_file):
-                        try:
-                            with open(contacts_file, 'r', encoding='utf-8') as f:
-                                contacts_info = json.load(f)
-                            logger.debug(f"[WX849] 已加载 {len(contacts_info)} 个现有联系人信息")
-                        except Exception as e:
-                            logger.error(f"[WX849] 加载现有联系人信息失败: {str(e)}")
-
                     # 提取必要的联系人信息
                     if contact_info and isinstance(contact_info, dict):
                         # 递归函数用于查找特定key的值
@@ -5354,16 +3856,8 @@ class WX849Channel(ChatChannel):
 
                         # 如果找到了联系人昵称，更新缓存
                         if contact_name:
-                            # 更新联系人信息
-                            if contact_id not in contacts_info:
-                                contacts_info[contact_id] = {}
-
-                            contacts_info[contact_id]["NickName"] = contact_name
-                            contacts_info[contact_id]["last_update"] = current_time
-
-                            # 保存到文件
-                            with open(contacts_file, 'w', encoding='utf-8') as f:
-                                json.dump(contacts_info, f, ensure_ascii=False, indent=2)
+                            # 更新联系人信息，文件在后台写回
+                            self.contact_directory.update_contact(contact_id, nick_name=contact_name)
 
                             # 更新内存缓存
                             if not hasattr(self, "contact_name_cache"):
@@ -5429,37 +3923,21 @@ class WX849Channel(ChatChannel):
 
             # 尝试发送心跳包检查会话有效性
             try:
-                # 准备心跳请求参数
-                protocol_version = conf().get("wx849_protocol_version", "849")
-                api_host = conf().get("wx849_api_host", "127.0.0.1")
-                api_port = conf().get("wx849_api_port", 9011)
-
-                if protocol_version == "855" or protocol_version == "ipad":
-                    api_path_prefix = "/api"
-                else:
-                    api_path_prefix = "/VXAPI"
-
-                # 构建心跳包URL
-                heart_url = f"http://{api_host}:{api_port}{api_path_prefix}/Login/HeartBeat"
-
                 # 准备心跳请求参数
                 heart_form_data = {"wxid": self.wxid}
                 encoded_heart_data = urllib.parse.urlencode(heart_form_data)
                 headers = {'Content-Type': 'application/x-www-form-urlencoded'}
 
-                async with aiohttp.ClientSession() as session:
-                    async with session.post(heart_url, data=encoded_heart_data, headers=headers) as response:
-                        if response.status == 200:
-                            heart_json = await response.json()
-                            if heart_json.get("Success", False):
-                                logger.info("[WX849] 原始框架会话仍然有效")
-                                return True
-                            else:
-                                logger.error(f"[WX849] 原始框架会话已失效: {heart_json.get('Message', '未知错误')}")
-                                return False
-                        else:
-                            logger.error(f"[WX849] 心跳包请求失败，状态码: {response.status}")
-                            return False
+                heart_json = await self.api.post("/Login/HeartBeat", data=encoded_heart_data, headers=headers, idempotent=True)
+                if heart_json is None:
+                    logger.error("[WX849] 心跳包请求失败")
+                    return False
+                if heart_json.get("Success", False):
+                    logger.info("[WX849] 原始框架会话仍然有效")
+                    return True
+                else:
+                    logger.error(f"[WX849] 原始框架会话已失效: {heart_json.get('Message', '未知错误')}")
+                    return False
             except Exception as e:
                 logger.error(f"[WX849] 检查原始框架会话状态失败: {e}")
                 return False
@@ -5552,24 +4030,15 @@ class WX849Channel(ChatChannel):
 
             # 下载视频，设置30秒超时
             try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(video_url, headers=headers, timeout=30) as response:
-                        if response.status != 200:
-                            logger.error(f"[WX849] 下载视频失败, 状态码: {response.status}")
-                            return False
-
-                        # 检查内容类型
-                        content_type = response.headers.get('Content-Type', '')
-                        if 'video' not in content_type and 'octet-stream' not in content_type:
-                            logger.warning(f"[WX849] 警告: 响应内容类型不是视频: {content_type}")
+                # 使用共享的HTTP会话流式下载
+                content_type = await self.api.download_to_file(video_url, tmp_path, headers=headers, timeout=30)
+                if content_type is None:
+                    logger.error(f"[WX849] 下载视频失败: {video_url}")
+                    return False
 
-                        # 使用流式下载
-                        with open(tmp_path, 'wb') as f:
-                            while True:
-                                chunk = await response.content.read(8192)  # 8KB块
-                                if not chunk:
-                                    break
-                                f.write(chunk)
+                # 检查内容类型
+                if 'video' not in content_type and 'octet-stream' not in content_type:
+                    logger.warning(f"[WX849] 警告: 响应内容类型不是视频: {content_type}")
 
                 # 检查下载的文件
                 if not os.path.exists(tmp_path) or os.path.getsize(tmp_path) < 1024:  # 小于1KB
@@ -5783,132 +4252,46 @@ class WX849Channel(ChatChannel):
                 "PlayLength": video_duration  # 这是必需的参数，缺少会导致[Key:]数据不存在错误
             }
 
-            # 获取API配置
-            api_host = conf().get("wx849_api_host", "127.0.0.1")
-            api_port = conf().get("wx849_api_port", 9011)
-
-            # 确定API路径前缀
-            protocol_version = conf().get("wx849_protocol_version", "849")
-            if protocol_version == "855" or protocol_version == "ipad":
-                api_path_prefix = "/api"
-            else:
-                api_path_prefix = "/VXAPI"
-
             # 构建完整API URL
-            url = f"http://{api_host}:{api_port}{api_path_prefix}/Msg/SendVideo"
+            url = self.api.url("/Msg/SendVideo")
 
             logger.debug(f"[WX849] 直接调用SendVideo API: {url}")
 
             # 发送请求
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, json=params) as response:
-                    json_resp = await response.json()
+            json_resp = await self.api.post("/Msg/SendVideo", json=params)
 
-                    # 检查响应
-                    if json_resp and json_resp.get("Success", False):
-                        data = json_resp.get("Data", {})
-                        client_msg_id = data.get("clientMsgId")
-                        new_msg_id = data.get("newMsgId")
+            # 检查响应
+            if json_resp and json_resp.get("Success", False):
+                data = json_resp.get("Data", {})
+                client_msg_id = data.get("clientMsgId")
+                new_msg_id = data.get("newMsgId")
 
-                        logger.info(f"[WX849] 视频发送成功，返回ID: {client_msg_id}, {new_msg_id}")
-                        return {"Success": True, "client_msg_id": client_msg_id, "new_msg_id": new_msg_id}
-                    else:
-                        error_msg = json_resp.get("Message", "未知错误")
-                        logger.error(f"[WX849] 视频API返回错误: {error_msg}")
-                        logger.error(f"[WX849] 响应详情: {json.dumps(json_resp, ensure_ascii=False)}")
-                        return None
+                logger.info(f"[WX849] 视频发送成功，返回ID: {client_msg_id}, {new_msg_id}")
+                return {"Success": True, "client_msg_id": client_msg_id, "new_msg_id": new_msg_id}
+            else:
+                error_msg = json_resp.get("Message", "未知错误") if json_resp else "接口无响应"
+                logger.error(f"[WX849] 视频API返回错误: {error_msg}")
+                logger.error(f"[WX849] 响应详情: {json.dumps(json_resp, ensure_ascii=False)}")
+                return None
 
         except Exception as e:
             logger.error(f"[WX849] 发送视频失败: {e}")
             logger.error(traceback.format_exc())
             return None
 
-    def _send_api_request(self, url, data):
-        """同步发送API请求"""
-        try:
-            # 设置请求头
-            headers = {
-                'Content-Type': 'application/json'
-            }
-
-            # 发送请求
-            response = requests.post(url, json=data, headers=headers, timeout=10)
-
-            # 检查响应状态码
-            if response.status_code != 200:
-                logger.error(f"[WX849] API请求失败: {url}, 状态码: {response.status_code}")
-                return None
-
-            # 解析响应
-            result = response.json()
-            return result
-        except Exception as e:
-            logger.error(f"[WX849] API请求失败: {url}, 错误: {e}")
-            return None
-
     def _get_nickname_from_wxid(self, wxid):
         """从wxid获取昵称"""
         try:
             # 检查是否是群ID
             if wxid.endswith("@chatroom"):
-                # 尝试从群聊缓存中获取群名称
-                tmp_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "tmp")
-                chatrooms_file = os.path.join(tmp_dir, 'wx849_rooms.json')
-
-                if os.path.exists(chatrooms_file):
-                    try:
-                        with open(chatrooms_file, 'r', encoding='utf-8') as f:
-                            chatrooms_info = json.load(f)
-
-                        if wxid in chatrooms_info and "nickName" in chatrooms_info[wxid]:
-                            return chatrooms_info[wxid]["nickName"]
-                    except Exception as e:
-                        logger.debug(f"[WX849] 从缓存获取群名称失败: {e}")
-
-                # 如果没有找到，返回默认值
-                return "群聊"
-
-            # 检查是否是个人ID
-            # 首先尝试从群成员列表中获取昵称
-            tmp_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "tmp")
-            chatrooms_file = os.path.join(tmp_dir, 'wx849_rooms.json')
-
-            if os.path.exists(chatrooms_file):
-                try:
-                    with open(chatrooms_file, 'r', encoding='utf-8') as f:
-                        chatrooms_info = json.load(f)
-
-                    # 遍历所有群聊
-                    for group_id, group_info in chatrooms_info.items():
-                        if "members" in group_info:
-                            # 遍历群成员
-                            for member in group_info["members"]:
-                                if member.get("UserName") == wxid:
-                                    # 优先使用群内显示名称(群昵称)
-                                    if member.get("DisplayName"):
-                                        logger.debug(f"[WX849] 从群成员列表获取到用户 {wxid} 的群昵称: {member.get('DisplayName')}")
-                                        return member.get("DisplayName")
-                                    # 次选使用个人昵称
-                                    elif member.get("NickName"):
-                                        logger.debug(f"[WX849] 从群成员列表获取到用户 {wxid} 的昵称: {member.get('NickName')}")
-                                        return member.get("NickName")
-                except Exception as e:
-                    logger.debug(f"[WX849] 从群成员列表获取昵称失败: {e}")
-
-            # 如果在群成员列表中没有找到，尝试从联系人缓存中获取昵称
-            contacts_file = os.path.join(tmp_dir, 'wx849_contacts.json')
-
-            if os.path.exists(contacts_file):
-                try:
-                    with open(contacts_file, 'r', encoding='utf-8') as f:
-                        contacts_info = json.load(f)
+                # 从联系人目录中获取群名称，没有找到时返回默认值
+                return self.contact_directory.room_name(wxid) or "群聊"
 
-                    for contact in contacts_info:
-                        if contact.get("wxid") == wxid and contact.get("nickname"):
-                            logger.debug(f"[WX849] 从联系人列表获取到用户 {wxid} 的昵称: {contact.get('nickname')}")
-                            return contact.get("nickname")
-                except Exception as e:
-                    logger.debug(f"[WX849] 从缓存获取联系人昵称失败: {e}")
+            # 个人ID：先查群成员昵称，再查联系人昵称
+            nickname = self.contact_directory.nickname(wxid)
+            if nickname:
+                logger.debug(f"[WX849] 从联系人目录获取到用户 {wxid} 的昵称: {nickname}")
+                return nickname
 
             # 如果是机器人自己的wxid，返回机器人昵称
             if wxid == self.wxid and hasattr(self, "name") and self.name:
@@ -5925,38 +4308,13 @@ class WX849Channel(ChatChannel):
             logger.error(f"[WX849] 获取昵称失败: {e}")
             return "用户"
 
-    async def _send_api_request(self, endpoint, params):
+    async def _send_api_request(self, endpoint, params, idempotent=False):
         """异步发送API请求"""
-        try:
-            # 获取API配置
-            api_host = conf().get("wx849_api_host", "127.0.0.1")
-            api_port = conf().get("wx849_api_port", 9011)
-            protocol_version = conf().get("wx849_protocol_version", "849")
-
-            # 确定API路径前缀
-            if protocol_version == "855" or protocol_version == "ipad":
-                api_path_prefix = "/api"
-            else:
-                api_path_prefix = "/VXAPI"
-
-            # 构建完整的API URL
-            url = f"http://{api_host}:{api_port}{api_path_prefix}{endpoint}"
-            logger.debug(f"[WX849] 发送API请求: {url}")
-            logger.debug(f"[WX849] 请求参数: {json.dumps(params, ensure_ascii=False)}")
-
-            # 发送POST请求
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, json=params) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        logger.debug(f"[WX849] API响应: {json.dumps(result, ensure_ascii=False)}")
-                        return result
-                    else:
-                        logger.error(f"[WX849] API请求失败: {url}, 状态码: {response.status}")
-                        return None
-        except Exception as e:
-            logger.error(f"[WX849] API请求失败: {endpoint}, 错误: {e}")
-            return None
+        logger.debug(f"[WX849] 发送API请求: {endpoint}")
+        result = await self.api.post(endpoint, params, idempotent=idempotent)
+        if result is not None:
+            logger.debug("[WX849] API响应: {}", lazy_json(result))
+        return result
 
     async def _get_group_members(self, group_id):
         """获取群成员列表"""
@@ -5968,7 +4326,7 @@ class WX849Channel(ChatChannel):
             }
 
             # 发送API请求
-            result = await self._send_api_request("/Group/GetChatRoomMemberDetail", params)
+            result = await self._send_api_request("/Group/GetChatRoomMemberDetail", params, idempotent=True)
 
             if not result or not isinstance(result, dict):
                 logger.error(f"[WX849] 获取群成员列表失败: 无效响应")
@@ -6026,36 +4384,12 @@ class WX849Channel(ChatChannel):
         try:
             logger.debug(f"[WX849] 尝试获取群 {group_id} 的成员详情")
 
-            # 检查是否已存在群成员信息，并检查是否需要更新
-            # 定义群聊信息文件路径
-            tmp_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "tmp")
-            if not os.path.exists(tmp_dir):
-                os.makedirs(tmp_dir)
-
-            chatrooms_file = os.path.join(tmp_dir, 'wx849_rooms.json')
-
-            # 读取现有的群聊信息（如果存在）
-            chatrooms_info = {}
-            if os.path.exists(chatrooms_file):
-                try:
-                    with open(chatrooms_file, 'r', encoding='utf-8') as f:
-                        chatrooms_info = json.load(f)
-                    logger.debug(f"[WX849] 已加载 {len(chatrooms_info)} 个现有群聊信息")
-                except Exception as e:
-                    logger.error(f"[WX849] 加载现有群聊信息失败: {str(e)}")
-
             # 检查该群聊是否已存在且成员信息是否已更新
             # 设定缓存有效期为24小时(86400秒)
             cache_expiry = 86400
-            current_time = int(time.time())
-
-            if (group_id in chatrooms_info and
-                "members" in chatrooms_info[group_id] and
-                len(chatrooms_info[group_id]["members"]) > 0 and
-                "last_update" in chatrooms_info[group_id] and
-                current_time - chatrooms_info[group_id]["last_update"] < cache_expiry):
+            if self.contact_directory.is_room_fresh(group_id, cache_expiry):
                 logger.debug(f"[WX849] 群 {group_id} 成员信息已存在且未过期，跳过更新")
-                return chatrooms_info[group_id]
+                return self.contact_directory.room(group_id)
 
             logger.debug(f"[WX849] 群 {group_id} 成员信息不存在或已过期，开始更新")
 
@@ -6066,21 +4400,10 @@ class WX849Channel(ChatChannel):
             }
 
             try:
-                # 获取API配置
-                api_host = conf().get("wx849_api_host", "127.0.0.1")
-                api_port = conf().get("wx849_api_port", 9011)
-                protocol_version = conf().get("wx849_protocol_version", "849")
-
-                # 确定API路径前缀
-                if protocol_version == "855" or protocol_version == "ipad":
-                    api_path_prefix = "/api"
-                else:
-                    api_path_prefix = "/VXAPI"
-
                 # 构建完整的API URL用于日志
-                api_url = f"http://{api_host}:{api_port}{api_path_prefix}/Group/GetChatRoomMemberDetail"
+                api_url = self.api.url("/Group/GetChatRoomMemberDetail")
                 logger.debug(f"[WX849] 正在请求群成员详情API: {api_url}")
-                logger.debug(f"[WX849] 请求参数: {json.dumps(params, ensure_ascii=False)}")
+                logger.debug("[WX849] 请求参数: {}", lazy_json(params))
 
                 # 使用新的_get_group_members方法获取群成员
                 members_data = await self._get_group_members(group_id)
@@ -6096,16 +4419,6 @@ class WX849Channel(ChatChannel):
                     "ChatRoomMember": members_data
                 }
 
-                # 检查当前群聊是否已存在
-                if group_id not in chatrooms_info:
-                    chatrooms_info[group_id] = {
-                        "chatroomId": group_id,
-                        "nickName": group_id,
-                        "chatRoomOwner": "",
-                        "members": [],
-                        "last_update": int(time.time())
-                    }
-
                 # 提取成员信息
                 member_count = new_chatroom_data.get("MemberCount", 0)
                 chat_room_members = new_chatroom_data.get("ChatRoomMember", [])
@@ -6124,20 +4437,15 @@ class WX849Channel(ChatChannel):
                     # 提取成员必要信息，直接使用原始成员信息
                     members.append(member)
 
-                # 更新群聊信息
-                chatrooms_info[group_id]["members"] = members
-                chatrooms_info[group_id]["last_update"] = int(time.time())
-                chatrooms_info[group_id]["memberCount"] = member_count
-
                 # 同时更新群主信息
+                owner = None
                 for member in members:
                     if member.get("ChatroomMemberFlag") == 2049:  # 群主标志
-                        chatrooms_info[group_id]["chatRoomOwner"] = member.get("UserName", "")
+                        owner = member.get("UserName", "")
                         break
 
-                # 保存到文件
-                with open(chatrooms_file, 'w', encoding='utf-8') as f:
-                    json.dump(chatrooms_info, f, ensure_ascii=False, indent=2)
+                # 更新联系人目录，文件在后台写回
+                self.contact_directory.update_room(group_id, owner=owner, members=members, member_count=member_count)
 
                 logger.info(f"[WX849] 已更新群聊 {group_id} 成员信息，成员数: {len(members)}")
 
@@ -6158,17 +4466,6 @@ class WX849Channel(ChatChannel):
             return None
 
         try:
-            # 获取API配置
-            api_host = conf().get("wx849_api_host", "127.0.0.1")
-            api_port = conf().get("wx849_api_port", 9011)
-            protocol_version = conf().get("wx849_protocol_version", "849")
-
-            # 确定API路径前缀
-            if protocol_version == "855" or protocol_version == "ipad":
-                api_path_prefix = "/api"
-            else:
-                api_path_prefix = "/VXAPI"
-
             # 构建API请求参数
             params = {
                 "Wxid": self.wxid,
@@ -6177,12 +4474,12 @@ class WX849Channel(ChatChannel):
             }
 
             # 构建完整的API URL用于日志
-            api_url = f"http://{api_host}:{api_port}{api_path_prefix}/Friend/GetContractDetail"
+            api_url = self.api.url("/Friend/GetContractDetail")
             logger.debug(f"[WX849] 正在请求群组详情API: {api_url}")
-            logger.debug(f"[WX849] 请求参数: {json.dumps(params, ensure_ascii=False)}")
+            logger.debug("[WX849] 请求参数: {}", lazy_json(params))
 
             # 调用API获取群组详情
-            response = await self._call_api("/Friend/GetContractDetail", params)
+            response = await self._call_api("/Friend/GetContractDetail", params, idempotent=True)
 
             if not response or not isinstance(response, dict):
                 logger.error(f"[WX849] 获取群组详情失败: 无效响应")
@@ -6270,84 +4567,33 @@ class WX849Channel(ChatChannel):
                 cached_name = self.group_name_cache[cache_key]
                 logger.debug(f"[WX849] 从缓存中获取群名: {cached_name}")
 
-                # 检查是否需要更新群成员详情
-                tmp_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "tmp")
-                chatrooms_file = os.path.join(tmp_dir, 'wx849_rooms.json')
-
-                need_update = True
-                # 设定缓存有效期为24小时(86400秒)
-                cache_expiry = 86400
-                current_time = int(time.time())
-
-                if os.path.exists(chatrooms_file):
-                    try:
-                        with open(chatrooms_file, 'r', encoding='utf-8') as f:
-                            chatrooms_info = json.load(f)
-
-                        # 检查群信息是否存在且未过期
-                        if (group_id in chatrooms_info and
-                            "last_update" in chatrooms_info[group_id] and
-                            current_time - chatrooms_info[group_id]["last_update"] < cache_expiry and
-                            "members" in chatrooms_info[group_id] and
-                            len(chatrooms_info[group_id]["members"]) > 0):
-                            logger.debug(f"[WX849] 群 {group_id} 信息已存在且未过期，跳过更新")
-                            need_update = False
-                    except Exception as e:
-                        logger.error(f"[WX849] 检查群信息缓存时出错: {e}")
-
-                # 只有需要更新时才启动线程获取群成员详情
-                if need_update:
+                # 检查是否需要更新群成员详情，设定缓存有效期为24小时(86400秒)
+                if self.contact_directory.is_room_fresh(group_id, 86400):
+                    logger.debug(f"[WX849] 群 {group_id} 信息已存在且未过期，跳过更新")
+                else:
                     logger.debug(f"[WX849] 群 {group_id} 信息需要更新，启动更新线程")
-                    threading.Thread(target=lambda: asyncio.run(self._get_group_member_details(group_id))).start()
+                    self.dispatcher.run_coroutine(self._get_group_member_details(group_id))
 
                 return cached_name
 
-            # 检查文件中是否已经有群信息，且未过期
-            tmp_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "tmp")
-            if not os.path.exists(tmp_dir):
-                os.makedirs(tmp_dir)
-
-            chatrooms_file = os.path.join(tmp_dir, 'wx849_rooms.json')
-
+            # 检查联系人目录中是否已经有群信息，且未过期
             # 设定缓存有效期为24小时(86400秒)
             cache_expiry = 86400
-            current_time = int(time.time())
-
-            if os.path.exists(chatrooms_file):
-                try:
-                    with open(chatrooms_file, 'r', encoding='utf-8') as f:
-                        chatrooms_info = json.load(f)
-
-                    # 检查群信息是否存在且未过期
-                    if (group_id in chatrooms_info and
-                        "nickName" in chatrooms_info[group_id] and
-                        chatrooms_info[group_id]["nickName"] and
-                        chatrooms_info[group_id]["nickName"] != group_id and
-                        "last_update" in chatrooms_info[group_id] and
-                        current_time - chatrooms_info[group_id]["last_update"] < cache_expiry):
-
-                        # 从文件中获取群名
-                        group_name = chatrooms_info[group_id]["nickName"]
-                        logger.debug(f"[WX849] 从文件缓存中获取群名: {group_name}")
-
-                        # 缓存群名
-                        if not hasattr(self, "group_name_cache"):
-                            self.group_name_cache = {}
-                        self.group_name_cache[cache_key] = group_name
+            if self.contact_directory.is_room_fresh(group_id, cache_expiry, need_members=False, need_name=True):
+                group_name = self.contact_directory.room_name(group_id)
+                logger.debug(f"[WX849] 从文件缓存中获取群名: {group_name}")
 
-                        # 检查是否需要更新群成员详情
-                        need_update_members = not ("members" in chatrooms_info[group_id] and
-                                                len(chatrooms_info[group_id]["members"]) > 0)
+                # 缓存群名
+                self.group_name_cache[cache_key] = group_name
 
-                        if need_update_members:
-                            logger.debug(f"[WX849] 群 {group_id} 名称已缓存，但需要更新成员信息")
-                            threading.Thread(target=lambda: asyncio.run(self._get_group_member_details(group_id))).start()
-                        else:
-                            logger.debug(f"[WX849] 群 {group_id} 信息已完整且未过期，无需更新")
+                # 检查是否需要更新群成员详情
+                if not self.contact_directory.room(group_id).get("members"):
+                    logger.debug(f"[WX849] 群 {group_id} 名称已缓存，但需要更新成员信息")
+                    self.dispatcher.run_coroutine(self._get_group_member_details(group_id))
+                else:
+                    logger.debug(f"[WX849] 群 {group_id} 信息已完整且未过期，无需更新")
 
-                        return group_name
-                except Exception as e:
-                    logger.error(f"[WX849] 从文件获取群名出错: {e}")
+                return group_name
 
             logger.debug(f"[WX849] 群 {group_id} 信息不存在或已过期，需要从API获取")
 
@@ -6356,36 +4602,16 @@ class WX849Channel(ChatChannel):
             if group_details and "nickName" in group_details:
                 group_name = group_details["nickName"]
 
-                # 保存到缓存
-                if not os.path.exists(tmp_dir):
-                    os.makedirs(tmp_dir)
-
-                chatrooms_info = {}
-                if os.path.exists(chatrooms_file):
-                    try:
-                        with open(chatrooms_file, 'r', encoding='utf-8') as f:
-                            chatrooms_info = json.load(f)
-                    except Exception as e:
-                        logger.error(f"[WX849] 加载现有群聊信息失败: {str(e)}")
-
-                if group_id not in chatrooms_info:
-                    chatrooms_info[group_id] = {}
-
-                chatrooms_info[group_id]["nickName"] = group_name
-                chatrooms_info[group_id]["last_update"] = int(time.time())
-
-                with open(chatrooms_file, 'w', encoding='utf-8') as f:
-                    json.dump(chatrooms_info, f, ensure_ascii=False, indent=2)
+                # 保存到联系人目录
+                self.contact_directory.update_room(group_id, nick_name=group_name)
 
                 # 缓存群名
-                if not hasattr(self, "group_name_cache"):
-                    self.group_name_cache = {}
                 self.group_name_cache[cache_key] = group_name
 
                 logger.debug(f"[WX849] 已更新群组 {group_id} 名称: {group_name}")
 
                 # 异步获取群成员详情
-                threading.Thread(target=lambda: asyncio.run(self._get_group_member_details(group_id))).start()
+                self.dispatcher.run_coroutine(self._get_group_member_details(group_id))
 
                 return group_name
 
@@ -6396,37 +4622,16 @@ class WX849Channel(ChatChannel):
             }
 
             try:
-                # 获取API配置
-                api_host = conf().get("wx849_api_host", "127.0.0.1")
-                api_port = conf().get("wx849_api_port", 9011)
-                protocol_version = conf().get("wx849_protocol_version", "849")
-
-                # 确定API路径前缀
-                if protocol_version == "855" or protocol_version == "ipad":
-                    api_path_prefix = "/api"
-                else:
-                    api_path_prefix = "/VXAPI"
-
                 # 构建完整的API URL用于日志
-                api_url = f"http://{api_host}:{api_port}{api_path_prefix}/Group/GetChatRoomInfo"
+                api_url = self.api.url("/Group/GetChatRoomInfo")
                 logger.debug(f"[WX849] 正在请求群信息API: {api_url}")
-                logger.debug(f"[WX849] 请求参数: {json.dumps(params, ensure_ascii=False)}")  # 记录请求参数
+                logger.debug("[WX849] 请求参数: {}", lazy_json(params))  # 记录请求参数
 
                 # 尝试使用群聊专用API
-                group_info = await self._call_api("/Group/GetChatRoomInfo", params)
+                group_info = await self._call_api("/Group/GetChatRoomInfo", params, idempotent=True)
 
-                # 保存群聊详情到统一的JSON文件
+                # 保存群聊详情到联系人目录
                 try:
-                    # 读取现有的群聊信息（如果存在）
-                    chatrooms_info = {}
-                    if os.path.exists(chatrooms_file):
-                        try:
-                            with open(chatrooms_file, 'r', encoding='utf-8') as f:
-                                chatrooms_info = json.load(f)
-                            logger.debug(f"[WX849] 已加载 {len(chatrooms_info)} 个现有群聊信息")
-                        except Exception as e:
-                            logger.error(f"[WX849] 加载现有群聊信息失败: {str(e)}")
-
                     # 提取必要的群聊信息
                     if group_info and isinstance(group_info, dict):
                         # 递归函数用于查找特定key的值
@@ -6487,38 +4692,17 @@ class WX849Channel(ChatChannel):
                                 if owner_id:
                                     break
 
-                        # 检查群聊信息是否已存在
-                        if group_id in chatrooms_info:
-                            # 更新已有群聊信息
-                            if group_name:
-                                chatrooms_info[group_id]["nickName"] = group_name
-                            if owner_id:
-                                chatrooms_info[group_id]["chatRoomOwner"] = owner_id
-                            chatrooms_info[group_id]["last_update"] = int(time.time())
-                        else:
-                            # 创建新群聊信息
-                            chatrooms_info[group_id] = {
-                                "chatroomId": group_id,
-                                "nickName": group_name or group_id,
-                                "chatRoomOwner": owner_id or "",
-                                "members": [],
-                                "last_update": int(time.time())
-                            }
-
-                        # 保存到文件
-                        with open(chatrooms_file, 'w', encoding='utf-8') as f:
-                            json.dump(chatrooms_info, f, ensure_ascii=False, indent=2)
+                        # 更新或创建群聊信息
+                        self.contact_directory.update_room(group_id, nick_name=group_name, owner=owner_id)
 
                         logger.info(f"[WX849] 已更新群聊 {group_id} 基础信息")
 
                         # 缓存群名
                         if group_name:
-                            if not hasattr(self, "group_name_cache"):
-                                self.group_name_cache = {}
                             self.group_name_cache[cache_key] = group_name
 
                             # 异步获取群成员详情（不阻塞当前方法）
-                            threading.Thread(target=lambda: asyncio.run(self._get_group_member_details(group_id))).start()
+                            self.dispatcher.run_coroutine(self._get_group_member_details(group_id))
 
                             return group_name
 
@@ -6545,12 +4729,10 @@ class WX849Channel(ChatChannel):
                         logger.debug(f"[WX849] 获取到群名称: {group_name}")
 
                         # 缓存群名
-                        if not hasattr(self, "group_name_cache"):
-                            self.group_name_cache = {}
                         self.group_name_cache[cache_key] = group_name
 
                         # 异步获取群成员详情
-                        threading.Thread(target=lambda: asyncio.run(self._get_group_member_details(group_id))).start()
+                        self.dispatcher.run_coroutine(self._get_group_member_details(group_id))
 
                         return group_name
                     else:
@@ -6566,12 +4748,10 @@ class WX849Channel(ChatChannel):
             # 如果无法获取群名，使用群ID作为名称
             logger.debug(f"[WX849] 无法获取群名称，使用群ID代替: {group_id}")
             # 缓存结果
-            if not hasattr(self, "group_name_cache"):
-                self.group_name_cache = {}
             self.group_name_cache[cache_key] = group_id
 
             # 尽管获取群名失败，仍然尝试获取群成员详情
-            threading.Thread(target=lambda: asyncio.run(self._get_group_member_details(group_id))).start()
+            self.dispatcher.run_coroutine(self._get_group_member_details(group_id))
 
             return group_id
         except Exception as e:
@@ -6717,21 +4897,8 @@ class WX849Channel(ChatChannel):
 
                 # 启动异步任务获取群名称并更新
                 try:
-                    # 使用已有事件循环运行更新任务
-                    def run_async_task():
-                        try:
-                            # 创建新的事件循环
-                            task_loop = asyncio.new_event_loop()
-                            asyncio.set_event_loop(task_loop)
-                            # 执行异步任务
-                            task_loop.run_until_complete(self._update_group_nickname_async(msg))
-                            # 关闭事件循环
-                            task_loop.close()
-                        except Exception as e:
-                            logger.error(f"[WX849] 异步获取群名称任务失败: {e}")
-
-                    # 启动线程执行异步任务
-                    threading.Thread(target=run_async_task).start()
+                    # 在通道事件循环中执行更新任务
+                    self.dispatcher.run_coroutine(self._update_group_nickname_async(msg))
                 except Exception as e:
                     logger.error(f"[WX849] 创建获取群名称任务失败: {e}")
             else:
@@ -6775,21 +4942,8 @@ class WX849Channel(ChatChannel):
 
                 # 启动异步任务获取联系人昵称并更新
                 try:
-                    # 使用已有事件循环运行更新任务
-                    def run_async_task():
-                        try:
-                            # 创建新的事件循环
-                            task_loop = asyncio.new_event_loop()
-                            asyncio.set_event_loop(task_loop)
-                            # 执行异步任务
-                            task_loop.run_until_complete(self._update_contact_nickname_async(msg))
-                            # 关闭事件循环
-                            task_loop.close()
-                        except Exception as e:
-                            logger.error(f"[WX849] 异步获取联系人昵称任务失败: {e}")
-
-                    # 启动线程执行异步任务
-                    threading.Thread(target=run_async_task).start()
+                    # 在通道事件循环中执行更新任务
+                    self.dispatcher.run_coroutine(self._update_contact_nickname_async(msg))
                 except Exception as e:
                     logger.error(f"[WX849] 创建获取联系人昵称任务失败: {e}")
 
@@ -6830,42 +4984,15 @@ class WX849Channel(ChatChannel):
             return member_wxid
 
         try:
-            # 优先从缓存获取群成员信息
-            tmp_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "tmp")
-            chatrooms_file = os.path.join(tmp_dir, 'wx849_rooms.json')
-
-            if os.path.exists(chatrooms_file):
-                with open(chatrooms_file, 'r', encoding='utf-8') as f:
-                    chatrooms_info = json.load(f)
-
-                if group_id in chatrooms_info and "members" in chatrooms_info[group_id]:
-                    for member in chatrooms_info[group_id]["members"]:
-                        if member.get("UserName") == member_wxid:
-                            # 优先使用群内显示名称(群昵称)
-                            if member.get("DisplayName"):
-                                logger.debug(f"[WX849] 获取到成员 {member_wxid} 的群昵称: {member.get('DisplayName')}")
-                                return member.get("DisplayName")
-                            # 次选使用个人昵称
-                            elif member.get("NickName"):
-                                logger.debug(f"[WX849] 获取到成员 {member_wxid} 的昵称: {member.get('NickName')}")
-                                return member.get("NickName")
-                            else:
-                                return member_wxid
+            # 优先从联系人目录获取群成员昵称(群昵称优先，其次个人昵称)
+            nickname = self.contact_directory.member_name(group_id, member_wxid)
+            if nickname:
+                logger.debug(f"[WX849] 获取到成员 {member_wxid} 的群昵称: {nickname}")
+                return nickname
 
             # 如果缓存中没有，尝试立即获取群成员信息
             logger.debug(f"[WX849] 未找到成员 {member_wxid} 的昵称信息，尝试立即获取")
 
-            # 获取API配置
-            api_host = conf().get("wx849_api_host", "127.0.0.1")
-            api_port = conf().get("wx849_api_port", 9011)
-            protocol_version = conf().get("wx849_protocol_version", "849")
-
-            # 确定API路径前缀
-            if protocol_version == "855" or protocol_version == "ipad":
-                api_path_prefix = "/api"
-            else:
-                api_path_prefix = "/VXAPI"
-
             # 构建API请求参数
             params = {
                 "QID": group_id,
@@ -6873,12 +5000,12 @@ class WX849Channel(ChatChannel):
             }
 
             # 构建完整的API URL用于日志
-            api_url = f"http://{api_host}:{api_port}{api_path_prefix}/Group/GetChatRoomMemberDetail"
+            api_url = self.api.url("/Group/GetChatRoomMemberDetail")
             logger.debug(f"[WX849] 正在请求群成员详情API: {api_url}")
-            logger.debug(f"[WX849] 请求参数: {json.dumps(params, ensure_ascii=False)}")
+            logger.debug("[WX849] 请求参数: {}", lazy_json(params))
 
             # 调用API获取群成员详情
-            response = await self._call_api("/Group/GetChatRoomMemberDetail", params)
+            response = await self._call_api("/Group/GetChatRoomMemberDetail", params, idempotent=True)
 
             if not response or not isinstance(response, dict):
                 logger.error(f"[WX849] 获取群成员详情失败: 无效响应")
@@ -6909,74 +5036,14 @@ class WX849Channel(ChatChannel):
                 logger.error(f"[WX849] 获取群成员详情失败: ChatRoomMember不是有效的列表")
                 return member_wxid
 
-            # 更新群聊成员信息
-            members = []
-            for member in chat_room_members:
-                if not isinstance(member, dict):
-                    continue
-
-                # 提取成员必要信息，直接使用原始成员信息
-                members.append(member)
-
-                # 检查是否是要查找的成员
-                if member.get("UserName") == member_wxid:
-                    # 优先使用群内显示名称(群昵称)
-                    if member.get("DisplayName"):
-                        logger.debug(f"[WX849] 获取到成员 {member_wxid} 的群昵称: {member.get('DisplayName')}")
-                        nickname = member.get("DisplayName")
-                    # 次选使用个人昵称
-                    elif member.get("NickName"):
-                        logger.debug(f"[WX849] 获取到成员 {member_wxid} 的昵称: {member.get('NickName')}")
-                        nickname = member.get("NickName")
-                    else:
-                        nickname = member_wxid
-
-            # 更新群聊信息
-            if os.path.exists(chatrooms_file):
-                try:
-                    with open(chatrooms_file, 'r', encoding='utf-8') as f:
-                        chatrooms_info = json.load(f)
-                except Exception as e:
-                    logger.error(f"[WX849] 加载现有群聊信息失败: {str(e)}")
-                    chatrooms_info = {}
-            else:
-                chatrooms_info = {}
-
-            if group_id not in chatrooms_info:
-                chatrooms_info[group_id] = {
-                    "chatroomId": group_id,
-                    "nickName": group_id,
-                    "chatRoomOwner": "",
-                    "members": [],
-                    "last_update": int(time.time())
-                }
-
-            # 更新群聊成员信息
-            chatrooms_info[group_id]["members"] = members
-            chatrooms_info[group_id]["last_update"] = int(time.time())
-
-            # 保存到文件
-            with open(chatrooms_file, 'w', encoding='utf-8') as f:
-                json.dump(chatrooms_info, f, ensure_ascii=False, indent=2)
+            # 更新群聊成员信息，直接使用原始成员信息
+            members = [member for member in chat_room_members if isinstance(member, dict)]
+            self.contact_directory.update_room(group_id, members=members)
 
             logger.info(f"[WX849] 已更新群聊 {group_id} 成员信息，成员数: {len(members)}")
 
-            # 再次尝试查找成员昵称
-            for member in members:
-                if member.get("UserName") == member_wxid:
-                    # 优先使用群内显示名称(群昵称)
-                    if member.get("DisplayName"):
-                        logger.debug(f"[WX849] 获取到成员 {member_wxid} 的群昵称: {member.get('DisplayName')}")
-                        return member.get("DisplayName")
-                    # 次选使用个人昵称
-                    elif member.get("NickName"):
-                        logger.debug(f"[WX849] 获取到成员 {member_wxid} 的昵称: {member.get('NickName')}")
-                        return member.get("NickName")
-                    else:
-                        return member_wxid
-
-            # 如果仍然找不到，返回wxid
-            return member_wxid
+            # 再次尝试查找成员昵称，仍然找不到时返回wxid
+            return self.contact_directory.member_name(group_id, member_wxid) or member_wxid
         except Exception as e:
             logger.error(f"[WX849] 获取群成员昵称失败: {e}")
             logger.error(f"[WX849] 详细错误: {traceback.format_exc()}")
@@ -6987,20 +5054,9 @@ class WX849Channel(ChatChannel):
         try:
             logger.debug(f"[WX849] 开始更新群聊信息缓存")
 
-            # 获取API配置
-            api_host = conf().get("wx849_api_host", "127.0.0.1")
-            api_port = conf().get("wx849_api_port", 9011)
-            protocol_version = conf().get("wx849_protocol_version", "849")
-
-            # 确定API路径前缀
-            if protocol_version == "855" or protocol_version == "ipad":
-                api_path_prefix = "/api"
-            else:
-                api_path_prefix = "/VXAPI"
-
             # 首先获取联系人列表，找出所有群聊
             # 构建完整的API URL用于日志
-            api_url = f"http://{api_host}:{api_port}{api_path_prefix}/Friend/GetContractList"
+            api_url = self.api.url("/Friend/GetContractList")
             logger.debug(f"[WX849] 正在请求联系人列表API: {api_url}")
 
             # 准备请求参数
@@ -7011,7 +5067,7 @@ class WX849Channel(ChatChannel):
             }
 
             # 调用API获取联系人列表
-            response = await self._call_api("/Friend/GetContractList", params)
+            response = await self._call_api("/Friend/GetContractList", params, idempotent=True)
 
             if not response or not isinstance(response, dict):
                 logger.error(f"[WX849] 获取联系人列表失败: 无效响应")
@@ -7030,24 +5086,6 @@ class WX849Channel(ChatChannel):
                 logger.error(f"[WX849] 获取联系人列表失败: 响应中无ContactList或格式不正确")
                 return
 
-            # 创建临时目录
-            tmp_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "tmp")
-            if not os.path.exists(tmp_dir):
-                os.makedirs(tmp_dir)
-
-            # 定义群聊信息文件路径
-            chatrooms_file = os.path.join(tmp_dir, 'wx849_rooms.json')
-
-            # 读取现有的群聊信息（如果存在）
-            chatrooms_info = {}
-            if os.path.exists(chatrooms_file):
-                try:
-                    with open(chatrooms_file, 'r', encoding='utf-8') as f:
-                        chatrooms_info = json.load(f)
-                    logger.debug(f"[WX849] 已加载 {len(chatrooms_info)} 个现有群聊信息")
-                except Exception as e:
-                    logger.error(f"[WX849] 加载现有群聊信息失败: {str(e)}")
-
             # 更新群聊信息
             updated_count = 0
             for contact in contact_list:
@@ -7062,31 +5100,14 @@ class WX849Channel(ChatChannel):
                 # 提取群聊信息
                 nick_name = contact.get("NickName", "")
 
-                # 更新群聊信息
-                if user_name not in chatrooms_info:
-                    chatrooms_info[user_name] = {
-                        "chatroomId": user_name,
-                        "nickName": nick_name or user_name,
-                        "chatRoomOwner": "",
-                        "members": [],
-                        "last_update": int(time.time())
-                    }
-                else:
-                    # 只更新昵称和时间戳
-                    if nick_name:
-                        chatrooms_info[user_name]["nickName"] = nick_name
-                    chatrooms_info[user_name]["last_update"] = int(time.time())
-
+                # 只更新昵称和时间戳，文件在后台写回
+                self.contact_directory.update_room(user_name, nick_name=nick_name)
                 updated_count += 1
 
-            # 保存到文件
-            with open(chatrooms_file, 'w', encoding='utf-8') as f:
-                json.dump(chatrooms_info, f, ensure_ascii=False, indent=2)
-
             logger.info(f"[WX849] 已更新 {updated_count} 个群聊基础信息")
 
             # 更新群成员信息
-            for group_id in list(chatrooms_info.keys())[:10]:  # 限制一次最多更新10个群
+            for group_id in list(self.contact_directory.rooms.keys())[:10]:  # 限制一次最多更新10个群
                 try:
                     await self._get_group_member_details(group_id)
                 except Exception as e:
@@ -7101,20 +5122,9 @@ class WX849Channel(ChatChannel):
         try:
             logger.debug(f"[WX849] 开始更新联系人信息缓存")
 
-            # 获取API配置
-            api_host = conf().get("wx849_api_host", "127.0.0.1")
-            api_port = conf().get("wx849_api_port", 9011)
-            protocol_version = conf().get("wx849_protocol_version", "849")
-
-            # 确定API路径前缀
-            if protocol_version == "855" or protocol_version == "ipad":
-                api_path_prefix = "/api"
-            else:
-                api_path_prefix = "/VXAPI"
-
             # 首先获取联系人列表
             # 构建完整的API URL用于日志
-            api_url = f"http://{api_host}:{api_port}{api_path_prefix}/Friend/GetContractList"
+            api_url = self.api.url("/Friend/GetContractList")
             logger.debug(f"[WX849] 正在请求联系人列表API: {api_url}")
 
             # 准备请求参数
@@ -7125,7 +5135,7 @@ class WX849Channel(ChatChannel):
             }
 
             # 调用API获取联系人列表
-            response = await self._call_api("/Friend/GetContractList", params)
+            response = await self._call_api("/Friend/GetContractList", params, idempotent=True)
 
             if not response or not isinstance(response, dict):
                 logger.error(f"[WX849] 获取联系人列表失败: 无效响应")
@@ -7144,24 +5154,6 @@ class WX849Channel(ChatChannel):
                 logger.error(f"[WX849] 获取联系人列表失败: 响应中无ContactList或格式不正确")
                 return
 
-            # 创建临时目录
-            tmp_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "tmp")
-            if not os.path.exists(tmp_dir):
-                os.makedirs(tmp_dir)
-
-            # 定义联系人信息文件路径
-            contacts_file = os.path.join(tmp_dir, 'wx849_contacts.json')
-
-            # 读取现有的联系人信息（如果存在）
-            contacts_info = {}
-            if os.path.exists(contacts_file):
-                try:
-                    with open(contacts_file, 'r', encoding='utf-8') as f:
-                        contacts_info = json.load(f)
-                    logger.debug(f"[WX849] 已加载 {len(contacts_info)} 个现有联系人信息")
-                except Exception as e:
-                    logger.error(f"[WX849] 加载现有联系人信息失败: {str(e)}")
-
             # 更新联系人信息
             updated_count = 0
             for contact in contact_list:
@@ -7177,28 +5169,10 @@ class WX849Channel(ChatChannel):
                 nick_name = contact.get("NickName", "")
                 remark_name = contact.get("RemarkName", "")
 
-                # 更新联系人信息
-                if user_name not in contacts_info:
-                    contacts_info[user_name] = {
-                        "UserName": user_name,
-                        "NickName": nick_name or user_name,
-                        "RemarkName": remark_name or "",
-                        "last_update": int(time.time())
-                    }
-                else:
-                    # 更新昵称、备注和时间戳
-                    if nick_name:
-                        contacts_info[user_name]["NickName"] = nick_name
-                    if remark_name:
-                        contacts_info[user_name]["RemarkName"] = remark_name
-                    contacts_info[user_name]["last_update"] = int(time.time())
-
+                # 更新昵称、备注和时间戳，文件在后台写回
+                self.contact_directory.update_contact(user_name, nick_name=nick_name, remark_name=remark_name)
                 updated_count += 1
 
-            # 保存到文件
-            with open(contacts_file, 'w', encoding='utf-8') as f:
-                json.dump(contacts_info, f, ensure_ascii=False, indent=2)
-
             logger.info(f"[WX849] 已更新 {updated_count} 个联系人信息")
 
         except Exception as e:
@@ -7217,224 +5191,19 @@ class WX849Channel(ChatChannel):
         """
         logger.debug(f"[WX849] 尝试下载图片: msg_id={msg_id}, group_id={group_id}")
 
-        # 创建临时目录
-        tmp_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "tmp", "images")
-        os.makedirs(tmp_dir, exist_ok=True)
-
-        # 生成图片文件名
-        image_filename = f"img_{msg_id}_{int(time.time())}.jpg"
-        image_path = os.path.join(tmp_dir, image_filename)
-
-        # 检查是否已经存在相同的图片文件
-        existing_files = [f for f in os.listdir(tmp_dir) if f.startswith(f"img_{msg_id}_")]
-        if existing_files:
-            # 找到最新的文件
-            latest_file = sorted(existing_files, key=lambda x: os.path.getmtime(os.path.join(tmp_dir, x)), reverse=True)[0]
-            existing_path = os.path.join(tmp_dir, latest_file)
-
-            # 检查文件是否有效
-            if os.path.exists(existing_path) and os.path.getsize(existing_path) > 0:
-                logger.debug(f"[WX849] 找到已存在的图片文件: {existing_path}")
-                return existing_path
-
-        # 构建API请求参数
-        api_host = conf().get("wx849_api_host", "127.0.0.1")
-        api_port = conf().get("wx849_api_port", 9011)
-        protocol_version = conf().get("wx849_protocol_version", "849")
-
-        # 确定API路径前缀
-        if protocol_version == "855" or protocol_version == "ipad":
-            api_path_prefix = "/api"
-        else:
-            api_path_prefix = "/VXAPI"
-
-        # 使用传入的图片大小或使用默认值
-        data_len = getattr(self, "data_len", 345519)  # 如果设置了data_len属性，则使用它，否则使用默认值
-        logger.debug(f"[WX849] 使用图片大小: {data_len} 字节")
-
-        # 分段大小
-        chunk_size = 65536  # 64KB - 必须使用这个大小，API限制每次最多下载64KB
-
-        # 计算分段数
-        num_chunks = (data_len + chunk_size - 1) // chunk_size
-        if num_chunks <= 0:
-            num_chunks = 1  # 至少分1段
-
-        logger.info(f"[WX849] 开始分段下载图片，总大小: {data_len} 字节，分 {num_chunks} 段下载")
-
-        # 创建一个空文件
-        with open(image_path, "wb") as f:
-            pass
-
-        # 分段下载
-        all_chunks_success = True
-        for i in range(num_chunks):
-            start_pos = i * chunk_size
-            current_chunk_size = min(chunk_size, data_len - start_pos)
-            if current_chunk_size <= 0:
-                current_chunk_size = chunk_size
-
-            # 构建API请求参数
-            params = {
-                "MsgId": msg_id,
-                "ToWxid": group_id if group_id else "filehelper",
-                "Wxid": self.wxid,
-                "DataLen": data_len,
-                "CompressType": 0,
-                "Section": {
-                    "StartPos": start_pos,
-                    "DataLen": current_chunk_size
-                }
-            }
-
-            logger.debug(f"[WX849] 尝试下载图片分段: MsgId={msg_id}, ToWxid={group_id if group_id else 'filehelper'}, DataLen={data_len}, StartPos={start_pos}, ChunkSize={current_chunk_size}")
-
-            # 构建完整的API URL
-            api_url = f"http://{api_host}:{api_port}{api_path_prefix}/Tools/DownloadImg"
-
-            # 记录完整的请求URL和参数
-            logger.debug(f"[WX849] 图片下载API URL: {api_url}")
-            logger.debug(f"[WX849] 图片下载API参数: {params}")
-
-            try:
-                # 使用同步请求
-                import requests
-                response = requests.post(api_url, json=params, timeout=10)
-
-                if response.status_code != 200:
-                    logger.error(f"[WX849] 下载图片分段失败, 状态码: {response.status_code}")
-                    all_chunks_success = False
-                    break
-
-                # 获取响应内容
-                result = response.json()
-
-                # 检查响应是否成功
-                if not result.get("Success", False):
-                    logger.error(f"[WX849] 下载图片分段失败: {result.get('Message', '未知错误')}")
-                    all_chunks_success = False
-                    break
-
-                # 提取图片数据
-                data = result.get("Data", {})
-
-                # 记录响应结构以便调试
-                if isinstance(data, dict):
-                    logger.debug(f"[WX849] 响应Data字段包含键: {list(data.keys())}")
-
-                # 尝试不同的响应格式
-                chunk_base64 = None
-
-                # 参考 WechatAPI/Client/tool_extension.py 中的处理方式
-                if isinstance(data, dict):
-                    # 如果是字典，尝试获取buffer字段
-                    if "buffer" in data:
-                        logger.debug(f"[WX849] 从data.buffer字段获取图片数据")
-                        chunk_base64 = data.get("buffer")
-                    elif "data" in data and isinstance(data["data"], dict) and "buffer" in data["data"]:
-                        logger.debug(f"[WX849] 从data.data.buffer字段获取图片数据")
-                        chunk_base64 = data["data"]["buffer"]
-                    else:
-                        # 尝试其他可能的字段名
-                        for field in ["Chunk", "Image", "Data", "FileData", "data"]:
-                            if field in data:
-                                logger.debug(f"[WX849] 从data.{field}字段获取图片数据")
-                                chunk_base64 = data.get(field)
-                                break
-                elif isinstance(data, str):
-                    # 如果直接返回字符串，可能就是base64数据
-                    logger.debug(f"[WX849] Data字段是字符串，直接使用")
-                    chunk_base64 = data
-
-                # 如果在data中没有找到，尝试在整个响应中查找
-                if not chunk_base64 and isinstance(result, dict):
-                    for field in ["data", "Data", "FileData", "Image"]:
-                        if field in result:
-                            logger.debug(f"[WX849] 从result.{field}字段获取图片数据")
-                            chunk_base64 = result.get(field)
-                            break
-
-                if not chunk_base64:
-                    logger.error(f"[WX849] 下载图片分段失败: 响应中无图片数据")
-                    all_chunks_success = False
-                    break
-
-                # 解码数据并保存图片分段
-                try:
-                    # 尝试确定数据类型并正确处理
-                    if isinstance(chunk_base64, str):
-                        # 尝试作为Base64解码
-                        try:
-                            # 修复：确保字符串是有效的Base64
-                            # 移除可能的非Base64字符
-                            clean_base64 = chunk_base64.strip()
-                            # 确保长度是4的倍数，如果不是，添加填充
-                            padding = 4 - (len(clean_base64) % 4) if len(clean_base64) % 4 != 0 else 0
-                            clean_base64 = clean_base64 + ('=' * padding)
-
-                            import base64
-                            chunk_data = base64.b64decode(clean_base64)
-                            logger.debug(f"[WX849] 成功解码Base64数据，大小: {len(chunk_data)} 字节")
-                        except Exception as decode_err:
-                            logger.error(f"[WX849] Base64解码失败: {decode_err}")
-                            all_chunks_success = False
-                            break
-                    elif isinstance(chunk_base64, bytes):
-                        # 已经是二进制数据，直接使用
-                        logger.debug(f"[WX849] 使用二进制数据，大小: {len(chunk_base64)} 字节")
-                        chunk_data = chunk_base64
-                    else:
-                        logger.error(f"[WX849] 未知数据类型: {type(chunk_base64)}")
-                        all_chunks_success = False
-                        break
-
-                    # 追加到文件
-                    with open(image_path, "ab") as f:
-                        f.write(chunk_data)
-                    logger.debug(f"[WX849] 第 {i+1}/{num_chunks} 段下载成功，大小: {len(chunk_data)} 字节")
-                except Exception as decode_err:
-                    logger.error(f"[WX849] 解码Base64图片分段数据失败: {decode_err}")
-                    all_chunks_success = False
-                    break
-            except Exception as api_err:
-                logger.error(f"[WX849] 调用图片分段API失败: {api_err}")
-                all_chunks_success = False
-                break
-
-        if all_chunks_success:
-            # 检查文件大小
-            file_size = os.path.getsize(image_path)
-            logger.info(f"[WX849] 分段下载图片成功，总大小: {file_size} 字节")
-
-            # 检查文件是否存在且有效
-            if os.path.exists(image_path) and os.path.getsize(image_path) > 0:
-                # 验证图片文件是否为有效的图片格式
-                try:
-                    from PIL import Image
-                    try:
-                        # 尝试打开图片文件
-                        with Image.open(image_path) as img:
-                            # 获取图片格式和大小
-                            img_format = img.format
-                            img_size = img.size
-                            logger.info(f"[WX849] 图片验证成功: 格式={img_format}, 大小={img_size}")
-                            return image_path
-                    except Exception as img_err:
-                        logger.error(f"[WX849] 图片验证失败，可能不是有效的图片文件: {img_err}")
-                except ImportError:
-                    # 如果PIL库未安装，假设文件有效
-                    if os.path.getsize(image_path) > 10000:  # 至少10KB
-                        logger.info(f"[WX849] 图片下载完成，保存到: {image_path}")
-                        return image_path
-
-        # 如果下载失败，删除可能存在的不完整文件
-        if os.path.exists(image_path):
-            try:
-                os.remove(image_path)
-            except Exception as e:
-                logger.error(f"[WX849] 删除不完整的图片文件失败: {e}")
+        # 使用传入的图片大小，未设置时由下载器估计并按实际数据截断
+        data_len = getattr(self, "data_len", 0)
+        coro = self.image_downloader.download(msg_id, group_id if group_id else "filehelper", self.wxid, data_len)
+        try:
+            # 在通道事件循环中下载，与消息处理中的下载共用去重和连接
+            image_path = self.dispatcher.run_coroutine_sync(coro, timeout=IMAGE_DOWNLOAD_TIMEOUT)
+        except Exception as e:
+            logger.error(f"[WX849] 下载图片失败: {e}")
+            return None
 
-        return None
+        if image_path:
+            self._verify_image(image_path)
+        return image_path
 
     def reply(self, reply: Reply, context: Context = None):
         """回复消息的统一处理函数"""
@@ -7447,15 +5216,15 @@ class WX849Channel(ChatChannel):
             logger.error("[WX849] 回复失败: 接收者为空")
             return
 
-        # 创建简单的事件循环，用于执行异步任务
-        loop = asyncio.new_event_loop()
+        # 在通道事件循环中发送并等待完成
+        run = self.dispatcher.run_coroutine_sync
 
         if reply.type == ReplyType.TEXT:
             # 发送文本消息
             logger.debug(f"[WX849] 开始发送文本消息: {reply.content}")
             try:
                 # 发送文本
-                result = loop.run_until_complete(self._send_text_message(receiver, reply.content))
+                result = run(self._send_text_message(receiver, reply.content))
                 if result:
                     logger.info(f"[WX849] 发送文本成功: 接收者: {receiver}, 内容: {reply.content[:20]}...")
                 else:
@@ -7482,7 +5251,7 @@ class WX849Channel(ChatChannel):
                     image_path = tmp_path
 
                 # 发送图片文件
-                result = loop.run_until_complete(self._send_image(receiver, image_path))
+                result = run(self._send_image(receiver, image_path))
 
                 # 如果是URL类型，删除临时文件
                 if reply.type == ReplyType.IMAGE_URL:
@@ -7505,7 +5274,7 @@ class WX849Channel(ChatChannel):
             logger.debug(f"[WX849] 开始发送语音, 文件路径={voice_path}")
             try:
                 # 使用统一的语音发送方法，会自动处理短语音和长语音的分割
-                result = loop.run_until_complete(self._send_voice(receiver, voice_path))
+                result = run(self._send_voice(receiver, voice_path))
                 if result:
                     logger.info(f"[WX849] 发送语音成功: 接收者: {receiver}")
                 else:
@@ -7528,7 +5297,7 @@ class WX849Channel(ChatChannel):
                         f.write(block)
 
                 # 使用统一的语音发送方法，会自动处理短语音和长语音的分割
-                result = loop.run_until_complete(self._send_voice(receiver, tmp_path))
+                result = run(self._send_voice(receiver, tmp_path))
 
                 if result:
                     logger.info(f"[WX849] 发送语音成功: 接收者: {receiver}")
@@ -7545,6 +5314,4 @@ class WX849Channel(ChatChannel):
                 logger.error(traceback.format_exc())
 
         else:
-            logger.warning(f"[WX849] 不支持的回复类型: {reply.type}")
-
-        loop.close()
\ No newline at end of file
+            logger.warning(f"[WX849] 不支持的回复类型: {reply.type}")
\ No newline at end of file
@@ -0,0 +1,200 @@
+"""
+wx849 联系人目录
+
+群聊信息(tmp/wx849_rooms.json)和联系人信息(tmp/wx849_contacts.json)启动时只加载一次，
+在内存中维护 wxid->昵称、(群ID, wxid)->群内显示名称 的哈希索引，查询为O(1)。
+群成员、群名称和联系人的更新直接写入内存并刷新索引，文件由后台线程合并写回，不阻塞消息处理。
+"""
+
+import json
+import os
+import threading
+import time
+
+from common.log import logger
+
+
+def _member_name(member: dict):
+    # 优先使用群内显示名称(群昵称)，其次使用个人昵称
+    return member.get("DisplayName") or member.get("NickName") or None
+
+
+class ContactDirectory:
+    def __init__(self, tmp_dir, save_delay=2):
+        self.rooms_file = os.path.join(tmp_dir, "wx849_rooms.json")
+        self.contacts_file = os.path.join(tmp_dir, "wx849_contacts.json")
+        self.save_delay = save_delay  # 合并写回的等待时间，单位秒
+        self.lock = threading.RLock()
+        self.rooms = {}  # room_id -> 群信息，与wx849_rooms.json格式一致
+        self.contacts = {}  # wxid -> 联系人信息，与wx849_contacts.json格式一致
+        self.member_names = {}  # (room_id, wxid) -> 群内显示名称
+        self.nicknames = {}  # wxid -> 在任意群中看到的名称，用于不带群ID的查询
+        self.member_rooms = {}  # wxid -> 有该成员的群ID集合，成员退出所有群后从nicknames中移除
+        self.dirty = set()  # 待写回的文件
+        self.save_event = threading.Event()
+        self.write_lock = threading.Lock()  # shutdown和后台线程可能同时flush，文件按顺序逐个写入
+        self.loaded = False
+
+    def load(self):
+        with self.lock:
+            if self.loaded:
+                return
+            self.rooms = self._read(self.rooms_file, {})
+            contacts = self._read(self.contacts_file, {})
+            if isinstance(contacts, list):
+                # 兼容旧格式: [{"wxid": ..., "nickname": ...}]
+                contacts = {c["wxid"]: {"UserName": c["wxid"], "NickName": c.get("nickname", "")}
+                            for c in contacts if isinstance(c, dict) and c.get("wxid")}
+            self.contacts = contacts
+            for room_id, room in self.rooms.items():
+                self._index_members(room_id, room.get("members") or [])
+            self.loaded = True
+        threading.Thread(target=self._save_loop, daemon=True, name="wx849-contacts").start()
+        logger.info("[WX849] 联系人目录已加载: {} 个群聊, {} 个联系人".format(len(self.rooms), len(self.contacts)))
+
+    @staticmethod
+    def _read(path, default):
+        if not os.path.exists(path):
+            return default
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            logger.error("[WX849] 加载 {} 失败: {}".format(path, e))
+            return default
+
+    def _index_members(self, room_id, members):
+        for member in members:
+            if not isinstance(member, dict) or not member.get("UserName"):
+                continue
+            name = _member_name(member)
+            if name:
+                self.member_names[(room_id, member["UserName"])] = name
+                self.nicknames[member["UserName"]] = name
+                self.member_rooms.setdefault(member["UserName"], set()).add(room_id)
+
+    def _unindex_members(self, room_id, members):
+        for member in members:
+            if not isinstance(member, dict):
+                continue
+            wxid = member.get("UserName")
+            if self.member_names.pop((room_id, wxid), None) is None:
+                continue
+            rooms = self.member_rooms.get(wxid)
+            if rooms is not None:
+                rooms.discard(room_id)
+            if rooms:
+                # 还在其他群中，使用其他群中的名称
+                self.nicknames[wxid] = self.member_names[(next(iter(rooms)), wxid)]
+            else:
+                self.member_rooms.pop(wxid, None)
+                self.nicknames.pop(wxid, None)
+
+    # ---------- 查询 ----------
+
+    def room(self, room_id):
+        return self.rooms.get(room_id)
+
+    def room_name(self, room_id):
+        room = self.rooms.get(room_id)
+        return room.get("nickName") if room else None
+
+    def member_name(self, room_id, wxid):
+        return self.member_names.get((room_id, wxid))
+
+    def has_member(self, room_id, wxid):
+        return (room_id, wxid) in self.member_names
+
+    def nickname(self, wxid):
+        """不带群ID查询昵称：先查群成员，再查联系人"""
+        name = self.nicknames.get(wxid)
+        if name:
+            return name
+        contact = self.contacts.get(wxid)
+        return contact.get("NickName") if contact else None
+
+    def contact(self, wxid):
+        return self.contacts.get(wxid)
+
+    def is_room_fresh(self, room_id, expiry, need_members=True, need_name=False):
+        room = self.rooms.get(room_id)
+        if not room or time.time() - room.get("last_update", 0) >= expiry:
+            return False
+        if need_members and not room.get("members"):
+            return False
+        if need_name and (not room.get("nickName") or room.get("nickName") == room_id):
+            return False
+        return True
+
+    # ---------- 更新 ----------
+
+    def update_room(self, room_id, nick_name=None, owner=None, members=None, member_count=None):
+        with self.lock:
+            room = self.rooms.get(room_id)
+            if room is None:
+                room = {"chatroomId": room_id, "nickName": room_id, "chatRoomOwner": "", "members": []}
+                self.rooms[room_id] = room
+            if nick_name:
+                room["nickName"] = nick_name
+            if owner:
+                room["chatRoomOwner"] = owner
+            if members is not None:
+                # 只刷新本群的成员索引，已退群的成员同时移除
+                self._unindex_members(room_id, room.get("members") or [])
+                room["members"] = members
+                self._index_members(room_id, members)
+            if member_count is not None:
+                room["memberCount"] = member_count
+            room["last_update"] = int(time.time())
+            self._mark_dirty(self.rooms_file)
+            return room
+
+    def update_contact(self, wxid, nick_name=None, remark_name=None):
+        with self.lock:
+            contact = self.contacts.get(wxid)
+            if contact is None:
+                contact = {"UserName": wxid, "NickName": nick_name or wxid, "RemarkName": remark_name or ""}
+                self.contacts[wxid] = contact
+            if nick_name:
+                contact["NickName"] = nick_name
+            if remark_name:
+                contact["RemarkName"] = remark_name
+            contact["last_update"] = int(time.time())
+            self._mark_dirty(self.contacts_file)
+            return contact
+
+    # ---------- 写回 ----------
+
+    def _mark_dirty(self, path):
+        self.dirty.add(path)
+        self.save_event.set()
+
+    def _save_loop(self):
+        while True:
+            self.save_event.wait()
+            time.sleep(self.save_delay)  # 合并短时间内的多次更新
+            self.flush()
+
+    def flush(self):
+        # 取数据和写文件都在write_lock内，并发flush时后取的数据一定后写入，不会被旧数据覆盖
+        with self.write_lock:
+            with self.lock:
+                self.save_event.clear()
+                dirty, self.dirty = self.dirty, set()
+                payloads = {}
+                if self.rooms_file in dirty:
+                    payloads[self.rooms_file] = json.dumps(self.rooms, ensure_ascii=False, indent=2)
+                if self.contacts_file in dirty:
+                    payloads[self.contacts_file] = json.dumps(self.contacts, ensure_ascii=False, indent=2)
+            for path, payload in payloads.items():
+                try:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    tmp_path = path + ".tmp"
+                    with open(tmp_path, "w", encoding="utf-8") as f:
+                        f.write(payload)
+                    os.replace(tmp_path, path)
+                except Exception as e:
+                    logger.error("[WX849] 写入 {} 失败: {}".format(path, e))
+                    with self.lock:
+                        # 下次写回时重试
+                        self._mark_dirty(path)
@@ -0,0 +1,91 @@
+"""
+wx849 回调消息调度器
+
+所有回调消息都在通道唯一的事件循环中排队，同一会话的消息按到达顺序依次处理，不同会话之间并发处理。
+消息处理逻辑(handle_group/handle_single)是同步代码，统一在有界线程池中执行，处理结果再通过ChatChannel.produce进入通用处理流程。
+"""
+
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from common.log import logger
+
+
+class WX849Dispatcher:
+    def __init__(self, max_workers=16, max_pending=1000):
+        self.loop = None  # 通道的事件循环，start后赋值
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="wx849-msg")
+        self.max_pending = max_pending
+        self.queues = {}  # conversation_id -> asyncio.Queue, 只在事件循环中访问
+        self.slots = None  # 限制排队中的消息总数，队列满时回调请求会等待，形成背压
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.slots = asyncio.Semaphore(self.max_pending)
+
+    def is_running(self):
+        return self.loop is not None and self.loop.is_running() and not self.loop.is_closed()
+
+    async def submit(self, conversation_id, fn, *args):
+        """在事件循环中调用，将同步处理函数加入对应会话的队列"""
+        await self.slots.acquire()
+        queue = self.queues.get(conversation_id)
+        if queue is None:
+            queue = asyncio.Queue()
+            self.queues[conversation_id] = queue
+            self.loop.create_task(self._drain(conversation_id, queue))
+        queue.put_nowait((fn, args))
+
+    async def _drain(self, conversation_id, queue: asyncio.Queue):
+        # 每个会话一个worker协程，队列处理完即退出，保证同一会话内的消息按顺序处理
+        while not queue.empty():
+            fn, args = queue.get_nowait()
+            try:
+                await self.loop.run_in_executor(self.executor, fn, *args)
+            except Exception as e:
+                logger.exception("[WX849] dispatcher task failed, conversation={}: {}".format(conversation_id, e))
+            finally:
+                self.slots.release()
+        del self.queues[conversation_id]
+
+    def run_coroutine(self, coro):
+        """从任意线程提交协程到通道事件循环，不等待结果；事件循环未启动时退化为临时线程执行"""
+        if self.is_running():
+            future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+            future.add_done_callback(_log_exception)
+            return future
+        threading.Thread(target=asyncio.run, args=(coro,), daemon=True).start()
+
+    def run_coroutine_sync(self, coro, timeout=None):
+        """
+        从消息处理线程提交协程到通道事件循环并等待结果，不再为每次调用创建事件循环；
+        事件循环未启动时在当前线程临时执行。不能在事件循环线程中调用，否则会阻塞事件循环
+        """
+        if not self.is_running():
+            return asyncio.run(coro)
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            coro.close()
+            raise RuntimeError("run_coroutine_sync called from the dispatcher loop")
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            future.cancel()  # 超时后不再继续执行
+            raise
+
+    def stats(self) -> dict:
+        return {
+            "conversations": len(self.queues),
+            "pending": sum(q.qsize() for q in list(self.queues.values())),
+        }
+
+
+def _log_exception(future):
+    if not future.cancelled() and future.exception():
+        logger.error("[WX849] background coroutine failed: {}".format(future.exception()))
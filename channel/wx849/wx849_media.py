@@ -0,0 +1,297 @@
+"""
+wx849 图片分段下载
+
+协议接口每次最多返回64KB的base64数据。下载时文件只打开一次并按总大小预分配，
+各分段在有限并发下同时请求，收到后立即解码并写入对应偏移；
+消息中没有图片大小时逐段顺序下载，直到某一段不满64KB。
+未完成的下载保留.part文件和进度记录，下次从缺失的分段继续；md5与消息中的不一致时清除进度，下次重新下载。
+同一MsgId只下载一次，并发或重复投递的消息直接复用结果。文件读写和md5计算在线程池中执行，不阻塞事件循环。
+
+语音消息在回调中只带voiceurl，通道不下载收到的语音，这里只处理图片。
+"""
+
+import asyncio
+import base64
+import binascii
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import Future
+
+from common.log import logger
+from config import conf
+
+CHUNK_SIZE = 65536  # 协议接口限制每次最多下载64KB
+DEFAULT_IMAGE_SIZE = 229920  # XML中没有长度时，请求参数中总大小的最小估计值
+MAX_IMAGE_SIZE = 32 * 1024 * 1024  # 没有长度时最多下载的大小，避免接口一直返回整段时无限请求
+
+# 响应中可能存放图片数据的位置，按优先级排列
+PAYLOAD_PATHS = [
+    ("Data", "buffer"),
+    ("Data", "data", "buffer"),
+    ("Data", "Chunk"),
+    ("Data", "Image"),
+    ("Data", "Data"),
+    ("Data", "FileData"),
+    ("Data", "data"),
+    ("Data",),
+    ("data",),
+    ("FileData",),
+    ("Image",),
+]
+
+
+def _lookup(obj, path):
+    for key in path:
+        if not isinstance(obj, dict) or key not in obj:
+            return None
+        obj = obj[key]
+    return obj if isinstance(obj, (str, bytes)) and obj else None
+
+
+def _decode(payload):
+    if isinstance(payload, bytes):
+        return payload
+    payload = payload.strip()
+    return base64.b64decode(payload + "=" * (-len(payload) % 4))
+
+
+class ImageDownloader:
+    def __init__(self, api, media_dir):
+        self.api = api
+        self.media_dir = media_dir
+        self.max_parallel = conf().get("wx849_image_download_parallel", 4)
+        self.lock = threading.Lock()
+        self.inflight = {}  # msg_id -> Future，同一消息的并发请求共用一次下载
+        self.payload_path = PAYLOAD_PATHS[0]  # 上次命中的数据位置，避免每个分段都重新探测
+
+    def final_path(self, msg_id):
+        return os.path.join(self.media_dir, f"img_{msg_id}.jpg")
+
+    def lookup(self, msg_id):
+        """已下载完成的图片路径，没有时返回None"""
+        path = self.final_path(msg_id)
+        return path if os.path.exists(path) and os.path.getsize(path) > 0 else None
+
+    async def download(self, msg_id, to_wxid, wxid, data_len=0, md5=None):
+        """下载图片，返回本地路径，失败返回None"""
+        path = self.lookup(msg_id)
+        if path:
+            logger.debug(f"[WX849] 图片 {msg_id} 已下载，直接复用: {path}")
+            return path
+        with self.lock:
+            future = self.inflight.get(msg_id)
+            owner = future is None
+            if owner:
+                future = Future()
+                self.inflight[msg_id] = future
+        if not owner:
+            logger.debug(f"[WX849] 图片 {msg_id} 正在下载，等待结果")
+            return await asyncio.wrap_future(future)
+        path = None
+        try:
+            path = await self._download(msg_id, to_wxid, wxid, data_len, md5)
+            return path
+        except Exception as e:
+            logger.error(f"[WX849] 下载图片 {msg_id} 失败: {e}")
+            return None
+        finally:
+            with self.lock:
+                self.inflight.pop(msg_id, None)
+            future.set_result(path)
+
+    async def _download(self, msg_id, to_wxid, wxid, data_len, md5):
+        os.makedirs(self.media_dir, exist_ok=True)
+        final_path = self.final_path(msg_id)
+        part_path = final_path + ".part"
+        progress_path = final_path + ".progress"
+        if data_len > 0:
+            end = await self._download_parallel(msg_id, to_wxid, wxid, data_len, part_path, progress_path)
+        else:
+            end = await self._download_sequential(msg_id, to_wxid, wxid, part_path, progress_path)
+        if end is None:
+            return None
+
+        loop = asyncio.get_running_loop()
+        checksum = await loop.run_in_executor(None, self._md5, part_path)
+        if md5 and checksum != md5.lower():
+            # 数据有误，保留.part文件但清除进度，下次所有分段重新下载
+            logger.error(f"[WX849] 图片 {msg_id} md5与消息中的不一致: {checksum} != {md5}，下次重新下载")
+            await loop.run_in_executor(None, self._remove, progress_path)
+            return None
+        await loop.run_in_executor(None, os.replace, part_path, final_path)
+        await loop.run_in_executor(None, self._remove, progress_path)
+        logger.info(f"[WX849] 图片 {msg_id} 下载完成，大小: {end} 字节，md5: {checksum}")
+        return final_path
+
+    async def _download_parallel(self, msg_id, to_wxid, wxid, data_len, part_path, progress_path):
+        """已知总大小：预分配文件，各分段并发下载后写入对应偏移，返回文件大小，未完成返回None"""
+        num_chunks = (data_len + CHUNK_SIZE - 1) // CHUNK_SIZE
+        done, end = self._load_progress(part_path, progress_path, data_len)
+        pending = [i for i in range(num_chunks) if i not in done]
+        if done:
+            logger.info(f"[WX849] 继续下载图片 {msg_id}，已完成 {len(done)}/{num_chunks} 段")
+        else:
+            logger.info(f"[WX849] 开始分段下载图片 {msg_id}，总大小: {data_len} 字节，分 {num_chunks} 段下载")
+
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(self.max_parallel)
+        write_lock = threading.Lock()  # 各分段在线程池中写入同一文件句柄，seek和write需要一起执行
+        f = await loop.run_in_executor(None, self._open, part_path, data_len)
+        try:
+            async def fetch(index):
+                start = index * CHUNK_SIZE
+                size = min(CHUNK_SIZE, data_len - start)
+                async with semaphore:
+                    chunk = await self._fetch_chunk(msg_id, to_wxid, wxid, data_len, start, size, f"{index + 1}/{num_chunks}")
+                if chunk is None:
+                    return index, False
+                if len(chunk) != size:
+                    # 不完整的分段会在预分配的文件中留下空洞，按失败处理
+                    logger.error(f"[WX849] 第 {index + 1}/{num_chunks} 段数据不完整: {len(chunk)}/{size} 字节")
+                    return index, False
+                await loop.run_in_executor(None, self._write_at, f, write_lock, start, chunk)
+                return index, True
+
+            results = await asyncio.gather(*(fetch(i) for i in pending))
+        finally:
+            await loop.run_in_executor(None, f.close)
+
+        for index, ok in results:
+            if ok:
+                done.add(index)
+                end = max(end, min(data_len, (index + 1) * CHUNK_SIZE))
+        if len(done) < num_chunks:
+            await loop.run_in_executor(None, self._save_progress, progress_path, data_len, done, end)
+            logger.warning(f"[WX849] 图片 {msg_id} 未下载完整 ({len(done)}/{num_chunks} 段)，下次继续")
+            return None
+        return end
+
+    async def _download_sequential(self, msg_id, to_wxid, wxid, part_path, progress_path):
+        """
+        XML中没有长度：逐段请求完整的64KB，直到某一段不满64KB表示数据结束，返回文件大小，未完成返回None
+        不知道总大小时无法并发，否则会请求到数据末尾之后的分段
+        """
+        done, end = self._load_progress(part_path, progress_path, 0)
+        if end % CHUNK_SIZE:
+            # 已经收到最后一段，只是上次没来得及完成
+            return end
+        if end:
+            logger.info(f"[WX849] 继续下载图片 {msg_id}，已下载 {end} 字节")
+        else:
+            logger.info(f"[WX849] 开始分段下载图片 {msg_id}，总大小未知，逐段下载")
+        loop = asyncio.get_running_loop()
+        write_lock = threading.Lock()
+        f = await loop.run_in_executor(None, self._open, part_path, end)
+        try:
+            while end < MAX_IMAGE_SIZE:
+                index = end // CHUNK_SIZE
+                # 接口需要总大小，按至少还有一整段估计
+                estimate = max(DEFAULT_IMAGE_SIZE, end + CHUNK_SIZE)
+                # 图片大小刚好是64KB的整数倍时，数据末尾之后的分段返回成功但没有数据
+                chunk = await self._fetch_chunk(msg_id, to_wxid, wxid, estimate, end, CHUNK_SIZE, f"{index + 1}",
+                                                allow_empty=end > 0)
+                if chunk is None:
+                    await loop.run_in_executor(None, self._save_progress, progress_path, 0, done, end)
+                    logger.warning(f"[WX849] 图片 {msg_id} 未下载完整 (已下载 {end} 字节)，下次继续")
+                    return None
+                await loop.run_in_executor(None, self._write_at, f, write_lock, end, chunk)
+                end += len(chunk)
+                done.add(index)
+                if len(chunk) < CHUNK_SIZE:
+                    return end
+        finally:
+            await loop.run_in_executor(None, f.close)
+        logger.error(f"[WX849] 图片 {msg_id} 超过 {MAX_IMAGE_SIZE} 字节仍未结束，放弃下载")
+        await loop.run_in_executor(None, self._remove, part_path)
+        await loop.run_in_executor(None, self._remove, progress_path)
+        return None
+
+    async def _fetch_chunk(self, msg_id, to_wxid, wxid, data_len, start, size, label, allow_empty=False):
+        """下载一个分段，返回解码后的数据，失败返回None；allow_empty时接口成功但没有数据返回空bytes"""
+        params = {
+            "MsgId": msg_id,
+            "ToWxid": to_wxid,
+            "Wxid": wxid,
+            "DataLen": data_len,
+            "CompressType": 0,
+            "Section": {"StartPos": start, "DataLen": size},
+        }
+        result = await self.api.post("/Tools/DownloadImg", json=params, idempotent=True)
+        chunk = self._extract(result)
+        if chunk is None and allow_empty and isinstance(result, dict) and result.get("Success", False):
+            return b""
+        if chunk is None:
+            logger.error(f"[WX849] 第 {label} 段下载失败: "
+                         f"{result.get('Message', '响应中无图片数据') if result else '接口无响应'}")
+        return chunk
+
+    def _extract(self, result):
+        if not isinstance(result, dict) or not result.get("Success", False):
+            return None
+        payload = _lookup(result, self.payload_path)
+        if payload is None:
+            for path in PAYLOAD_PATHS:
+                payload = _lookup(result, path)
+                if payload is not None:
+                    self.payload_path = path
+                    break
+        if payload is None:
+            return None
+        try:
+            return _decode(payload)
+        except (binascii.Error, ValueError) as e:
+            logger.error(f"[WX849] 解码图片分段失败: {e}")
+            return None
+
+    @staticmethod
+    def _load_progress(part_path, progress_path, data_len):
+        if not os.path.exists(part_path) or not os.path.exists(progress_path):
+            return set(), 0
+        try:
+            with open(progress_path, "r", encoding="utf-8") as f:
+                progress = json.load(f)
+            if progress.get("data_len") == data_len:
+                return set(progress.get("done", [])), progress.get("end", 0)
+        except Exception as e:
+            logger.warning(f"[WX849] 读取图片下载进度失败，重新下载: {e}")
+        return set(), 0
+
+    @staticmethod
+    def _save_progress(progress_path, data_len, done, end):
+        try:
+            with open(progress_path, "w", encoding="utf-8") as f:
+                json.dump({"data_len": data_len, "done": sorted(done), "end": end}, f)
+        except Exception as e:
+            logger.warning(f"[WX849] 保存图片下载进度失败: {e}")
+
+    @staticmethod
+    def _open(path, size):
+        """打开.part文件并调整到size，已有的数据保留"""
+        f = open(path, "r+b" if os.path.exists(path) else "w+b")
+        try:
+            f.truncate(size)
+        except BaseException:
+            f.close()
+            raise
+        return f
+
+    @staticmethod
+    def _write_at(f, lock, offset, data):
+        with lock:
+            f.seek(offset)
+            f.write(data)
+
+    @staticmethod
+    def _remove(path):
+        if os.path.exists(path):
+            os.remove(path)
+
+    @staticmethod
+    def _md5(path):
+        digest = hashlib.md5()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(CHUNK_SIZE), b""):
+                digest.update(block)
+        return digest.hexdigest()
@@ -1,42 +1,121 @@
-from datetime import datetime, timedelta
+import threading
+import time
+from collections import OrderedDict
 
+_MISSING = object()
 
-class ExpiredDict(dict):
-    def __init__(self, expires_in_seconds):
-        super().__init__()
+
+class ExpiredDict(object):
+    """
+    带过期时间和容量上限的缓存，线程安全
+
+    每次读写都会刷新key的过期时间，并把key移到队尾，所以队列始终按过期时间排序，
+    过期清理只需从队首弹出，摊还O(1)；超过max_size时淘汰最久未访问的key。
+    写入后不再读取的key(如消息去重ID)也会在后续操作中被清理，不会无限增长。
+    """
+
+    def __init__(self, expires_in_seconds, max_size=None, clock=time.monotonic):
         self.expires_in_seconds = expires_in_seconds
+        self.max_size = max_size
+        self.clock = clock
+        self.lock = threading.RLock()
+        self.data = OrderedDict()  # key -> (value, expiry_time)，按过期时间从早到晚排列
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+
+    def _purge(self, now):
+        while self.data:
+            key, (_, expiry_time) = next(iter(self.data.items()))
+            if expiry_time > now:
+                break
+            del self.data[key]
+            self.expirations += 1
+
+    def _lookup(self, key):
+        now = self.clock()
+        self._purge(now)
+        item = self.data.get(key, _MISSING)
+        if item is _MISSING:
+            self.misses += 1
+            return _MISSING
+        self.hits += 1
+        self.data[key] = (item[0], now + self.expires_in_seconds)
+        self.data.move_to_end(key)
+        return item[0]
 
     def __getitem__(self, key):
-        value, expiry_time = super().__getitem__(key)
-        if datetime.now() > expiry_time:
-            del self[key]
+        with self.lock:
+            value = self._lookup(key)
+        if value is _MISSING:
             raise KeyError("expired {}".format(key))
-        self.__setitem__(key, value)
         return value
 
     def __setitem__(self, key, value):
-        expiry_time = datetime.now() + timedelta(seconds=self.expires_in_seconds)
-        super().__setitem__(key, (value, expiry_time))
+        with self.lock:
+            now = self.clock()
+            self._purge(now)
+            self.data[key] = (value, now + self.expires_in_seconds)
+            self.data.move_to_end(key)
+            if self.max_size:
+                while len(self.data) > self.max_size:
+                    self.data.popitem(last=False)
+                    self.evictions += 1
+
+    def __delitem__(self, key):
+        with self.lock:
+            del self.data[key]
 
     def get(self, key, default=None):
-        try:
-            return self[key]
-        except KeyError:
-            return default
+        with self.lock:
+            value = self._lookup(key)
+        return default if value is _MISSING else value
+
+    def pop(self, key, default=None):
+        with self.lock:
+            self._purge(self.clock())
+            item = self.data.pop(key, _MISSING)
+        return default if item is _MISSING else item[0]
 
     def __contains__(self, key):
-        try:
-            self[key]
-            return True
-        except KeyError:
-            return False
+        with self.lock:
+            return self._lookup(key) is not _MISSING
+
+    def __len__(self):
+        with self.lock:
+            self._purge(self.clock())
+            return len(self.data)
 
     def keys(self):
-        keys = list(super().keys())
-        return [key for key in keys if key in self]
+        with self.lock:
+            self._purge(self.clock())
+            return list(self.data.keys())
+
+    def values(self):
+        with self.lock:
+            self._purge(self.clock())
+            return [value for value, _ in self.data.values()]
 
     def items(self):
-        return [(key, self[key]) for key in self.keys()]
+        with self.lock:
+            self._purge(self.clock())
+            return [(key, value) for key, (value, _) in self.data.items()]
 
     def __iter__(self):
-        return self.keys().__iter__()
+        return iter(self.keys())
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "size": len(self.data),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "expirations": self.expirations,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,43 @@
+"""
+共享HTTP连接池
+
+直接调用requests.post时每个请求都要重新建立TCP和TLS连接。
+session()返回进程内共享的requests.Session，同一host的连接会被复用；
+preconnect(url)用于启动预热，提前建立连接并放入连接池，首条消息不必再等待握手。
+"""
+
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from common.log import logger
+from config import conf
+
+_lock = threading.Lock()
+_session = None
+
+
+def session() -> requests.Session:
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                s = requests.Session()
+                adapter = HTTPAdapter(pool_connections=16, pool_maxsize=conf().get("http_pool_size", 32))
+                s.mount("http://", adapter)
+                s.mount("https://", adapter)
+                _session = s
+    return _session
+
+
+def preconnect(url, timeout=5):
+    """向url发一个HEAD请求，建立的连接留在连接池中，失败时只记录日志"""
+    try:
+        proxy = conf().get("proxy")
+        proxies = {"http": proxy, "https": proxy} if proxy else None
+        session().head(url, timeout=timeout, proxies=proxies, allow_redirects=False)
+        return True
+    except Exception as e:
+        logger.debug("[HTTP] preconnect {} failed: {}".format(url, e))
+        return False
@@ -0,0 +1,87 @@
+"""
+模块导入耗时统计，用于 python app.py --import-profile
+
+install()在sys.meta_path最前面插入一个finder，记录之后每个源码模块和扩展模块执行(exec_module)的耗时：
+累计耗时包含它导入的其他模块，自身耗时不包含。需要在导入其他模块之前调用。
+"""
+
+import sys
+import threading
+import time
+from importlib.machinery import ExtensionFileLoader, SourceFileLoader, SourcelessFileLoader
+
+_lock = threading.Lock()
+_local = threading.local()
+_records = {}  # 模块名 -> (累计耗时, 自身耗时)
+_finder = None
+
+
+def _timed(fullname, exec_module):
+    def wrapper(module):
+        stack = getattr(_local, "stack", None)
+        if stack is None:
+            stack = _local.stack = []
+        stack.append(0.0)  # 子模块耗时
+        start = time.perf_counter()
+        try:
+            return exec_module(module)
+        finally:
+            elapsed = time.perf_counter() - start
+            children = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            with _lock:
+                _records[fullname] = (elapsed, elapsed - children)
+
+    return wrapper
+
+
+class _TimingFinder(object):
+    def find_spec(self, fullname, path=None, target=None):
+        for finder in sys.meta_path:
+            if finder is self:
+                continue
+            find_spec = getattr(finder, "find_spec", None)
+            if find_spec is None:
+                continue
+            spec = find_spec(fullname, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+        # 这几种loader每个模块一个实例，可以直接替换实例上的exec_module；内置、冻结模块的loader是类本身，不处理
+        if isinstance(spec.loader, (SourceFileLoader, SourcelessFileLoader, ExtensionFileLoader)):
+            spec.loader.exec_module = _timed(fullname, spec.loader.exec_module)
+        return spec
+
+
+def install():
+    global _finder
+    if _finder is None:
+        _finder = _TimingFinder()
+        sys.meta_path.insert(0, _finder)
+
+
+def enabled():
+    return _finder is not None
+
+
+def report(top=30):
+    """按累计耗时列出最慢的模块，并按顶层包汇总自身耗时"""
+    with _lock:
+        records = dict(_records)
+    if not records:
+        return "import profile: no module imported"
+    packages = {}
+    for name, (_, self_time) in records.items():
+        package = name.split(".")[0]
+        packages[package] = packages.get(package, 0.0) + self_time
+    total = sum(packages.values())
+    lines = ["import profile: {} modules, {:.0f}ms in total".format(len(records), total * 1000)]
+    lines.append("slowest modules (cumulative / self):")
+    for name, (cumulative, self_time) in sorted(records.items(), key=lambda item: item[1][0], reverse=True)[:top]:
+        lines.append("  {:<50} {:>8.1f}ms {:>8.1f}ms".format(name, cumulative * 1000, self_time * 1000))
+    lines.append("by top-level package (self):")
+    for package, self_time in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]:
+        lines.append("  {:<50} {:>8.1f}ms".format(package, self_time * 1000))
+    return "\n".join(lines)
@@ -1,4 +1,9 @@
+import atexit
+import collections
+import json
 import os
+import threading
+import time
 from loguru import logger
 import sys
 from typing import Any, Callable
@@ -40,42 +45,250 @@ logger: CustomLogger = logger_instance
 
 # 添加全局变量存储当前日志级别
 level = "INFO"
+_level_no = 20
+# 为True时日志由后台线程写入控制台和文件，调用方不等待IO
+enqueue = False
+# 单条日志消息的最大长度，超过时截断，0为不限制
+max_length = 0
 
-def set_log_level(new_level: str):
-    """设置日志级别"""
-    global level
+def set_log_level(new_level: str, **options):
+    """设置日志级别，options可以同时修改enqueue、max_length"""
+    global level, enqueue, max_length
     level = new_level
+    enqueue = options.get("enqueue", enqueue)
+    max_length = options.get("max_length", max_length)
     # 重新配置logger
     set_logger()
 
+def debug_enabled():
+    """是否输出DEBUG日志，用于跳过只为日志准备数据的代码"""
+    return _level_no <= 10
+
+def truncate(text, limit=None):
+    """截断过长的文本，limit默认为max_length"""
+    limit = max_length if limit is None else limit
+    if limit and len(text) > limit:
+        return "{}...(共{}字符)".format(text[:limit], len(text))
+    return text
+
+class _LazyJson(object):
+    __slots__ = ("obj", "limit", "text")
+
+    def __init__(self, obj, limit):
+        self.obj = obj
+        self.limit = limit
+        self.text = None
+
+    def __str__(self):
+        # 彩色输出的控制台会再格式化一次消息，只序列化一次
+        if self.text is None:
+            try:
+                text = json.dumps(self.obj, ensure_ascii=False, default=str)
+            except Exception:
+                text = repr(self.obj)
+            self.text = truncate(text, self.limit)
+        return self.text
+
+    def __format__(self, format_spec):
+        return format(str(self), format_spec)
+
+def lazy_json(obj, limit=None):
+    """
+    作为日志参数使用，日志级别不输出时不会序列化：
+    logger.debug("[WX849] 请求参数: {}", lazy_json(params))
+    不要写成f-string，f-string在调用logger前就已经格式化
+    """
+    return _LazyJson(obj, limit)
+
+_samples = {}
+_samples_lock = threading.Lock()
+
+def sample_log(key, interval=60.0):
+    """
+    重复日志限流，同一key每interval秒最多输出一次
+    返回None表示这次不输出，否则返回上次输出后跳过的次数。key应为固定的字符串
+    """
+    now = time.monotonic()
+    with _samples_lock:
+        last, skipped = _samples.get(key, (None, 0))
+        if last is not None and now - last < interval:
+            _samples[key] = (last, skipped + 1)
+            return None
+        _samples[key] = (now, 0)
+    return skipped
+
+def _truncate_filter(record):
+    # 同一个record会经过每个sink的filter，只截断一次
+    if max_length and len(record["message"]) > max_length and "_truncated" not in record["extra"]:
+        record["message"] = truncate(record["message"])
+        record["extra"]["_truncated"] = True
+    return True
+
+class _DailyFile(object):
+    """按日期命名的日志文件，日期变化时切换到新文件"""
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.date = None
+        self.file = None
+
+    def write(self, text, date):
+        if date != self.date:
+            self.close()
+            self.file = open(self.pattern.format(date), "a", encoding="utf-8")
+            self.date = date
+        self.file.write(text)
+
+    def flush(self):
+        if self.file is not None:
+            self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class _StreamTarget(object):
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, text, date):
+        self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+
+class _LogWriter(object):
+    """
+    enqueue模式下的后台写日志线程
+    loguru在调用方线程格式化消息，格式化好的文本放入内存队列，由这个线程写入控制台和文件。
+    控制台或磁盘变慢时队列满了就丢弃并计数，调用方不会阻塞；loguru自带的enqueue经过进程间管道，管道满时仍会阻塞
+    """
+
+    def __init__(self, max_size=100000):
+        self.max_size = max_size
+        self.queue = collections.deque()
+        self.cond = threading.Condition(threading.Lock())
+        self.dropped = 0
+        self.writing = False  # 写线程取出了一批日志、还没有写完
+        self.targets = {}
+        self.thread = None
+
+    def target(self, name, factory):
+        """同一个name复用同一个目标，重新配置logger时不会重复打开文件"""
+        if name not in self.targets:
+            self.targets[name] = factory()
+        return self.targets[name]
+
+    def sink(self, target):
+        def write(message):
+            with self.cond:
+                if len(self.queue) >= self.max_size:
+                    self.dropped += 1
+                    return
+                self.queue.append((target, message))
+                self.cond.notify()
+            if self.thread is None:
+                self._start()
+        return write
+
+    def _start(self):
+        with self.cond:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self.thread.start()
+        atexit.register(self.flush, 5.0)
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.queue:
+                    self.cond.wait()
+                batch = list(self.queue)
+                self.queue.clear()
+                dropped, self.dropped = self.dropped, 0
+                self.writing = True
+            self._write(batch, dropped)
+            with self.cond:
+                self.writing = False
+                self.cond.notify_all()
+
+    def _write(self, batch, dropped):
+        used = set()
+        for target, message in batch:
+            try:
+                target.write(message, message.record["time"].strftime("%Y-%m-%d"))
+                used.add(target)
+            except Exception as e:
+                sys.stderr.write("log writer error: {}\n".format(e))
+        if dropped:
+            # 只在控制台提示，这里不能再调用logger
+            sys.stderr.write("日志队列已满，丢弃了{}条日志\n".format(dropped))
+        for target in used:
+            try:
+                target.flush()
+            except Exception:
+                pass
+
+    def flush(self, timeout=None):
+        """等待队列中的日志写完，用于退出前"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.cond:
+            while (self.queue or self.writing) and self.thread is not None:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.cond.wait(remaining)
+        return True
+
+
+_writer = _LogWriter()
+
 def set_logger():
+    global _level_no
     print(f"set_logger level: {level}")
     # 配置日志记录器
     logger.remove()  # 移除默认的日志记录器
+    _level_no = logger.level(level).no
+    if enqueue:
+        os.makedirs("logs", exist_ok=True)
+        console = _writer.sink(_writer.target("stdout", lambda: _StreamTarget(sys.stdout)))
+        run_file = _writer.sink(_writer.target("run", lambda: _DailyFile("logs/run_{}.log")))
+        err_file = _writer.sink(_writer.target("err", lambda: _DailyFile("logs/err_{}.log")))
+        rotation = {}
+    else:
+        console = sys.stdout
+        run_file = "logs/run_{time:YYYY-MM-DD}.log"
+        err_file = "logs/err_{time:YYYY-MM-DD}.log"
+        rotation = dict(rotation="1 day", encoding="utf-8")  # 每天午夜轮换日志文件
     # 添加控制台日志记录器，设置为 info 级别
     logger.add(
-        sink=sys.stdout,
+        sink=console,
         format="<level>{level:.4} <blue>{time:HH:mm:ss}</blue> {message} </level><blue>[{file}:{line}]</blue>",
         level=level,
         colorize=True,  # 控制台日志彩色输出
+        filter=_truncate_filter,
     )
 
     # 添加文件日志记录器，按日期命名，设置为 info 级别
     logger.add(
-        "logs/run_{time:YYYY-MM-DD}.log",
+        run_file,
         format="[{level}][{time:YYYY-MM-DD HH:mm:ss}] {message} [{file}:{line}]",
-        rotation="1 day",  # 每天午夜轮换日志文件
-        encoding="utf-8",
         level=level,
+        filter=_truncate_filter,
+        **rotation,
     )
 
     # 添加错误日志记录器，按日期命名，设置为 error 级别
     logger.add(
-        "logs/err_{time:YYYY-MM-DD}.log",
+        err_file,
         level="ERROR",
         format="[{level}][{time:YYYY-MM-DD HH:mm:ss}] {message} [{file}:{line}]",
-        rotation="1 day",  # 每天午夜轮换日志文件
-        encoding="utf-8",
+        filter=_truncate_filter,
+        **rotation,
     )
  # 设置默认日志级别为 DEBUG
  # 设置默认日志级别为 DEBUG
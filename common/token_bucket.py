@@ -1,39 +1,133 @@
+"""
+令牌桶限流
+
+令牌数不由后台线程定时增加，而是在每次获取时按距离上次计算经过的时间(monotonic)补充，
+没有常驻线程，也不需要定时唤醒。支持：
+- 按权重获取(如按预估的token数限制TPM)，权重超过容量时在桶满时放行，之后的请求等待欠下的令牌补足
+- 阻塞获取(get_token)、非阻塞获取(try_get_token)和asyncio中使用的acquire
+- KeyedTokenBucket按key(用户、群)分别限流，空闲的桶自动清理
+"""
+
+import asyncio
 import threading
 import time
 
+from common.expired_dict import ExpiredDict
+
 
 class TokenBucket:
-    def __init__(self, tpm, timeout=None):
+    def __init__(self, tpm, timeout=None, initial=None, clock=time.monotonic):
         self.capacity = int(tpm)  # 令牌桶容量
-        self.tokens = 0  # 初始令牌数为0
         self.rate = int(tpm) / 60  # 令牌每秒生成速率
-        self.timeout = timeout  # 等待令牌超时时间
-        self.cond = threading.Condition()  # 条件变量
-        self.is_running = True
-        # 开启令牌生成线程
-        threading.Thread(target=self._generate_tokens).start()
-
-    def _generate_tokens(self):
-        """生成令牌"""
-        while self.is_running:
-            with self.cond:
-                if self.tokens < self.capacity:
-                    self.tokens += 1
-                self.cond.notify()  # 通知获取令牌的线程
-            time.sleep(1 / self.rate)
-
-    def get_token(self):
-        """获取令牌"""
-        with self.cond:
-            while self.tokens <= 0:
-                flag = self.cond.wait(self.timeout)
-                if not flag:  # 超时
+        self.timeout = timeout  # 等待令牌超时时间，None表示一直等待
+        self.clock = clock
+        self.lock = threading.Lock()
+        # 默认与原来的生成线程一致，启动时只有1个令牌
+        self._tokens = min(1.0, self.capacity) if initial is None else initial
+        self._updated = clock()
+
+    def _refill(self, now):
+        if now > self._updated:
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+    def _take(self, weight):
+        """令牌足够时扣除并返回0，否则返回还需等待的秒数"""
+        now = self.clock()
+        self._refill(now)
+        need = min(weight, self.capacity)
+        if self._tokens >= need:
+            self._tokens -= weight
+            return 0
+        if self.rate <= 0:
+            return None
+        return (need - self._tokens) / self.rate
+
+    @property
+    def tokens(self):
+        """当前可用的令牌数"""
+        with self.lock:
+            self._refill(self.clock())
+            return self._tokens
+
+    def try_get_token(self, weight=1):
+        """不等待，令牌不够时返回False"""
+        with self.lock:
+            return self._take(weight) == 0
+
+    def get_token(self, weight=1, timeout=None):
+        """获取令牌，令牌不够时等待补充，超过timeout(默认为创建时的timeout)返回False"""
+        timeout = self.timeout if timeout is None else timeout
+        deadline = None if timeout is None else self.clock() + timeout
+        while True:
+            with self.lock:
+                wait = self._take(weight)
+            if wait == 0:
+                return True
+            if wait is None:
+                return False
+            if deadline is not None:
+                remaining = deadline - self.clock()
+                if remaining < wait:
+                    # 等到超时也补不够，不必再等
+                    if remaining > 0:
+                        time.sleep(remaining)
                     return False
-            self.tokens -= 1
-        return True
+            time.sleep(wait)
+
+    async def acquire(self, weight=1, timeout=None):
+        """asyncio版本的get_token，等待时不阻塞事件循环"""
+        timeout = self.timeout if timeout is None else timeout
+        deadline = None if timeout is None else self.clock() + timeout
+        while True:
+            with self.lock:
+                wait = self._take(weight)
+            if wait == 0:
+                return True
+            if wait is None:
+                return False
+            if deadline is not None:
+                remaining = deadline - self.clock()
+                if remaining < wait:
+                    if remaining > 0:
+                        await asyncio.sleep(remaining)
+                    return False
+            await asyncio.sleep(wait)
 
     def close(self):
-        self.is_running = False
+        """没有后台线程，保留用于兼容"""
+        pass
+
+
+class KeyedTokenBucket:
+    """每个key一个令牌桶，用于按用户、群分别限流"""
+
+    def __init__(self, tpm, timeout=None, max_keys=10000, clock=time.monotonic):
+        self.tpm = tpm
+        self.timeout = timeout
+        self.clock = clock
+        self.lock = threading.Lock()
+        # 新建的桶是满的，空闲60秒后桶也已经补满(透支过多的除外)，可以直接清理
+        self.buckets = ExpiredDict(60, max_size=max_keys, clock=clock)
+
+    def bucket(self, key):
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            with self.lock:
+                bucket = self.buckets.get(key)
+                if bucket is None:
+                    bucket = TokenBucket(self.tpm, self.timeout, initial=int(self.tpm), clock=self.clock)
+                    self.buckets[key] = bucket
+        return bucket
+
+    def try_get_token(self, key, weight=1):
+        return self.bucket(key).try_get_token(weight)
+
+    def get_token(self, key, weight=1, timeout=None):
+        return self.bucket(key).get_token(weight, timeout)
+
+    async def acquire(self, key, weight=1, timeout=None):
+        return await self.bucket(key).acquire(weight, timeout)
 
 
 if __name__ == "__main__":
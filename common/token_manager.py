@@ -0,0 +1,213 @@
+"""
+access token缓存
+
+百度等接口需要先用AK/SK换取access_token，token有效期很长(百度为30天)，不需要每次请求都重新获取。
+每个key(接口+账号)对应一个TokenSource：
+- token在过期前margin秒之外直接返回缓存(有效期比margin短时为有效期过半之前)
+- 之后仍返回旧token，同时由后台线程刷新，调用方不等待
+- 没有可用token时同步获取，并发的调用方共用同一次获取(single-flight)，失败时一起抛出异常
+- 获取到的token保存在数据目录的tokens.json，重启后继续使用
+- 接口返回token失效时调用invalidate，下次get重新获取
+
+用法：
+    source = token_manager.source("baidu_wenxin:" + api_key, fetch)
+    token = source.get()
+fetch返回(token, expires_in)，expires_in为有效秒数
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+from common.log import logger
+
+STORE_FILE = "tokens.json"
+
+
+class TokenStore(object):
+    """token持久化到json文件，key为原始key的摘要，不在文件中保存AK等信息"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.data = None
+
+    @staticmethod
+    def _digest(key):
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+
+    def _load(self):
+        if self.data is None:
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self.data = json.load(f)
+            except FileNotFoundError:
+                self.data = {}
+            except Exception as e:
+                logger.warning("[TokenManager] load {} failed: {}".format(self.path, e))
+                self.data = {}
+        return self.data
+
+    def get(self, key):
+        """返回(token, expires_at)，expires_at为时间戳；没有保存时返回None"""
+        with self.lock:
+            item = self._load().get(self._digest(key))
+        if not item:
+            return None
+        return item["token"], item["expires_at"]
+
+    def put(self, key, token, expires_at):
+        with self.lock:
+            data = self._load()
+            if token is None:
+                if data.pop(self._digest(key), None) is None:
+                    return
+            else:
+                data[self._digest(key)] = {"token": token, "expires_at": expires_at}
+            # 清理已过期的token
+            now = time.time()
+            for k in [k for k, v in data.items() if v["expires_at"] <= now]:
+                del data[k]
+            try:
+                tmp_path = self.path + ".tmp"
+                fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(data, f)
+                os.replace(tmp_path, self.path)
+            except Exception as e:
+                logger.warning("[TokenManager] save {} failed: {}".format(self.path, e))
+
+
+class TokenSource(object):
+    # 后台刷新失败后，间隔多少秒再尝试
+    retry_interval = 30
+
+    def __init__(self, key, fetch, margin, store=None, clock=time.time):
+        self.key = key
+        self.fetch = fetch
+        self.margin = margin
+        self.store = store
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.token = None
+        self.expires_at = 0
+        self.refresh_at = 0  # 之后的get在后台刷新
+        self.fetched_at = 0
+        self.refreshing = None  # 正在进行的获取，完成时set的Event
+        self.error = None  # 最近一次获取的异常
+        self.retry_at = 0
+        self.fetch_count = 0
+        if store is not None:
+            saved = store.get(key)
+            if saved and saved[1] > clock():
+                self.token, self.expires_at = saved
+                self.refresh_at = self.expires_at - margin
+
+    def _begin(self):
+        """加入正在进行的获取，没有时发起新的，返回(event, 是否由调用方执行获取)"""
+        if self.refreshing is not None:
+            return self.refreshing, False
+        self.refreshing = threading.Event()
+        return self.refreshing, True
+
+    def _refresh(self, event):
+        try:
+            token, expires_in = self.fetch()
+            if not token:
+                raise Exception("empty token")
+            error = None
+        except Exception as e:
+            token, expires_in, error = None, 0, e
+        with self.lock:
+            self.fetch_count += 1
+            if error is None:
+                now = self.clock()
+                self.token = token
+                self.fetched_at = now
+                self.expires_at = now + expires_in
+                # 有效期比margin短时在有效期过半后刷新
+                self.refresh_at = now + max(expires_in - self.margin, expires_in / 2)
+                self.error = None
+            else:
+                self.error = error
+                self.retry_at = self.clock() + self.retry_interval
+            self.refreshing = None
+            expires_at = self.expires_at
+        event.set()
+        if error is not None:
+            logger.warning("[TokenManager] fetch token {} failed: {}".format(self.key.split(":")[0], error))
+        elif self.store is not None:
+            self.store.put(self.key, token, expires_at)
+
+    def get(self, timeout=30):
+        """返回可用的token，获取失败时抛出fetch的异常"""
+        with self.lock:
+            now = self.clock()
+            if self.token is not None and now < self.expires_at:
+                if now < self.refresh_at or self.refreshing is not None or now < self.retry_at:
+                    return self.token
+                # 即将过期，后台刷新，先返回旧token
+                event, _ = self._begin()
+                threading.Thread(target=self._refresh, args=(event,), name="token-refresh", daemon=True).start()
+                return self.token
+            event, leader = self._begin()
+        if leader:
+            self._refresh(event)
+        elif not event.wait(timeout):
+            raise TimeoutError("wait token timeout")
+        with self.lock:
+            if self.token is not None and self.clock() < self.expires_at:
+                return self.token
+            raise self.error or Exception("fetch token failed")
+
+    def invalidate(self, token=None, min_age=0):
+        """
+        接口返回token无效时调用，token为使用的旧token，已经刷新过时不再清除；
+        不知道使用的是哪个token时用min_age跳过刚获取的token，避免并发失败的请求重复获取
+        """
+        with self.lock:
+            if self.token is None or (token is not None and token != self.token):
+                return
+            if min_age and self.clock() - self.fetched_at < min_age:
+                return
+            self.token = None
+            self.expires_at = 0
+            self.refresh_at = 0
+            self.retry_at = 0
+        if self.store is not None:
+            self.store.put(self.key, None, 0)
+
+
+class TokenManager(object):
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.store = None
+        self.sources = {}
+
+    def _store(self):
+        if self.store is None:
+            path = self.path
+            if path is None:
+                from config import get_appdata_dir
+
+                path = os.path.join(get_appdata_dir(), STORE_FILE)
+            self.store = TokenStore(path)
+        return self.store
+
+    def source(self, key, fetch, margin=300, persist=True):
+        """
+        获取key对应的TokenSource，同一个key多次调用返回同一个对象
+        key应包含接口和账号(如AK)，更换账号后不会使用旧账号的token
+        """
+        with self.lock:
+            source = self.sources.get(key)
+            if source is None:
+                source = TokenSource(key, fetch, margin, self._store() if persist else None)
+                self.sources[key] = source
+            return source
+
+
+token_manager = TokenManager()
@@ -1,10 +1,15 @@
 # encoding:utf-8
 
+import ast
 import json
 import logging
 import os
+import functools
+import itertools
 import pickle
 import copy
+import threading
+from types import MappingProxyType
 
 from common.log import logger
 from common.log import set_log_level
@@ -58,18 +63,30 @@ available_setting = {
     "image_proxy": True,  # 是否需要图片代理，国内访问LinkAI时需要
     "image_create_prefix": ["画", "看", "找"],  # 开启图片回复的前缀
     "concurrency_in_session": 1,  # 同一会话最多有多少条消息在处理中，大于1可能乱序
+    "handler_pool_llm_workers": 8,  # 处理大模型对话消息的线程数
+    "handler_pool_media_workers": 2,  # 处理语音、图片等媒体消息的线程数
+    "handler_pool_command_workers": 2,  # 处理#管理指令和插件指令的线程数
+    "handler_pool_max_queue": 100,  # 每个线程池通道最多排队的消息数，小于等于0不限制
+    "handler_pool_overflow_policy": "block",  # 排队已满时的策略，可选: reject(拒绝并回复), drop_oldest(丢弃最早的消息), block(等待)
+    "handler_pool_reject_reply": "当前消息较多，请稍后再试~",  # reject策略下拒绝消息时的回复，为空则不回复
     "image_create_size": "256x256",  # 图片大小,可选有 256x256, 512x512, 1024x1024 (dall-e-3默认为1024x1024)
     "group_chat_exit_group": False,
     "group_exit_msg": "",  # 退出群聊的消息
     "accept_friend_msg": "",  # 接受好友请求后发送的消息
     # chatgpt会话参数
     "expires_in_seconds": 3600,  # 无操作会话的过期时间
+    "session_store": "memory",  # 会话存储方式，可选: memory(仅内存), sqlite(内存热数据+本地SQLite，重启后保留上下文)
+    "session_store_path": "",  # sqlite会话数据库路径，为空时使用数据目录下的sessions.db
+    "session_cache_size": 1000,  # sqlite存储时内存中最多保留的会话数，超出后淘汰最久未使用的会话
+    "session_flush_interval": 5,  # sqlite存储时批量写回修改过的会话的间隔，单位秒
     # 人格描述
     "character_desc": "你是ChatGPT, 一个由OpenAI训练的大型语言模型, 你旨在回答并解决人们的任何问题，并且可以使用多种语言与人交流。",
     "conversation_max_tokens": 1000,  # 支持上下文记忆的最多字符数
     # chatgpt限流配置
     "rate_limit_chatgpt": 20,  # chatgpt的调用频率限制
     "rate_limit_dalle": 50,  # openai dalle的调用频率限制
+    "rate_limit_per_chat": 0,  # 每个群或私聊用户每分钟最多触发多少次对话，超出后不调用对话后端，0表示不限制
+    "rate_limit_per_chat_reply": "消息太频繁了，请稍后再试",  # 超出rate_limit_per_chat时的提示，每个群或用户每分钟最多提示一次，为空时不提示只记录日志
     # chatgpt api参数 参考https://platform.openai.com/docs/api-reference/chat/create
     "temperature": 0.9,
     "top_p": 1,
@@ -159,6 +176,8 @@ available_setting = {
     "wechatmp_app_id": "",  # 微信公众平台的appID
     "wechatmp_app_secret": "",  # 微信公众平台的appsecret
     "wechatmp_aes_key": "",  # 微信公众平台的EncodingAESKey，加密模式需要
+    "wechatmp_max_waiting_requests": 8,  # 被动回复模式同时等待回复的请求数上限，超过时直接提示稍后获取，0为不限制
+    "wechatmp_reply_cache_ttl": 3600,  # 被动回复模式用户未取走的回复保留时间(秒)
     # wechatcom的通用配置
     "wechatcom_corp_id": "",  # 企业微信公司的corpID
     # wechatcomapp的配置
@@ -195,6 +214,13 @@ available_setting = {
     "wx849_wxid": "",
     "wx849_device_name": "DoW微信机器人",
     "wx849_device_id": "",
+    "wx849_dispatch_workers": 16,  # 处理回调消息的线程数
+    "wx849_dispatch_max_pending": 1000,  # 最多排队的回调消息数，超过后回调请求会等待
+    "wx849_api_timeout": 30,  # 调用协议接口的默认超时时间，单位秒
+    "wx849_api_endpoint_timeouts": {},  # 按接口设置超时时间，如 {"/Msg/SendVideo": 120}
+    "wx849_api_retries": 2,  # 连接失败或网关错误(502/503/504)时的重试次数
+    "wx849_api_max_concurrency": 32,  # 同时进行的协议接口请求数上限
+    "wx849_image_download_parallel": 4,  # 图片分段下载时同时请求的分段数
 
     # chatgpt指令自定义触发词
     "clear_memory_commands": ["#清除记忆"],  # 重置会话指令，必须以#开头
@@ -202,11 +228,41 @@ available_setting = {
     "channel_type": "",  # 通道类型，支持：{wx,wxy,terminal,wechatmp,wechatmp_service,wechatcom_app,dingtalk}
     "subscribe_msg": "",  # 订阅消息, 支持: wechatmp, wechatmp_service, wechatcom_app
     "debug": False,  # 是否开启debug模式，开启后会打印更多日志
+    "log_enqueue": False,  # 日志由后台线程写入控制台和文件，记录日志时不等待IO，积压过多时丢弃
+    "log_max_length": 4000,  # 单条日志的最大长度，超过时截断，0为不限制
     "appdata_dir": "",  # 数据目录
     # 插件配置
     "plugin_trigger_prefix": "$",  # 规范插件提供聊天相关指令的前缀，建议不要和管理员指令前缀"#"冲突
     # 是否使用全局插件配置
     "use_global_plugin_config": False,
+    "plugin_lazy_load": True,  # 启动时在后台线程池中导入和初始化插件，通道无需等待插件加载完成
+    "plugin_load_workers": 4,  # 后台加载插件的线程数
+    "plugin_load_timeout": 60,  # 事件等待插件加载的最长时间，单位秒，超时后本次事件跳过该插件
+    # 多个对话后端之间的路由，为空时只使用model对应的一个后端
+    # 如 [{"type": "deepseek", "max_concurrency": 8, "rate_limit": 60}, {"type": "chatGPT", "model": "gpt-4o-mini"}]
+    # rate_limit为每分钟请求数，model覆盖该后端使用的模型，name默认为type
+    "chat_router_backends": [],
+    "chat_router_queue_timeout": 30,  # 所有后端都满时等待的最长时间，单位秒
+    "chat_router_cooldown": 30,  # 后端连续失败后暂停使用的时间，单位秒
+    "chat_router_hedge": False,  # 请求超过后端p95延迟未返回时，同时发给另一个后端
+    "chat_router_hedge_delay": 3,  # 发起对冲请求前至少等待的时间，单位秒
+    "bridge_warm_up": True,  # 通道启动时在后台提前创建对话、语音bot，加载SDK和tokenizer并建立连接
+    "http_pool_size": 32,  # 共享HTTP连接池中每个host保留的连接数
+    # 回复缓存：相同的问题(归一化后)在有效期内直接返回之前的文本回复，不再请求对话后端
+    "reply_cache": False,
+    "reply_cache_ttl": 600,  # 缓存有效期，从写入时开始计算，单位秒
+    "reply_cache_size": 1000,  # 内存中最多缓存的回复数，持久化时数据库最多保留10倍
+    "reply_cache_scope": "group",  # 群聊缓存范围，global: 所有群共用；group: 每个群单独；session: 每个会话单独。私聊总是每个用户单独
+    "reply_cache_session_window": 0,  # 计算key时包含的会话最近消息数，0表示会话已有上下文时不使用缓存
+    "reply_cache_patterns": [],  # 只缓存匹配这些正则的问题，为空时缓存所有问题
+    "reply_cache_persist": False,  # 同时保存到本地SQLite，重启后仍可命中
+    "reply_cache_path": "",  # 持久化数据库路径，默认为数据目录下的reply_cache.db
+    # 流式回复：边生成边按句子/段落分多条消息发送，目前支持chatGPT、deepseek、dify(chatbot/chatflow/agent)，其他bot仍一次性回复
+    "stream_reply": False,
+    "stream_reply_min_chars": 80,  # 每条消息的最少字数，不足时继续等待后续内容
+    "stream_reply_interval": 1.5,  # 两条消息之间的最小间隔，单位秒，避免发送过快被限制
+    "stream_reply_connect_timeout": 10,  # 流式请求建立连接的超时时间，单位秒
+    "stream_reply_read_timeout": 60,  # 流式请求两次收到数据之间的最长等待时间，单位秒，上游卡住时结束本次回复
     "max_media_send_count": 3,  # 单次最大发送媒体资源的个数
     "media_send_interval": 1,  # 发送图片的事件间隔，单位秒
     # 智谱AI 平台配置
@@ -233,6 +289,9 @@ available_setting = {
     "Minimax_group_id": "",
     "Minimax_base_url": "",
     "web_port": 9899,
+    "web_heartbeat_interval": 15,  # web通道SSE心跳间隔(秒)，用于发现已断开的连接
+    "web_idle_timeout": 300,  # web通道用户断开连接超过该时间(秒)后清理其消息队列
+    "web_queue_size": 100,  # web通道每个用户未送达消息的上限，超过时丢弃最早的消息
     
     "bot_account": "bot",
     "bot_name": "扁鹊子",
@@ -248,10 +307,13 @@ available_setting = {
     "chat_billing_enabled": False  # 是否开启聊天收费
 }
 
+_config_versions = itertools.count(1)  # 所有Config对象共用，每次修改配置都会得到新的版本号
+
 
 class Config(dict):
     def __init__(self, d=None):
         super().__init__()
+        self.version = next(_config_versions)  # 配置版本号，依赖配置计算的缓存据此判断是否需要重建
         if d is None:
             d = {}
         for k, v in d.items():
@@ -267,6 +329,7 @@ class Config(dict):
     def __setitem__(self, key, value):
         if key not in available_setting:
             raise Exception("key {} not in available_setting".format(key))
+        self.version = next(_config_versions)
         return super().__setitem__(key, value)
 
     def get(self, key, default=None):
@@ -355,15 +418,7 @@ def load_config():
         name = name.lower()
         if name in available_setting:
             logger.info("[INIT] override config by environ args: {}={}".format(name, value))
-            try:
-                config[name] = eval(value)
-            except:
-                if value == "false":
-                    config[name] = False
-                elif value == "true":
-                    config[name] = True
-                else:
-                    config[name] = value
+            config[name] = parse_env_value(name, value)
 
     if config.get("debug", False):
         set_log_level("DEBUG")
@@ -400,6 +455,105 @@ def conf():
     return config
 
 
+def parse_env_value(name, value):
+    """
+    按available_setting中默认值的类型解析环境变量，不再使用eval
+    JSON解析失败时再按Python字面量解析(如 ['ALL_GROUP']、None)，都无法解析时保留原字符串并打印警告
+    """
+    default = available_setting.get(name)
+    lowered = value.strip().lower()
+    if isinstance(default, bool) or lowered in ["true", "false"]:
+        if lowered in ["true", "1", "yes", "on"]:
+            return True
+        if lowered in ["false", "0", "no", "off", ""]:
+            return False
+    try:
+        if isinstance(default, (int, float)):
+            number = float(value)
+            return int(number) if isinstance(default, int) and number.is_integer() else number
+        if isinstance(default, str):
+            return value
+        # list/dict/None等按JSON解析，如 ["ALL_GROUP"]
+        return json.loads(value)
+    except ValueError:
+        pass
+    try:
+        return ast.literal_eval(value.strip())
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        logger.warning("[INIT] environment variable {} is not valid JSON or Python literal, use it as string: {}".format(name, value))
+        return value
+
+
+class ConfigSnapshot(object):
+    """
+    某一版本配置的只读快照
+
+    值在创建时深拷贝，之后不再变化；配置项可以用 snapshot.get(key, default) 或属性 snapshot.key 读取，
+    未配置的项属性值为None。读取不加锁，也不做available_setting校验，适合每条消息都要读取配置的地方。
+    """
+
+    def __init__(self, config):
+        values = copy.deepcopy(dict(config))
+        attrs = dict.fromkeys(available_setting)
+        attrs.update(values)
+        attrs["version"] = config.version
+        attrs["values"] = MappingProxyType(values)
+        self.__dict__.update(attrs)
+
+    def __setattr__(self, key, value):
+        raise AttributeError("ConfigSnapshot is read-only")
+
+    def get(self, key, default=None):
+        return self.values.get(key, default)
+
+    def __getitem__(self, key):
+        return self.values[key]
+
+    def __contains__(self, key):
+        return key in self.values
+
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def config_snapshot() -> ConfigSnapshot:
+    """当前配置的快照，配置修改或重新加载后自动生成新快照；读取路径无锁"""
+    global _snapshot
+    snapshot = _snapshot
+    if snapshot is None or snapshot.version != config.version:
+        with _snapshot_lock:
+            snapshot = _snapshot
+            if snapshot is None or snapshot.version != config.version:
+                snapshot = ConfigSnapshot(config)
+                _snapshot = snapshot
+    return snapshot
+
+
+def config_derived(builder):
+    """
+    依赖配置计算的派生对象(如编译好的匹配规则)，按配置版本缓存。
+    builder接收ConfigSnapshot，配置变化后第一次调用时重建，新对象整体替换旧对象，
+    正在使用旧对象的消息不受影响。
+    """
+    lock = threading.Lock()
+    holder = [None]  # (version, value)
+
+    @functools.wraps(builder)
+    def get():
+        snapshot = config_snapshot()
+        entry = holder[0]
+        if entry is None or entry[0] != snapshot.version:
+            with lock:
+                entry = holder[0]
+                if entry is None or entry[0] != snapshot.version:
+                    entry = (snapshot.version, builder(snapshot))
+                    holder[0] = entry
+        return entry[1]
+
+    return get
+
+
 def get_appdata_dir():
     data_path = os.path.join(get_root(), conf().get("appdata_dir", ""))
     if not os.path.exists(data_path):
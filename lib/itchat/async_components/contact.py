@@ -115,29 +115,31 @@ def update_local_chatrooms(core, l):
             if 'RemarkName' in member:
                 utils.emoji_formatter(member, 'RemarkName')
         # update it to old chatrooms
-        oldChatroom = utils.search_dict_list(
-            core.chatroomList, 'UserName', chatroom['UserName'])
+        oldChatroom = core.storageClass.get_chatroom(chatroom['UserName'])
         if oldChatroom:
             update_info_dict(oldChatroom, chatroom)
+            core.storageClass.reindex(oldChatroom)
             #  - update other values
             memberList = chatroom.get('MemberList', [])
             oldMemberList = oldChatroom['MemberList']
             if memberList:
+                oldMembers = {}
+                for member in oldMemberList:
+                    oldMembers.setdefault(member['UserName'], member)
                 for member in memberList:
-                    oldMember = utils.search_dict_list(
-                        oldMemberList, 'UserName', member['UserName'])
+                    oldMember = oldMembers.get(member['UserName'])
                     if oldMember:
                         update_info_dict(oldMember, member)
                     else:
                         oldMemberList.append(member)
+                        oldMembers[member['UserName']] = oldMemberList[-1]
         else:
             core.chatroomList.append(chatroom)
-            oldChatroom = utils.search_dict_list(
-                core.chatroomList, 'UserName', chatroom['UserName'])
+            oldChatroom = core.storageClass.get_chatroom(chatroom['UserName'])
         # delete useless members
         if len(chatroom['MemberList']) != len(oldChatroom['MemberList']) and \
                 chatroom['MemberList']:
-            existsUserNames = [member['UserName'] for member in chatroom['MemberList']]
+            existsUserNames = set(member['UserName'] for member in chatroom['MemberList'])
             delList = []
             for i, member in enumerate(oldChatroom['MemberList']):
                 if member['UserName'] not in existsUserNames:
@@ -172,7 +174,6 @@ def update_local_friends(core, l):
     '''
         get a list of friends or mps for updating local contact
     '''
-    fullList = core.memberList + core.mpList
     for friend in l:
         if 'NickName' in friend:
             utils.emoji_formatter(friend, 'NickName')
@@ -180,8 +181,8 @@ def update_local_friends(core, l):
             utils.emoji_formatter(friend, 'DisplayName')
         if 'RemarkName' in friend:
             utils.emoji_formatter(friend, 'RemarkName')
-        oldInfoDict = utils.search_dict_list(
-            fullList, 'UserName', friend['UserName'])
+        oldInfoDict = core.storageClass.get_friend(friend['UserName']) or \
+            core.storageClass.get_mp(friend['UserName'])
         if oldInfoDict is None:
             oldInfoDict = copy.deepcopy(friend)
             if oldInfoDict['VerifyFlag'] & 8 == 0:
@@ -190,6 +191,7 @@ def update_local_friends(core, l):
                 core.mpList.append(oldInfoDict)
         else:
             update_info_dict(oldInfoDict, friend)
+            core.storageClass.reindex(oldInfoDict)
 
 @contact_change
 def update_local_uin(core, msg):
@@ -212,9 +214,7 @@ def update_local_uin(core, msg):
         if 0 < len(uins) == len(usernames):
             for uin, username in zip(uins, usernames):
                 if not '@' in username: continue
-                fullContact = core.memberList + core.chatroomList + core.mpList
-                userDicts = utils.search_dict_list(fullContact,
-                    'UserName', username)
+                userDicts = core.storageClass.get_contact(username)
                 if userDicts:
                     if userDicts.get('Uin', 0) == 0:
                         userDicts['Uin'] = uin
@@ -229,8 +229,7 @@ def update_local_uin(core, msg):
                         core.storageClass.updateLock.release()
                         update_chatroom(core, username)
                         core.storageClass.updateLock.acquire()
-                        newChatroomDict = utils.search_dict_list(
-                            core.chatroomList, 'UserName', username)
+                        newChatroomDict = core.storageClass.get_chatroom(username)
                         if newChatroomDict is None:
                             newChatroomDict = utils.struct_friend_info({
                                 'UserName': username,
@@ -243,8 +242,7 @@ def update_local_uin(core, msg):
                         core.storageClass.updateLock.release()
                         update_friend(core, username)
                         core.storageClass.updateLock.acquire()
-                        newFriendDict = utils.search_dict_list(
-                            core.memberList, 'UserName', username)
+                        newFriendDict = core.storageClass.get_friend(username)
                         if newFriendDict is None:
                             newFriendDict = utils.struct_friend_info({
                                 'UserName': username,
@@ -319,8 +317,8 @@ def get_mps(self, update=False):
     return utils.contact_deep_copy(self, self.mpList)
 
 def set_alias(self, userName, alias):
-    oldFriendInfo = utils.search_dict_list(
-        self.memberList, 'UserName', userName)
+    with self.storageClass.updateLock:
+        oldFriendInfo = self.storageClass.get_friend(userName)
     if oldFriendInfo is None:
         return ReturnValue({'BaseResponse': {
             'Ret': -1001, }})
@@ -336,7 +334,9 @@ def set_alias(self, userName, alias):
         headers=headers)
     r = ReturnValue(rawResponse=r)
     if r:
-        oldFriendInfo['RemarkName'] = alias
+        with self.storageClass.updateLock:
+            oldFriendInfo['RemarkName'] = alias
+            self.storageClass.reindex(oldFriendInfo)
     return r
 
 def set_pinned(self, userName, isPinned=True):
@@ -238,9 +238,11 @@ def produce_group_chat(core, msg):
         msg['IsAt'] = False
         utils.msg_formatter(msg, 'Content')
         return
-    chatroom = core.storageClass.search_chatrooms(userName=chatroomUserName)
-    member = utils.search_dict_list((chatroom or {}).get(
-        'MemberList') or [], 'UserName', actualUserName)
+    with core.storageClass.updateLock:
+        # only values are read here, no need to copy the whole chatroom
+        chatroom = core.storageClass.get_chatroom(chatroomUserName)
+        member = utils.search_dict_list((chatroom or {}).get(
+            'MemberList') or [], 'UserName', actualUserName)
     if member is None:
         chatroom = core.update_chatroom(chatroomUserName)
         member = utils.search_dict_list((chatroom or {}).get(
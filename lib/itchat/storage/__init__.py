@@ -2,6 +2,7 @@ import os, time, copy
 from threading import Lock
 
 from .messagequeue import Queue
+from .contactindex import ContactIndex
 from .templates import (
     ContactList, AbstractUserDict, User,
     MassivePlatform, Chatroom, ChatroomMember)
@@ -22,12 +23,50 @@ class Storage(object):
         self.chatroomList      = ContactList()
         self.msgList           = Queue(-1)
         self.lastInputUserName = None
-        self.memberList.set_default_value(contactClass=User)
+        # indexes of the lists above, contacts are added by the init functions
+        self.memberIndex       = ContactIndex(('NickName', 'RemarkName', 'Alias'))
+        self.mpIndex           = ContactIndex(substringKey='NickName')
+        self.chatroomIndex     = ContactIndex(substringKey='NickName')
+        self.memberList.set_default_value(
+            self._index_fn(self.memberList, self.memberIndex), User)
         self.memberList.core = core
-        self.mpList.set_default_value(contactClass=MassivePlatform)
+        self.mpList.set_default_value(
+            self._index_fn(self.mpList, self.mpIndex), MassivePlatform)
         self.mpList.core = core
-        self.chatroomList.set_default_value(contactClass=Chatroom)
+        self.chatroomList.set_default_value(
+            self._index_fn(self.chatroomList, self.chatroomIndex), Chatroom)
         self.chatroomList.core = core
+    @staticmethod
+    def _index_fn(contactList, index):
+        def init_fn(parentList, contact):
+            # deep copies of the list share this function, only index the list itself
+            if parentList is contactList:
+                index.add(contact)
+        return init_fn
+    def _index(self, contactList, index):
+        # lists may be cleared directly (logout, loads), rebuild then
+        if index.is_stale(contactList):
+            index.rebuild(contactList)
+        return index
+    def reindex(self, contact):
+        ''' call after values of a stored contact are changed, with updateLock held '''
+        for contactList, index in ((self.memberList, self.memberIndex),
+                (self.mpList, self.mpIndex), (self.chatroomList, self.chatroomIndex)):
+            if self._index(contactList, index).reindex(contact):
+                return
+    def get_friend(self, userName):
+        ''' stored friend without copying, call with updateLock held '''
+        return self._index(self.memberList, self.memberIndex).get(userName)
+    def get_mp(self, userName):
+        ''' stored mp without copying, call with updateLock held '''
+        return self._index(self.mpList, self.mpIndex).get(userName)
+    def get_chatroom(self, userName):
+        ''' stored chatroom without copying, call with updateLock held '''
+        return self._index(self.chatroomList, self.chatroomIndex).get(userName)
+    def get_contact(self, userName):
+        ''' stored friend, chatroom or mp without copying, call with updateLock held '''
+        return self.get_friend(userName) or self.get_chatroom(userName) or \
+            self.get_mp(userName)
     def dumps(self):
         return {
             'userName'          : self.userName,
@@ -40,12 +79,15 @@ class Storage(object):
         self.userName = j.get('userName', None)
         self.nickName = j.get('nickName', None)
         del self.memberList[:]
+        self.memberIndex.clear()
         for i in j.get('memberList', []):
             self.memberList.append(i)
         del self.mpList[:]
+        self.mpIndex.clear()
         for i in j.get('mpList', []):
             self.mpList.append(i)
         del self.chatroomList[:]
+        self.chatroomIndex.clear()
         for i in j.get('chatroomList', []):
             self.chatroomList.append(i)
         # I tried to solve everything in pickle
@@ -61,13 +103,15 @@ class Storage(object):
         self.lastInputUserName = j.get('lastInputUserName', None)
     def search_friends(self, name=None, userName=None, remarkName=None, nickName=None,
             wechatAccount=None):
+        ''' contacts are looked up in indexes and returned as shallow copies
+            (new dicts sharing values), changing them won't affect storage '''
         with self.updateLock:
             if (name or userName or remarkName or nickName or wechatAccount) is None:
-                return copy.deepcopy(self.memberList[0]) # my own account
-            elif userName: # return the only userName match
-                for m in self.memberList:
-                    if m['UserName'] == userName:
-                        return copy.deepcopy(m)
+                return copy.copy(self.memberList[0]) # my own account
+            index = self._index(self.memberList, self.memberIndex)
+            if userName: # return the only userName match
+                m = index.get(userName)
+                return None if m is None else copy.copy(m)
             else:
                 matchDict = {
                     'RemarkName' : remarkName,
@@ -77,41 +121,28 @@ class Storage(object):
                     if matchDict[k] is None:
                         del matchDict[k]
                 if name: # select based on name
-                    contact = []
-                    for m in self.memberList:
-                        if any([m.get(k) == name for k in ('RemarkName', 'NickName', 'Alias')]):
-                            contact.append(m)
+                    contact = index.find_any(('RemarkName', 'NickName', 'Alias'), name)
+                elif matchDict: # select based on the most selective key
+                    contact = min((index.find(k, v) for k, v in matchDict.items()), key=len)
                 else:
                     contact = self.memberList[:]
                 if matchDict: # select again based on matchDict
-                    friendList = []
-                    for m in contact:
-                        if all([m.get(k) == v for k, v in matchDict.items()]):
-                            friendList.append(m)
-                    return copy.deepcopy(friendList)
-                else:
-                    return copy.deepcopy(contact)
+                    contact = [m for m in contact
+                        if all([m.get(k) == v for k, v in matchDict.items()])]
+                return [copy.copy(m) for m in contact]
     def search_chatrooms(self, name=None, userName=None):
         with self.updateLock:
+            index = self._index(self.chatroomList, self.chatroomIndex)
             if userName is not None:
-                for m in self.chatroomList:
-                    if m['UserName'] == userName:
-                        return copy.deepcopy(m)
+                m = index.get(userName)
+                return None if m is None else copy.copy(m)
             elif name is not None:
-                matchList = []
-                for m in self.chatroomList:
-                    if name in m['NickName']:
-                        matchList.append(copy.deepcopy(m))
-                return matchList
+                return [copy.copy(m) for m in index.search(name)]
     def search_mps(self, name=None, userName=None):
         with self.updateLock:
+            index = self._index(self.mpList, self.mpIndex)
             if userName is not None:
-                for m in self.mpList:
-                    if m['UserName'] == userName:
-                        return copy.deepcopy(m)
+                m = index.get(userName)
+                return None if m is None else copy.copy(m)
             elif name is not None:
-                matchList = []
-                for m in self.mpList:
-                    if name in m['NickName']:
-                        matchList.append(copy.deepcopy(m))
-                return matchList
+                return [copy.copy(m) for m in index.search(name)]
@@ -0,0 +1,139 @@
+''' secondary indexes of a ContactList
+
+    * UserName -> contact, and value -> contacts for other exact-match keys
+      (NickName, RemarkName, Alias for friends)
+    * character and bigram postings of NickName for `name in NickName` searches
+      of chatrooms and mps, candidates are checked with `in` again
+    contacts are indexed when appended to the list (ContactList init function)
+    and must be reindexed by whoever changes indexed values (update_info_dict),
+    all calls should hold storage.updateLock
+'''
+
+
+def _grams(text):
+    grams = set(text)
+    grams.update(text[i:i + 2] for i in range(len(text) - 1))
+    return grams
+
+
+class ContactIndex(object):
+    def __init__(self, exactKeys=(), substringKey=None):
+        self.exactKeys = tuple(exactKeys)
+        self.substringKey = substringKey
+        self.clear()
+
+    def clear(self):
+        self.seq = 0
+        self.count = 0 # number of add(), compared with len(contactList) to find bypassed changes
+        self.entries = {} # id(contact) -> (seq, contact, indexed values)
+        self.userNames = {} # UserName -> {id: contact}, usually only one
+        self.exact = dict((k, {}) for k in self.exactKeys) # key -> value -> {id: contact}
+        self.grams = {} # gram -> {id: contact}
+
+    def rebuild(self, contactList):
+        self.clear()
+        for contact in contactList:
+            self.add(contact)
+
+    def is_stale(self, contactList):
+        return self.count != len(contactList)
+
+    def _values(self, contact):
+        userName = contact.get('UserName')
+        # only str and int values are compared with names, others can't be dict keys
+        values = tuple(v if isinstance(v, (str, int)) else None
+            for v in (contact.get(k) for k in self.exactKeys))
+        text = contact.get(self.substringKey) if self.substringKey else None
+        return userName, values, text if isinstance(text, str) else ''
+
+    @staticmethod
+    def _put(index, value, key, contact):
+        index.setdefault(value, {})[key] = contact
+
+    @staticmethod
+    def _pop(index, value, key):
+        bucket = index.get(value)
+        if bucket is not None:
+            bucket.pop(key, None)
+            if not bucket:
+                del index[value]
+
+    def add(self, contact, seq=None):
+        if seq is None:
+            seq = self.seq
+            self.seq += 1
+            self.count += 1
+        indexed = userName, values, text = self._values(contact)
+        key = id(contact)
+        self.entries[key] = (seq, contact, indexed)
+        self._put(self.userNames, userName, key, contact)
+        for k, v in zip(self.exactKeys, values):
+            self._put(self.exact[k], v, key, contact)
+        if self.substringKey:
+            for gram in _grams(text):
+                self._put(self.grams, gram, key, contact)
+
+    def _discard(self, contact):
+        key = id(contact)
+        seq, _, (userName, values, text) = self.entries.pop(key)
+        self._pop(self.userNames, userName, key)
+        for k, v in zip(self.exactKeys, values):
+            self._pop(self.exact[k], v, key)
+        for gram in _grams(text):
+            self._pop(self.grams, gram, key)
+        return seq
+
+    def reindex(self, contact):
+        ''' update indexes after values of an indexed contact changed
+            * return False if the contact is not in this index '''
+        entry = self.entries.get(id(contact))
+        if entry is None:
+            return False
+        if entry[2] != self._values(contact):
+            self.add(contact, self._discard(contact))
+        return True
+
+    def __contains__(self, contact):
+        return id(contact) in self.entries
+
+    def get(self, userName):
+        ''' the first contact with userName in list order '''
+        contacts = self.userNames.get(userName)
+        if not contacts:
+            return None
+        if len(contacts) == 1:
+            for contact in contacts.values():
+                return contact
+        return self._ordered(contacts.values())[0]
+
+    def _ordered(self, contacts):
+        entries = self.entries
+        return sorted(contacts, key=lambda c: entries[id(c)][0])
+
+    def find(self, key, value):
+        ''' contacts whose key equals value, in list order '''
+        return self._ordered(self.exact[key].get(value, {}).values())
+
+    def find_any(self, keys, value):
+        ''' contacts whose value of any of keys equals value, in list order '''
+        contacts = {}
+        for key in keys:
+            contacts.update(self.exact[key].get(value, {}))
+        return self._ordered(contacts.values())
+
+    def search(self, name):
+        ''' contacts whose substringKey contains name, in list order '''
+        if not name:
+            return self._ordered(c for _, c, _ in self.entries.values())
+        grams = [name] if len(name) <= 2 else [name[i:i + 2] for i in range(len(name) - 1)]
+        buckets = []
+        for gram in grams:
+            bucket = self.grams.get(gram)
+            if not bucket:
+                return []
+            buckets.append(bucket)
+        buckets.sort(key=len)
+        candidates = [c for k, c in buckets[0].items() if all(k in b for b in buckets[1:])]
+        return self._ordered(c for c in candidates
+            if name in self.entries[id(c)][2][2])
+
@@ -124,6 +124,10 @@ class AbstractUserDict(AttributeDict):
             'Ret': -1006,
             'ErrMsg': '%s do not have members' % \
                 self.__class__.__name__, }, })
+    def __copy__(self):
+        r = self.__class__(self)
+        r.core = self.core
+        return r
     def __deepcopy__(self, memo):
         r = self.__class__()
         for k, v in self.items():
@@ -156,6 +160,10 @@ class User(AbstractUserDict):
         return self.core.set_pinned(self.userName, isPinned)
     def verify(self):
         return self.core.add_friend(**self.verifyDict)
+    def __copy__(self):
+        r = super(User, self).__copy__()
+        r.verifyDict = dict(self.verifyDict)
+        return r
     def __deepcopy__(self, memo):
         r = super(User, self).__deepcopy__(memo)
         r.verifyDict = copy.deepcopy(self.verifyDict)
@@ -242,6 +250,12 @@ class Chatroom(AbstractUserDict):
                     return copy.deepcopy(friendList)
                 else:
                     return copy.deepcopy(contact)
+    def __copy__(self):
+        # __init__ has rebuilt MemberList with copies of members
+        r = super(Chatroom, self).__copy__()
+        if isinstance(self.get('Self'), AbstractUserDict):
+            r['Self'] = copy.copy(self['Self'])
+        return r
     def __setstate__(self, state):
         super(Chatroom, self).__setstate__(state)
         if not 'MemberList' in self:
@@ -265,6 +279,12 @@ class ChatroomMember(AbstractUserDict):
         if isinstance(value, dict) and 'UserName' in value:
             self._chatroom = ref(value)
             self._chatroomUserName = value['UserName']
+    def __copy__(self):
+        r = super(ChatroomMember, self).__copy__()
+        if hasattr(self, '_chatroom'):
+            r._chatroom = self._chatroom
+            r._chatroomUserName = self._chatroomUserName
+        return r
     def get_head_image(self, imageDir=None):
         return self.core.get_head_img(self.userName, self.chatroom.userName, picDir=imageDir)
     def delete_member(self, userName):
@@ -40,6 +40,8 @@ def format_day_to_y_m_d(start_date, end_date):
     desc="纪念日，节假日倒计时，可搭配timetask",
     version="0.7",
     author="Francis",
+    context_types=[ContextType.TEXT],
+    prefixes=["run", "add", "rm", "ls"],
 )
 class Countdown(Plugin):
     command_prefix = ""
@@ -1,5 +1,6 @@
 # encoding:utf-8
 
+import hashlib
 import json
 import os
 
@@ -33,13 +34,24 @@ class Banwords(Plugin):
             self.searchr = WordsSearch()
             self.action = conf["action"]
             banwords_path = os.path.join(curdir, "banwords.txt")
-            with open(banwords_path, "r", encoding="utf-8") as f:
+            with open(banwords_path, "rb") as f:
+                raw = f.read()
+            # 编译后的自动机按词库内容的hash缓存，词库不变时启动直接加载
+            cache_path = os.path.join(curdir, "banwords.cache")
+            words_hash = hashlib.sha256(raw).hexdigest()
+            if self.searchr.Load(cache_path, words_hash):
+                logger.debug("[Banwords] loaded compiled banwords from cache")
+            else:
                 words = []
-                for line in f:
+                for line in raw.decode("utf-8").splitlines():
                     word = line.strip()
                     if word:
                         words.append(word)
-            self.searchr.SetKeywords(words)
+                self.searchr.SetKeywords(words)
+                try:
+                    self.searchr.Save(cache_path, words_hash)
+                except Exception as e:
+                    logger.warn("[Banwords] save cache failed: %s" % e)
             self.handlers[Event.ON_HANDLE_CONTEXT] = self.on_handle_context
             if conf.get("reply_filter", True):
                 self.handlers[Event.ON_DECORATE_REPLY] = self.on_decorate_reply
@@ -6,245 +6,232 @@
 # 更新日志
 # 2020.04.06 第一次提交
 # 2020.05.16 修改，支持大于0xffff的字符
+# 之后 Aho-Corasick自动机编译为扁平数组(array('i'))，构建结果可缓存到磁盘，支持批量扫描
+
+import pickle
+from array import array
 
 __all__ = ['WordsSearch']
 __author__ = 'Lin Zhijun'
 __date__ = '2020.05.16'
 
+_CACHE_VERSION = 1
+
+
 class TrieNode():
+    """只在构建时使用"""
+    __slots__ = ('Children', 'Results')
+
     def __init__(self):
-        self.Index = 0
-        self.Index = 0
-        self.Layer = 0
-        self.End = False
-        self.Char = ''
-        self.Results = []
-        self.m_values = {}
-        self.Failure = None
-        self.Parent = None
-
-    def Add(self,c):
-        if c in self.m_values :
-            return self.m_values[c]
-        node = TrieNode()
-        node.Parent = self
-        node.Char = c
-        self.m_values[c] = node
-        return node
-
-    def SetResults(self,index):
-        if (self.End == False):
-            self.End = True
-        self.Results.append(index)
-
-class TrieNode2():
-    def __init__(self):
-        self.End = False
+        self.Children = {}  # 字符编号 -> TrieNode
         self.Results = []
-        self.m_values = {}
-        self.minflag = 0xffff
-        self.maxflag = 0
-
-    def Add(self,c,node3):
-        if (self.minflag > c):
-            self.minflag = c
-        if (self.maxflag < c):
-             self.maxflag = c
-        self.m_values[c] = node3
-
-    def SetResults(self,index):
-        if (self.End == False) :
-            self.End = True
-        if (index in self.Results )==False : 
-            self.Results.append(index)
-
-    def HasKey(self,c):
-        return c in self.m_values
-        
- 
-    def TryGetValue(self,c):
-        if (self.minflag <= c and self.maxflag >= c):
-            if c in self.m_values:
-                return self.m_values[c]
-        return None
 
 
 class WordsSearch():
+    """
+    关键词编译为Aho-Corasick自动机:
+    - 关键词中出现的字符映射为从1开始的连续编号，不在任何关键词中的字符直接回到根状态
+    - 状态转移保存在一个以 状态*字符数+字符编号 为key的字典中，失败指针、输出区间保存在array('i')中
+    - 每个状态的输出(命中的关键词)按 自身关键词、失败状态的输出 顺序平铺在一个数组中
+    """
+
     def __init__(self):
-        self._first = {}
         self._keywords = []
-        self._indexs=[]
-    
-    def SetKeywords(self,keywords):
-        self._keywords = keywords
-        self._indexs=[]
-        for i in range(len(keywords)):
-            self._indexs.append(i)
+        self._indexs = []
+        self._chars = {}  # 字符 -> 编号(从1开始)
+        self._width = 1  # 字符编号数+1，用于计算转移表的key
+        self._goto = {}  # state * _width + 字符编号 -> 下一状态
+        self._fail = array('i', [0])  # 状态 -> 失败状态
+        self._outStart = array('i', [0, 0])  # 状态s的输出为 _out[_outStart[s]:_outStart[s + 1]]
+        self._out = array('i')
+        self._terminal = bytearray(1)  # 状态 -> 是否有输出
+
+    def SetKeywords(self, keywords):
+        self._keywords = list(keywords)
+        self._indexs = list(range(len(self._keywords)))
+
+        chars = {}
+        for p in self._keywords:
+            for c in p:
+                if c not in chars:
+                    chars[c] = len(chars) + 1
+        width = len(chars) + 1
 
         root = TrieNode()
-        allNodeLayer={}
-
-        for i in range(len(self._keywords)): # for (i = 0; i < _keywords.length; i++) 
-            p = self._keywords[i]
+        for i, p in enumerate(self._keywords):
             nd = root
-            for j in range(len(p)): # for (j = 0; j < p.length; j++) 
-                nd = nd.Add(ord(p[j]))
-                if (nd.Layer == 0):
-                    nd.Layer = j + 1
-                    if nd.Layer in allNodeLayer:
-                        allNodeLayer[nd.Layer].append(nd)
-                    else:
-                        allNodeLayer[nd.Layer]=[]
-                        allNodeLayer[nd.Layer].append(nd)
-            nd.SetResults(i)
-
-
-        allNode = []
-        allNode.append(root)
-        for key in allNodeLayer.keys():
-            for nd in allNodeLayer[key]:
-                allNode.append(nd)
-        allNodeLayer=None
-
-        for i in range(len(allNode)): # for (i = 0; i < allNode.length; i++) 
-            if i==0 :
+            for c in p:
+                code = chars[c]
+                child = nd.Children.get(code)
+                if child is None:
+                    child = TrieNode()
+                    nd.Children[code] = child
+                nd = child
+            nd.Results.append(i)
+
+        # 按层遍历给状态编号，同时计算失败指针和输出
+        nodes = [root]
+        fail = [0]
+        outputs = [[]]
+        goto = {}
+        head = 0
+        while head < len(nodes):
+            nd = nodes[head]
+            state = head
+            head += 1
+            for code, child in nd.Children.items():
+                child_state = len(nodes)
+                nodes.append(child)
+                goto[state * width + code] = child_state
+                if state == 0:
+                    f = 0
+                else:
+                    f = fail[state]
+                    while f and (f * width + code) not in goto:
+                        f = fail[f]
+                    f = goto.get(f * width + code, 0)
+                fail.append(f)
+                outputs.append(child.Results + outputs[f])
+
+        out_start = array('i', [0])
+        out = array('i')
+        for results in outputs:
+            out.extend(results)
+            out_start.append(len(out))
+
+        self._chars = chars
+        self._width = width
+        self._goto = goto
+        self._fail = array('i', fail)
+        self._outStart = out_start
+        self._out = out
+        self._terminal = bytearray(1 if results else 0 for results in outputs)
+
+    # ---------- 构建结果缓存 ----------
+
+    def Save(self, path, key=''):
+        """保存编译后的自动机，key用于校验词库是否变化(如词库文件的hash)"""
+        data = (_CACHE_VERSION, key, self._keywords, self._chars, self._width, self._goto,
+                self._fail.tobytes(), self._outStart.tobytes(), self._out.tobytes())
+        with open(path, 'wb') as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def Load(self, path, key=''):
+        """加载Save保存的自动机，版本或key不一致时返回False"""
+        try:
+            with open(path, 'rb') as f:
+                data = pickle.load(f)
+        except Exception:
+            return False
+        if not isinstance(data, tuple) or len(data) != 9 or data[0] != _CACHE_VERSION or data[1] != key:
+            return False
+        _, _, self._keywords, self._chars, self._width, self._goto, fail, out_start, out = data
+        self._indexs = list(range(len(self._keywords)))
+        self._fail = array('i')
+        self._fail.frombytes(fail)
+        self._outStart = array('i')
+        self._outStart.frombytes(out_start)
+        self._out = array('i')
+        self._out.frombytes(out)
+        self._terminal = bytearray(1 if self._outStart[s] != self._outStart[s + 1] else 0 for s in range(len(self._fail)))
+        return True
+
+    # ---------- 查找 ----------
+
+    def _scan(self, text):
+        """依次返回 (结束位置, 状态)，只返回有输出的状态"""
+        chars = self._chars
+        goto = self._goto
+        fail = self._fail
+        terminal = self._terminal
+        width = self._width
+        state = 0
+        index = -1
+        for c in text:
+            index += 1
+            code = chars.get(c)
+            if code is None:
+                state = 0
                 continue
-            nd=allNode[i]
-            nd.Index = i
-            r = nd.Parent.Failure
-            c = nd.Char
-            while (r != None and (c in r.m_values)==False):
-                r = r.Failure
-            if (r == None):
-                nd.Failure = root
-            else:
-                nd.Failure = r.m_values[c]
-                for key2 in nd.Failure.Results :
-                    nd.SetResults(key2)
-        root.Failure = root
-
-        allNode2 = []
-        for i in range(len(allNode)): # for (i = 0; i < allNode.length; i++) 
-            allNode2.append( TrieNode2())
-        
-        for i in range(len(allNode2)): # for (i = 0; i < allNode2.length; i++) 
-            oldNode = allNode[i]
-            newNode = allNode2[i]
-
-            for key in oldNode.m_values :
-                index = oldNode.m_values[key].Index
-                newNode.Add(key, allNode2[index])
-            
-            for index in range(len(oldNode.Results)): # for (index = 0; index < oldNode.Results.length; index++) 
-                item = oldNode.Results[index]
-                newNode.SetResults(item)
-            
-            oldNode=oldNode.Failure
-            while oldNode != root:
-                for key in oldNode.m_values :
-                    if (newNode.HasKey(key) == False):
-                        index = oldNode.m_values[key].Index
-                        newNode.Add(key, allNode2[index])
-                for index in range(len(oldNode.Results)): 
-                    item = oldNode.Results[index]
-                    newNode.SetResults(item)
-                oldNode=oldNode.Failure
-        allNode = None
-        root = None
-
-        # first = []
-        # for index in range(65535):# for (index = 0; index < 0xffff; index++) 
-        #     first.append(None)
-        
-        # for key in allNode2[0].m_values :
-        #     first[key] = allNode2[0].m_values[key]
-        
-        self._first = allNode2[0]
-    
-
-    def FindFirst(self,text):
-        ptr = None
-        for index in range(len(text)): # for (index = 0; index < text.length; index++) 
-            t =ord(text[index]) # text.charCodeAt(index)
-            tn = None
-            if (ptr == None):
-                tn = self._first.TryGetValue(t)
-            else:
-                tn = ptr.TryGetValue(t)
-                if (tn==None):
-                    tn = self._first.TryGetValue(t)
-                
-            
-            if (tn != None):
-                if (tn.End):
-                    item = tn.Results[0]
-                    keyword = self._keywords[item]
-                    return { "Keyword": keyword, "Success": True, "End": index, "Start": index + 1 - len(keyword), "Index": self._indexs[item] }
-            ptr = tn
+            nxt = goto.get(state * width + code)
+            while nxt is None:
+                if not state:
+                    nxt = 0
+                    break
+                state = fail[state]
+                nxt = goto.get(state * width + code)
+            state = nxt
+            if terminal[state]:
+                yield index, state
+
+    def _result(self, index, item):
+        keyword = self._keywords[item]
+        return {"Keyword": keyword, "Success": True, "End": index, "Start": index + 1 - len(keyword), "Index": self._indexs[item]}
+
+    def FindFirst(self, text):
+        for index, state in self._scan(text):
+            return self._result(index, self._out[self._outStart[state]])
         return None
 
-    def FindAll(self,text):
-        ptr = None
+    def FindAll(self, text):
+        out = self._out
+        out_start = self._outStart
         list = []
-
-        for index in range(len(text)): # for (index = 0; index < text.length; index++) 
-            t =ord(text[index]) # text.charCodeAt(index)
-            tn = None
-            if (ptr == None):
-                tn = self._first.TryGetValue(t)
-            else:
-                tn = ptr.TryGetValue(t)
-                if (tn==None):
-                    tn = self._first.TryGetValue(t)
-                
-            
-            if (tn != None):
-                if (tn.End):
-                    for j in range(len(tn.Results)): # for (j = 0; j < tn.Results.length; j++) 
-                        item = tn.Results[j]
-                        keyword = self._keywords[item]
-                        list.append({ "Keyword": keyword, "Success": True, "End": index, "Start": index + 1 - len(keyword), "Index": self._indexs[item] })
-            ptr = tn
+        for index, state in self._scan(text):
+            for j in range(out_start[state], out_start[state + 1]):
+                list.append(self._result(index, out[j]))
         return list
 
-
-    def ContainsAny(self,text):
-        ptr = None
-        for index in range(len(text)): # for (index = 0; index < text.length; index++) 
-            t =ord(text[index]) # text.charCodeAt(index)
-            tn = None
-            if (ptr == None):
-                tn = self._first.TryGetValue(t)
-            else:
-                tn = ptr.TryGetValue(t)
-                if (tn==None):
-                    tn = self._first.TryGetValue(t)
-            
-            if (tn != None):
-                if (tn.End):
-                    return True
-            ptr = tn
+    def ContainsAny(self, text):
+        for _ in self._scan(text):
+            return True
         return False
-    
-    def Replace(self,text, replaceChar = '*'):
-        result = list(text) 
-
-        ptr = None
-        for i in range(len(text)): # for (i = 0; i < text.length; i++) 
-            t =ord(text[i]) # text.charCodeAt(index)
-            tn = None
-            if (ptr == None):
-                tn = self._first.TryGetValue(t)
-            else:
-                tn = ptr.TryGetValue(t)
-                if (tn==None):
-                    tn = self._first.TryGetValue(t)
-            
-            if (tn != None):
-                if (tn.End):
-                    maxLength = len( self._keywords[tn.Results[0]])
-                    start = i + 1 - maxLength
-                    for j in range(start,i+1): # for (j = start; j <= i; j++) 
-                        result[j] = replaceChar
-            ptr = tn
-        return ''.join(result) 
\ No newline at end of file
+
+    def Replace(self, text, replaceChar='*'):
+        result = list(text)
+        for i, state in self._scan(text):
+            # 每个状态的第一个输出是以该位置结尾的最长关键词
+            maxLength = len(self._keywords[self._out[self._outStart[state]]])
+            for j in range(i + 1 - maxLength, i + 1):
+                result[j] = replaceChar
+        return ''.join(result)
+
+    # ---------- 批量查找 ----------
+
+    def _scanBatch(self, texts):
+        """把多条消息用不在词库中的字符拼接后扫描一次，依次返回 (消息序号, 结束位置, 状态)"""
+        sep = '\n'
+        while sep in self._chars:
+            sep = chr(ord(sep) + 1)
+        starts = []
+        pos = 0
+        for text in texts:
+            starts.append(pos)
+            pos += len(text) + 1
+        i = 0
+        for index, state in self._scan(sep.join(texts)):
+            while i + 1 < len(starts) and starts[i + 1] <= index:
+                i += 1
+            yield i, index - starts[i], state
+
+    def FindFirstBatch(self, texts):
+        results = [None] * len(texts)
+        for i, index, state in self._scanBatch(texts):
+            if results[i] is None:
+                results[i] = self._result(index, self._out[self._outStart[state]])
+        return results
+
+    def FindAllBatch(self, texts):
+        out = self._out
+        out_start = self._outStart
+        results = [[] for _ in texts]
+        for i, index, state in self._scanBatch(texts):
+            for j in range(out_start[state], out_start[state + 1]):
+                results[i].append(self._result(index, out[j]))
+        return results
+
+    def ContainsAnyBatch(self, texts):
+        results = [False] * len(texts)
+        for i, _, _ in self._scanBatch(texts):
+            results[i] = True
+        return results
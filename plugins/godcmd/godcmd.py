@@ -9,6 +9,7 @@ import plugins
 from bridge.bridge import Bridge
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
+from bridge.reply_cache import get_reply_cache
 from common import const
 from config import load_config, global_config
 from plugins import *
@@ -137,6 +138,20 @@ ADMIN_COMMANDS = {
         "alias": ["admin", "管理员模式", "管理模式"],
         "desc": "开启机器管理员模式",
     },
+    "poolstats": {
+        "alias": ["poolstats", "线程池"],
+        "desc": "查看消息处理线程池状态",
+    },
+    "stats": {
+        "alias": ["stats", "插件统计"],
+        "args": ["reset(可选)"],
+        "desc": "查看各插件的调用次数和耗时",
+    },
+    "cache": {
+        "alias": ["cache", "回复缓存"],
+        "args": ["reset/clear(可选)"],
+        "desc": "查看回复缓存命中率，reset重置统计，clear清空缓存",
+    },
 }
 
 
@@ -444,6 +459,42 @@ class Godcmd(Plugin):
                             ok, result = True,open_admin_mode()
                         elif args[0]== "关闭":
                             ok, result = True,close_admin_mode()
+                    elif cmd == "poolstats":
+                        from channel.chat_channel import handler_pool
+                        ok = True
+                        result = "线程池状态：\n"
+                        for lane, stats in handler_pool.stats().items():
+                            result += f"{lane}: 运行{stats['running']}/{stats['workers']} 排队{stats['queued']}/{stats['max_queue']} " \
+                                      f"完成{stats['completed']} 拒绝{stats['rejected']} 丢弃{stats['dropped']}\n"
+                    elif cmd == "stats":
+                        reset = len(args) > 0 and args[0] == "reset"
+                        plugin_stats = PluginManager().stats(reset=reset)
+                        ok = True
+                        if not plugin_stats:
+                            result = "暂无插件调用记录"
+                        else:
+                            result = "插件统计(按累计耗时排序)：\n"
+                            for name, stats in plugin_stats:
+                                avg = stats["total"] / stats["calls"] * 1000
+                                result += f"{name}: 调用{stats['calls']}次 累计{stats['total'] * 1000:.1f}ms " \
+                                          f"平均{avg:.2f}ms 最大{stats['max'] * 1000:.1f}ms 中断{stats['breaks']}次\n"
+                            if reset:
+                                result += "统计已重置"
+                    elif cmd == "cache":
+                        cache = get_reply_cache()
+                        if cache is None:
+                            ok, result = False, "未开启回复缓存(reply_cache)"
+                        else:
+                            reset = len(args) > 0 and args[0] == "reset"
+                            if len(args) > 0 and args[0] == "clear":
+                                cache.clear()
+                            stats = cache.stats(reset=reset)
+                            ok = True
+                            result = f"回复缓存：{stats['size']}条\n命中{stats['hits']}次 磁盘命中{stats['disk_hits']}次 " \
+                                     f"未命中{stats['misses']}次 跳过{stats['bypasses']}次 写入{stats['stores']}次\n" \
+                                     f"命中率{stats['hit_rate'] * 100:.1f}% 平均查找{stats['avg_lookup'] * 1e6:.0f}µs"
+                            if reset:
+                                result += "\n统计已重置"
                     elif cmd == "updatep":
                         if len(args) != 1:
                             ok, result = False, "请提供插件名"
@@ -15,6 +15,7 @@ import requests
     desc="发送卡片式链接和小程序",
     version="0.3.1",
     author="Francis",
+    context_types=[ContextType.TEXT],
 )
 class lcard(Plugin):
     def __init__(self):
@@ -4,7 +4,11 @@ import importlib
 import importlib.util
 import json
 import os
+import re
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from common.log import logger
 from common.singleton import singleton
@@ -13,6 +17,10 @@ from config import conf, write_plugin_config
 
 from .event import *
 
+# 后台加载时从插件源码中读取的元数据：@plugins.register(name=...) 和 self.handlers[Event.XXX]
+_REGISTER_NAME = re.compile(r"register\([^)]*?\bname\s*=\s*[\"']([^\"']+)[\"']")
+_HANDLER_EVENT = re.compile(r"handlers\[\s*Event\.(\w+)\s*\]")
+
 
 @singleton
 class PluginManager:
@@ -21,8 +29,24 @@ class PluginManager:
         self.listening_plugins = {}
         self.instances = {}
         self.pconf = {}
-        self.current_plugin_path = None
+        self.local = threading.local()  # current_plugin_path按线程保存，插件可以在多个线程中同时导入
         self.loaded = {}
+        self.load_lock = threading.RLock()
+        self.pending = {}  # plugin_path -> (订阅的事件集合，未知时为None, Future)，后台加载中的插件
+        self.load_report = {}  # plugin_path -> {"import": 秒}，name -> {"init": 秒}
+        # 事件分发索引：event -> ((name, handler, context_types, prefixes), ...)，只包含已启用的插件，按优先级排列
+        # 插件启用/禁用、优先级变化、重载时重建，emit_event不再逐个检查插件状态
+        self.dispatch_index = {}
+        self.stats_lock = threading.Lock()
+        self.plugin_stats = {}  # name -> {"calls", "total", "max", "breaks"}
+
+    @property
+    def current_plugin_path(self):
+        return getattr(self.local, "current_plugin_path", None)
+
+    @current_plugin_path.setter
+    def current_plugin_path(self, path):
+        self.local.current_plugin_path = path
 
     def register(self, name: str, desire_priority: int = 0, **kwargs):
         def wrapper(plugincls):
@@ -35,9 +59,15 @@ class PluginManager:
             plugincls.namecn = kwargs.get("namecn") if kwargs.get("namecn") != None else name
             plugincls.hidden = kwargs.get("hidden") if kwargs.get("hidden") != None else False
             plugincls.enabled = True
+            # 可选的过滤条件，只有context满足时才调用插件，实例中可以覆盖(如前缀来自插件配置)
+            context_types = kwargs.get("context_types")
+            plugincls.context_types = tuple(context_types) if context_types else None
+            prefixes = kwargs.get("prefixes")
+            plugincls.prefixes = tuple(prefixes) if prefixes else None
             if self.current_plugin_path == None:
                 raise Exception("Plugin path not set")
-            self.plugins[name.upper()] = plugincls
+            with self.load_lock:
+                self.plugins[name.upper()] = plugincls
             logger.info("Plugin %s_v%s registered, path=%s" % (name, plugincls.version, plugincls.path))
 
         return wrapper
@@ -96,6 +126,7 @@ class PluginManager:
                 if os.path.isfile(main_module_path):
                     # 导入插件
                     import_path = "plugins.{}".format(plugin_name)
+                    start = time.perf_counter()
                     try:
                         self.current_plugin_path = plugin_path
                         if plugin_path in self.loaded:
@@ -110,55 +141,94 @@ class PluginManager:
                             self.loaded[plugin_path] = importlib.import_module(import_path)
                         self.current_plugin_path = None
                     except Exception as e:
+                        self.current_plugin_path = None
                         logger.error("Failed to import plugin %s: %s" % (plugin_name, e))
                         continue
-        pconf = self.pconf
+                    self._record_load(plugin_path, "import", time.perf_counter() - start)
         news = [self.plugins[name] for name in self.plugins]
         new_plugins = list(set(news) - set(raws))
-        modified = False
-        for name, plugincls in self.plugins.items():
-            rawname = plugincls.name
-            if rawname not in pconf["plugins"]:
-                modified = True
-                logger.info("Plugin %s not found in pconfig, adding to pconfig..." % name)
-                pconf["plugins"][rawname] = {
-                    "enabled": plugincls.enabled,
-                    "priority": plugincls.priority,
-                }
-            else:
-                self.plugins[name].enabled = pconf["plugins"][rawname]["enabled"]
-                self.plugins[name].priority = pconf["plugins"][rawname]["priority"]
-                self.plugins._update_heap(name)  # 更新下plugins中的顺序
-        if modified:
-            self.save_config()
+        self._sync_pconf(list(self.plugins.keys()))
         return new_plugins
 
+    def _sync_pconf(self, names):
+        """新插件写入plugins.json，已有插件按plugins.json设置启用状态和优先级"""
+        with self.load_lock:
+            pconf = self.pconf
+            modified = False
+            for name in names:
+                plugincls = self.plugins[name]
+                rawname = plugincls.name
+                if rawname not in pconf["plugins"]:
+                    modified = True
+                    logger.info("Plugin %s not found in pconfig, adding to pconfig..." % name)
+                    pconf["plugins"][rawname] = {
+                        "enabled": plugincls.enabled,
+                        "priority": plugincls.priority,
+                    }
+                else:
+                    self.plugins[name].enabled = pconf["plugins"][rawname]["enabled"]
+                    self.plugins[name].priority = pconf["plugins"][rawname]["priority"]
+                    self.plugins._update_heap(name)  # 更新下plugins中的顺序
+            if modified:
+                self.save_config()
+
     def refresh_order(self):
         for event in self.listening_plugins.keys():
             self.listening_plugins[event].sort(key=lambda name: self.plugins[name].priority, reverse=True)
+        self.rebuild_index()
+
+    def rebuild_index(self):
+        """根据当前启用的插件和优先级重建事件分发索引"""
+        index = {}
+        for event, names in self.listening_plugins.items():
+            entries = []
+            for name in dict.fromkeys(names):  # 多次activate可能重复登记同一插件
+                plugincls = self.plugins.get(name)
+                instance = self.instances.get(name)
+                if plugincls is None or instance is None or not plugincls.enabled or event not in instance.handlers:
+                    continue
+                context_types = getattr(instance, "context_types", None)
+                prefixes = getattr(instance, "prefixes", None)
+                entries.append((
+                    name,
+                    instance.handlers[event],
+                    tuple(context_types) if context_types else None,
+                    tuple(prefixes) if prefixes else None,
+                ))
+            if entries:
+                index[event] = tuple(entries)
+        self.dispatch_index = index
 
     def activate_plugins(self):  # 生成新开启的插件实例
         failed_plugins = []
-        for name, plugincls in self.plugins.items():
+        for name, plugincls in list(self.plugins.items()):
             if plugincls.enabled:
                 if 'GODCMD' in self.instances and name == 'GODCMD':
                     continue
                 # if name not in self.instances:
-                try:
-                    instance = plugincls()
-                except Exception as e:
-                    logger.warn("Failed to init %s, diabled. %s" % (name, e))
-                    self.disable_plugin(name)
+                if not self._activate_plugin(name, plugincls):
                     failed_plugins.append(name)
-                    continue
-                self.instances[name] = instance
-                for event in instance.handlers:
-                    if event not in self.listening_plugins:
-                        self.listening_plugins[event] = []
-                    self.listening_plugins[event].append(name)
-        self.refresh_order()
+        with self.load_lock:
+            self.refresh_order()
         return failed_plugins
 
+    def _activate_plugin(self, name, plugincls):
+        start = time.perf_counter()
+        try:
+            instance = plugincls()
+        except Exception as e:
+            logger.warn("Failed to init %s, diabled. %s" % (name, e))
+            self.disable_plugin(name)
+            return False
+        self._record_load(name, "init", time.perf_counter() - start)
+        with self.load_lock:
+            self.instances[name] = instance
+            for event in instance.handlers:
+                if event not in self.listening_plugins:
+                    self.listening_plugins[event] = []
+                self.listening_plugins[event].append(name)
+        return True
+
     def reload_plugin(self, name: str):
         name = name.upper()
         if name in self.instances:
@@ -172,28 +242,194 @@ class PluginManager:
 
     def load_plugins(self):
         self.load_config()
+        if conf().get("plugin_lazy_load", True):
+            self._load_all_config()
+            self._load_plugins_background()
+            return
+        start = time.perf_counter()
         self.scan_plugins()
         # 加载全量插件配置
         self._load_all_config()
+        self._check_pconf()
+        self.activate_plugins()
+        self._report_load(time.perf_counter() - start)
+
+    def _check_pconf(self):
         pconf = self.pconf
         logger.debug("plugins.json config={}".format(pconf))
         for name, plugin in pconf["plugins"].items():
             if name.upper() not in self.plugins:
                 logger.error("Plugin %s not found, but found in plugins.json" % name)
-        self.activate_plugins()
+
+    # ---------- 后台加载 ----------
+
+    def _load_plugins_background(self):
+        """
+        插件在后台线程池中导入并初始化，load_plugins立即返回。
+        插件订阅的事件从源码中静态读取(self.handlers[Event.XXX])，emit_event只等待订阅了当前事件且尚未加载完成的插件，
+        读取不到时该插件的加载会阻塞所有事件。
+        """
+        start = time.perf_counter()
+        plugins_dir = "./plugins"
+        targets = []
+        for plugin_name in os.listdir(plugins_dir):
+            plugin_path = os.path.join(plugins_dir, plugin_name)
+            if os.path.isdir(plugin_path) and os.path.isfile(os.path.join(plugin_path, "__init__.py")):
+                targets.append((plugin_name, plugin_path))
+        if not targets:
+            return
+        executor = ThreadPoolExecutor(max_workers=conf().get("plugin_load_workers", 4), thread_name_prefix="plugin-loader")
+        with self.load_lock:
+            for plugin_name, plugin_path in targets:
+                events = self._scan_events(plugin_path)
+                future = executor.submit(self._load_plugin, plugin_name, plugin_path, start)
+                self.pending[plugin_path] = (events, future)
+        executor.shutdown(wait=False)
+        logger.info("Loading {} plugins in background".format(len(targets)))
+
+    def _scan_events(self, plugin_path):
+        """不导入插件，从源码中读取插件名和订阅的事件；插件在plugins.json中被禁用时返回空集合"""
+        events = set()
+        name = None
+        try:
+            for filename in os.listdir(plugin_path):
+                if not filename.endswith(".py"):
+                    continue
+                with open(os.path.join(plugin_path, filename), "r", encoding="utf-8") as f:
+                    source = f.read()
+                match = _REGISTER_NAME.search(source)
+                if match:
+                    name = match.group(1)
+                for event_name in _HANDLER_EVENT.findall(source):
+                    if event_name in Event.__members__:
+                        events.add(Event[event_name])
+        except Exception as e:
+            logger.debug("scan plugin {} events failed: {}", plugin_path, e)
+            return None
+        plugin_conf = self.pconf["plugins"].get(name) if name else None
+        if plugin_conf is not None and not plugin_conf.get("enabled", True):
+            return set()
+        return events or None
+
+    def _load_plugin(self, plugin_name, plugin_path, start):
+        import_path = "plugins.{}".format(plugin_name)
+        try:
+            import_start = time.perf_counter()
+            self.current_plugin_path = plugin_path
+            try:
+                self.loaded[plugin_path] = importlib.import_module(import_path)
+            finally:
+                self.current_plugin_path = None
+            self._record_load(plugin_path, "import", time.perf_counter() - import_start)
+            with self.load_lock:
+                names = [name for name, plugincls in self.plugins.items() if plugincls.path == plugin_path]
+            self._sync_pconf(names)
+            for name in names:
+                plugincls = self.plugins[name]
+                if plugincls.enabled and name not in self.instances:
+                    self._activate_plugin(name, plugincls)
+            with self.load_lock:
+                self.refresh_order()
+        except Exception as e:
+            logger.error("Failed to load plugin %s: %s" % (plugin_name, e))
+        finally:
+            with self.load_lock:
+                self.pending.pop(plugin_path, None)
+                done = not self.pending
+            if done:
+                self._check_pconf()
+                self._report_load(time.perf_counter() - start)
+
+    def wait_loaded(self, timeout=None):
+        """等待后台加载的插件全部完成"""
+        for _, future in list(self.pending.values()):
+            try:
+                future.result(timeout=timeout)
+            except Exception:
+                pass
+
+    def _wait_pending(self, event):
+        for plugin_path, (events, future) in list(self.pending.items()):
+            if events is None or event in events:
+                try:
+                    future.result(timeout=conf().get("plugin_load_timeout", 60))
+                except Exception:
+                    # 只等待一次，之后的事件不再等待该插件；插件加载完成后仍会正常注册
+                    with self.load_lock:
+                        skipped = self.pending.get(plugin_path, (None, None))[1] is future
+                        if skipped:
+                            del self.pending[plugin_path]
+                    if skipped:
+                        logger.warning("Plugin {} loading timeout, events will be dispatched without waiting for it", plugin_path)
+
+    def _record_load(self, key, stage, elapsed):
+        # 导入时还不知道插件名，导入耗时按目录记录，初始化耗时按插件名记录，报告时再对应起来
+        with self.load_lock:
+            self.load_report.setdefault(key, {})[stage] = elapsed
+
+    def _report_load(self, elapsed):
+        with self.load_lock:
+            rows = []
+            for name, plugincls in self.plugins.items():
+                import_time = self.load_report.get(plugincls.path, {}).get("import", 0.0)
+                init_time = self.load_report.get(name, {}).get("init", 0.0)
+                rows.append((plugincls.name, import_time, init_time))
+        rows.sort(key=lambda row: row[1] + row[2], reverse=True)
+        report = "Plugins loaded in {:.0f}ms:".format(elapsed * 1000)
+        for rawname, import_time, init_time in rows:
+            report += "\n  {}: import {:.0f}ms, init {:.0f}ms".format(rawname, import_time * 1000, init_time * 1000)
+        logger.info(report)
 
     def emit_event(self, e_context: EventContext, *args, **kwargs):
-        if e_context.event in self.listening_plugins:
-            for name in self.listening_plugins[e_context.event]:
-                if self.plugins[name].enabled and e_context.action == EventAction.CONTINUE:
-                    logger.debug("Plugin %s triggered by event %s" % (name, e_context.event))
-                    instance = self.instances[name]
-                    instance.handlers[e_context.event](e_context, *args, **kwargs)
-                    if e_context.is_break():
-                        e_context["breaked_by"] = name
-                        logger.debug("Plugin %s breaked event %s" % (name, e_context.event))
+        if self.pending:
+            self._wait_pending(e_context.event)
+        entries = self.dispatch_index.get(e_context.event)
+        if not entries:
+            return e_context
+        for name, handler, context_types, prefixes in entries:
+            if e_context.action is not EventAction.CONTINUE:
+                break
+            if context_types is not None or prefixes is not None:
+                # 前面的插件可能修改context，过滤条件每次都按当前context判断
+                context = e_context.econtext.get("context")
+                if context is None:
+                    continue
+                if context_types is not None and context.type not in context_types:
+                    continue
+                if prefixes is not None and not (isinstance(context.content, str) and context.content.startswith(prefixes)):
+                    continue
+            logger.debug("Plugin {} triggered by event {}", name, e_context.event)
+            start = time.perf_counter()
+            try:
+                handler(e_context, *args, **kwargs)
+            finally:
+                breaked = e_context.action is not EventAction.CONTINUE
+                self._record(name, time.perf_counter() - start, breaked)
+            if breaked:
+                e_context["breaked_by"] = name
+                logger.debug("Plugin {} breaked event {}", name, e_context.event)
         return e_context
 
+    def _record(self, name, elapsed, breaked):
+        with self.stats_lock:
+            stats = self.plugin_stats.get(name)
+            if stats is None:
+                stats = self.plugin_stats[name] = {"calls": 0, "total": 0.0, "max": 0.0, "breaks": 0}
+            stats["calls"] += 1
+            stats["total"] += elapsed
+            if elapsed > stats["max"]:
+                stats["max"] = elapsed
+            if breaked:
+                stats["breaks"] += 1
+
+    def stats(self, reset=False):
+        """各插件的调用次数、累计耗时(秒)、最大耗时和中断事件次数，按累计耗时从高到低排列"""
+        with self.stats_lock:
+            result = sorted(((name, dict(stats)) for name, stats in self.plugin_stats.items()), key=lambda item: item[1]["total"], reverse=True)
+            if reset:
+                self.plugin_stats.clear()
+        return result
+
     def set_plugin_priority(self, name: str, priority: int):
         name = name.upper()
         if name not in self.plugins:
@@ -233,6 +469,7 @@ class PluginManager:
             rawname = self.plugins[name].name
             self.pconf["plugins"][rawname]["enabled"] = False
             self.save_config()
+            self.rebuild_index()
             return True
         return True
 
@@ -247,7 +484,6 @@ class PluginManager:
         except Exception as e:
             logger.error("Failed to install plugin, {}".format(e))
             return False, "无法导入dulwich，安装插件失败"
-        import re
 
         from dulwich import porcelain
 
@@ -331,6 +567,8 @@ class PluginManager:
                 if name in self.listening_plugins[event]:
                     self.listening_plugins[event].remove(name)
             del self.plugins[name]
+            self.instances.pop(name, None)
+            self.rebuild_index()
             del self.pconf["plugins"][rawname]
             self.loaded[dirname] = None
             self.save_config()
@@ -37,6 +37,7 @@ class TimeTaskRemindType(Enum):
     desc="定时任务系统，可定时处理事件",
     version="2.8",
     author="haikerwang",
+    context_types=[ContextType.TEXT],
 )
 class timetask(Plugin):
 
@@ -0,0 +1,141 @@
+"""
+ChatChannel._compose_context吞吐量：繁忙的白名单群中不触发机器人的普通消息
+
+python tests/benchmarks/bench_compose_context.py [--old]
+
+200个白名单群、3个前缀和3个关键词，插件事件分发替换为直接返回，只统计规则匹配部分。
+--old 使用每条消息读取conf()、在列表中查找并逐个检查前缀/关键词的匹配器作为对比(原来_compose_context的写法)
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+
+import config
+
+GROUPS = ["测试群%d" % i for i in range(200)]
+config.config = config.Config(
+    {
+        "group_name_white_list": GROUPS,
+        "group_name_keyword_white_list": ["技术交流", "机器人"],
+        "group_chat_in_one_session": GROUPS[:50],
+        "group_chat_prefix": ["@bot", "bot", "机器人"],
+        "group_chat_keyword": ["帮我查", "请问", "翻译"],
+        "nick_name_black_list": ["spam%d" % i for i in range(50)],
+    }
+)
+
+from common.log import logger
+
+logger.remove()
+
+from bridge.context import ContextType
+from channel import chat_channel
+from channel.chat_channel import ChatChannel, check_contain, check_prefix
+from channel.chat_message import ChatMessage
+from config import conf
+
+
+class LegacyMatcher:
+    """原来的写法：每次都从conf()读取规则，在列表中查找"""
+
+    @property
+    def config(self):
+        return conf()
+
+    @property
+    def group_chat_prefix(self):
+        return conf().get("group_chat_prefix")
+
+    @property
+    def group_chat_keyword(self):
+        return conf().get("group_chat_keyword")
+
+    @property
+    def single_chat_prefix(self):
+        return conf().get("single_chat_prefix", [""])
+
+    @property
+    def image_create_prefix(self):
+        return conf().get("image_create_prefix", [""])
+
+    @property
+    def group_at_off(self):
+        return conf().get("group_at_off", False)
+
+    @property
+    def trigger_by_self(self):
+        return conf().get("trigger_by_self", True)
+
+    @property
+    def always_reply_voice(self):
+        return conf().get("always_reply_voice")
+
+    @property
+    def voice_reply_voice(self):
+        return conf().get("voice_reply_voice")
+
+    def is_group_allowed(self, group_name):
+        white_list = conf().get("group_name_white_list", [])
+        return any(
+            [
+                group_name in white_list,
+                "ALL_GROUP" in white_list,
+                check_contain(group_name, conf().get("group_name_keyword_white_list", [])),
+            ]
+        )
+
+    def is_shared_session_group(self, group_name):
+        in_one_session = conf().get("group_chat_in_one_session", [])
+        return any([group_name in in_one_session, "ALL_GROUP" in in_one_session])
+
+    def is_nick_name_blocked(self, nick_name):
+        return bool(nick_name) and nick_name in conf().get("nick_name_black_list", [])
+
+    @staticmethod
+    def match_prefix(prefix_list, content):
+        return check_prefix(content, prefix_list)
+
+    @staticmethod
+    def match_contain(keyword_list, content):
+        return check_contain(content, keyword_list)
+
+
+class StubPluginManager:
+    def emit_event(self, e_context):
+        return e_context
+
+
+class BenchChannel(ChatChannel):
+    def consume(self):
+        pass
+
+
+def main():
+    old = "--old" in sys.argv
+    chat_channel.PluginManager = StubPluginManager
+    if old:
+        legacy = LegacyMatcher()
+        chat_channel.get_trigger_matcher = lambda: legacy
+    channel = BenchChannel()
+    channel.name = "bot"
+    messages = []
+    for i in range(20000):
+        cmsg = ChatMessage(None)
+        cmsg.from_user_id = cmsg.other_user_id = "%d@chatroom" % (i % 200)
+        cmsg.other_user_nickname = GROUPS[-1 - i % 20]  # 白名单靠后的群，列表查找最慢
+        cmsg.actual_user_id = "wxid_%d" % (i % 500)
+        cmsg.actual_user_nickname = "成员%d" % (i % 500)
+        cmsg.to_user_id = "wxid_bot"
+        messages.append((cmsg, "今天天气不错，大家中午吃什么 %d" % i))
+    start = time.perf_counter()
+    for cmsg, content in messages:
+        assert channel._compose_context(ContextType.TEXT, content, isgroup=True, msg=cmsg) is None
+    elapsed = time.perf_counter() - start
+    print("%s: %d messages in %.2fs, %.0f msg/s" % ("old" if old else "new", len(messages), elapsed, len(messages) / elapsed))
+
+
+if __name__ == "__main__":
+    main()
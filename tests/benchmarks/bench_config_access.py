@@ -0,0 +1,70 @@
+"""
+每条消息读取配置的耗时：conf().get逐项读取(旧) 与 config_snapshot()快照读取(新) 对比
+
+python tests/benchmarks/bench_config_access.py [--messages 100000]
+
+模拟处理一条消息时读取的配置项(触发前缀、群白名单、会话、限流等)，每条消息各读取一遍，
+输出每条消息的平均耗时；中途修改一次配置，确认快照随之更新。
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+
+import config
+
+KEYS = [
+    "single_chat_prefix",
+    "single_chat_reply_prefix",
+    "group_chat_prefix",
+    "group_chat_keyword",
+    "group_at_off",
+    "group_name_white_list",
+    "group_name_keyword_white_list",
+    "group_chat_in_one_session",
+    "nick_name_black_list",
+    "image_create_prefix",
+    "concurrency_in_session",
+    "rate_limit_per_chat",
+    "stream_reply",
+    "conversation_max_tokens",
+    "model",
+]
+
+
+def per_message_old():
+    for key in KEYS:
+        config.conf().get(key)
+
+
+def per_message_new():
+    snapshot = config.config_snapshot()
+    for key in KEYS:
+        snapshot.get(key)
+
+
+def run(handle, messages):
+    start = time.perf_counter()
+    for i in range(messages):
+        if i == messages // 2:
+            config.conf()["conversation_max_tokens"] = 2000  # 中途修改配置
+        handle()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=100000)
+    args = parser.parse_args()
+    for name, handle in (("old conf().get", per_message_old), ("new config_snapshot", per_message_new)):
+        config.config = config.Config({key: value for key, value in config.available_setting.items() if key in KEYS})
+        elapsed = run(handle, args.messages)
+        assert config.config_snapshot().conversation_max_tokens == 2000
+        print("%-20s messages=%d total=%.3fs per message=%.2fus" % (name, args.messages, elapsed, elapsed / args.messages * 1e6))
+
+
+if __name__ == "__main__":
+    main()
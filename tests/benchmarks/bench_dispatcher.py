@@ -0,0 +1,116 @@
+"""
+ChatChannel消息调度延迟：produce到_handle开始执行的时间
+
+python tests/benchmarks/bench_dispatcher.py [--old]
+
+每个规模分两种负载：
+- burst: N个session同时各收到一条消息
+- trickle: 之后每5ms向随机session发一条消息，共200条
+--old 使用原来每0.2秒扫描一次所有session的consume作为对比
+"""
+
+import os
+import random
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+
+import config
+
+# 原来的线程池没有排队上限，两种模式都不限制，避免旧consume遇到PoolFullError
+config.config = config.Config({"concurrency_in_session": 1, "handler_pool_max_queue": 0})
+
+from common.log import logger
+
+logger.remove()
+
+from bridge.context import Context, ContextType
+from channel import chat_channel
+from channel.chat_channel import ChatChannel
+
+
+def make_channel(old, on_handle):
+    class BenchChannel(ChatChannel):
+        futures = {}
+        sessions = {}
+        lock = threading.Lock()
+        ready = threading.Condition(lock)
+        ready_sessions = OrderedDict()
+        blocked_sessions = OrderedDict()
+
+        def _handle(self, context):
+            on_handle(context)
+
+        if old:
+            # 原来的consume：每0.2秒对所有session逐个加锁检查
+            def consume(self):
+                while True:
+                    with self.lock:
+                        session_ids = list(self.sessions.keys())
+                    for session_id in session_ids:
+                        with self.lock:
+                            context_queue, semaphore = self.sessions[session_id]
+                        if semaphore.acquire(blocking=False):
+                            if not context_queue.empty():
+                                context = context_queue.get()
+                                lane = chat_channel.handler_pool.lane_of(context)
+                                future = chat_channel.handler_pool.submit(lane, self._handle, context)
+                                future.add_done_callback(self._thread_pool_callback(session_id, lane, context=context))
+                                with self.lock:
+                                    self.futures.setdefault(session_id, []).append(future)
+                            elif semaphore._initial_value == semaphore._value + 1:
+                                with self.lock:
+                                    self.futures[session_id] = [t for t in self.futures.get(session_id, []) if not t.done()]
+                                    del self.sessions[session_id]
+                            else:
+                                semaphore.release()
+                    time.sleep(0.2)
+
+    return BenchChannel()
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def run(old, sessions):
+    latencies = []
+    done = threading.Semaphore(0)
+
+    def on_handle(context):
+        latencies.append(time.perf_counter() - context["enqueued_at"])
+        done.release()
+
+    channel = make_channel(old, on_handle)
+    cpu_start = time.process_time()
+
+    def produce(session_id):
+        channel.produce(Context(ContextType.TEXT, "hello", {"session_id": session_id, "enqueued_at": time.perf_counter()}))
+
+    for i in range(sessions):
+        produce(i)
+    for _ in range(sessions):
+        done.acquire()
+    burst = latencies[:]
+    del latencies[:]
+    for _ in range(200):
+        produce(random.randrange(sessions))
+        time.sleep(0.005)
+    for _ in range(200):
+        done.acquire()
+    cpu = time.process_time() - cpu_start
+    print(
+        "%-4s sessions=%-6d burst p50=%7.1fms p99=%7.1fms  trickle p50=%6.2fms p99=%6.2fms  cpu=%.2fs"
+        % ("old" if old else "new", sessions, percentile(burst, 0.5) * 1000, percentile(burst, 0.99) * 1000,
+           percentile(latencies, 0.5) * 1000, percentile(latencies, 0.99) * 1000, cpu)
+    )
+
+
+if __name__ == "__main__":
+    old = "--old" in sys.argv
+    for n in (10, 1000, 10000):
+        run(old, n)
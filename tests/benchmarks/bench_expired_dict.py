@@ -0,0 +1,43 @@
+"""
+ExpiredDict内存占用：模拟一周的消息去重ID写入，观察缓存大小和内存是否保持稳定
+
+python tests/benchmarks/bench_expired_dict.py [--rate 0.5] [--ttl 3600]
+
+使用模拟时钟，每条消息写入一个新的ID且之后不再读取，每隔一天输出一次缓存大小和tracemalloc统计的内存
+"""
+
+import argparse
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+
+from common.expired_dict import ExpiredDict
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rate", type=float, default=0.5, help="每秒消息数")
+    parser.add_argument("--ttl", type=int, default=3600)
+    parser.add_argument("--days", type=int, default=7)
+    args = parser.parse_args()
+
+    now = [0.0]
+    tracemalloc.start()
+    cache = ExpiredDict(args.ttl, clock=lambda: now[0])
+    interval = 1 / args.rate
+    day = 86400
+    msg_id = 0
+    for d in range(args.days):
+        while now[0] < (d + 1) * day:
+            cache["msg_%d" % msg_id] = True
+            msg_id += 1
+            now[0] += interval
+        current, peak = tracemalloc.get_traced_memory()
+        print("day %d: messages=%d size=%d memory=%.0fKB peak=%.0fKB" % (d, msg_id, len(cache), current / 1024, peak / 1024))
+    print(cache.stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+itchat联系人查找：10k好友、1k群的联系人列表上，旧的线性查找+deepcopy 与 索引查找对比
+
+python tests/benchmarks/bench_itchat_contacts.py [--friends 10000] [--chatrooms 1000]
+
+每项查找随机取200个(500人的大群取20个)，输出每次查找的平均耗时，以及重建好友索引的耗时。
+"""
+
+import argparse
+import copy
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+
+from lib.itchat.storage import Storage
+
+
+class FakeCore(object):
+    pass
+
+
+def build_storage(friend_count, chatroom_count):
+    random.seed(0)
+    words = [chr(c) for c in range(0x4E00, 0x4E00 + 300)]
+    storage = Storage(FakeCore())
+    for i in range(friend_count):
+        storage.memberList.append(
+            {
+                "UserName": "@%032x" % i,
+                "NickName": "".join(random.choice(words) for _ in range(3)),
+                "RemarkName": "remark%d" % i if i % 3 == 0 else "",
+                "Alias": "wx%d" % i,
+                "VerifyFlag": 0,
+                "Sex": i % 2,
+                "Signature": "signature of %d" % i,
+                "City": "city",
+            }
+        )
+    for i in range(chatroom_count):
+        storage.chatroomList.append(
+            {
+                "UserName": "@@%032x" % i,
+                "NickName": "".join(random.choice(words) for _ in range(6)),
+                "MemberList": [{"UserName": "@%032x" % j, "NickName": "member%d" % j} for j in range(500 if i == 0 else i % 50)],
+            }
+        )
+    return storage
+
+
+def bench(label, fn, args):
+    start = time.perf_counter()
+    for a in args:
+        fn(*a)
+    print("%-45s %10.1fus" % (label, (time.perf_counter() - start) / len(args) * 1e6))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--friends", type=int, default=10000)
+    parser.add_argument("--chatrooms", type=int, default=1000)
+    args = parser.parse_args()
+    storage = build_storage(args.friends, args.chatrooms)
+
+    def old_search_friends(name):
+        return copy.deepcopy([m for m in storage.memberList if any([m.get(k) == name for k in ("RemarkName", "NickName", "Alias")])])
+
+    def old_search_chatrooms(name=None, userName=None):
+        if userName is not None:
+            for m in storage.chatroomList:
+                if m["UserName"] == userName:
+                    return copy.deepcopy(m)
+        return [copy.deepcopy(m) for m in storage.chatroomList if name in m["NickName"]]
+
+    names = [(storage.memberList[random.randrange(args.friends)]["NickName"],) for _ in range(200)]
+    aliases = [("wx%d" % random.randrange(args.friends),) for _ in range(200)]
+    users = [(storage.memberList[random.randrange(args.friends)]["UserName"],) for _ in range(200)]
+    rooms = [(None, storage.chatroomList[random.randrange(args.chatrooms)]["UserName"]) for _ in range(200)]
+    fragments = [(storage.chatroomList[random.randrange(args.chatrooms)]["NickName"][1:3],) for _ in range(200)]
+    big = [(None, storage.chatroomList[0]["UserName"])] * 20
+
+    bench("old search_friends(name=NickName)", old_search_friends, names)
+    bench("new search_friends(name=NickName)", lambda n: storage.search_friends(name=n), names)
+    bench("old search_friends(name=Alias)", old_search_friends, aliases)
+    bench("new search_friends(wechatAccount=Alias)", lambda n: storage.search_friends(wechatAccount=n), aliases)
+    bench("old search_friends(userName)", lambda u: copy.deepcopy(next(m for m in storage.memberList if m["UserName"] == u)), users)
+    bench("new search_friends(userName)", lambda u: storage.search_friends(userName=u), users)
+    bench("rebuild friend index (%d contacts)" % args.friends, lambda: storage.memberIndex.rebuild(storage.memberList), [()] * 5)
+    bench("old search_chatrooms(userName)", old_search_chatrooms, rooms)
+    bench("new search_chatrooms(userName)", lambda n, u: storage.search_chatrooms(userName=u), rooms)
+    bench("old search_chatrooms(userName), 500 members", old_search_chatrooms, big)
+    bench("new search_chatrooms(userName), 500 members", lambda n, u: storage.search_chatrooms(userName=u), big)
+    bench("new get_chatroom(userName), 500 members", lambda n, u: storage.get_chatroom(u), big)
+    bench("old search_chatrooms(name=2 chars)", old_search_chatrooms, fragments)
+    bench("new search_chatrooms(name=2 chars)", lambda n: storage.search_chatrooms(name=n), fragments)
+
+
+if __name__ == "__main__":
+    main()
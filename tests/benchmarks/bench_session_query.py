@@ -0,0 +1,72 @@
+"""
+会话token计算耗时：同一会话连续200轮session_query/session_reply，统计每轮耗时
+
+python tests/benchmarks/bench_session_query.py [--turns 200] [--max-tokens 1000] [--model gpt-3.5-turbo] [--old]
+
+每轮请求前与_prepare_request一样原地改写system消息，--old使用旧实现(每次裁剪都重新计算整个会话的token)作对比。
+默认模型需要安装tiktoken，--model wenxin按字符数计算，不依赖tiktoken。
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+
+import config
+
+config.config = config.Config({})
+
+from common.log import logger
+
+logger.remove()
+
+from bot.chatgpt.chat_gpt_session import ChatGPTSession, num_tokens_from_messages
+from bot.session_manager import SessionManager
+
+
+class OldChatGPTSession(ChatGPTSession):
+    """旧实现：不缓存token，每弹出一条消息都重新计算整个会话"""
+
+    def discard_exceeding(self, max_tokens, cur_tokens=None):
+        cur_tokens = self.calc_tokens()
+        while cur_tokens > max_tokens and len(self.messages) > 2:
+            self.messages.pop(1)
+            cur_tokens = self.calc_tokens()
+        return cur_tokens
+
+    def calc_tokens(self):
+        return num_tokens_from_messages(self.messages, self.model)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--max-tokens", type=int, default=1000)
+    parser.add_argument("--model", default="gpt-3.5-turbo")
+    parser.add_argument("--old", action="store_true")
+    args = parser.parse_args()
+
+    config.config = config.Config({"conversation_max_tokens": args.max_tokens})
+    sessioncls = OldChatGPTSession if args.old else ChatGPTSession
+    manager = SessionManager(sessioncls, model=args.model)
+    prompts = ["你是一个乐于助人的助手。", "你是群聊助手，回答要简短。" * 20]
+    timings = []
+    for turn in range(args.turns):
+        start = time.perf_counter()
+        session = manager.session_query("第%d个问题：请介绍一下今天的天气和出行建议。" % turn, "user")
+        session.messages[0]["content"] = prompts[turn % 2]
+        manager.session_reply("第%d个回答：今天晴，适合出行，注意防晒。" % turn * 3, "user")
+        timings.append(time.perf_counter() - start)
+    session = manager.build_session("user")
+    timings.sort()
+    print("impl=%s turns=%d messages=%d tokens=%d" % ("old" if args.old else "new", args.turns, len(session.messages), session.calc_tokens()))
+    print(
+        "per turn: mean=%.3fms p50=%.3fms p99=%.3fms total=%.1fms"
+        % (sum(timings) / len(timings) * 1000, timings[len(timings) // 2] * 1000, timings[int(len(timings) * 0.99)] * 1000, sum(timings) * 1000)
+    )
+
+
+if __name__ == "__main__":
+    main()
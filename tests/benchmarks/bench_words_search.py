@@ -0,0 +1,64 @@
+"""
+Banwords WordsSearch扫描吞吐量
+
+python tests/benchmarks/bench_words_search.py [--old path/to/WordsSearch.py]
+
+随机生成中文关键词库和消息，输出构建耗时和FindAll/ContainsAny/Replace/FindAllBatch的MB/s；
+--old 指定另一个WordsSearch.py(如git show <rev>:plugins/banwords/lib/WordsSearch.py导出的旧实现)一起测试
+"""
+
+import argparse
+import importlib.util
+import os
+import random
+import time
+
+LIB = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "plugins", "banwords", "lib", "WordsSearch.py")
+
+
+def load(path, name):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.WordsSearch
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+
+def run(name, cls, keywords, messages):
+    size = sum(len(m.encode("utf-8")) for m in messages) / 1024 / 1024
+    ws = cls()
+    build, _ = timed(ws.SetKeywords, keywords)
+    line = "%-4s build=%.2fs" % (name, build)
+    for method in ("FindAll", "ContainsAny", "Replace"):
+        elapsed, _ = timed(lambda: [getattr(ws, method)(m) for m in messages])
+        line += "  %s=%.1fMB/s" % (method, size / elapsed)
+    if hasattr(ws, "FindAllBatch"):
+        elapsed, _ = timed(ws.FindAllBatch, messages)
+        line += "  FindAllBatch=%.1fMB/s" % (size / elapsed)
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--old")
+    parser.add_argument("--keywords", type=int, default=10000)
+    parser.add_argument("--messages", type=int, default=20000)
+    args = parser.parse_args()
+
+    rnd = random.Random(0)
+    chars = [chr(c) for c in range(0x4E00, 0x4E00 + 3000)]
+    keywords = ["".join(rnd.choice(chars) for _ in range(rnd.randint(2, 5))) for _ in range(args.keywords)]
+    messages = ["".join(rnd.choice(chars) for _ in range(rnd.randint(10, 100))) for _ in range(args.messages)]
+    print("keywords=%d messages=%d" % (len(keywords), len(messages)))
+    run("new", load(LIB, "new_words_search"), keywords, messages)
+    if args.old:
+        run("old", load(args.old, "old_words_search"), keywords, messages)
+
+
+if __name__ == "__main__":
+    main()
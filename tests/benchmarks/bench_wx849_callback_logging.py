@@ -0,0 +1,110 @@
+"""
+wx849回调入口的日志开销：_handle_callback每秒可处理的回调数
+
+python tests/benchmarks/bench_wx849_callback_logging.py [--old] [--level INFO] [--enqueue] [--console]
+
+每个回调带3条群消息，只测日志部分(_process_callback_message替换为空操作)。
+--old 使用原来每个回调都在INFO级别输出完整JSON的写法；--enqueue 使用后台线程写日志；
+日志文件写入临时目录，控制台默认输出到/dev/null，--console 时写到stdout，
+可以接一个慢速读取的管道模拟控制台变慢，如 ... --console | python -c "import sys,time;[time.sleep(0.01) for _ in iter(lambda: sys.stdin.buffer.read(20000), b'')]"
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+sys.path.insert(0, os.path.abspath(ROOT))
+
+import config
+
+config.config = config.Config({})
+
+from common import log
+from common.log import logger
+import channel.wx849.wx849_channel as wx849_channel
+
+PAYLOAD = {
+    "messages": [
+        {
+            "MsgId": 123456789 + i,
+            "NewMsgId": 987654321 + i,
+            "FromUserName": {"string": "wxid_%d@chatroom" % i},
+            "ToUserName": {"string": "wxid_bot"},
+            "MsgType": 1,
+            "Content": {"string": "wxid_abc:\n" + "这是一条群消息" * 20},
+            "CreateTime": 1700000000,
+            "MsgSource": "<msgsource><silence>1</silence><membercount>300</membercount>" + "x" * 800 + "</msgsource>",
+            "PushContent": "someone: hi",
+        }
+        for i in range(3)
+    ]
+}
+
+
+class FakeRequest:
+    headers = {}
+    remote = "127.0.0.1"
+
+    async def json(self):
+        return PAYLOAD
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--old", action="store_true")
+    parser.add_argument("--level", default="INFO")
+    parser.add_argument("--enqueue", action="store_true")
+    parser.add_argument("--console", action="store_true")
+    parser.add_argument("-n", type=int, default=5000)
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix="wx849-log-bench-"))
+    stdout = sys.stdout
+    if not args.console:
+        sys.stdout = open(os.devnull, "w")
+    log.set_log_level(args.level, enqueue=args.enqueue, max_length=4000)
+
+    cls = [c.cell_contents for c in wx849_channel.WX849Channel.__closure__ if isinstance(c.cell_contents, type)][0]
+    channel = object.__new__(cls)
+    channel.api_key = None
+
+    async def process(data):
+        pass
+
+    channel._process_callback_message = process
+    if args.old:
+        # 原来的写法：每个回调都在INFO级别输出完整的JSON
+        async def handle(request):
+            data = await request.json()
+            logger.info(f"[WX849] 收到回调消息: {json.dumps(data, ensure_ascii=False)}")
+            await channel._process_callback_message(data)
+
+        channel._handle_callback = handle
+
+    async def run():
+        request = FakeRequest()
+        for _ in range(200):
+            await channel._handle_callback(request)
+        start = time.perf_counter()
+        for _ in range(args.n):
+            await channel._handle_callback(request)
+        caller = time.perf_counter() - start
+        log._writer.flush()
+        return caller, time.perf_counter() - start
+
+    caller, written = asyncio.run(run())
+    sys.stdout = stdout
+    size = sum(os.path.getsize(os.path.join("logs", f)) for f in os.listdir("logs"))
+    sys.stderr.write(
+        "%-4s %-5s enqueue=%d  %8.0f callbacks/s (caller)  %8.0f callbacks/s (written)  log files=%.0fKB  dropped=%d\n"
+        % ("old" if args.old else "new", args.level, args.enqueue, args.n / caller, args.n / written, size / 1024, log._writer.dropped)
+    )
+
+
+if __name__ == "__main__":
+    main()
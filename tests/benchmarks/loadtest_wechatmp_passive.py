@@ -0,0 +1,139 @@
+"""
+公众号被动回复压测：模拟微信服务器对每条消息5秒×3次的重试，后端为延迟随机的stub bot
+
+python tests/benchmarks/loadtest_wechatmp_passive.py [--old] [--users 30] [--spread 0] [--scale 5]
+
+按passive_reply.py中Query.POST的流程处理每次请求：等待回复(最多到请求后4秒)、未完成时前两次返回success、
+第3次提示稍后获取；同时处理的请求数与web.py一样限制为10个线程，超出的请求排队，排到时微信已断开的算作丢失。
+--old 使用原来每0.1秒检查一次的轮询等待作为对比；--scale N 把所有时间缩短为1/N
+"""
+
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+
+from channel.wechatmp.passive_state import PassiveReplyState
+
+WEB_THREADS = 10  # web.py默认的工作线程数
+
+
+class PollingState(PassiveReplyState):
+    """原来的实现：请求线程每0.1秒检查一次消息是否处理完"""
+
+    def __init__(self, scale):
+        super().__init__(max_waiters=0)
+        self.scale = scale
+
+    def wait(self, user, timeout):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if user not in self.running:
+                return True
+            time.sleep(0.1 / self.scale)
+        return user not in self.running
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else float("nan")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--old", action="store_true")
+    parser.add_argument("--users", type=int, default=30)
+    parser.add_argument("--spread", type=float, default=0, help="用户消息在多少秒内均匀到达，0表示同时到达")
+    parser.add_argument("--scale", type=float, default=5)
+    args = parser.parse_args()
+    scale = args.scale
+    rnd = random.Random(0)
+
+    state = PollingState(scale) if args.old else PassiveReplyState(max_waiters=8)
+    web_pool = ThreadPoolExecutor(WEB_THREADS)
+    bot_pool = ThreadPoolExecutor(16)
+    lock = threading.Lock()
+    outcome = {"replied": 0, "fetch_later": 0, "timeout": 0, "lost": 0}
+    wake_latency = []
+    ready_at = {}
+    user_done = {}
+    cpu_start = time.process_time()
+
+    def stub_bot(user, latency):
+        time.sleep(latency / scale)
+        state.add_reply(user, ("text", "reply to " + user))
+        ready_at[user] = time.perf_counter()
+        state.finish(user)
+
+    def post(user, request_cnt, sent_at):
+        # 微信服务器5秒后断开连接，排队超过5秒才开始处理的请求已经没有意义
+        if time.perf_counter() - sent_at > 5 / scale:
+            with lock:
+                outcome["lost"] += 1
+            return "closed"
+        request_time = time.time()
+        if request_cnt == 1:
+            state.start(user)
+            bot_pool.submit(stub_bot, user, rnd.uniform(1, 12))
+        finished = state.wait(user, (request_time + 4 / scale) - time.time())
+        if finished is None:
+            with lock:
+                outcome["fetch_later"] += 1
+            return "done"
+        if not finished:
+            if request_cnt < 3:
+                time.sleep(2 / scale)
+                return "retry"
+            with lock:
+                outcome["timeout"] += 1
+            return "done"
+        if state.pop_reply(user) is not None:
+            with lock:
+                outcome["replied"] += 1
+                wake_latency.append(time.perf_counter() - ready_at[user])
+        return "done"
+
+    def wechat_server(user, delay):
+        # 同一条消息最多请求3次，每次等待5秒
+        time.sleep(delay / scale)
+        for request_cnt in range(1, 4):
+            sent_at = time.perf_counter()
+            future = web_pool.submit(post, user, request_cnt, sent_at)
+            remaining = 5 / scale - (time.perf_counter() - sent_at)
+            try:
+                result = future.result(max(0, remaining))
+            except Exception:
+                result = "retry"  # 5秒内没有响应，微信重试
+            if result == "done":
+                break
+            time.sleep(max(0, 5 / scale - (time.perf_counter() - sent_at)))
+        user_done[user] = True
+
+    users = ["user%d" % i for i in range(args.users)]
+    start = time.perf_counter()
+    threads = []
+    for i, user in enumerate(users):
+        delay = args.spread * i / max(1, len(users)) if args.spread else 0
+        t = threading.Thread(target=wechat_server, args=(user, delay))
+        t.start()
+        threads.append(t)
+    for t in threads:
+        t.join()
+    web_pool.shutdown(wait=True)
+    bot_pool.shutdown(wait=True)
+    elapsed = time.perf_counter() - start
+    print(
+        "%s users=%d spread=%ss scale=%sx: %s, wake p50=%.0fms p99=%.0fms (real time), elapsed=%.1fs, cpu=%.2fs"
+        % ("polling" if args.old else "events", args.users, args.spread, scale, outcome,
+           percentile(wake_latency, 0.5) * 1000 * scale, percentile(wake_latency, 0.99) * 1000 * scale,
+           elapsed * scale, time.process_time() - cpu_start)
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+"""
+wx849回调消息压测：向通道的回调HTTP服务重放一批回调，协议服务由本地stub代替
+
+python tests/benchmarks/loadtest_wx849_callbacks.py [recorded.jsonl] [--conversations N] [--callbacks N] [--concurrency N]
+
+recorded.jsonl每行是一条原始回调请求体({"messages": [...]})，不指定时按真实回调的格式生成：
+群聊和私聊文本消息，分布在N个会话中，每条回调带3条消息。
+输出全部消息处理完的耗时、吞吐、峰值线程数、新建事件循环数，并检查同一会话内的消息按到达顺序处理。
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import sys
+import threading
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+
+import aiohttp
+from aiohttp import web
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+API_PORT = free_port()
+CALLBACK_PORT = free_port()
+
+import config
+
+config.config = config.Config(
+    {
+        "wx849_api_host": "127.0.0.1",
+        "wx849_api_port": API_PORT,
+        "wx849_callback_host": "127.0.0.1",
+        "wx849_callback_port": CALLBACK_PORT,
+    }
+)
+
+from common.log import logger
+
+logger.remove()
+
+# 统计处理过程中新建的事件循环，旧实现每条消息都会新建
+_new_event_loop = asyncio.new_event_loop
+created_loops = [0]
+
+
+def counting_new_event_loop():
+    created_loops[0] += 1
+    return _new_event_loop()
+
+
+asyncio.new_event_loop = counting_new_event_loop
+
+import channel.wx849.wx849_channel as wx849_channel
+
+
+def generate_callbacks(conversations, callbacks):
+    groups = ["%d@chatroom" % (100000 + i) for i in range(conversations // 2)]
+    users = ["wxid_user%d" % i for i in range(conversations - len(groups))]
+    seq = defaultdict(int)
+    bodies = []
+    for n in range(callbacks):
+        messages = []
+        for _ in range(3):
+            conversation = random.choice(groups + users)
+            seq[conversation] += 1
+            is_group = conversation.endswith("@chatroom")
+            sender = "wxid_member%d" % random.randrange(500)
+            content = "%s:\nseq=%d 这是一条普通群消息" % (sender, seq[conversation]) if is_group else "seq=%d 你好" % seq[conversation]
+            messages.append(
+                {
+                    "MsgId": 1000000 + len(bodies) * 3 + len(messages),
+                    "NewMsgId": 9000000 + len(bodies) * 3 + len(messages),
+                    "FromUserName": {"string": conversation},
+                    "ToUserName": {"string": "wxid_bot"},
+                    "MsgType": 1,
+                    "Content": {"string": content},
+                    "CreateTime": int(time.time()),
+                    "MsgSource": "<msgsource><silence>1</silence><membercount>300</membercount></msgsource>",
+                    "PushContent": "",
+                }
+            )
+        bodies.append({"messages": messages})
+    return bodies
+
+
+def conversation_and_seq(msg):
+    conversation = msg["FromUserName"]["string"]
+    content = msg["Content"]["string"]
+    if "seq=" not in content:
+        return conversation, None
+    return conversation, int(content.split("seq=")[1].split()[0])
+
+
+async def stub_api(request):
+    # 协议服务：所有接口都返回成功，带少量延迟
+    await asyncio.sleep(0.005)
+    stub_api.count += 1
+    return web.json_response({"Success": True, "Data": {}})
+
+
+stub_api.count = 0
+
+
+async def start_stub_server():
+    app = web.Application()
+    app.router.add_route("*", "/{tail:.*}", stub_api)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", API_PORT).start()
+    return runner
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("recorded", nargs="?")
+    parser.add_argument("--conversations", type=int, default=200)
+    parser.add_argument("--callbacks", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+    if args.recorded:
+        with open(args.recorded, encoding="utf-8") as f:
+            bodies = [json.loads(line) for line in f if line.strip()]
+    else:
+        bodies = generate_callbacks(args.conversations, args.callbacks)
+    total = sum(len(b["messages"]) for b in bodies)
+
+    cls = [c.cell_contents for c in wx849_channel.WX849Channel.__closure__ if isinstance(c.cell_contents, type)][0]
+    channel = cls()
+    channel.wxid = "wxid_bot"
+    channel.name = "bot"
+
+    processed = []
+    order = defaultdict(list)
+    lock = threading.Lock()
+    process = channel._process_single_message_independently
+
+    def recording_process(msg_id, msg):
+        process(msg_id, msg)
+        conversation, seq = conversation_and_seq(msg)
+        with lock:
+            processed.append(msg_id)
+            if seq is not None:
+                order[conversation].append(seq)
+
+    channel._process_single_message_independently = recording_process
+    produced = []
+    channel.produce = produced.append
+
+    # 通道事件循环，与startup中一样在独立线程中运行
+    loop = _new_event_loop()
+    ready = threading.Event()
+
+    async def run_channel():
+        channel.dispatcher.start(asyncio.get_running_loop())
+        channel.api.start(asyncio.get_running_loop())
+        await start_stub_server()
+        await channel._start_http_server()
+        ready.set()
+        while True:
+            await asyncio.sleep(3600)
+
+    threading.Thread(target=loop.run_until_complete, args=(run_channel(),), daemon=True).start()
+    assert ready.wait(10)
+    created_loops[0] = 0
+
+    peak_threads = [threading.active_count()]
+    done = threading.Event()
+
+    def sample_threads():
+        while not done.is_set():
+            peak_threads[0] = max(peak_threads[0], threading.active_count())
+            time.sleep(0.01)
+
+    threading.Thread(target=sample_threads, daemon=True).start()
+
+    async def replay():
+        url = "http://127.0.0.1:%d/wx849/callback" % CALLBACK_PORT
+        queue = asyncio.Queue()
+        for body in bodies:
+            queue.put_nowait(body)
+        statuses = defaultdict(int)
+        async with aiohttp.ClientSession() as session:
+
+            async def worker():
+                while not queue.empty():
+                    body = queue.get_nowait()
+                    async with session.post(url, json=body) as response:
+                        statuses[response.status] += 1
+
+            await asyncio.gather(*[worker() for _ in range(args.concurrency)])
+        return statuses
+
+    start = time.perf_counter()
+    statuses = asyncio.run(replay())
+    accepted = time.perf_counter() - start
+    while len(processed) < total and time.perf_counter() - start < 300:
+        time.sleep(0.01)
+    elapsed = time.perf_counter() - start
+    done.set()
+
+    out_of_order = sum(1 for seqs in order.values() if seqs != sorted(seqs))
+    print("callbacks=%d messages=%d conversations=%d concurrency=%d" % (len(bodies), total, len(order), args.concurrency))
+    print("callback responses: %s, all accepted in %.2fs" % (dict(statuses), accepted))
+    print("processed %d/%d in %.2fs (%.0f msg/s), produced=%d" % (len(processed), total, elapsed, len(processed) / elapsed, len(produced)))
+    print("peak threads=%d, event loops created while processing=%d, stub API calls=%d" % (peak_threads[0], created_loops[0], stub_api.count))
+    print("conversations processed out of order: %d" % out_of_order)
+    print("dispatcher: %s" % channel.dispatcher.stats())
+
+
+if __name__ == "__main__":
+    main()
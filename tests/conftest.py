@@ -0,0 +1,25 @@
+"""
+测试使用内存中的默认配置，不读取config.json，也不输出日志
+
+需要修改配置的测试使用set_config fixture，测试结束后恢复默认配置
+"""
+
+import pytest
+
+import config
+
+config.config = config.Config({})
+
+from common.log import logger
+
+logger.remove()
+
+
+@pytest.fixture
+def set_config():
+    def _set(**kwargs):
+        config.config = config.Config(kwargs)
+        return config.config
+
+    yield _set
+    config.config = config.Config({})
@@ -0,0 +1,58 @@
+import threading
+import time
+
+from bot.bot import Bot
+from bridge import bridge
+
+BridgeClass = [c.cell_contents for c in bridge.Bridge.__closure__ if isinstance(c.cell_contents, type)][0]
+
+
+class SlowBot(Bot):
+    warmed = 0
+
+    def __init__(self):
+        time.sleep(0.05)  # 模拟导入SDK等耗时
+
+    def warm_up(self):
+        SlowBot.warmed += 1
+
+
+def test_warm_up_creates_chat_bot_once(set_config, monkeypatch):
+    set_config(model="deepseek-chat")
+    created = []
+
+    def create_bot(bot_type):
+        created.append(bot_type)
+        return SlowBot()
+
+    monkeypatch.setattr(bridge, "create_bot", create_bot)
+    monkeypatch.setattr(SlowBot, "warmed", 0)
+    instance = BridgeClass()
+
+    start = time.perf_counter()
+    thread = instance.warm_up()
+    assert time.perf_counter() - start < 0.05  # 在后台线程中预热
+    # 处理首条消息的线程与预热线程同时获取bot
+    bots = []
+    workers = [threading.Thread(target=lambda: bots.append(instance.get_bot("chat"))) for _ in range(8)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    thread.join(5)
+
+    assert created == ["deepseek"]
+    assert len({id(bot) for bot in bots}) == 1 and bots[0] is instance.get_bot("chat")
+    assert SlowBot.warmed == 1
+
+
+def test_warm_up_failure_is_only_logged(set_config, monkeypatch):
+    set_config()
+
+    def create_bot(bot_type):
+        raise RuntimeError("no sdk")
+
+    monkeypatch.setattr(bridge, "create_bot", create_bot)
+    thread = BridgeClass().warm_up()
+    thread.join(5)
+    assert not thread.is_alive()
@@ -0,0 +1,131 @@
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+import pytest
+
+from bridge.context import Context, ContextType
+from bridge.reply import ReplyType
+from channel.chat_channel import ChatChannel
+
+
+def make_channel(handle):
+    # ChatChannel的调度状态是类属性，每个测试使用独立的子类
+    class DispatchChannel(ChatChannel):
+        futures = {}
+        sessions = {}
+        lock = threading.Lock()
+        ready = threading.Condition(lock)
+        ready_sessions = OrderedDict()
+        blocked_sessions = OrderedDict()
+
+        def _handle(self, context):
+            handle(context)
+
+    return DispatchChannel()
+
+
+def text(session_id, content):
+    return Context(ContextType.TEXT, content, {"session_id": session_id})
+
+
+def wait_until(predicate, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+def test_messages_of_a_session_are_handled_in_order(set_config):
+    set_config(concurrency_in_session=1)
+    handled = defaultdict(list)
+    channel = make_channel(lambda c: handled[c["session_id"]].append(c.content))
+    for i in range(50):
+        for session_id in range(20):
+            channel.produce(text(session_id, str(i)))
+    assert wait_until(lambda: sum(len(v) for v in handled.values()) == 1000)
+    for session_id in range(20):
+        assert handled[session_id] == [str(i) for i in range(50)]
+    assert wait_until(lambda: not channel.sessions), "drained sessions should be reclaimed"
+
+
+@pytest.mark.parametrize("concurrency", [1, 3])
+def test_concurrency_in_session_is_respected(set_config, concurrency):
+    set_config(concurrency_in_session=concurrency)
+    lock = threading.Lock()
+    running = defaultdict(int)
+    peak = defaultdict(int)
+    done = []
+
+    def handle(context):
+        session_id = context["session_id"]
+        with lock:
+            running[session_id] += 1
+            peak[session_id] = max(peak[session_id], running[session_id])
+        time.sleep(0.01)
+        with lock:
+            running[session_id] -= 1
+            done.append(context)
+
+    channel = make_channel(handle)
+    for i in range(12):
+        for session_id in ("a", "b"):
+            channel.produce(text(session_id, str(i)))
+    assert wait_until(lambda: len(done) == 24)
+    assert peak["a"] == peak["b"] == concurrency
+
+
+def test_admin_command_jumps_the_session_queue(set_config):
+    set_config(concurrency_in_session=1)
+    started = threading.Event()
+    release = threading.Event()
+    handled = []
+
+    def handle(context):
+        if context.content == "slow":
+            started.set()
+            release.wait(5)
+        handled.append(context.content)
+
+    channel = make_channel(handle)
+    channel.produce(text("s", "slow"))
+    assert started.wait(5)
+    channel.produce(text("s", "1"))
+    channel.produce(text("s", "2"))
+    channel.produce(text("s", "#help"))
+    release.set()
+    assert wait_until(lambda: len(handled) == 4)
+    assert handled == ["slow", "#help", "1", "2"]
+
+
+def test_produce_wakes_the_consumer_without_polling(set_config):
+    set_config(concurrency_in_session=1)
+    handled = {}
+    channel = make_channel(lambda c: handled.setdefault(c.content, time.perf_counter()))
+    # 消费者空闲一段时间后再发消息，旧的实现每200ms才扫描一次
+    time.sleep(0.05)
+    latencies = []
+    for i in range(20):
+        start = time.perf_counter()
+        channel.produce(text(i, str(i)))
+        assert wait_until(lambda: str(i) in handled, timeout=2)
+        latencies.append(handled[str(i)] - start)
+    latencies.sort()
+    assert latencies[len(latencies) // 2] < 0.05
+
+
+def test_rate_limit_per_chat_notifies_once(set_config):
+    from channel import chat_channel
+
+    set_config(rate_limit_per_chat=1)
+    chat_channel.rate_limit_notified.clear()
+    channel = make_channel(lambda c: None)
+    # 先用掉这个群的令牌
+    assert chat_channel.get_chat_limiter().try_get_token("group@chatroom")
+    context = Context(ContextType.TEXT, "hello", {"receiver": "group@chatroom", "isgroup": False})
+    reply = channel._generate_reply(context)
+    assert reply.type == ReplyType.TEXT and reply.content == "消息太频繁了，请稍后再试"
+    # 一分钟内不再重复提示
+    assert channel._generate_reply(context).type is None
@@ -0,0 +1,97 @@
+import pytest
+
+import config
+from config import parse_env_value
+
+
+@pytest.mark.parametrize(
+    "name, value, expected",
+    [
+        ("group_name_white_list", '["ALL_GROUP"]', ["ALL_GROUP"]),
+        ("group_name_white_list", "['ALL_GROUP', '群2']", ["ALL_GROUP", "群2"]),
+        ("group_chat_in_one_session", "None", None),
+        ("group_at_off", "True", True),
+        ("debug", "0", False),
+        ("conversation_max_tokens", "2000", 2000),
+        ("temperature", "0.5", 0.5),
+        ("open_ai_api_key", "sk-xxx", "sk-xxx"),
+    ],
+)
+def test_parse_env_value(name, value, expected):
+    assert parse_env_value(name, value) == expected
+
+
+def test_unparseable_value_is_kept_as_string_with_a_warning(monkeypatch):
+    warnings = []
+    monkeypatch.setattr(config.logger, "warning", lambda msg, *args: warnings.append(msg))
+    assert parse_env_value("group_name_white_list", "[ALL_GROUP") == "[ALL_GROUP"
+    assert len(warnings) == 1 and "group_name_white_list" in warnings[0]
+    # 能解析时不警告
+    parse_env_value("group_name_white_list", "['a']")
+    assert len(warnings) == 1
+
+
+def test_snapshot_follows_config_version(set_config):
+    set_config(conversation_max_tokens=1000)
+    snapshot = config.config_snapshot()
+    assert config.config_snapshot() is snapshot
+    assert snapshot.conversation_max_tokens == 1000
+    assert snapshot.get("conversation_max_tokens") == 1000
+    assert snapshot.get("model", "gpt-3.5-turbo") == "gpt-3.5-turbo"
+    assert snapshot.model is None  # 未配置的项属性值为None
+    assert "model" not in snapshot
+
+    config.conf()["conversation_max_tokens"] = 2000
+    updated = config.config_snapshot()
+    assert updated is not snapshot and updated.version > snapshot.version
+    assert updated.conversation_max_tokens == 2000
+    # 旧快照不受影响
+    assert snapshot.conversation_max_tokens == 1000
+
+
+def test_snapshot_is_read_only(set_config):
+    set_config(group_name_white_list=["group1"])
+    snapshot = config.config_snapshot()
+    with pytest.raises(AttributeError):
+        snapshot.model = "gpt-4"
+    with pytest.raises(TypeError):
+        snapshot.values["model"] = "gpt-4"
+    # 值是深拷贝，修改配置中的列表不影响快照
+    config.conf()["group_name_white_list"].append("group2")
+    assert snapshot.group_name_white_list == ["group1"]
+
+
+def test_load_config_swaps_snapshot(set_config, tmp_path, monkeypatch):
+    set_config()
+    before = config.config_snapshot()
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv("MODEL", raising=False)
+    (tmp_path / "config.json").write_text('{"model": "deepseek-chat"}', encoding="utf-8")
+    config.load_config()
+    after = config.config_snapshot()
+    assert after.version != before.version
+    assert after.model == "deepseek-chat"
+    assert before.model is None
+
+
+def test_config_derived_rebuilds_once_per_version(set_config):
+    built = []
+
+    @config.config_derived
+    def get_prefixes(snapshot):
+        built.append(snapshot.version)
+        return tuple(snapshot.get("single_chat_prefix", []))
+
+    set_config(single_chat_prefix=["bot"])
+    assert get_prefixes() == ("bot",)
+    assert get_prefixes() is get_prefixes()
+    assert len(built) == 1
+
+    config.conf()["single_chat_prefix"] = ["bot", "@bot"]
+    assert get_prefixes() == ("bot", "@bot")
+    get_prefixes()
+    assert len(built) == 2
+
+    set_config(single_chat_prefix=["ai"])
+    assert get_prefixes() == ("ai",)
+    assert len(built) == 3
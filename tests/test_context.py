@@ -0,0 +1,79 @@
+import threading
+
+import pytest
+
+from bridge.context import Context, ContextKwargs, ContextType
+
+
+def make_context():
+    return Context(ContextType.TEXT, "hi", {"session_id": "s", "at_list": ["a"], "extra": {"k": 1}, "msg": object()})
+
+
+@pytest.mark.parametrize("layered", [False, True])
+def test_fork_isolates_parent_and_child(layered):
+    parent = make_context()
+    if layered:
+        parent = parent.fork()
+        parent["session_id"] = "p"
+    kwargs = parent.kwargs
+    child = parent.fork()
+    assert parent.kwargs is kwargs  # fork不修改原上下文
+    assert child["msg"] is parent["msg"]  # 消息对象不复制
+
+    child["session_id"] = "c"
+    child["at_list"].append("child")
+    child["extra"]["k"] = 2
+    del child["msg"]
+    parent["at_list"].append("parent")
+    parent["extra"]["k"] = 3
+    parent["new"] = True
+
+    assert parent["session_id"] == ("p" if layered else "s")
+    assert parent["at_list"] == ["a", "parent"] and parent["extra"] == {"k": 3} and "msg" in parent
+    assert child["session_id"] == "c"
+    assert child["at_list"] == ["a", "child"] and child["extra"] == {"k": 2}
+    assert "msg" not in child and "new" not in child
+
+
+def test_fork_base_is_read_only():
+    child = make_context().fork()
+    base = child.kwargs.freeze()
+    with pytest.raises(TypeError):
+        base["session_id"] = "x"
+    grandchild = child.fork()
+    grandchild["session_id"] = "g"
+    assert child["session_id"] == "s"
+    assert isinstance(grandchild.kwargs, ContextKwargs)
+
+
+def test_forks_are_isolated_between_concurrent_sessions():
+    # 同一条群消息分发给多个会话，各自在独立线程中逐级fork并修改
+    shared = make_context()
+    errors = []
+    start = threading.Barrier(16)
+
+    def handle(n):
+        start.wait()
+        for i in range(300):
+            context = shared.fork()
+            context["session_id"] = n
+            context["at_list"].append(n)
+            context["extra"]["k"] = n
+            stage = context.fork()
+            stage["at_list"].append(i)
+            if (
+                context["session_id"] != n
+                or context["at_list"] != ["a", n]
+                or context["extra"] != {"k": n}
+                or stage["at_list"] != ["a", n, i]
+                or stage["session_id"] != n
+            ):
+                errors.append((n, i))
+
+    threads = [threading.Thread(target=handle, args=(n,)) for n in range(16)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    assert shared["session_id"] == "s" and shared["at_list"] == ["a"] and shared["extra"] == {"k": 1}
@@ -0,0 +1,66 @@
+import threading
+
+from common.expired_dict import ExpiredDict
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_entries_expire_after_ttl_and_access_slides_it():
+    clock = FakeClock()
+    d = ExpiredDict(10, clock=clock)
+    d["a"] = 1
+    d["b"] = 2
+    clock.now = 8
+    assert d["a"] == 1  # 访问后a的过期时间顺延到18
+    clock.now = 12
+    assert "b" not in d
+    assert d.get("a") == 1
+    clock.now = 40
+    assert len(d) == 0
+    assert d.get("a", "gone") == "gone"
+
+
+def test_write_once_keys_are_purged_by_later_operations():
+    clock = FakeClock()
+    d = ExpiredDict(60, clock=clock)
+    for i in range(10000):
+        clock.now = i
+        d[i] = True  # 消息去重ID写入后不会再读取
+    assert len(d.data) == 60
+    assert d.stats()["expirations"] == 10000 - 60
+
+
+def test_max_size_evicts_least_recently_used():
+    clock = FakeClock()
+    d = ExpiredDict(100, max_size=3, clock=clock)
+    for key in "abc":
+        d[key] = key
+    d["a"]  # b成为最久未访问的key
+    d["d"] = "d"
+    assert d.keys() == ["c", "a", "d"]
+    stats = d.stats()
+    assert stats["evictions"] == 1 and stats["size"] == 3
+    assert stats["hits"] == 1
+
+
+def test_concurrent_access_keeps_size_bounded():
+    d = ExpiredDict(60, max_size=100)
+
+    def worker(n):
+        for i in range(5000):
+            d["%d-%d" % (n, i)] = i
+            d.get("%d-%d" % (n, i - 1))
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(d) == 100
+    assert d.stats()["evictions"] == 8 * 5000 - 100
@@ -0,0 +1,121 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import pytest
+
+from bridge.context import Context, ContextType
+from channel import chat_channel
+from channel.handler_pool import (
+    LANE_COMMAND,
+    LANE_LLM,
+    LANE_MEDIA,
+    POLICY_DROP_OLDEST,
+    POLICY_REJECT,
+    HandlerPool,
+    Lane,
+    PoolFullError,
+)
+
+
+def blocked_lane(policy, max_queue=2):
+    lane = Lane("test", 1, max_queue, policy)
+    release = threading.Event()
+    started = threading.Event()
+
+    def block():
+        started.set()
+        release.wait(5)
+
+    lane.submit(block)
+    assert started.wait(5)
+    return lane, release
+
+
+def test_reject_policy_raises_when_full():
+    lane, release = blocked_lane(POLICY_REJECT)
+    lane.submit(lambda: None)
+    lane.submit(lambda: None)
+    with pytest.raises(PoolFullError):
+        lane.submit(lambda: None)
+    release.set()
+    assert lane.stats()["rejected"] == 1
+
+
+def test_drop_oldest_cancels_the_oldest_pending_task():
+    lane, release = blocked_lane(POLICY_DROP_OLDEST)
+    first = lane.submit(lambda: "first")
+    second = lane.submit(lambda: "second")
+    third = lane.submit(lambda: "third")
+    release.set()
+    assert first.cancelled()
+    assert second.result(5) == "second" and third.result(5) == "third"
+    assert lane.stats()["dropped"] == 1
+
+
+def test_drop_oldest_does_not_count_a_task_that_already_started():
+    lane, release = blocked_lane(POLICY_DROP_OLDEST, max_queue=1)
+    # 线程池已经开始执行、但_run还没从pending中移除的任务，cancel会失败
+    started = Future()
+    started.set_running_or_notify_cancel()
+    with lane.lock:
+        lane.pending[0] = started  # 通道刚好满
+    lane.submit(lambda: None)
+    release.set()
+    assert not started.cancelled()
+    assert lane.stats()["dropped"] == 0
+
+
+def test_reject_reply_goes_through_the_command_lane(set_config, monkeypatch):
+    set_config(
+        concurrency_in_session=1,
+        handler_pool_llm_workers=1,
+        handler_pool_command_workers=1,
+        handler_pool_max_queue=1,
+        handler_pool_overflow_policy=POLICY_REJECT,
+        handler_pool_reject_reply="busy",
+    )
+    pool = HandlerPool()
+    monkeypatch.setattr(chat_channel, "handler_pool", pool)
+    release = threading.Event()
+    sent = []
+
+    class RejectChannel(chat_channel.ChatChannel):
+        futures = {}
+        sessions = {}
+        lock = threading.Lock()
+        ready = threading.Condition(lock)
+        ready_sessions = OrderedDict()
+        blocked_sessions = OrderedDict()
+
+        def _handle(self, context):
+            release.wait(5)
+
+        def _send(self, reply, context, retry_cnt=0):
+            sent.append((reply.content, context["session_id"]))
+
+    channel = RejectChannel()
+    for session_id in ("a", "b", "c"):
+        channel.produce(Context(ContextType.TEXT, "hi", {"session_id": session_id}))
+        time.sleep(0.05)
+    deadline = time.monotonic() + 5
+    while not sent and time.monotonic() < deadline:
+        time.sleep(0.01)
+    release.set()
+    assert sent == [("busy", "c")]
+    stats = pool.stats()
+    assert stats[LANE_LLM]["rejected"] == 1
+    assert stats[LANE_COMMAND]["submitted"] == 1
+
+
+def test_lane_of_follows_trigger_prefix(set_config):
+    set_config(plugin_trigger_prefix="$")
+    assert HandlerPool.lane_of(Context(ContextType.TEXT, "$help")) == LANE_COMMAND
+    assert HandlerPool.lane_of(Context(ContextType.TEXT, "#stats")) == LANE_COMMAND
+    assert HandlerPool.lane_of(Context(ContextType.TEXT, "你好")) == LANE_LLM
+    assert HandlerPool.lane_of(Context(ContextType.VOICE, None)) == LANE_MEDIA
+
+    set_config(plugin_trigger_prefix="!")
+    assert HandlerPool.lane_of(Context(ContextType.TEXT, "!help")) == LANE_COMMAND
+    assert HandlerPool.lane_of(Context(ContextType.TEXT, "$help")) == LANE_LLM
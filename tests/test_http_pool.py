@@ -0,0 +1,64 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from common import http_pool
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    connections = set()
+
+    def do_HEAD(self):
+        Handler.connections.add(self.client_address)
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    do_GET = do_HEAD
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setattr(http_pool, "_session", None)
+    monkeypatch.setattr(Handler, "connections", set())
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield "http://127.0.0.1:{}".format(httpd.server_address[1])
+    httpd.shutdown()
+    httpd.server_close()
+    http_pool.session().close()
+
+
+def test_session_is_shared(server, set_config):
+    set_config(http_pool_size=4)
+    sessions = []
+    threads = [threading.Thread(target=lambda: sessions.append(http_pool.session())) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len({id(s) for s in sessions}) == 1
+    assert http_pool.session().get_adapter(server)._pool_maxsize == 4
+
+
+def test_preconnect_connection_is_reused(server, set_config):
+    set_config()
+    assert http_pool.preconnect(server)
+    # 后续请求复用预热时建立的连接
+    assert http_pool.session().get(server + "/v1").status_code == 200
+    assert len(Handler.connections) == 1
+
+
+def test_preconnect_failure_returns_false(set_config, monkeypatch):
+    set_config()
+    monkeypatch.setattr(http_pool, "_session", None)
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    port = httpd.server_address[1]
+    httpd.server_close()  # 端口上没有服务
+    assert http_pool.preconnect("http://127.0.0.1:{}".format(port), timeout=1) is False
@@ -0,0 +1,47 @@
+import sys
+
+import pytest
+
+from common import import_profile
+
+
+@pytest.fixture
+def profile(monkeypatch, tmp_path):
+    monkeypatch.setattr(import_profile, "_finder", None)
+    monkeypatch.setattr(import_profile, "_records", {})
+    monkeypatch.syspath_prepend(str(tmp_path))
+    meta_path = list(sys.meta_path)
+    yield tmp_path
+    sys.meta_path[:] = meta_path
+    for name in ("profiled_pkg", "profiled_pkg.slow"):
+        sys.modules.pop(name, None)
+
+
+def test_records_cumulative_and_self_time(profile):
+    package = profile / "profiled_pkg"
+    package.mkdir()
+    (package / "__init__.py").write_text("from . import slow\n", encoding="utf-8")
+    (package / "slow.py").write_text("import time\ntime.sleep(0.05)\n", encoding="utf-8")
+
+    assert not import_profile.enabled()
+    import_profile.install()
+    import_profile.install()  # 重复调用只安装一次
+    assert import_profile.enabled()
+    assert sum(isinstance(finder, import_profile._TimingFinder) for finder in sys.meta_path) == 1
+
+    import profiled_pkg  # noqa: F401
+
+    cumulative, self_time = import_profile._records["profiled_pkg"]
+    slow_cumulative, slow_self = import_profile._records["profiled_pkg.slow"]
+    assert slow_self >= 0.05 and slow_cumulative >= slow_self
+    # 包的累计耗时包含子模块，自身耗时不包含
+    assert cumulative >= slow_cumulative
+    assert self_time < 0.05
+
+    report = import_profile.report()
+    assert "profiled_pkg.slow" in report
+    assert "by top-level package" in report
+
+
+def test_report_without_records(profile):
+    assert import_profile.report() == "import profile: no module imported"
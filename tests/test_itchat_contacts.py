@@ -0,0 +1,143 @@
+import copy
+import random
+
+import pytest
+import requests
+
+storage_module = pytest.importorskip("lib.itchat.storage")
+from lib.itchat.components import contact as contact_component  # noqa: E402
+from lib.itchat.components import login as login_component  # noqa: E402
+
+WORDS = [chr(c) for c in range(0x4e00, 0x4e00 + 30)]
+
+
+def old_search_friends(storage, name=None, userName=None, remarkName=None, nickName=None, wechatAccount=None):
+    """索引之前的线性查找"""
+    if (name or userName or remarkName or nickName or wechatAccount) is None:
+        return storage.memberList[0]
+    if userName:
+        for m in storage.memberList:
+            if m["UserName"] == userName:
+                return m
+        return None
+    matchDict = {"RemarkName": remarkName, "NickName": nickName, "Alias": wechatAccount}
+    matchDict = {k: v for k, v in matchDict.items() if v is not None}
+    if name:
+        contact = [m for m in storage.memberList if any([m.get(k) == name for k in ("RemarkName", "NickName", "Alias")])]
+    else:
+        contact = storage.memberList[:]
+    return [m for m in contact if all([m.get(k) == v for k, v in matchDict.items()])]
+
+
+def old_search_chatrooms(storage, name=None, userName=None):
+    if userName is not None:
+        for m in storage.chatroomList:
+            if m["UserName"] == userName:
+                return m
+        return None
+    return [m for m in storage.chatroomList if name in m["NickName"]]
+
+
+class FakeCore(object):
+    """Storage和组件函数用到的Core属性"""
+
+
+def nick(n):
+    return "".join(random.choice(WORDS) for _ in range(n))
+
+
+def friend(i):
+    return {
+        "UserName": "@%032x" % i,
+        "NickName": nick(2),
+        "RemarkName": "remark%d" % (i % 40) if i % 3 == 0 else "",
+        "Alias": "wx%d" % i,
+        "VerifyFlag": 0,
+    }
+
+
+@pytest.fixture
+def core():
+    random.seed(1)
+    core = FakeCore()
+    core.storageClass = storage_module.Storage(core)
+    core.memberList = core.storageClass.memberList
+    core.mpList = core.storageClass.mpList
+    core.chatroomList = core.storageClass.chatroomList
+    core.memberList.append({"UserName": "@self", "NickName": "me", "VerifyFlag": 0})
+    for i in range(300):
+        core.memberList.append(friend(i))
+    for i in range(100):
+        core.chatroomList.append({"UserName": "@@%032x" % i, "NickName": nick(4), "MemberList": []})
+    return core
+
+
+def user_names(result):
+    if result is None or isinstance(result, dict):
+        return result and result["UserName"]
+    return [m["UserName"] for m in result]
+
+
+def assert_same_as_linear_search(storage):
+    friends = storage.memberList[1:]
+    queries = [{"name": m["NickName"]} for m in random.sample(friends, 20)]
+    queries += [{"name": "remark%d" % i} for i in range(0, 40, 3)]
+    queries += [{"name": "wx%d" % i} for i in range(0, 300, 17)]
+    queries += [{"nickName": m["NickName"], "remarkName": m["RemarkName"]} for m in random.sample(friends, 10)]
+    queries += [{"wechatAccount": "wx5"}, {"name": "not exist"}, {"remarkName": ""}]
+    queries += [{"userName": m["UserName"]} for m in random.sample(friends, 10)] + [{"userName": "@none"}]
+    for query in queries:
+        assert user_names(storage.search_friends(**query)) == user_names(old_search_friends(storage, **query)), query
+
+    rooms = storage.chatroomList
+    fragments = [m["NickName"][i:i + n] for m in random.sample(rooms, 10) for i, n in ((0, 1), (1, 2), (0, 3))]
+    for name in fragments + ["", "不存在的群名"]:
+        assert user_names(storage.search_chatrooms(name=name)) == user_names(old_search_chatrooms(storage, name=name)), name
+    for m in random.sample(rooms, 10):
+        assert storage.search_chatrooms(userName=m["UserName"])["UserName"] == m["UserName"]
+    assert storage.search_chatrooms(userName="@@none") is None
+
+
+def test_index_matches_linear_search(core):
+    assert_same_as_linear_search(core.storageClass)
+
+
+def test_results_are_copies(core):
+    storage = core.storageClass
+    found = storage.search_friends(wechatAccount="wx3")[0]
+    found["NickName"] = "changed"
+    assert storage.search_friends(userName=found["UserName"])["NickName"] != "changed"
+
+
+def test_incremental_updates_are_indexed(core):
+    storage = core.storageClass
+    assert_same_as_linear_search(storage)
+    changed = []
+    for m in random.sample(storage.memberList[1:], 30):
+        changed.append({"UserName": m["UserName"], "NickName": nick(2), "RemarkName": "new%s" % m["Alias"], "VerifyFlag": 0})
+    added = [friend(i) for i in range(300, 350)]
+    contact_component.update_local_friends(core, changed + added)
+    assert storage.search_friends(name="wx320")[0]["UserName"] == "@%032x" % 320
+    assert user_names(storage.search_friends(name=changed[0]["RemarkName"])) == [changed[0]["UserName"]]
+    assert_same_as_linear_search(storage)
+
+    # 直接修改列表时索引自动重建
+    del core.memberList[5:10]
+    core.chatroomList.pop(0)
+    assert_same_as_linear_search(storage)
+
+
+def test_logout_clears_indexes(core):
+    storage = core.storageClass
+    name = storage.memberList[1]["NickName"]
+    assert storage.search_friends(name=name)
+    core.alive = False
+    core.s = requests.Session()
+    login_component.logout(core)
+    assert storage.search_friends(name=name) == []
+    assert storage.search_chatrooms(name="") == []
+    assert storage.search_chatrooms(userName=copy.copy("@@%032x" % 1)) is None
+
+    core.memberList.append({"UserName": "@self", "NickName": "me", "VerifyFlag": 0})
+    core.memberList.append(friend(1))
+    assert user_names(storage.search_friends(wechatAccount="wx1")) == ["@%032x" % 1]
@@ -0,0 +1,91 @@
+import threading
+
+import pytest
+
+from common import log
+from common.log import _LogWriter, _truncate_filter, lazy_json, logger, sample_log
+
+
+@pytest.fixture
+def sinks():
+    ids = []
+
+    def add(level="INFO", **kwargs):
+        messages = []
+        ids.append(logger.add(lambda m: messages.append(str(m.record["message"])), level=level, format="{message}", **kwargs))
+        return messages
+
+    yield add
+    for handler_id in ids:
+        logger.remove(handler_id)
+
+
+class Counted:
+    """json序列化时通过default=str调用__str__，用于统计序列化次数"""
+
+    count = 0
+
+    def __str__(self):
+        Counted.count += 1
+        return "counted"
+
+
+def test_lazy_json_is_serialized_only_when_emitted_and_only_once(sinks):
+    first, second = sinks(), sinks()
+    Counted.count = 0
+    logger.debug("payload {}", lazy_json({"obj": Counted()}))
+    assert Counted.count == 0 and first == []
+    logger.info("payload {}", lazy_json({"obj": Counted()}))
+    assert Counted.count == 1
+    assert first == second == ['payload {"obj": "counted"}']
+
+
+def test_sample_log_limits_repeated_lines(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(log.time, "monotonic", lambda: now[0])
+    key = "test_sample_log_limits_repeated_lines"
+    assert sample_log(key, 60) == 0
+    assert sample_log(key, 60) is None
+    assert sample_log(key, 60) is None
+    now[0] += 61
+    assert sample_log(key, 60) == 2  # 返回跳过的次数
+
+
+def test_long_messages_are_truncated_once_across_sinks(sinks, monkeypatch):
+    monkeypatch.setattr(log, "max_length", 10)
+    first, second = sinks(filter=_truncate_filter), sinks(filter=_truncate_filter)
+    logger.info("x" * 50)
+    assert first == second == ["x" * 10 + "...(共50字符)"]
+
+
+class BlockingTarget:
+    def __init__(self):
+        self.lines = []
+        self.entered = threading.Event()
+        self.release = threading.Event()
+
+    def write(self, text, date):
+        self.entered.set()
+        self.release.wait(5)
+        self.lines.append(text.strip())
+
+    def flush(self):
+        pass
+
+
+def test_log_writer_does_not_block_the_caller_and_drops_when_full(sinks):
+    writer = _LogWriter(max_size=2)
+    target = BlockingTarget()
+    handler_id = logger.add(writer.sink(target), format="{message}")
+    try:
+        logger.info("0")
+        assert target.entered.wait(5)  # 写线程卡在第一条
+        for i in range(1, 6):
+            logger.info(str(i))  # 调用方不等待，队列满后丢弃
+        assert writer.dropped == 3
+        target.release.set()
+        assert writer.flush(5)
+        assert target.lines == ["0", "1", "2"]
+    finally:
+        target.release.set()
+        logger.remove(handler_id)
@@ -0,0 +1,46 @@
+import threading
+import time
+
+from channel.wechatmp.passive_state import PassiveReplyState
+
+
+def test_waiting_request_wakes_as_soon_as_the_reply_is_ready():
+    state = PassiveReplyState()
+    state.start("u")
+    threading.Timer(0.05, lambda: (state.add_reply("u", ("text", "hi")), state.finish("u"))).start()
+    start = time.perf_counter()
+    assert state.wait("u", 4) is True
+    assert time.perf_counter() - start < 1
+    assert state.pop_reply("u") == ("text", "hi")
+    assert state.pop_reply("u") is None
+
+
+def test_wait_times_out_while_the_reply_is_still_running():
+    state = PassiveReplyState()
+    state.start("u")
+    assert state.wait("u", 0.05) is False
+    assert state.wait("other", 0.05) is True  # 没有在处理的消息
+
+
+def test_waiters_over_the_limit_return_at_once():
+    state = PassiveReplyState(max_waiters=2)
+    state.start("u")
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(state.wait("u", 1))) for _ in range(2)]
+    for t in threads:
+        t.start()
+    time.sleep(0.05)
+    start = time.perf_counter()
+    assert state.wait("u", 1) is None
+    assert time.perf_counter() - start < 0.5
+    state.finish("u")
+    for t in threads:
+        t.join()
+    assert results == [True, True]
+
+
+def test_replies_are_returned_in_order():
+    state = PassiveReplyState()
+    state.add_reply("u", ("text", "1"))
+    state.add_reply("u", ("text", "2"))
+    assert [state.pop_reply("u"), state.pop_reply("u"), state.pop_reply("u")] == [("text", "1"), ("text", "2"), None]
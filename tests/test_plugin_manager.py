@@ -0,0 +1,146 @@
+import sys
+import textwrap
+import time
+
+import pytest
+
+import plugins
+from bridge.context import Context, ContextType
+from plugins.event import Event, EventAction, EventContext
+from plugins.plugin_manager import PluginManager
+
+PLUGIN_SOURCE = """
+import time
+
+import plugins
+from bridge.context import ContextType
+from plugins import Event, EventAction, Plugin
+
+time.sleep({delay})
+
+
+@plugins.register(name="{name}", desire_priority={priority}{register_args})
+class {name}(Plugin):
+    def __init__(self):
+        super().__init__()
+        self.handlers[Event.{event}] = self.on_event
+
+    def on_event(self, e_context):
+        e_context["reply"] = "{name}"
+        e_context.action = EventAction.BREAK_PASS
+"""
+
+
+@pytest.fixture
+def manager(set_config, tmp_path, monkeypatch):
+    """独立的PluginManager，插件目录在临时目录下"""
+    set_config(plugin_load_timeout=0.2)
+    (tmp_path / "plugins").mkdir()
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(plugins, "__path__", list(plugins.__path__) + [str(tmp_path / "plugins")])
+    cls = [c.cell_contents for c in PluginManager.__closure__ if isinstance(c.cell_contents, type)][0]
+    instance = cls()
+    monkeypatch.setattr(plugins, "register", instance.register)
+    created = []
+
+    def add_plugin(name, event="ON_HANDLE_CONTEXT", delay=0, priority=0, register_args=""):
+        path = tmp_path / "plugins" / name.lower()
+        path.mkdir()
+        source = PLUGIN_SOURCE.format(name=name, event=event, delay=delay, priority=priority, register_args=register_args)
+        (path / "__init__.py").write_text(source, encoding="utf-8")
+        created.append("plugins." + name.lower())
+
+    instance.add_plugin = add_plugin
+    yield instance
+    for future in [future for _, future in instance.pending.values()]:
+        future.result(timeout=5)
+    for name in created:
+        sys.modules.pop(name, None)
+
+
+def emit(manager, event, context=None):
+    e_context = EventContext(event, {"context": context, "reply": None})
+    return manager.emit_event(e_context)
+
+
+def test_scan_events_reads_handlers_and_disabled_plugins(manager, tmp_path):
+    manager.add_plugin("ScanA", event="ON_DECORATE_REPLY")
+    manager.load_config()
+    assert manager._scan_events("./plugins/scana") == {Event.ON_DECORATE_REPLY}
+
+    (tmp_path / "plugins" / "nohandler").mkdir()
+    (tmp_path / "plugins" / "nohandler" / "__init__.py").write_text("x = 1\n", encoding="utf-8")
+    assert manager._scan_events("./plugins/nohandler") is None
+
+    manager.pconf["plugins"]["ScanA"] = {"enabled": False, "priority": 0}
+    assert manager._scan_events("./plugins/scana") == set()
+
+
+def test_lazy_load_returns_immediately_and_event_waits_for_subscriber(manager):
+    manager.add_plugin("LazyEcho", delay=0.1)
+    start = time.perf_counter()
+    manager.load_plugins()
+    assert time.perf_counter() - start < 0.1
+    assert manager.pending
+
+    # 其他事件不等待该插件
+    e_context = emit(manager, Event.ON_SEND_REPLY)
+    assert e_context.action is EventAction.CONTINUE
+    # 订阅的事件等待插件加载完成后分发给它
+    e_context = emit(manager, Event.ON_HANDLE_CONTEXT)
+    assert e_context["reply"] == "LazyEcho"
+    assert e_context.is_pass()
+    manager.wait_loaded(5)
+    assert not manager.pending
+    assert "LAZYECHO" in manager.instances
+
+
+def test_timed_out_plugin_is_only_waited_once(manager):
+    manager.add_plugin("SlowEcho", delay=0.5)
+    manager.load_plugins()
+
+    start = time.perf_counter()
+    e_context = emit(manager, Event.ON_HANDLE_CONTEXT)
+    assert 0.15 < time.perf_counter() - start < 0.45
+    assert e_context["reply"] is None
+    assert not manager.pending
+
+    start = time.perf_counter()
+    emit(manager, Event.ON_HANDLE_CONTEXT)
+    assert time.perf_counter() - start < 0.1
+
+    # 插件加载完成后仍会注册
+    deadline = time.time() + 5
+    while "SLOWECHO" not in manager.instances and time.time() < deadline:
+        time.sleep(0.01)
+    assert emit(manager, Event.ON_HANDLE_CONTEXT)["reply"] == "SlowEcho"
+
+
+def test_dispatch_index_applies_filters_and_follows_enabled_state(manager):
+    manager.add_plugin("RunCmd", priority=10, register_args=", context_types=[ContextType.TEXT], prefixes=['$run']")
+    manager.add_plugin("CatchAll")
+    manager.load_plugins()
+    manager.wait_loaded(5)
+    assert [entry[0] for entry in manager.dispatch_index[Event.ON_HANDLE_CONTEXT]] == ["RUNCMD", "CATCHALL"]
+
+    def reply_to(ctype, content):
+        return emit(manager, Event.ON_HANDLE_CONTEXT, Context(ctype, content))["reply"]
+
+    assert reply_to(ContextType.TEXT, "$run ls") == "RunCmd"
+    # 前缀或类型不满足时跳过，交给后面的插件
+    assert reply_to(ContextType.TEXT, "hello") == "CatchAll"
+    assert reply_to(ContextType.IMAGE, "$run ls") == "CatchAll"
+    # 没有context时带过滤条件的插件不调用
+    assert emit(manager, Event.ON_HANDLE_CONTEXT)["reply"] == "CatchAll"
+
+    stats = dict(manager.stats())
+    assert stats["RUNCMD"]["calls"] == 1 and stats["RUNCMD"]["breaks"] == 1
+    assert stats["CATCHALL"]["calls"] == 3
+    manager.stats(reset=True)
+    assert manager.stats() == []
+
+    # 禁用后从索引中移除，重新启用后恢复
+    manager.disable_plugin("RunCmd")
+    assert reply_to(ContextType.TEXT, "$run ls") == "CatchAll"
+    manager.enable_plugin("RunCmd")
+    assert reply_to(ContextType.TEXT, "$run ls") == "RunCmd"
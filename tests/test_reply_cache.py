@@ -0,0 +1,142 @@
+import pytest
+
+from bot.session_manager import Session
+from bridge import reply_cache
+from bridge.context import Context, ContextType
+from bridge.reply_cache import ReplyCache, normalize_query
+from common import const
+
+
+class FakeSession(Session):
+    def __init__(self, session_id, system_prompt=None):
+        super().__init__(session_id, system_prompt)
+        self.reset()
+
+
+class FakeBot(object):
+    """和SessionManager一样通过bot.sessions.sessions访问会话"""
+
+    def __init__(self):
+        self.sessions = type("Sessions", (), {"sessions": {}})()
+
+    def session(self, session_id, *history):
+        session = FakeSession(session_id, "prompt")
+        for i, content in enumerate(history):
+            (session.add_query if i % 2 == 0 else session.add_reply)(content)
+        self.sessions.sessions[session_id] = session
+        return session
+
+
+@pytest.fixture
+def cache(set_config):
+    def _cache(**kwargs):
+        set_config(reply_cache=True, **kwargs)
+        return ReplyCache()
+
+    return _cache
+
+
+def group_context(group, user):
+    return Context(ContextType.TEXT, "", {"isgroup": True, "receiver": group, "session_id": user})
+
+
+def private_context(user):
+    return Context(ContextType.TEXT, "", {"isgroup": False, "receiver": user, "session_id": user})
+
+
+def test_normalize_query():
+    assert normalize_query("  今天 天气  怎么样？？ ") == "今天天气怎么样"
+    assert normalize_query("ＨＥＬＬＯ   World!") == "hello world"
+    assert normalize_query("What's up ...") == "what's up"
+    assert normalize_query("？！") == ""
+
+
+def test_equivalent_queries_share_a_key(cache):
+    cache = cache()
+    bot = FakeBot()
+    context = group_context("group1@chatroom", "alice")
+    key = cache.make_key("今天天气怎么样？", context, const.CHATGPT, bot)
+    assert key is not None
+    assert cache.make_key("今天 天气怎么样", context, const.CHATGPT, bot) == key
+    assert cache.make_key("今天天气怎么样", context, const.DEEPSEEK, bot) != key
+
+
+def test_group_scope(cache):
+    bot = FakeBot()
+    query = "今天天气怎么样"
+    group_scoped = cache(reply_cache_scope="group")
+    a = group_scoped.make_key(query, group_context("group1@chatroom", "alice"), const.CHATGPT, bot)
+    assert group_scoped.make_key(query, group_context("group1@chatroom", "bob"), const.CHATGPT, bot) == a
+    assert group_scoped.make_key(query, group_context("group2@chatroom", "alice"), const.CHATGPT, bot) != a
+
+    global_scoped = cache(reply_cache_scope="global")
+    b = global_scoped.make_key(query, group_context("group1@chatroom", "alice"), const.CHATGPT, bot)
+    assert global_scoped.make_key(query, group_context("group2@chatroom", "bob"), const.CHATGPT, bot) == b
+
+    session_scoped = cache(reply_cache_scope="session")
+    c = session_scoped.make_key(query, group_context("group1@chatroom", "alice"), const.CHATGPT, bot)
+    assert session_scoped.make_key(query, group_context("group1@chatroom", "bob"), const.CHATGPT, bot) != c
+
+
+@pytest.mark.parametrize("scope", ["global", "group", "session"])
+def test_private_chats_never_share_a_scope(cache, scope):
+    cache = cache(reply_cache_scope=scope)
+    bot = FakeBot()
+    alice = cache.make_key("今天天气怎么样", private_context("alice"), const.CHATGPT, bot)
+    bob = cache.make_key("今天天气怎么样", private_context("bob"), const.CHATGPT, bot)
+    assert alice is not None and bob is not None and alice != bob
+
+
+def test_bypass(cache, monkeypatch):
+    cache = cache(reply_cache_patterns=["天气"])
+    bot = FakeBot()
+    context = group_context("group1@chatroom", "alice")
+    assert cache.make_key("今天天气怎么样", context, const.DIFY, bot) is None
+    assert cache.make_key("今天天气怎么样", context, const.COZE, bot) is None
+    assert cache.make_key("#清除记忆", context, const.CHATGPT, bot) is None
+    assert cache.make_key("你好", context, const.CHATGPT, bot) is None
+    monkeypatch.setitem(reply_cache.memory.USER_IMAGE_CACHE, "alice", {"path": "x.png"})
+    assert cache.make_key("今天天气怎么样", context, const.CHATGPT, bot) is None
+    assert cache.stats()["bypasses"] == 5
+
+
+def test_bypass_when_session_has_history(cache):
+    cache = cache()
+    bot = FakeBot()
+    context = private_context("alice")
+    bot.session("alice")
+    assert cache.make_key("为什么", context, const.CHATGPT, bot) is not None
+    bot.session("alice", "1+1等于几", "2")
+    assert cache.make_key("为什么", context, const.CHATGPT, bot) is None
+
+
+def test_session_window_puts_history_in_key(cache):
+    cache = cache(reply_cache_session_window=2)
+    bot = FakeBot()
+    bot.session("alice", "1+1等于几", "2")
+    bot.session("bob", "2+2等于几", "4")
+    alice = cache.make_key("为什么", group_context("group1@chatroom", "alice"), const.CHATGPT, bot)
+    bob = cache.make_key("为什么", group_context("group1@chatroom", "bob"), const.CHATGPT, bot)
+    assert alice is not None and bob is not None and alice != bob
+    bot.session("bob", "1+1等于几", "2")
+    assert cache.make_key("为什么", group_context("group1@chatroom", "bob"), const.CHATGPT, bot) == alice
+
+
+def test_ttl_counts_from_write_time(cache, monkeypatch):
+    cache = cache(reply_cache_ttl=10)
+    now = [1000.0]
+    monkeypatch.setattr(reply_cache.time, "time", lambda: now[0])
+    cache.put("key", "晴天")
+    now[0] += 9
+    assert cache.get("key") == "晴天"
+    now[0] += 2
+    assert cache.get("key") is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_persisted_reply_survives_restart(cache, tmp_path):
+    path = str(tmp_path / "reply_cache.db")
+    cache(reply_cache_persist=True, reply_cache_path=path).put("key", "晴天")
+    restarted = cache(reply_cache_persist=True, reply_cache_path=path)
+    assert restarted.get("key") == "晴天"
+    assert restarted.stats()["disk_hits"] == 1
@@ -0,0 +1,78 @@
+import threading
+
+from bot.bot import Bot
+from bot.session_manager import Session, SessionManager
+from bridge.context import Context, ContextType
+from bridge.reply import Reply, ReplyType
+from bridge.router import ChatRouter
+
+
+class StubBot(Bot):
+    def __init__(self, name, handle=None):
+        self.name = name
+        self.handle = handle
+        self.args = {"model": "global-model"}
+        self.sessions = SessionManager(Session, model="global-model")
+        self.contexts = []
+
+    def reply(self, query, context=None):
+        self.contexts.append(context)
+        if self.handle is not None:
+            return self.handle(query, context)
+        return Reply(ReplyType.TEXT, "{}:{}".format(self.name, query))
+
+
+def text(session_id="s"):
+    return Context(ContextType.TEXT, "hi", {"session_id": session_id})
+
+
+def test_fails_over_to_the_next_backend(set_config):
+    set_config(chat_router_cooldown=30)
+    bots = {"a": StubBot("a", lambda q, c: Reply(ReplyType.ERROR, "down")), "b": StubBot("b")}
+    router = ChatRouter([{"type": "a"}, {"type": "b"}], bots.get)
+    assert router.reply("hi", text()).content == "b:hi"
+    # 会话随后优先使用成功回复的后端
+    assert router.reply("hi", text()).content == "b:hi"
+    assert len(bots["a"].contexts) == 1
+
+
+def test_model_override_uses_a_dedicated_bot(set_config):
+    set_config()
+    shared = StubBot("a")
+    created = []
+
+    def new_bot(bot_type):
+        bot = StubBot(bot_type)
+        created.append(bot)
+        return bot
+
+    router = ChatRouter([{"type": "a", "name": "small", "model": "small-model"}, {"type": "a"}], lambda t: shared, new_bot)
+    assert router.backends[0].bot is created[0] and router.backends[1].bot is shared
+    assert created[0].args["model"] == "small-model"
+    assert created[0].sessions.session_args["model"] == "small-model"
+    # 共用的bot不受影响
+    assert shared.args["model"] == "global-model"
+    assert shared.sessions.session_args["model"] == "global-model"
+
+
+def test_hedge_leg_gets_a_context_forked_before_the_primary_starts(set_config):
+    set_config(chat_router_hedge=True, chat_router_hedge_delay=0.05)
+    release = threading.Event()
+
+    def slow(query, context):
+        context["written_by"] = "slow"
+        release.wait(5)
+        return Reply(ReplyType.TEXT, "slow")
+
+    def fast(query, context):
+        return Reply(ReplyType.TEXT, "fast:{}".format(context.get("written_by")))
+
+    bots = {"slow": StubBot("slow", slow), "fast": StubBot("fast", fast)}
+    router = ChatRouter([{"type": "slow"}, {"type": "fast"}], bots.get)
+    router.backends[1].latency = 1  # 保证先选择slow
+    context = text()
+    reply = router.reply("hi", context)
+    release.set()
+    assert reply.content == "fast:None"
+    assert bots["fast"].contexts[0] is not context
+    assert context["written_by"] == "slow"
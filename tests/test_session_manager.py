@@ -0,0 +1,66 @@
+from bot.chatgpt.chat_gpt_session import ChatGPTSession
+
+
+class CharSession(ChatGPTSession):
+    """按字符数计token，并记录实际计算的次数"""
+
+    base_tokens = 0
+
+    def __init__(self, session_id, system_prompt=None):
+        self.counted = 0
+        super().__init__(session_id, system_prompt)
+
+    def count_message_tokens(self, message):
+        self.counted += 1
+        return len(message["content"])
+
+
+def uncached_tokens(session):
+    return sum(len(message["content"]) for message in session.messages)
+
+
+def test_calc_tokens_counts_each_message_once():
+    session = CharSession("s", "sys")
+    for i in range(10):
+        session.add_query("q%d" % i)
+        session.add_reply("reply%d" % i)
+        assert session.calc_tokens() == uncached_tokens(session)
+    assert session.counted == 21
+
+
+def test_calc_tokens_recounts_rewritten_system_prompt():
+    session = CharSession("s", "short")
+    session.add_query("hello")
+    assert session.calc_tokens() == 10
+    # 与_prepare_request一样原地改写system消息
+    session.messages[0]["content"] = "a much longer group prompt " * 10
+    assert session.calc_tokens() == uncached_tokens(session)
+    session.add_reply("world")
+    session.messages[0]["content"] = "s"
+    assert session.calc_tokens() == uncached_tokens(session)
+
+
+def test_discard_exceeding_uses_rewritten_system_prompt():
+    session = CharSession("s", "sys")
+    for i in range(5):
+        session.add_query("q" * 10)
+        session.add_reply("r" * 10)
+    assert session.discard_exceeding(200) == uncached_tokens(session)
+    session.messages[0]["content"] = "p" * 150
+    total = session.discard_exceeding(200)
+    assert total == uncached_tokens(session) <= 200
+    assert session.messages[0]["content"] == "p" * 150
+
+
+def test_pop_message_keeps_total_in_sync():
+    session = CharSession("s", "sys")
+    for i in range(4):
+        session.add_query("query%d" % i)
+        session.add_reply("reply%d" % i)
+    session.calc_tokens()
+    assert session.pop_message(1) == len("query0")
+    assert session.calc_tokens() == uncached_tokens(session)
+    session.messages.pop(1)  # 外部直接修改列表
+    assert session.calc_tokens() == uncached_tokens(session)
+    session.pop_message(0)
+    assert session.calc_tokens() == uncached_tokens(session)
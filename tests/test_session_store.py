@@ -0,0 +1,101 @@
+import threading
+
+import pytest
+
+from bot.session_manager import Session
+from bot.session_store import SQLiteSessionStore
+
+
+class FakeSession(Session):
+    def __init__(self, session_id, system_prompt=None):
+        super().__init__(session_id, system_prompt)
+        self.reset()
+
+
+@pytest.fixture
+def open_store(set_config, tmp_path):
+    set_config(session_cache_size=2, session_flush_interval=3600, expires_in_seconds=3600)
+    path = str(tmp_path / "sessions.db")
+
+    def _open():
+        return SQLiteSessionStore(path, "test", FakeSession, {})
+
+    return _open
+
+
+def count_dumps(store, monkeypatch):
+    dumped = []
+    dump = store._dump
+
+    def counting(system_prompt, messages):
+        dumped.append(len(messages))
+        return dump(system_prompt, messages)
+
+    monkeypatch.setattr(store, "_dump", counting)
+    return dumped
+
+
+def test_lookup_does_not_mark_the_session_dirty(open_store, monkeypatch):
+    store = open_store()
+    store["a"] = FakeSession("a", "prompt")
+    store.flush()
+    dumped = count_dumps(store, monkeypatch)
+    assert "a" in store and store["a"].messages
+    store.flush()
+    assert dumped == []
+    store["a"].add_query("hi")
+    store.flush()
+    assert dumped == [2]
+
+
+def test_evicted_session_still_held_keeps_its_updates(open_store):
+    store = open_store()
+    store["a"] = FakeSession("a", "prompt")
+    held = store["a"]
+    store["b"] = FakeSession("b")
+    store["c"] = FakeSession("c")  # 容量为2，a被淘汰
+    assert "a" not in store.hot
+    held.add_query("after eviction")
+    assert store["a"] is held
+    store["d"] = FakeSession("d")
+    store["e"] = FakeSession("e")
+    store.flush()
+    held.add_reply("after flush")  # 已写回并淘汰后再次修改
+    store.flush()
+    reopened = open_store()
+    assert [m["content"] for m in reopened["a"].messages] == ["prompt", "after eviction", "after flush"]
+
+
+def test_flush_serializes_outside_the_lock(open_store, monkeypatch):
+    store = open_store()
+    for session_id in "ab":
+        store[session_id] = FakeSession(session_id)
+    dump = store._dump
+    reads = []
+
+    def slow_dump(system_prompt, messages):
+        # 序列化期间其它线程可以继续读取会话
+        reader = threading.Thread(target=lambda: reads.append("a" in store))
+        reader.start()
+        reader.join(2)
+        return dump(system_prompt, messages)
+
+    monkeypatch.setattr(store, "_dump", slow_dump)
+    store.flush()
+    assert reads == [True, True]
+
+
+def test_session_deleted_during_flush_is_not_written_back(open_store, monkeypatch):
+    store = open_store()
+    store["a"] = FakeSession("a")
+    dump = store._dump
+
+    def deleting_dump(system_prompt, messages):
+        threading.Thread(target=store.__delitem__, args=("a",)).start()
+        while "a" in store.hot:
+            pass
+        return dump(system_prompt, messages)
+
+    monkeypatch.setattr(store, "_dump", deleting_dump)
+    store.flush()
+    assert "a" not in open_store()
@@ -0,0 +1,77 @@
+import types
+
+import pytest
+
+from channel import stream_chunker
+from channel.stream_chunker import StreamChunker
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(stream_chunker, "time", types.SimpleNamespace(monotonic=lambda: now[0]))
+    return now
+
+
+def feed_all(chunker, pieces):
+    return [chunk for chunk in (chunker.feed(piece) for piece in pieces) if chunk is not None]
+
+
+def test_cuts_at_sentence_boundary(clock):
+    chunker = StreamChunker(min_chars=10, interval=0)
+    assert chunker.feed("今天天气很好，") is None
+    # 切在最后一个句子结尾，后面的内容留到下一条
+    assert chunker.feed("适合出门散步。我们去公园") == "今天天气很好，适合出门散步。"
+    assert chunker.finish() == "我们去公园"
+
+
+def test_prefers_paragraph_boundary(clock):
+    chunker = StreamChunker(min_chars=5, interval=0)
+    assert chunker.feed("第一段第一句。\n\n第二段第一句。第二段还没完") == "第一段第一句。"
+    assert chunker.finish() == "第二段第一句。第二段还没完"
+
+
+def test_english_period_needs_whitespace(clock):
+    chunker = StreamChunker(min_chars=5, interval=0)
+    assert chunker.feed("version 3.14 and www.example.com") is None
+    assert chunker.feed(" are fine. next") == "version 3.14 and www.example.com are fine."
+
+
+def test_waits_for_min_chars(clock):
+    chunker = StreamChunker(min_chars=20, interval=0)
+    assert chunker.feed("短句。短句。") is None
+    assert chunker.feed("这一句比较长一些，足够二十个字了。后") == "短句。短句。这一句比较长一些，足够二十个字了。"
+
+
+def test_never_cuts_off_the_last_message(clock):
+    chunker = StreamChunker(min_chars=5, interval=0)
+    # 句子结尾之后只有空白时不切分，最后一条消息由finish返回
+    assert chunker.feed("完整的一句话。  \n") is None
+    assert chunker.finish() == "完整的一句话。"
+
+
+def test_respects_flush_interval(clock):
+    chunker = StreamChunker(min_chars=5, interval=1.5)
+    # 第一条不受间隔限制
+    assert chunker.feed("第一句话说完了。第二") == "第一句话说完了。"
+    assert chunker.feed("句话也说完了。第三") is None
+    assert chunker.wait_time() == pytest.approx(1.5)
+    clock[0] += 1.0
+    assert chunker.feed("") is None
+    assert chunker.wait_time() == pytest.approx(0.5)
+    clock[0] += 0.6
+    assert chunker.feed("") == "第二句话也说完了。"
+    assert chunker.finish() == "第三"
+
+
+def test_forced_cut_at_max_chars(clock):
+    chunker = StreamChunker(min_chars=10, interval=0, max_chars=50)
+    code = "x = 1 " * 20  # 没有句子结尾
+    chunks = feed_all(chunker, [code[i:i + 7] for i in range(0, len(code), 7)])
+    assert chunks and all(len(chunk) <= 50 for chunk in chunks)
+    assert "".join(chunks).replace(" ", "") + chunker.finish().replace(" ", "") == code.replace(" ", "")
+
+
+def test_default_max_chars():
+    assert StreamChunker(min_chars=80).max_chars == 1000
+    assert StreamChunker(min_chars=200).max_chars == 1600
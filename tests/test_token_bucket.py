@@ -0,0 +1,101 @@
+import asyncio
+import types
+
+import pytest
+
+from common import token_bucket
+from common.token_bucket import KeyedTokenBucket, TokenBucket
+
+
+class FakeClock:
+    """模拟时钟，sleep只推进时间"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    async def async_sleep(self, seconds):
+        self.sleep(seconds)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(token_bucket, "time", types.SimpleNamespace(sleep=clock.sleep, monotonic=clock))
+    monkeypatch.setattr(token_bucket, "asyncio", types.SimpleNamespace(sleep=clock.async_sleep))
+    return clock
+
+
+def test_refill_is_computed_lazily(clock):
+    bucket = TokenBucket(60, initial=0, clock=clock)  # 每秒1个
+    assert not bucket.try_get_token()
+    clock.now += 2.5
+    assert bucket.tokens == pytest.approx(2.5)
+    assert bucket.try_get_token() and bucket.try_get_token()
+    assert not bucket.try_get_token()
+    # 不超过容量
+    clock.now += 3600
+    assert bucket.tokens == 60
+
+
+def test_default_starts_with_one_token(clock):
+    bucket = TokenBucket(20, clock=clock)
+    assert bucket.try_get_token()
+    assert not bucket.try_get_token()
+
+
+def test_get_token_waits_for_refill(clock):
+    bucket = TokenBucket(60, initial=0, clock=clock)
+    assert bucket.get_token()
+    assert sum(clock.sleeps) == pytest.approx(1)
+
+
+def test_weight_above_capacity_runs_when_full_and_leaves_debt(clock):
+    bucket = TokenBucket(60, initial=60, clock=clock)
+    # 权重超过容量，桶满时放行
+    assert bucket.try_get_token(weight=90)
+    assert bucket.tokens == pytest.approx(-30)
+    # 欠下的令牌补足之前，后面的请求需要等待
+    assert not bucket.try_get_token()
+    assert bucket.get_token()
+    assert sum(clock.sleeps) == pytest.approx(31)
+
+
+def test_timeout(clock):
+    bucket = TokenBucket(60, timeout=0.5, initial=0, clock=clock)
+    assert not bucket.get_token()
+    # 等到超时也补不够时只等待到超时
+    assert sum(clock.sleeps) == pytest.approx(0.5)
+    clock.sleeps.clear()
+    assert bucket.get_token(timeout=2)
+    assert sum(clock.sleeps) == pytest.approx(0.5)
+
+
+def test_async_acquire(clock):
+    bucket = TokenBucket(60, initial=0, clock=clock)
+    assert asyncio.run(bucket.acquire(weight=3))
+    assert sum(clock.sleeps) == pytest.approx(3)
+    clock.sleeps.clear()
+    assert not asyncio.run(bucket.acquire(weight=10, timeout=1))
+    assert sum(clock.sleeps) == pytest.approx(1)
+
+
+def test_keyed_buckets_are_independent_and_expire(clock):
+    buckets = KeyedTokenBucket(2, clock=clock)
+    assert buckets.try_get_token("a") and buckets.try_get_token("a")
+    assert not buckets.try_get_token("a")
+    assert buckets.try_get_token("b")
+    first = buckets.bucket("a")
+    assert len(buckets.buckets) == 2
+
+    clock.now += 61
+    assert len(buckets.buckets) == 0
+    assert buckets.bucket("a") is not first
+    assert buckets.try_get_token("a") and buckets.try_get_token("a")
@@ -0,0 +1,188 @@
+import threading
+import time
+
+import pytest
+
+from common.token_manager import TokenManager, TokenSource, TokenStore
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000000.0
+
+    def __call__(self):
+        return self.now
+
+
+class Fetcher:
+    """依次返回token1、token2...，fail为True时抛出异常"""
+
+    def __init__(self, expires_in=1000):
+        self.expires_in = expires_in
+        self.calls = 0
+        self.fail = False
+        self.gate = None  # 设置后fetch等待gate
+
+    def __call__(self):
+        if self.gate is not None:
+            self.gate.wait(5)
+        self.calls += 1
+        if self.fail:
+            raise Exception("fetch failed")
+        return "token%d" % self.calls, self.expires_in
+
+
+def wait_until(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def wait_refreshed(source):
+    wait_until(lambda: source.refreshing is None)
+
+
+def test_concurrent_get_fetches_once():
+    fetch = Fetcher()
+    fetch.gate = threading.Event()
+    source = TokenSource("test", fetch, margin=300, clock=FakeClock())
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(source.get())) for _ in range(10)]
+    for t in threads:
+        t.start()
+    wait_until(lambda: source.refreshing is not None)
+    time.sleep(0.05)
+    fetch.gate.set()
+    for t in threads:
+        t.join()
+    assert results == ["token1"] * 10
+    assert fetch.calls == 1
+
+
+def test_failed_fetch_is_raised_to_all_waiters():
+    fetch = Fetcher()
+    fetch.fail = True
+    source = TokenSource("test", fetch, margin=300, clock=FakeClock())
+    with pytest.raises(Exception, match="fetch failed"):
+        source.get()
+    fetch.fail = False
+    assert source.get() == "token2"
+
+
+def test_refresh_in_background_after_margin():
+    clock = FakeClock()
+    fetch = Fetcher(expires_in=1000)
+    source = TokenSource("test", fetch, margin=300, clock=clock)
+    assert source.get() == "token1"
+    clock.now += 699
+    assert source.get() == "token1"
+    assert fetch.calls == 1
+
+    clock.now += 2
+    fetch.gate = threading.Event()
+    # 即将过期，返回旧token，不等待刷新
+    assert source.get() == "token1"
+    assert source.get() == "token1"
+    fetch.gate.set()
+    wait_refreshed(source)
+    assert fetch.calls == 2
+    assert source.get() == "token2"
+
+
+def test_short_lived_token_refreshes_at_half_life():
+    clock = FakeClock()
+    fetch = Fetcher(expires_in=100)
+    source = TokenSource("test", fetch, margin=300, clock=clock)
+    source.get()
+    clock.now += 49
+    source.get()
+    assert fetch.calls == 1
+    clock.now += 2
+    source.get()
+    wait_refreshed(source)
+    assert fetch.calls == 2
+
+
+def test_failed_refresh_is_retried_after_interval():
+    clock = FakeClock()
+    fetch = Fetcher(expires_in=1000)
+    source = TokenSource("test", fetch, margin=300, clock=clock)
+    source.get()
+    clock.now += 701
+    fetch.fail = True
+    assert source.get() == "token1"
+    wait_refreshed(source)
+    assert fetch.calls == 2
+
+    # 重试间隔内继续使用旧token，不再获取
+    clock.now += source.retry_interval - 1
+    assert source.get() == "token1"
+    assert fetch.calls == 2
+
+    clock.now += 2
+    fetch.fail = False
+    assert source.get() == "token1"
+    wait_refreshed(source)
+    assert fetch.calls == 3
+    assert source.get() == "token3"
+
+
+def test_expired_token_is_fetched_synchronously():
+    clock = FakeClock()
+    fetch = Fetcher(expires_in=1000)
+    source = TokenSource("test", fetch, margin=300, clock=clock)
+    source.get()
+    clock.now += 1001
+    assert source.get() == "token2"
+
+
+def test_invalidate_keeps_newer_token():
+    clock = FakeClock()
+    fetch = Fetcher()
+    source = TokenSource("test", fetch, margin=300, clock=clock)
+    source.get()
+    source.invalidate()
+    assert source.get() == "token2"
+
+    # 请求使用的是旧token，已经刷新过，不再清除
+    source.invalidate("token1")
+    assert source.get() == "token2"
+    assert fetch.calls == 2
+
+    # 刚获取的token不清除
+    source.invalidate(min_age=60)
+    assert source.get() == "token2"
+    clock.now += 61
+    source.invalidate(min_age=60)
+    assert source.get() == "token3"
+
+
+def test_store_survives_restart(tmp_path):
+    path = str(tmp_path / "tokens.json")
+    fetch = Fetcher()
+    assert TokenManager(path).source("baidu:ak-secret", fetch).get() == "token1"
+    with open(path, encoding="utf-8") as f:
+        assert "ak-secret" not in f.read()
+
+    restarted = Fetcher()
+    manager = TokenManager(path)
+    source = manager.source("baidu:ak-secret", restarted)
+    assert manager.source("baidu:ak-secret", restarted) is source
+    assert source.get() == "token1"
+    assert restarted.calls == 0
+    # 其他账号不使用这个token
+    assert manager.source("baidu:other", restarted).get() == "token1"
+    assert restarted.calls == 1
+
+    source.invalidate()
+    assert TokenStore(path).get("baidu:ak-secret") is None
+
+
+def test_expired_token_in_store_is_ignored(tmp_path):
+    store = TokenStore(str(tmp_path / "tokens.json"))
+    clock = FakeClock()
+    store.put("test", "old", clock.now - 1)
+    fetch = Fetcher()
+    source = TokenSource("test", fetch, margin=300, store=store, clock=clock)
+    assert source.get() == "token1"
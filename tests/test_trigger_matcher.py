@@ -0,0 +1,83 @@
+import random
+
+import pytest
+
+import config
+from channel.chat_channel import check_contain, check_prefix
+from channel.trigger_matcher import TriggerMatcher, at_pattern, get_trigger_matcher
+
+ALPHABET = "ab@#.*?[]()|\\ 画图机器人"
+
+
+def random_text(rnd, low, high):
+    return "".join(rnd.choice(ALPHABET) for _ in range(rnd.randint(low, high)))
+
+
+def old_group_allowed(conf, group_name):
+    white_list = conf.get("group_name_white_list", [])
+    return any(
+        [
+            group_name in white_list,
+            "ALL_GROUP" in white_list,
+            check_contain(group_name, conf.get("group_name_keyword_white_list", [])),
+        ]
+    )
+
+
+def old_shared_session(conf, group_name):
+    in_one_session = conf.get("group_chat_in_one_session", [])
+    return group_name in in_one_session or "ALL_GROUP" in in_one_session
+
+
+@pytest.mark.parametrize("seed", range(30))
+def test_matches_the_original_checks_on_random_rules(seed):
+    rnd = random.Random(seed)
+
+    def rules(n, low=0, high=3):
+        # 包含正则特殊字符、空串和互为前缀的规则
+        return [random_text(rnd, low, high) for _ in range(rnd.randint(0, n))]
+
+    groups = rules(5, 1, 4)
+    conf = config.Config(
+        {
+            "group_name_white_list": groups + (["ALL_GROUP"] if rnd.random() < 0.2 else []),
+            "group_name_keyword_white_list": rules(3, 1, 2),
+            "group_chat_in_one_session": groups[:2] + (["ALL_GROUP"] if rnd.random() < 0.2 else []),
+            "nick_name_black_list": rules(3, 1, 3),
+            "group_chat_prefix": rules(4),
+            "group_chat_keyword": rules(4, 1, 3),
+            "single_chat_prefix": rules(4),
+            "image_create_prefix": rules(4),
+        }
+    )
+    matcher = TriggerMatcher(conf)
+    for _ in range(200):
+        content = random_text(rnd, 0, 12)
+        for key, pattern in (
+            ("group_chat_prefix", matcher.group_chat_prefix),
+            ("single_chat_prefix", matcher.single_chat_prefix),
+            ("image_create_prefix", matcher.image_create_prefix),
+        ):
+            assert matcher.match_prefix(pattern, content) == check_prefix(content, conf.get(key))
+        assert matcher.match_contain(matcher.group_chat_keyword, content) == check_contain(content, conf.get("group_chat_keyword"))
+        group_name = rnd.choice(groups + [content]) if groups else content
+        assert matcher.is_group_allowed(group_name) == old_group_allowed(conf, group_name)
+        assert matcher.is_shared_session_group(group_name) == old_shared_session(conf, group_name)
+        nick_name = rnd.choice(conf.get("nick_name_black_list") + [content, "", None])
+        assert matcher.is_nick_name_blocked(nick_name) == bool(nick_name and nick_name in conf.get("nick_name_black_list"))
+
+
+def test_at_pattern_removes_mentions_of_names_with_special_characters():
+    assert at_pattern("bot(1)").sub("", "@bot(1) hello @bot(1) x") == "hello x"
+    assert at_pattern("a.b").sub("", "@axb hi") == "@axb hi"
+
+
+def test_matcher_is_rebuilt_when_config_changes(set_config):
+    set_config(single_chat_prefix=["bot"])
+    first = get_trigger_matcher()
+    assert get_trigger_matcher() is first
+    assert first.match_prefix(first.single_chat_prefix, "bot hi") == "bot"
+    config.conf()["single_chat_prefix"] = ["@bot"]
+    second = get_trigger_matcher()
+    assert second is not first
+    assert second.match_prefix(second.single_chat_prefix, "bot hi") is None
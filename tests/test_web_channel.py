@@ -0,0 +1,144 @@
+import asyncio
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+from bridge.context import Context, ContextType
+from bridge.reply import Reply, ReplyType
+from channel.web import web_channel
+
+WebChannelClass = [c.cell_contents for c in web_channel.WebChannel.__closure__ if isinstance(c.cell_contents, type)][0]
+
+
+@pytest.fixture
+def channel(set_config):
+    set_config(web_heartbeat_interval=0.05, web_idle_timeout=0.1, web_queue_size=2)
+
+    class TestWebChannel(WebChannelClass):
+        # ChatChannel的调度状态是类属性，每个测试使用独立的子类
+        futures = {}
+        sessions = {}
+        lock = threading.Lock()
+        ready = threading.Condition(lock)
+        ready_sessions = OrderedDict()
+        blocked_sessions = OrderedDict()
+
+    return TestWebChannel()
+
+
+def run(channel, test):
+    async def main():
+        channel.loop = asyncio.get_running_loop()
+        async with TestClient(TestServer(channel._app())) as client:
+            await test(client)
+
+    asyncio.run(main())
+
+
+async def read_event(response, timeout=2):
+    """读取下一条SSE事件(空行分隔)"""
+    lines = []
+    while True:
+        line = (await asyncio.wait_for(response.content.readline(), timeout)).decode("utf-8").rstrip("\n")
+        if not line:
+            if lines:
+                return "\n".join(lines)
+            continue
+        lines.append(line)
+
+
+def text_reply(channel, user_id, content):
+    context = Context(ContextType.TEXT, "", {"receiver": user_id})
+    # send在工作线程中调用
+    thread = threading.Thread(target=channel.send, args=(Reply(ReplyType.TEXT, content), context))
+    thread.start()
+    thread.join()
+
+
+def test_reply_reaches_waiting_sse_connection(channel):
+    async def test(client):
+        response = await client.get("/sse/alice")
+        assert await read_event(response) == ": connected"
+        text_reply(channel, "alice", "你好")
+        event = await read_event(response)
+        while event == ": heartbeat":
+            event = await read_event(response)
+        assert json.loads(event[len("data: "):])["content"] == "你好"
+        response.close()
+
+    run(channel, test)
+
+
+def test_idle_connection_gets_heartbeats(channel):
+    async def test(client):
+        response = await client.get("/sse/alice")
+        assert await read_event(response) == ": connected"
+        assert await read_event(response) == ": heartbeat"
+        assert await read_event(response) == ": heartbeat"
+        response.close()
+
+    run(channel, test)
+
+
+def test_unsent_message_is_delivered_after_reconnect(channel):
+    async def test(client):
+        response = await client.get("/sse/alice")
+        assert await read_event(response) == ": connected"
+        sse = channel.message_queues["alice"]
+        response.close()
+        # 服务端发现连接断开前放入的消息，写入失败后保留在unsent中
+        channel._enqueue("alice", {"content": "断线期间的回复"})
+        deadline = time.monotonic() + 2
+        while sse.connections and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        assert sse.connections == 0
+        assert sse.unsent == {"content": "断线期间的回复"} or sse.queue.qsize() == 1
+
+        response = await client.get("/sse/alice")
+        assert await read_event(response) == ": connected"
+        assert json.loads((await read_event(response))[len("data: "):])["content"] == "断线期间的回复"
+        response.close()
+
+    run(channel, test)
+
+
+def test_full_queue_drops_the_oldest_message(channel):
+    async def test(client):
+        for i in range(3):
+            channel._enqueue("bob", {"content": str(i)})
+        queue = channel.message_queues["bob"].queue
+        assert [queue.get_nowait()["content"] for _ in range(queue.qsize())] == ["1", "2"]
+
+    run(channel, test)
+
+
+def test_idle_clients_are_reaped(channel):
+    async def test(client):
+        channel._enqueue("gone", {"content": "没人取"})
+        response = await client.get("/sse/online")
+        assert await read_event(response) == ": connected"
+        channel.message_queues["gone"].last_seen -= 1
+        reaper = asyncio.ensure_future(channel._reap_idle_clients())
+        await asyncio.sleep(0.25)
+        reaper.cancel()
+        assert "gone" not in channel.message_queues
+        # 仍在连接的用户不清理
+        assert "online" in channel.message_queues
+        response.close()
+
+    run(channel, test)
+
+
+def test_send_before_loop_runs_is_not_dropped(channel):
+    loop = asyncio.new_event_loop()
+    channel.loop = loop
+    try:
+        text_reply(channel, "carol", "启动前的回复")
+        loop.run_until_complete(asyncio.sleep(0))
+        assert channel.message_queues["carol"].queue.get_nowait()["content"] == "启动前的回复"
+    finally:
+        loop.close()
@@ -0,0 +1,72 @@
+import importlib.util
+import os
+import random
+
+import pytest
+
+# 直接加载模块，导入plugins.banwords包会注册插件
+_spec = importlib.util.spec_from_file_location(
+    "WordsSearch", os.path.join(os.path.dirname(__file__), "..", "plugins", "banwords", "lib", "WordsSearch.py")
+)
+_module = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(_module)
+WordsSearch = _module.WordsSearch
+
+ALPHABET = "abc敏感词\U0001F600"
+
+
+def reference_find_all(keywords, text):
+    """逐个位置比较的参照实现，与原实现一样：同一结束位置的关键词中最长的排在最前，同长时序号小的在前"""
+    results = []
+    for end in range(len(text)):
+        matched = [(i, k) for i, k in enumerate(keywords) if k and text[: end + 1].endswith(k)]
+        matched.sort(key=lambda item: (-len(item[1]), item[0]))
+        for i, k in matched:
+            results.append({"Keyword": k, "Success": True, "End": end, "Start": end + 1 - len(k), "Index": i})
+    return results
+
+
+def reference_replace(keywords, text, replace_char="*"):
+    result = list(text)
+    ends = {}
+    for r in reference_find_all(keywords, text):
+        ends.setdefault(r["End"], r)
+    for r in ends.values():
+        for j in range(r["Start"], r["End"] + 1):
+            result[j] = replace_char
+    return "".join(result)
+
+
+def random_word(rnd, low, high):
+    return "".join(rnd.choice(ALPHABET) for _ in range(rnd.randint(low, high)))
+
+
+@pytest.mark.parametrize("seed", range(30))
+def test_matches_the_reference_on_random_input(seed, tmp_path):
+    rnd = random.Random(seed)
+    keywords = list(dict.fromkeys(random_word(rnd, 1, 4) for _ in range(rnd.randint(1, 30))))
+    texts = [random_word(rnd, 0, 40) for _ in range(20)] + ["xyz", "", "正常消息"]
+    search = WordsSearch()
+    search.SetKeywords(keywords)
+    # 缓存加载后的自动机结果应与直接构建一致
+    cached = WordsSearch()
+    search.Save(str(tmp_path / "cache"), "k")
+    assert cached.Load(str(tmp_path / "cache"), "k")
+    for ws in (search, cached):
+        for text in texts:
+            expected = reference_find_all(keywords, text)
+            assert ws.FindAll(text) == expected
+            assert ws.FindFirst(text) == (expected[0] if expected else None)
+            assert ws.ContainsAny(text) == bool(expected)
+            assert ws.Replace(text) == reference_replace(keywords, text)
+        assert ws.FindAllBatch(texts) == [ws.FindAll(t) for t in texts]
+        assert ws.FindFirstBatch(texts) == [ws.FindFirst(t) for t in texts]
+        assert ws.ContainsAnyBatch(texts) == [ws.ContainsAny(t) for t in texts]
+
+
+def test_cache_with_another_key_is_rejected(tmp_path):
+    search = WordsSearch()
+    search.SetKeywords(["abc"])
+    search.Save(str(tmp_path / "cache"), "v1")
+    assert not WordsSearch().Load(str(tmp_path / "cache"), "v2")
+    assert not WordsSearch().Load(str(tmp_path / "missing"), "v1")
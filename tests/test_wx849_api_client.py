@@ -0,0 +1,74 @@
+import asyncio
+import os
+
+from aiohttp import web
+
+from channel.wx849.wx849_api_client import WX849ApiClient
+
+
+async def serve(routes):
+    app = web.Application()
+    app.add_routes(routes)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    return runner, "http://127.0.0.1:%d" % site._server.sockets[0].getsockname()[1]
+
+
+def make_client(base_url):
+    client = WX849ApiClient()
+    client.base_url = base_url
+    client.start(asyncio.get_running_loop())
+    return client
+
+
+def test_gateway_error_is_retried_only_for_idempotent_calls(set_config):
+    set_config(wx849_api_retries=2)
+    calls = {"send": 0, "query": 0}
+
+    async def unavailable(request):
+        calls[request.match_info["name"]] += 1
+        return web.Response(status=503)
+
+    async def main():
+        runner, base_url = await serve([web.post("/{name}", unavailable)])
+        client = make_client(base_url)
+        try:
+            assert await client.post("/send", json={}) is None
+            assert await client.post("/query", json={}, idempotent=True) is None
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    asyncio.run(main())
+    # 发送接口可能已经被处理，不能重复发送
+    assert calls == {"send": 1, "query": 3}
+
+
+def test_download_to_file_leaves_no_partial_file(set_config, tmp_path):
+    set_config(wx849_api_retries=0)
+
+    async def ok(request):
+        return web.Response(body=b"x" * 200000, content_type="video/mp4")
+
+    async def broken(request):
+        response = web.StreamResponse(headers={"Content-Length": "200000"})
+        await response.prepare(request)
+        await response.write(b"x" * 1000)
+        request.transport.close()  # 写了一部分后断开连接
+        return response
+
+    async def main():
+        runner, base_url = await serve([web.get("/ok", ok), web.get("/broken", broken)])
+        client = make_client(base_url)
+        try:
+            assert await client.download_to_file(base_url + "/ok", str(tmp_path / "ok.mp4")) == "video/mp4"
+            assert await client.download_to_file(base_url + "/broken", str(tmp_path / "broken.mp4")) is None
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    asyncio.run(main())
+    assert sorted(os.listdir(tmp_path)) == ["ok.mp4"]
+    assert (tmp_path / "ok.mp4").stat().st_size == 200000
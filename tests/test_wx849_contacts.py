@@ -0,0 +1,103 @@
+import json
+import threading
+
+from channel.wx849 import wx849_contacts
+from channel.wx849.wx849_contacts import ContactDirectory
+
+
+def member(wxid, nickname, display_name=""):
+    return {"UserName": wxid, "NickName": nickname, "DisplayName": display_name}
+
+
+def test_load_builds_indexes(tmp_path):
+    rooms = {
+        "room1@chatroom": {"chatroomId": "room1@chatroom", "nickName": "群一", "members": [member("wxid_a", "阿甲", "甲在群一"), member("wxid_b", "阿乙")]},
+    }
+    (tmp_path / "wx849_rooms.json").write_text(json.dumps(rooms, ensure_ascii=False), encoding="utf-8")
+    # 旧格式的联系人文件
+    (tmp_path / "wx849_contacts.json").write_text(json.dumps([{"wxid": "wxid_c", "nickname": "阿丙"}], ensure_ascii=False), encoding="utf-8")
+    directory = ContactDirectory(str(tmp_path), save_delay=3600)
+    directory.load()
+    assert directory.room_name("room1@chatroom") == "群一"
+    assert directory.member_name("room1@chatroom", "wxid_a") == "甲在群一"
+    assert directory.has_member("room1@chatroom", "wxid_b")
+    assert directory.nickname("wxid_b") == "阿乙"
+    assert directory.nickname("wxid_c") == "阿丙"
+    assert directory.nickname("wxid_none") is None
+
+
+def test_missing_or_broken_files_start_empty(tmp_path):
+    (tmp_path / "wx849_rooms.json").write_text("{broken", encoding="utf-8")
+    directory = ContactDirectory(str(tmp_path), save_delay=3600)
+    directory.load()
+    assert directory.rooms == {} and directory.contacts == {}
+
+
+def test_update_room_refreshes_member_indexes(tmp_path):
+    directory = ContactDirectory(str(tmp_path), save_delay=3600)
+    directory.update_room("room1@chatroom", nick_name="群一", members=[member("wxid_a", "阿甲"), member("wxid_b", "阿乙")])
+    directory.update_room("room2@chatroom", members=[member("wxid_b", "阿乙", "乙在群二")])
+    assert directory.nickname("wxid_b") == "乙在群二"
+
+    # 阿甲退出群一，阿乙改了群昵称
+    directory.update_room("room1@chatroom", members=[member("wxid_b", "阿乙", "乙在群一")])
+    assert not directory.has_member("room1@chatroom", "wxid_a")
+    assert directory.nickname("wxid_a") is None
+    assert directory.member_name("room1@chatroom", "wxid_b") == "乙在群一"
+    assert directory.room_name("room1@chatroom") == "群一"
+
+    # 阿乙退出群二后，仍可以查到在群一中的名称
+    directory.update_room("room2@chatroom", members=[])
+    assert directory.nickname("wxid_b") == "乙在群一"
+    directory.update_room("room1@chatroom", members=[])
+    assert directory.nickname("wxid_b") is None
+
+
+def test_update_contact(tmp_path):
+    directory = ContactDirectory(str(tmp_path), save_delay=3600)
+    directory.update_contact("wxid_c", nick_name="阿丙")
+    directory.update_contact("wxid_c", remark_name="丙")
+    assert directory.contact("wxid_c")["NickName"] == "阿丙"
+    assert directory.contact("wxid_c")["RemarkName"] == "丙"
+    assert directory.nickname("wxid_c") == "阿丙"
+
+
+def test_flush_writes_only_dirty_files(tmp_path):
+    directory = ContactDirectory(str(tmp_path), save_delay=3600)
+    directory.update_room("room1@chatroom", nick_name="群一", members=[member("wxid_a", "阿甲")])
+    directory.flush()
+    assert (tmp_path / "wx849_rooms.json").exists()
+    assert not (tmp_path / "wx849_contacts.json").exists()
+    directory.update_contact("wxid_c", nick_name="阿丙")
+    directory.flush()
+
+    reloaded = ContactDirectory(str(tmp_path), save_delay=3600)
+    reloaded.load()
+    assert reloaded.member_name("room1@chatroom", "wxid_a") == "阿甲"
+    assert reloaded.nickname("wxid_c") == "阿丙"
+
+
+def test_concurrent_flush_keeps_the_latest_data(tmp_path, monkeypatch):
+    directory = ContactDirectory(str(tmp_path), save_delay=3600)
+    errors = []
+    # 写入失败只记录日志，同时收集
+    monkeypatch.setattr(wx849_contacts.logger, "error", lambda msg, *args: errors.append(msg))
+
+    def update_and_flush(n):
+        try:
+            for i in range(50):
+                directory.update_contact("wxid_%d_%d" % (n, i), nick_name="name")
+                directory.flush()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=update_and_flush, args=(n,)) for n in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    directory.flush()
+    assert not errors
+    with open(tmp_path / "wx849_contacts.json", encoding="utf-8") as f:
+        assert len(json.load(f)) == 200
+    assert not list(tmp_path.glob("*.tmp"))
@@ -0,0 +1,101 @@
+import asyncio
+import base64
+import hashlib
+import os
+
+import pytest
+
+from channel.wx849.wx849_media import CHUNK_SIZE, ImageDownloader
+
+
+class FakeApi:
+    """按Section返回图片数据的协议接口，fail中的起始位置第一次请求失败"""
+
+    def __init__(self, image, fail=(), short=()):
+        self.image = image
+        self.fail = set(fail)
+        self.short = set(short)  # 这些起始位置第一次只返回一半数据
+        self.sections = []
+
+    async def post(self, endpoint, json=None, idempotent=False):
+        section = json["Section"]
+        start, size = section["StartPos"], section["DataLen"]
+        self.sections.append((start, size))
+        if start in self.fail:
+            self.fail.discard(start)
+            return None
+        data = self.image[start:start + size]
+        if start in self.short:
+            self.short.discard(start)
+            data = data[:len(data) // 2]
+        return {"Success": True, "Data": {"buffer": base64.b64encode(data).decode()}}
+
+
+def download(tmp_path, api, data_len=0, md5=None):
+    downloader = ImageDownloader(api, str(tmp_path))
+    return asyncio.run(downloader.download("1", "filehelper", "wxid_bot", data_len, md5))
+
+
+@pytest.mark.parametrize("size", [1000, 300000, 2 * CHUNK_SIZE])
+def test_unknown_length_downloads_sequentially_until_short_chunk(tmp_path, size):
+    image = os.urandom(size)
+    api = FakeApi(image)
+    path = download(tmp_path, api)
+    with open(path, "rb") as f:
+        assert f.read() == image
+    # 每次请求完整的64KB，不会请求数据末尾之后的更多分段
+    assert [s for _, s in api.sections] == [CHUNK_SIZE] * (size // CHUNK_SIZE + 1)
+    assert [p for p, _ in api.sections] == [i * CHUNK_SIZE for i in range(size // CHUNK_SIZE + 1)]
+
+
+def test_known_length_downloads_each_section_once(tmp_path):
+    image = os.urandom(300000)
+    api = FakeApi(image)
+    path = download(tmp_path, api, len(image))
+    with open(path, "rb") as f:
+        assert f.read() == image
+    assert sorted(api.sections) == [(i, min(CHUNK_SIZE, len(image) - i)) for i in range(0, len(image), CHUNK_SIZE)]
+
+
+@pytest.mark.parametrize("known", [True, False])
+def test_failed_download_resumes_from_missing_sections(tmp_path, known):
+    image = os.urandom(300000)
+    data_len = len(image) if known else 0
+    api = FakeApi(image, fail=[2 * CHUNK_SIZE])
+    assert download(tmp_path, api, data_len) is None
+    first = len(api.sections)
+    path = download(tmp_path, api, data_len)
+    with open(path, "rb") as f:
+        assert f.read() == image
+    # 第二次只请求缺失的分段
+    assert {p for p, _ in api.sections[first:]} == ({2 * CHUNK_SIZE} if known else {2 * CHUNK_SIZE, 3 * CHUNK_SIZE, 4 * CHUNK_SIZE})
+
+
+def test_short_section_is_downloaded_again(tmp_path):
+    image = os.urandom(300000)
+    api = FakeApi(image, short=[CHUNK_SIZE])
+    assert download(tmp_path, api, len(image)) is None
+    assert not os.path.exists(os.path.join(str(tmp_path), "img_1.jpg"))
+    first = len(api.sections)
+    path = download(tmp_path, api, len(image))
+    with open(path, "rb") as f:
+        assert f.read() == image
+    assert api.sections[first:] == [(CHUNK_SIZE, CHUNK_SIZE)]
+
+
+@pytest.mark.parametrize("known", [True, False])
+def test_md5_mismatch_is_not_published_and_restarts(tmp_path, known):
+    image = os.urandom(300000)
+    data_len = len(image) if known else 0
+    api = FakeApi(image)
+    assert download(tmp_path, api, data_len, md5="0" * 32) is None
+    final_path = os.path.join(str(tmp_path), "img_1.jpg")
+    assert not os.path.exists(final_path)
+    assert os.path.exists(final_path + ".part")
+    assert not os.path.exists(final_path + ".progress")
+    first = len(api.sections)
+    path = download(tmp_path, api, data_len, md5=hashlib.md5(image).hexdigest().upper())
+    with open(path, "rb") as f:
+        assert f.read() == image
+    # 进度已清除，所有分段重新下载
+    assert len(api.sections) - first == first